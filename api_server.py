@@ -3,17 +3,37 @@ import json
 import logging
 from datetime import datetime
 import redis
-from typing import Dict, Any
+from typing import Callable, Dict, Any, List, Optional
 import os
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2 import sql
+from psycopg2.extras import DictCursor, execute_values
 import time
 import threading
 import subprocess
 import re
-from queue import Queue
-import requests
-from decimal import Decimal
+import socket
+import socketserver
+from decimal import Decimal, InvalidOperation
+from user_registry import UserRegistry, parse_login, write_user_logins
+from redis_keys import (TOTAL_SHARES_KEY, GENERATION_KEY, ROUND_START_KEY, ROUND_PENDING_KEY, ROUND_KEY_PREFIX,
+                        AGGREGATORS_KEY, FLUSH_REQUEST_KEY, FLUSH_ACK_KEY, CHAINS,
+                        get_generation_key, get_range_key, get_journal_seq_key, get_aggregator_alive_key)
+from round_shares import (load_round_layout, get_users_round_shares, get_chain_round_shares, get_range_shares,
+                          seal_round, release_range)
+import block_queue
+from block_queue import request_cluster_flush
+from share_dedup import (RedisDedupSet, get_batch_key, get_share_id, check_batch_entries, fill_batch_results,
+                         invalid_params, submit_counts_result)
+from reward_split import split_round_rewards
+from money import XMR_ATOMIC_UNITS, TARI_ATOMIC_UNITS, to_atomic, coins
+from round_replay import save_round_snapshot, load_snapshots, replay_rewards, restore_rewards
+from balance_ledger import LedgerCompactor, REASON_REWARD, lock_for_append
+from leader import LeaderElection, LeadershipLost, ROLE_LOG_TAILER, ROLE_BLOCK_CREDITING
+from tari_verifier import TariVerifier, DEFAULT_API_URL as DEFAULT_TARI_API_URL
+from header_cache import open_cache as open_header_cache
+from log_tailer import (LogTailer, XMR_BLOCK_PATTERN, TARI_BLOCK_PATTERN,
+                        XMR_BLOCK_MARKER, TARI_BLOCK_MARKER)
 
 # 配置日志
 logging.basicConfig(
@@ -48,9 +68,10 @@ def load_config():
 config = load_config()
 
 # Redis连接配置
-REDIS_HOST = 'localhost'
-REDIS_PORT = 6379
-REDIS_DB = 0
+redis_config = config.get('redis', {})
+REDIS_HOST = redis_config.get('host', 'localhost')
+REDIS_PORT = redis_config.get('port', 6379)
+REDIS_DB = redis_config.get('db', 0)
 
 # 初始化Redis连接
 try:
@@ -66,9 +87,14 @@ except redis.ConnectionError as e:
     logger.error(f"Failed to connect to Redis: {str(e)}")
     raise
 
-# Redis键前缀
-XMR_PREFIX = "xmr:submit:"
-TARI_PREFIX = "tari:submit:"
+# 提交计数的Redis键名见 redis_keys.py
+# 新增合并挖矿链只需在CHAINS中添加，不会增加提交入口的写入次数
+
+# 旧版本的计数键，启动时迁移
+LEGACY_PREFIXES = {
+    'xmr': "xmr:submit:",
+    'tari': "tari:submit:"
+}
 
 # 添加XMR爆块记录
 xmr_blocks = []
@@ -83,56 +109,418 @@ def get_db_connection():
         password=config['database']['password']
     )
 
-def get_chain_key(username: str, chain: str) -> str:
-    """获取Redis键名"""
-    prefix = XMR_PREFIX if chain.lower() == 'xmr' else TARI_PREFIX
-    return f"{prefix}{username}"
+def mirror_user_logins(new_users: Dict[int, str], cur=None):
+    """把新分配的用户ID及解析后的用户名、钱包同步到 account_login 表，登录名只在这里解析一次"""
+    if cur is not None:
+        write_user_logins(cur, new_users)
+        return
+    try:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as c:
+                write_user_logins(c, new_users)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        # 入账时会补齐缺失的映射，这里失败不影响提交
+        logger.error(f"同步 {len(new_users)} 个新用户ID到数据库失败: {str(e)}")
+
+user_registry = UserRegistry(
+    redis_client,
+    on_new_users=mirror_user_logins,
+    cache_size=config.get('user_id_cache_size', 100000)
+)
+
+def resolve_user_logins(cur, user_ids) -> Dict[int, tuple]:
+    """一次查询取得 {用户ID: (用户名, XMR钱包, Tari钱包)}，account_login 中缺失的ID从Redis补齐"""
+    user_ids = [int(user_id) for user_id in user_ids]
+    cur.execute("""
+        SELECT user_id, username, xmr_wallet, tari_wallet
+        FROM account_login
+        WHERE user_id = ANY(%s)
+    """, (user_ids,))
+    accounts = {row[0]: (row[1], row[2], row[3]) for row in cur.fetchall()}
+    
+    missing = [user_id for user_id in user_ids if user_id not in accounts]
+    if missing:
+        new_users = user_registry.get_logins(missing)
+        if new_users:
+            mirror_user_logins(new_users, cur)
+            for user_id, login in new_users.items():
+                accounts[user_id] = parse_login(login)
+        unknown = len(missing) - len(new_users)
+        if unknown:
+            logger.warning(f"{unknown} 个用户ID在注册表中不存在，已忽略")
+    return accounts
 
-def increment_submit_count(username: str) -> Dict[str, int]:
-    """同时增加用户XMR和TARI链的提交计数"""
+def migrate_legacy_submit_keys():
+    """将旧版按链计数的 xmr:submit:<登录名> / tari:submit:<登录名> 键迁移为按代存储的提交计数
+
+    当前代先改名到临时键，迁移期间的新提交计入新的当前代。各链按 CHAINS 顺序，
+    第 i 代保存 (第 i 条链的轮次计数 - 第 i+1 条链的轮次计数)，第 i 条链从第 i 代开始计数，
+    允许出现负数，读取时求和后截断为0。未入账快照引用的封存代保持不变。
+    """
     try:
-        # 同时增加两条链的计数
-        xmr_key = get_chain_key(username, 'xmr')
-        tari_key = get_chain_key(username, 'tari')
-        
-        xmr_count = redis_client.incr(xmr_key)
-        tari_count = redis_client.incr(tari_key)
-        
-        # 设置过期时间(30天)
-        redis_client.expire(xmr_key, 30 * 24 * 60 * 60)
-        redis_client.expire(tari_key, 30 * 24 * 60 * 60)
-        
-        return {
-            'xmr': xmr_count,
-            'tari': tari_count
-        }
+        legacy_counts = {chain: {} for chain in CHAINS}
+        for chain, prefix in LEGACY_PREFIXES.items():
+            for key in redis_client.scan_iter(match=f"{prefix}*", count=1000):
+                # MULTI/EXEC 保证读取和删除之间不会丢失计数
+                pipe = redis_client.pipeline()
+                pipe.get(key)
+                pipe.delete(key)
+                login = key[len(prefix):]
+                legacy_counts[chain][login] = legacy_counts[chain].get(login, 0) + int(pipe.execute()[0] or 0)
+        logins = set()
+        for counts in legacy_counts.values():
+            logins.update(counts)
+        if not logins:
+            return
+        logins = list(logins)
+        ids = dict(zip(logins, user_registry.get_ids(logins)))
+        
+        staging_key = f"{TOTAL_SHARES_KEY}:migrating"
+        pipe = redis_client.pipeline()
+        if redis_client.exists(TOTAL_SHARES_KEY):
+            pipe.rename(TOTAL_SHARES_KEY, staging_key)
+        pipe.hgetall(staging_key)
+        live = pipe.execute()[-1]
+        
+        # 已经按代存储时 (新旧版本进程同时运行过)，各链已封存的代和当前代也计入该链的轮次计数
+        generation, starts = load_round_layout(redis_client)
+        low = min(starts.values())
+        pipe = redis_client.pipeline(transaction=False)
+        for sealed in range(low, generation + 1):
+            pipe.hgetall(get_generation_key(sealed))
+        sealed_counts = pipe.execute()
+        round_counts = []
+        for chain in CHAINS:
+            counts = {}
+            for fields in [live] + sealed_counts[starts[chain] - low:]:
+                for user_id, count in fields.items():
+                    counts[int(user_id)] = counts.get(int(user_id), 0) + int(count)
+            for login, count in legacy_counts[chain].items():
+                counts[ids[login]] = counts.get(ids[login], 0) + count
+            round_counts.append({user_id: max(count, 0) for user_id, count in counts.items()})
+        
+        pipe = redis_client.pipeline()
+        for i, chain in enumerate(CHAINS):
+            generation += 1
+            next_counts = round_counts[i + 1] if i + 1 < len(CHAINS) else {}
+            fields = {user_id: round_counts[i].get(user_id, 0) - next_counts.get(user_id, 0)
+                      for user_id in round_counts[i].keys() | next_counts.keys()}
+            fields = {user_id: count for user_id, count in fields.items() if count != 0}
+            if fields:
+                pipe.hset(get_generation_key(generation), mapping=fields)
+            pipe.hset(ROUND_START_KEY, chain, generation)
+        pipe.set(GENERATION_KEY, generation)
+        pipe.delete(staging_key)
+        pipe.execute()
+        logger.info(f"已将 {len(logins)} 个用户的旧版提交计数迁移为按代存储")
+    except redis.RedisError as e:
+        logger.error(f"Redis error while migrating legacy submit keys: {str(e)}")
+
+# 按 share_id / batch_id 丢弃客户端重发的提交，去重过滤器保存在Redis中，与 ingest_server.py 及其他实例共享
+dedup_config = config.get('share_dedup', {})
+share_dedup = RedisDedupSet(redis_client, dedup_config.get('window_seconds', 600),
+                            dedup_config.get('capacity', 1000000), dedup_config.get('error_rate', 0.001))
+
+# 启用写后聚合时的聚合器实例 (config.json 中 submit_aggregation.enabled)，未启用时为 None
+submit_aggregator = None
+
+def increment_submit_count(username: str, share_id: Optional[str] = None) -> Optional[Dict[str, int]]:
+    """增加用户的总提交计数，所有链共用；share_id 重复时不计数，返回 None"""
+    return increment_submit_counts_batch([{'username': username, 'count': 1, 'share_id': share_id}])[0]
+
+def increment_submit_counts_batch(entries: List[Dict[str, Any]]) -> List[Optional[Dict[str, int]]]:
+    """批量增加多个用户的总提交计数，去重和计数在一次Lua调用 (一次Redis往返) 中完成
+
+    条目可带 share_id，重复的条目不计数，结果为 None。
+    返回值的格式见 share_dedup.submit_counts_result，启用写后聚合时只累加到内存
+    """
+    try:
+        user_ids = user_registry.get_ids(entry['username'] for entry in entries)
+        if submit_aggregator is None:
+            totals = share_dedup.claim([(entry.get('share_id'), user_id, entry['count'])
+                                        for user_id, entry in zip(user_ids, entries)])
+            return [None if total is None else submit_counts_result(total) for total in totals]
+        
+        share_ids = [entry.get('share_id') for entry in entries]
+        if all(share_id is None for share_id in share_ids):
+            return submit_aggregator.add(user_ids, [entry['count'] for entry in entries])
+        claimed = share_dedup.claim([(share_id, None, 0) for share_id in share_ids])
+        accepted = [i for i, result in enumerate(claimed) if result is not None]
+        pending = iter(submit_aggregator.add([user_ids[i] for i in accepted], [entries[i]['count'] for i in accepted]))
+        return [None if result is None else next(pending) for result in claimed]
     except redis.RedisError as e:
         logger.error(f"Redis error while incrementing submit counts: {str(e)}")
         raise
 
 def get_submit_counts(username: str) -> Dict[str, int]:
-    """获取用户两条链的提交计数"""
+    """获取用户各条链当前轮次的提交计数"""
     try:
-        xmr_key = get_chain_key(username, 'xmr')
-        tari_key = get_chain_key(username, 'tari')
+        user_id = user_registry.lookup_id(username)
+        if user_id is None:
+            return {chain: 0 for chain in CHAINS}
         
-        xmr_count = int(redis_client.get(xmr_key) or 0)
-        tari_count = int(redis_client.get(tari_key) or 0)
-        
-        return {
-            'xmr': xmr_count,
-            'tari': tari_count
-        }
+        shares = get_users_round_shares(redis_client, [user_id])
+        return {chain: shares[chain][0] for chain in CHAINS}
     except redis.RedisError as e:
         logger.error(f"Redis error while getting submit counts: {str(e)}")
         raise
 
+def get_round_shares(chain: str) -> Dict[str, int]:
+    """读取链当前轮次所有用户的提交计数，以登录名为键 (当前代和本链引用的封存代各一次HGETALL)"""
+    id_shares = get_chain_round_shares(redis_client, chain)
+    logins = user_registry.get_logins(id_shares)
+    return {logins[user_id]: shares for user_id, shares in id_shares.items() if user_id in logins}
+
+def snapshot_round(chain: str, block_height, flush: Optional[Callable[[], None]] = None) -> str:
+    """在爆块时原子切换轮次 (见 round_shares.seal_round)，返回快照代范围的键名；快照保留到入账提交成功后再释放
+
+    flush 只在快照不存在、需要切换时调用
+    """
+    range_key, sealed = seal_round(redis_client, chain, block_height, flush)
+    if not sealed:
+        logger.info(f"{chain.upper()} 区块 {block_height} 的轮次快照已存在，复用快照")
+    else:
+        logger.info(f"{chain.upper()} 当前轮次已切换为快照 {range_key}")
+    return range_key
+
+def get_snapshot_shares(range_key: str) -> Dict[int, int]:
+    """读取快照代范围内所有用户的提交计数 (每代一次HGETALL，按用户求和)，以用户ID为键"""
+    snapshot_range = redis_client.hgetall(range_key)
+    if not snapshot_range:
+        return {}
+    return get_range_shares(redis_client, int(snapshot_range['start']), int(snapshot_range['end']))
+
+def release_round_snapshot(range_key: str):
+    """入账提交成功后释放快照，并回收不再被任何轮次引用的封存代"""
+    try:
+        collected = release_range(redis_client, range_key)
+        if collected:
+            logger.info(f"已回收提交计数第 {collected[0]}-{collected[1]} 代")
+    except redis.RedisError as e:
+        # 入账已提交，快照残留只会推迟封存代的回收，下次释放时会一并回收
+        logger.warning(f"Redis error while releasing round snapshot {range_key}: {str(e)}")
+
+# 按序号幂等地应用一条聚合日志记录: 序号不大于已应用序号时跳过，重试和重放都不会重复计数
+# KEYS[1]=总计数 KEYS[2]=已应用序号 ARGV[1]=序号 ARGV[2..]=用户名,增量 交替
+APPLY_JOURNAL_SCRIPT = redis_client.register_script("""
+if tonumber(redis.call('GET', KEYS[2]) or '0') >= tonumber(ARGV[1]) then
+    return 0
+end
+for i = 2, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('SET', KEYS[2], ARGV[1])
+return 1
+""")
+
+class SubmitAggregator(threading.Thread):
+    """写后聚合: 提交只在内存中按用户累加，每隔 flush_interval_ms 用一次Lua调用写入Redis
+
+    每次刷新先把本批增量追加到本地日志并fsync，再按序号幂等地写入Redis；
+    进程崩溃后重启时重放日志中尚未应用的记录。
+    已应用序号按实例ID保存，多个实例各自的日志序号互不影响。
+    每次刷新前读取集群刷新请求号，刷新成功后确认，爆块入账前由 flush_submit_aggregator() 等待所有实例确认。
+    """
+    def __init__(self, journal_path: str, flush_interval_ms: int, instance_id: str):
+        super().__init__()
+        self.daemon = True
+        self.running = True
+        self.journal_path = journal_path
+        self.flush_interval = max(flush_interval_ms, 1) / 1000.0
+        self.instance_id = instance_id
+        self.seq_key = get_journal_seq_key(instance_id)
+        self.alive_key = get_aggregator_alive_key(instance_id)
+        self.alive_ttl = max(int(self.flush_interval * 10), 5)
+        self.acked_request = 0
+        self.lock = threading.Lock()        # 保护 deltas
+        self.flush_lock = threading.Lock()  # 保证同一时间只有一次刷新，且按序号顺序写入
+        self.deltas = {}
+        self.inflight = None                # 已写入日志但尚未确认写入Redis的 (序号, 增量)
+        self.seq = 0
+        self.journal = None
+        
+    def replay_journal(self):
+        """启动时重放日志中尚未写入Redis的记录，然后清空日志"""
+        applied_seq = int(redis_client.get(self.seq_key) or 0)
+        self.seq = applied_seq
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        seq, deltas = line.rstrip('\n').split('\t', 1)
+                        seq = int(seq)
+                        deltas = json.loads(deltas)
+                    except ValueError:
+                        # 崩溃时写了一半的最后一行，该记录未被fsync确认，也从未写入Redis
+                        logger.warning(f"忽略聚合日志中不完整的记录: {line[:100]!r}")
+                        continue
+                    self.seq = max(self.seq, seq)
+                    if seq > applied_seq and self.apply(seq, deltas):
+                        replayed += 1
+        if replayed:
+            logger.info(f"已从 {self.journal_path} 重放 {replayed} 条未写入Redis的提交记录")
+        self.journal = open(self.journal_path, 'w')
+        
+    def apply(self, seq: int, deltas: Dict[str, int]) -> bool:
+        args = [seq]
+        for username, count in deltas.items():
+            args.extend((username, count))
+        return APPLY_JOURNAL_SCRIPT(keys=[TOTAL_SHARES_KEY, self.seq_key], args=args) == 1
+        
+    def add(self, user_ids: List[int], counts: List[int]) -> List[Dict[str, int]]:
+        with self.lock:
+            results = []
+            for user_id, count in zip(user_ids, counts):
+                pending = self.deltas.get(user_id, 0) + count
+                self.deltas[user_id] = pending
+                results.append(submit_counts_result(pending))
+            return results
+        
+    def flush(self):
+        """把内存中的增量写入Redis，失败时抛出异常，本批记录在下次刷新时按原序号重试"""
+        with self.flush_lock:
+            if self.inflight is None:
+                with self.lock:
+                    deltas, self.deltas = self.deltas, {}
+                if not deltas:
+                    return
+                self.seq += 1
+                self.journal.write(f"{self.seq}\t{json.dumps(deltas, separators=(',', ':'))}\n")
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+                self.inflight = (self.seq, deltas)
+            
+            seq, deltas = self.inflight
+            self.apply(seq, deltas)
+            self.inflight = None
+            
+            # 日志中的记录都已写入Redis，日志过大时截断
+            if self.journal.tell() > 1024 * 1024:
+                self.journal.seek(0)
+                self.journal.truncate()
+                
+    def register(self):
+        """加入集群聚合实例列表，入账前的集群刷新会等待本实例确认"""
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd(AGGREGATORS_KEY, self.instance_id)
+        pipe.set(self.alive_key, 1, ex=self.alive_ttl)
+        pipe.execute()
+        
+    def flush_and_ack(self):
+        """刷新前读取集群刷新请求号，刷新成功后确认；读取在取出增量之前，请求前接受的提交都已包含在内"""
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(self.alive_key, 1, ex=self.alive_ttl)
+        pipe.get(FLUSH_REQUEST_KEY)
+        request = int(pipe.execute()[1] or 0)
+        self.flush()
+        if request > self.acked_request:
+            redis_client.hset(FLUSH_ACK_KEY, self.instance_id, request)
+            self.acked_request = request
+        
+    def run(self):
+        while self.running:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_and_ack()
+            except Exception as e:
+                logger.error(f"刷新聚合提交计数失败: {str(e)}")
+        
+    def stop(self):
+        self.running = False
+        try:
+            self.flush()
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.srem(AGGREGATORS_KEY, self.instance_id)
+            pipe.delete(self.alive_key)
+            pipe.hdel(FLUSH_ACK_KEY, self.instance_id)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"停止时刷新聚合提交计数失败: {str(e)}")
+
+def flush_submit_aggregator():
+    """爆块入账读取轮次前刷新本实例和集群中其他实例的聚合器，保证快照包含所有已接受的提交"""
+    own_id = None
+    if submit_aggregator is not None:
+        submit_aggregator.flush()
+        own_id = submit_aggregator.instance_id
+    request_cluster_flush(redis_client, aggregation_config.get('cluster_flush_timeout_ms', 2000) / 1000.0, own_id)
+
+class SubmitSocketHandler(socketserver.BaseRequestHandler):
+    """Unix域套接字上的提交协议: 每行 "用户名\t数量\t难度\n"，无响应
+
+    每次recv读到的所有完整行合并为一次 increment_submit_counts_batch 调用
+    """
+    MAX_LINE = 64 * 1024
+    
+    def handle(self):
+        buffer = b''
+        while True:
+            try:
+                data = self.request.recv(65536)
+            except OSError as e:
+                logger.warning(f"读取提交套接字失败: {str(e)}")
+                return
+            if not data:
+                return
+            buffer += data
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+            if len(buffer) > self.MAX_LINE:
+                logger.warning("提交套接字收到超长行，断开连接")
+                return
+            
+            entries = []
+            for line in lines:
+                entry = self.parse_line(line)
+                if entry:
+                    entries.append(entry)
+            if entries:
+                try:
+                    increment_submit_counts_batch(entries)
+                except Exception as e:
+                    logger.error(f"Error processing socket submissions: {str(e)}")
+    
+    @staticmethod
+    def parse_line(line: bytes):
+        try:
+            fields = line.decode('utf-8').rstrip('\r').split('\t')
+            username = fields[0]
+            count = int(fields[1]) if len(fields) > 1 else 1
+            # 第三列为难度(哈希数)，目前只校验格式
+            if len(fields) > 2:
+                int(fields[2])
+        except (UnicodeDecodeError, ValueError):
+            logger.warning(f"Invalid socket submission: {line[:100]!r}")
+            return None
+        if not username or count <= 0:
+            logger.warning(f"Invalid socket submission: {line[:100]!r}")
+            return None
+        return {'username': username, 'count': count}
+
+class SubmitSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def start_submit_socket(path: str):
+    """在Unix域套接字上监听提交，stratum服务端通过 --share-report-socket 连接"""
+    if os.path.exists(path):
+        os.unlink(path)
+    server = SubmitSocketServer(path, SubmitSocketHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"提交套接字监听 {path}")
+    return server
+
 def handle_submit(params: Dict[str, Any]) -> Dict[str, Any]:
     """处理submit方法的请求"""
     try:
         username = params.get('username')
-        if not username:
-            logger.warning(f"Invalid submission: missing username")
+        if not isinstance(username, str) or not username:
+            logger.warning("Invalid submission: missing username")
             return {
                 'error': {
                     'code': -32602,
@@ -140,8 +528,21 @@ def handle_submit(params: Dict[str, Any]) -> Dict[str, Any]:
                 }
             }
         
-        # 同时增加两条链的提交计数
-        submit_counts = increment_submit_count(username)
+        try:
+            share_id = get_share_id(params)
+        except ValueError as e:
+            return invalid_params(str(e))
+        
+        # 同时增加两条链的提交计数，重发的提交只返回成功，不再计数
+        submit_counts = increment_submit_count(username, share_id)
+        if submit_counts is None:
+            return {
+                'result': {
+                    'status': 'OK',
+                    'message': 'Duplicate share ignored',
+                    'duplicate': True
+                }
+            }
         
         # 记录提交
         submission = {
@@ -168,131 +569,223 @@ def handle_submit(params: Dict[str, Any]) -> Dict[str, Any]:
             }
         }
 
+def handle_submit_batch(params: Any) -> Dict[str, Any]:
+    """处理submit_batch方法的请求，params为 {username, count} 列表或 {'shares': [...]}"""
+    try:
+        shares = params.get('shares') if isinstance(params, dict) else params
+        if not isinstance(shares, list):
+            logger.warning("Invalid batch submission: shares must be a list")
+            return {
+                'error': {
+                    'code': -32602,
+                    'message': 'Invalid params: shares must be a list'
+                }
+            }
+        
+        # 整批重发时按 batch_id 丢弃
+        try:
+            batch_key = get_batch_key(params)
+        except ValueError as e:
+            return invalid_params(str(e))
+        if batch_key is not None and not share_dedup.add(batch_key):
+            return {
+                'result': {
+                    'status': 'OK',
+                    'message': 'Duplicate batch ignored',
+                    'duplicate': True,
+                    'accepted': 0,
+                    'rejected': 0,
+                    'results': []
+                }
+            }
+        
+        # 先校验每个条目，无效条目单独返回错误，不影响其他条目
+        results, candidates = check_batch_entries(shares)
+        
+        # 所有有效条目的去重和计数在一次Redis往返中完成
+        accepted = duplicates = 0
+        if candidates:
+            try:
+                submit_counts = increment_submit_counts_batch(
+                    [dict(entry, share_id=share_id) for _, entry, share_id in candidates])
+            except Exception:
+                if batch_key is not None:
+                    share_dedup.discard(batch_key)
+                raise
+            accepted, duplicates = fill_batch_results(results, candidates, submit_counts)
+        
+        return {
+            'result': {
+                'status': 'OK',
+                'message': 'Batch submission recorded',
+                'accepted': accepted,
+                'duplicates': duplicates,
+                'rejected': len(shares) - accepted - duplicates,
+                'results': results
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error processing batch submission: {str(e)}")
+        return {
+            'error': {
+                'code': -32000,
+                'message': f'Internal error: {str(e)}'
+            }
+        }
+
+class PhaseTimer:
+    """记录爆块入账各阶段的耗时 (秒)，随入账结果返回，供 bench_crediting.py 统计"""
+    def __init__(self):
+        self.timings = {}
+        self.last = time.perf_counter()
+        
+    def mark(self, phase: str):
+        """把距上一次标记的耗时计入 phase"""
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0) + now - self.last
+        self.last = now
+        
+    def result(self) -> Dict[str, float]:
+        return {phase: round(seconds, 6) for phase, seconds in self.timings.items()}
+
+def load_round_credits(cur, credits: List[tuple]):
+    """把整轮的 (用户名, XMR钱包, Tari钱包, 提交数, 最小单位奖励) 一次性载入事务内的临时表 round_credit"""
+    cur.execute("""
+        CREATE TEMP TABLE round_credit (
+            username VARCHAR(255) PRIMARY KEY,
+            xmr_wallet VARCHAR(255),
+            tari_wallet VARCHAR(255),
+            shares BIGINT NOT NULL,
+            reward BIGINT NOT NULL
+        ) ON COMMIT DROP
+    """)
+    execute_values(cur, """
+        INSERT INTO round_credit (username, xmr_wallet, tari_wallet, shares, reward)
+        VALUES %s
+    """, credits, page_size=10000)
+
+def insert_round_rewards(cur, chain: str, block_height) -> int:
+    """用一条语句写入 round_credit 中所有用户的奖励，只为本次新插入的记录追加余额流水，返回入账用户数"""
+    lock_for_append(cur)
+    cur.execute("""
+        WITH inserted AS (
+            INSERT INTO rewards (block_height, type, username, reward, shares)
+            SELECT %s, %s, username, reward, shares
+            FROM round_credit
+            WHERE shares > 0
+            ON CONFLICT (block_height, type, username) DO NOTHING
+            RETURNING username, reward
+        )
+        INSERT INTO balance_ledger (username, type, amount, reason, ref)
+        SELECT username, %s, reward, %s, %s
+        FROM inserted
+        WHERE reward <> 0
+    """, (block_height, chain, chain, REASON_REWARD, str(block_height)))
+    return cur.rowcount
+
 def handle_xmr_block(params):
     """处理XMR爆块信息"""
+    timer = PhaseTimer()
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         
         # 获取区块信息
         block_height = params.get('height')
-        reward = Decimal(str(params.get('reward', 0)))
+        reward = to_atomic(params.get('reward', 0), XMR_ATOMIC_UNITS)
         
         if not block_height or not reward:
-            return {'error': '缺少必要的区块信息'}
+            return {'error': '缺少必要的区块信息', 'retry': False}
+        
+        # 已入账的区块不再切换轮次，避免吞掉新一轮的提交
+        cur.execute("SELECT EXISTS (SELECT 1 FROM blocks WHERE type = 'xmr' AND block_height = %s)", (block_height,))
+        if cur.fetchone()[0]:
+            logger.info(f"XMR 区块 {block_height} 已存在于数据库中，跳过处理")
+            # 入队后由其他途径入账的区块，释放入队时切换的快照
+            release_round_snapshot(get_range_key('xmr', block_height))
+            return {
+                'success': True,
+                'message': 'Block already exists in database',
+                'block_height': block_height
+            }
             
-        # 1. 从Redis获取用户提交记录
+        # 1. 取入队时切换的轮次快照 (入队时切换失败则现在切换)，再从快照获取用户提交记录
+        timer.mark('block_check')
+        snapshot_key = snapshot_round('xmr', block_height, flush_submit_aggregator)
+        timer.mark('round_snapshot')
         total_shares = 0
         user_shares = {}
         xmr_wallet = {}
         tari_wallet = {}
         
-        for key in redis_client.keys('xmr:submit:*'):
-            # 只删除前缀，保留完整的用户名
-            data = key.replace(XMR_PREFIX, '')
-            
-            # 判断用户名长度
-            if len(data) > 50 and ':' in data:
-                # 如果长度超过50且包含冒号，使用分割逻辑
-                parts = data.split(':')
-                if len(parts) >= 2:
-                    username = parts[1]
-                    xmr_wallet[username] = parts[0] if parts[0] else None
-                    tari_wallet[username] = parts[1] if parts[1] else None
-                else:
-                    username = data
-                    xmr_wallet[username] = None
-                    tari_wallet[username] = None
-            else:
-                # 如果长度不超过50或不包含冒号，直接使用整个字符串作为用户名
-                username = data
-                xmr_wallet[username] = None
-                tari_wallet[username] = None
-
-            # 从数据库获取用户的钱包地址
-            cur.execute("""
-                SELECT xmr_wallet, tari_wallet 
-                FROM account 
-                WHERE username = %s
-            """, (username,))
-            result = cur.fetchone()
-            if result:
-                xmr_wallet[username] = result[0] or xmr_wallet[username]
-                tari_wallet[username] = result[1] or tari_wallet[username]
-            else:
-                # 创建新用户
-                cur.execute("""
-                    INSERT INTO account (username, xmr_wallet, tari_wallet)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (username) DO UPDATE
-                    SET xmr_wallet = COALESCE(EXCLUDED.xmr_wallet, account.xmr_wallet),
-                        tari_wallet = COALESCE(EXCLUDED.tari_wallet, account.tari_wallet)
-                """, (username, xmr_wallet[username], tari_wallet[username]))
-                
-            shares = int(redis_client.get(key) or 0)
+        # 按代读取整轮的提交记录，一次查询取得所有用户ID对应的用户名和钱包
+        round_shares = get_snapshot_shares(snapshot_key)
+        timer.mark('redis_read')
+        accounts = resolve_user_logins(cur, round_shares)
+        timer.mark('resolve_logins')
+        for user_id, shares in round_shares.items():
+            if user_id not in accounts:
+                continue
+            username, xmr_wallet[username], tari_wallet[username] = accounts[user_id]
             total_shares += shares
-            user_shares[username] = shares
+            user_shares[username] = user_shares.get(username, 0) + shares
             
         if total_shares == 0:
-            return {'error': '没有找到提交记录'}
+            release_round_snapshot(snapshot_key)
+            return {'error': '没有找到提交记录', 'retry': False}
             
         # 2. 将区块信息写入数据库
         current_time = datetime.now()
-        value = reward / Decimal(str(total_shares))
+        value = Decimal(reward) / Decimal(total_shares)
         
         # 插入区块记录
         cur.execute("""
             INSERT INTO blocks (block_height, rewards, type, total_shares, time, value, is_valid, check_status, block_id)
             VALUES (%s, %s, 'xmr', %s, %s, %s, True,True, '-')
-            ON CONFLICT (block_height) DO NOTHING
+            ON CONFLICT (type, block_height) DO NOTHING
         """, (block_height, reward, total_shares, current_time, value))
         
-        # 3. 计算用户奖励
+        # 3. 以piconero为单位一次算出所有用户的奖励，余数按最大余数法分配
         fee = Decimal(str(config['pool_fees']))
-        
-        # 4. 记录用户奖励
-        for username, shares in user_shares.items():
-            if shares > 0:
-                # 计算用户奖励比例
-                user_reward = value * Decimal(str(shares)) * (Decimal('1') - fee)
-                
-                # 检查是否已存在该用户的奖励记录
-                cur.execute("""
-                    SELECT COUNT(*) 
-                    FROM rewards 
-                    WHERE block_height = %s 
-                    AND type = 'xmr' 
-                    AND username = %s
-                """, (block_height, username))
-                
-                if cur.fetchone()[0] == 0:
-                    # 插入奖励记录
-                    cur.execute("""
-                        INSERT INTO rewards (block_height, type, username, reward, shares)
-                        VALUES (%s, 'xmr', %s, %s, %s)
-                    """, (block_height, username, user_reward, shares))
-                    
-                    # 更新用户余额
-                    cur.execute("""
-                        UPDATE account 
-                        SET xmr_balance = xmr_balance + %s
-                        WHERE username = %s
-                    """, (user_reward, username))
-                else:
-                    logger.info(f"用户 {username} 的 XMR 区块 {block_height} 奖励记录已存在，跳过")
+        usernames = [username for username, shares in user_shares.items() if shares > 0]
+        user_rewards = split_round_rewards(reward, fee, [user_shares[username] for username in usernames])
+        timer.mark('reward_split')
+        
+        # 4. 整轮数据一次载入临时表，新用户创建、奖励写入和余额更新各一条语句
+        credits = [
+            (username, xmr_wallet[username], tari_wallet[username], user_shares[username], user_reward)
+            for username, user_reward in zip(usernames, user_rewards)
+        ]
+        load_round_credits(cur, credits)
+        save_round_snapshot(cur, 'xmr', block_height, round_shares, fee)
+        timer.mark('credit_load')
+        cur.execute("""
+            INSERT INTO account (username, xmr_wallet, tari_wallet)
+            SELECT username, xmr_wallet, tari_wallet FROM round_credit
+            ON CONFLICT (username) DO NOTHING
+        """)
+        timer.mark('account_upsert')
+        credited = insert_round_rewards(cur, 'xmr', block_height)
+        if credited < len(credits):
+            logger.info(f"XMR 区块 {block_height} 有 {len(credits) - credited} 个用户的奖励记录已存在，跳过")
+        timer.mark('reward_insert')
+        # 只有仍在任期内的主实例能提交入账
+        crediting_leader.check_fence(cur)
         conn.commit()
-        # 5. 清空Redis中的TARI提交记录
-        for key in redis_client.keys('xmr:submit:*'):
-            redis_client.delete(key)
+        timer.mark('commit')
+        # 5. 入账提交成功后释放轮次快照
+        release_round_snapshot(snapshot_key)
+        timer.mark('snapshot_cleanup')
             
         return {
             'success': True,
             'block_height': block_height,
             'total_shares': total_shares,
-            'reward': reward,
-            'time': current_time.isoformat()
+            'reward': coins(reward, 'xmr'),
+            'time': current_time.isoformat(),
+            'credited': credited,
+            'timings': timer.result()
         }
-        return {'success': True, 'message': '区块处理成功'}
         
     except Exception as e:
         if 'conn' in locals():
@@ -308,22 +801,25 @@ def handle_xmr_block(params):
 def handle_tari_block(params):
     """处理TARI爆块信息"""
     logger.info(f"处理 TARI 区块 {params.get('height')} 信息")
+    timer = PhaseTimer()
     try:
         block_height = params.get('height')
         block_id = params.get('block_id')
         if not block_height:
-            return {'error': '缺少必要参数'}
+            return {'error': '缺少必要参数', 'retry': False}
             
         # 首先检查数据库中是否已存在该区块
         conn = get_db_connection()
         cur = conn.cursor()
         
         try:
-            cur.execute("SELECT COUNT(*) FROM blocks WHERE block_height = %s AND type = 'tari'", (block_height,))
-            exists = cur.fetchone()[0] > 0
+            cur.execute("SELECT EXISTS (SELECT 1 FROM blocks WHERE type = 'tari' AND block_height = %s)", (block_height,))
+            exists = cur.fetchone()[0]
             
             if exists:
                 logger.info(f"TARI 区块 {block_height} 已存在于数据库中，跳过处理")
+                # 入队后由其他途径入账的区块，释放入队时切换的快照
+                release_round_snapshot(get_range_key('tari', block_height))
                 return {
                     'success': True,
                     'message': 'Block already exists in database',
@@ -331,126 +827,98 @@ def handle_tari_block(params):
                     'block_id': block_id
                 }
             
-            # 1. 统计TARI链的submit总数
+            # 1. 取入队时切换的轮次快照 (入队时切换失败则现在切换)，再统计快照中TARI链的submit总数
+            timer.mark('block_check')
+            snapshot_key = snapshot_round('tari', block_height, flush_submit_aggregator)
+            timer.mark('round_snapshot')
             total_shares = 0
             user_shares = {}
             xmr_wallet={}
             tari_wallet={}
-            for key in redis_client.keys('tari:submit:*'):
-                # 只删除前缀，保留完整的用户名
-                data    = key.replace(TARI_PREFIX, '')
-                                # 判断用户名长度
-                if len(data) > 50 and ':' in data:
-                    # 如果长度超过50且包含冒号，使用分割逻辑
-                    parts = data.split(':')
-                    if len(parts) >= 2:
-                        username = parts[1]
-                        xmr_wallet[username] = parts[0]
-                        tari_wallet[username] = parts[1]
-                    else:
-                        username = data
-                        xmr_wallet[username] = ""
-                        tari_wallet[username] = ""
-                else:
-                    # 如果长度不超过50或不包含冒号，直接使用整个字符串作为用户名
-                    username = data
-                    xmr_wallet[username] = ""
-                    tari_wallet[username] = ""
-
-
-                cur.execute("""
-                    SELECT xmr_wallet, tari_wallet 
-                    FROM account 
-                    WHERE username = %s and xmr_wallet != ''
-                """, (username,))
-                result = cur.fetchone()
-                if result:
-                    xmr_wallet[username], tari_wallet[username] = result
-                else:
-                    if xmr_wallet[username] != "":
-                        cur.execute("""
-                            UPDATE account 
-                            SET xmr_wallet = %s,
-                                tari_wallet = %s
-                            WHERE username = %s
-                        """, (xmr_wallet[username], tari_wallet[username], username))
-                    else:
-                        xmr_wallet[username] = ""
-                        tari_wallet[username] = "" 
-                        
-                shares = int(redis_client.get(key) or 0)
+            # 按代读取整轮的提交记录，一次查询取得所有用户ID对应的用户名和钱包
+            round_shares = get_snapshot_shares(snapshot_key)
+            timer.mark('redis_read')
+            accounts = resolve_user_logins(cur, round_shares)
+            timer.mark('resolve_logins')
+            for user_id, shares in round_shares.items():
+                if user_id not in accounts:
+                    continue
+                username, parsed_xmr_wallet, parsed_tari_wallet = accounts[user_id]
+                xmr_wallet[username] = parsed_xmr_wallet or ""
+                tari_wallet[username] = parsed_tari_wallet or ""
                 total_shares += shares
-                user_shares[username] = shares
+                user_shares[username] = user_shares.get(username, 0) + shares
                 
             if total_shares == 0:
-                return {'error': '没有找到提交记录'}
+                release_round_snapshot(snapshot_key)
+                return {'error': '没有找到提交记录', 'retry': False}
                 
             # 2. 将区块信息写入数据库
             # 从配置文件获取TARI区块奖励
-            reward = config['rewards']['tari_block_reward']
-            value = reward / total_shares
+            reward = to_atomic(config['rewards']['tari_block_reward'], TARI_ATOMIC_UNITS)
+            value = Decimal(reward) / Decimal(total_shares)
             current_time = datetime.now()
             
             # 插入区块记录
             cur.execute("""
                 INSERT INTO blocks (block_height, rewards, type, total_shares, time, value, is_valid, check_status, block_id)
                 VALUES (%s, %s, 'tari', %s, %s, %s, False, False, %s)
-                ON CONFLICT (block_height) DO NOTHING
+                ON CONFLICT (type, block_height) DO NOTHING
             """, (block_height, reward, total_shares, current_time, value, block_id))
             
-            # 3. 计算用户奖励
+            # 3. 以microTari为单位一次算出所有用户的奖励，余数按最大余数法分配
             fee = config['pool_fees']
+            usernames = [username for username, shares in user_shares.items() if shares > 0]
+            user_rewards = split_round_rewards(reward, fee, [user_shares[username] for username in usernames])
+            timer.mark('reward_split')
             
-            # 4. 记录用户奖励
-            for username, shares in user_shares.items():
-                if shares > 0:
-                    # 计算用户奖励比例
-                    user_reward = value * shares * (1 - fee)
-                    
-                    # 检查用户是否存在，不存在则创建
-                    cur.execute("""
-                        INSERT INTO account (username, xmr_wallet, tari_wallet, tari_balance, xmr_balance, fee)
-                        VALUES (%s, %s, %s, 0, 0, %s)
-                        ON CONFLICT (username) DO NOTHING
-                    """, (username, xmr_wallet[username], tari_wallet[username], fee))
-                    
-                    # 检查是否已存在该用户的奖励记录
-                    cur.execute("""
-                        SELECT COUNT(*) 
-                        FROM rewards 
-                        WHERE block_height = %s 
-                        AND type = 'tari' 
-                        AND username = %s
-                    """, (block_height, username))
-                    
-                    if cur.fetchone()[0] == 0:
-                        # 插入奖励记录
-                        cur.execute("""
-                            INSERT INTO rewards (block_height, type, username, reward, shares)
-                            VALUES (%s, 'tari', %s, %s, %s)
-                        """, (block_height, username, user_reward, shares))
-                        
-                        # 更新用户余额
-                        cur.execute("""
-                            UPDATE account 
-                            SET tari_balance = tari_balance + %s
-                            WHERE username = %s
-                        """, (user_reward, username))
-                    else:
-                        logger.info(f"用户 {username} 的 TARI 区块 {block_height} 奖励记录已存在，跳过")
+            # 4. 整轮数据一次载入临时表，钱包补全、新用户创建、奖励写入和余额更新各一条语句
+            credits = [
+                (username, xmr_wallet[username], tari_wallet[username], user_shares[username], user_reward)
+                for username, user_reward in zip(usernames, user_rewards)
+            ]
+            load_round_credits(cur, credits)
+            save_round_snapshot(cur, 'tari', block_height, round_shares, fee)
+            timer.mark('credit_load')
             
+            # 数据库中没有XMR钱包的已有用户，用登录名中解析出的钱包补全
+            cur.execute("""
+                UPDATE account
+                SET xmr_wallet = round_credit.xmr_wallet,
+                    tari_wallet = round_credit.tari_wallet
+                FROM round_credit
+                WHERE account.username = round_credit.username
+                AND COALESCE(account.xmr_wallet, '') = ''
+                AND round_credit.xmr_wallet != ''
+            """)
+            cur.execute("""
+                INSERT INTO account (username, xmr_wallet, tari_wallet, tari_balance, xmr_balance, fee)
+                SELECT username, xmr_wallet, tari_wallet, 0, 0, %s FROM round_credit
+                ON CONFLICT (username) DO NOTHING
+            """, (fee,))
+            timer.mark('account_upsert')
+            credited = insert_round_rewards(cur, 'tari', block_height)
+            if credited < len(credits):
+                logger.info(f"TARI 区块 {block_height} 有 {len(credits) - credited} 个用户的奖励记录已存在，跳过")
+            timer.mark('reward_insert')
+            
+            # 只有仍在任期内的主实例能提交入账
+            crediting_leader.check_fence(cur)
             conn.commit()
+            timer.mark('commit')
             
-            # 5. 清空Redis中的TARI提交记录
-            for key in redis_client.keys('tari:submit:*'):
-                redis_client.delete(key)
+            # 5. 入账提交成功后释放轮次快照
+            release_round_snapshot(snapshot_key)
+            timer.mark('snapshot_cleanup')
                 
             return {
                 'success': True,
                 'block_height': block_height,
                 'total_shares': total_shares,
-                'reward': reward,
-                'time': current_time.isoformat()
+                'reward': coins(reward, 'tari'),
+                'time': current_time.isoformat(),
+                'credited': credited,
+                'timings': timer.result()
             }
             
         except Exception as e:
@@ -485,10 +953,11 @@ def handle_json_rpc(data):
         result = None
         if method == 'submit':
             result = handle_submit(params)
-        elif method == 'xmr_block2':
-            result = handle_xmr_block(params)
-        elif method == 'tari_block2':
-            result = handle_tari_block(params)
+        elif method == 'submit_batch':
+            result = handle_submit_batch(params)
+        elif method in ('xmr_block2', 'tari_block2'):
+            # 爆块统一进入事件队列，由 block_crediting 主实例入账，任何实例都可以接收
+            result = queue_block_request('xmr' if method == 'xmr_block2' else 'tari', params)
         else:
             raise ValueError(f"Method {method} not found")
         
@@ -508,14 +977,152 @@ def handle_json_rpc(data):
             }
         }
 
+def dispatch_json_rpc(data) -> Dict[str, Any]:
+    """处理单个JSON-RPC请求对象，返回响应对象"""
+    # 验证JSON-RPC 2.0请求格式
+    if not isinstance(data, dict):
+        return {
+            'jsonrpc': '2.0',
+            'error': {
+                'code': -32600,
+                'message': 'Invalid Request'
+            },
+            'id': None
+        }
+    
+    # 提取请求参数
+    method = data.get('method')
+    params = data.get('params', {})
+    request_id = data.get('id')
+    
+    # 验证必要字段
+    if not method:
+        return {
+            'jsonrpc': '2.0',
+            'error': {
+                'code': -32600,
+                'message': 'Invalid Request: method is required'
+            },
+            'id': request_id
+        }
+    
+    # 根据方法名调用相应的处理函数
+    if method == 'submit':
+        result = handle_submit(params)
+    elif method == 'submit_batch':
+        result = handle_submit_batch(params)
+    elif method in ('xmr_block', 'tari_block'):
+        result = handle_block_event('xmr' if method == 'xmr_block' else 'tari', params)
+    else:
+        return {
+            'jsonrpc': '2.0',
+            'error': {
+                'code': -32601,
+                'message': f'Method not found: {method}'
+            },
+            'id': request_id
+        }
+    
+    # 返回响应
+    response = {
+        'jsonrpc': '2.0',
+        'id': request_id
+    }
+    response.update(result)
+    return response
+
+# JSON-RPC 数组批量请求的最大条数，超过时整批返回 -32600
+MAX_JSON_RPC_BATCH = config.get('json_rpc', {}).get('max_batch_size', 1000)
+
+def is_notification(data: Any) -> bool:
+    """没有 id 成员的请求是通知，按JSON-RPC 2.0照常处理但不返回响应"""
+    return isinstance(data, dict) and 'id' not in data and bool(data.get('method'))
+
+def dispatch_json_rpc_batch(batch: List[Any]) -> List[Dict[str, Any]]:
+    """处理JSON-RPC 2.0数组批量请求，其中的submit请求合并为一次Redis往返，通知不返回响应"""
+    responses = [None] * len(batch)
+    
+    # 收集所有合法的submit请求，去重和计数合并为一次Redis往返
+    candidates = []
+    for i, item in enumerate(batch):
+        if isinstance(item, dict) and item.get('method') == 'submit':
+            params = item.get('params', {})
+            username = params.get('username') if isinstance(params, dict) else None
+            if isinstance(username, str) and username:
+                try:
+                    candidates.append((i, username, get_share_id(params)))
+                    continue
+                except ValueError:
+                    pass
+        responses[i] = dispatch_json_rpc(item)
+    
+    if candidates:
+        try:
+            submit_counts = increment_submit_counts_batch(
+                [{'username': username, 'count': 1, 'share_id': share_id} for _, username, share_id in candidates])
+            for (i, _, _), counts in zip(candidates, submit_counts):
+                if counts is None:
+                    result = {
+                        'status': 'OK',
+                        'message': 'Duplicate share ignored',
+                        'duplicate': True
+                    }
+                else:
+                    result = {
+                        'status': 'OK',
+                        'message': 'Submission recorded successfully',
+                        'submit_counts': counts
+                    }
+                responses[i] = {
+                    'jsonrpc': '2.0',
+                    'id': batch[i].get('id'),
+                    'result': result
+                }
+        except Exception as e:
+            logger.error(f"Error processing batched submissions: {str(e)}")
+            for i, _, _ in candidates:
+                responses[i] = {
+                    'jsonrpc': '2.0',
+                    'id': batch[i].get('id'),
+                    'error': {
+                        'code': -32000,
+                        'message': f'Internal error: {str(e)}'
+                    }
+                }
+    
+    return [response for item, response in zip(batch, responses) if not is_notification(item)]
+
 @app.route('/json_rpc', methods=['POST'])
 def json_rpc():
     """处理JSON-RPC请求"""
     try:
         # 获取请求数据
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        
+        # JSON-RPC 2.0 数组批量请求
+        if isinstance(data, list):
+            if not data:
+                return jsonify({
+                    'jsonrpc': '2.0',
+                    'error': {
+                        'code': -32600,
+                        'message': 'Invalid Request: empty batch'
+                    },
+                    'id': None
+                })
+            if len(data) > MAX_JSON_RPC_BATCH:
+                return jsonify({
+                    'jsonrpc': '2.0',
+                    'error': {
+                        'code': -32600,
+                        'message': f'Invalid Request: batch exceeds {MAX_JSON_RPC_BATCH} requests'
+                    },
+                    'id': None
+                })
+            responses = dispatch_json_rpc_batch(data)
+            # 全部是通知时不返回任何内容
+            return jsonify(responses) if responses else ('', 204)
         
-        # 验证JSON-RPC 2.0请求格式
         if not isinstance(data, dict):
             return jsonify({
                 'jsonrpc': '2.0',
@@ -526,80 +1133,37 @@ def json_rpc():
                 'id': None
             })
         
-        # 提取请求参数
-        method = data.get('method')
-        params = data.get('params', {})
-        request_id = data.get('id')
-        
-        # 验证必要字段
-        if not method:
-            return jsonify({
-                'jsonrpc': '2.0',
-                'error': {
-                    'code': -32600,
-                    'message': 'Invalid Request: method is required'
-                },
-                'id': request_id
-            })
-        
-        # 根据方法名调用相应的处理函数
-        if method == 'submit':
-            result = handle_submit(params)
-        #elif method == 'xmr_block':
-        #    #result = handle_xmr_block(params)
-        #elif method == 'tari_block':
-        #    #result = handle_tari_block(params)
-        else:
-            return jsonify({
-                'jsonrpc': '2.0',
-                'error': {
-                    'code': -32601,
-                    'message': f'Method not found: {method}'
-                },
-                'id': request_id
-            })
-        
-        # 返回响应
-        response = {
-            'jsonrpc': '2.0',
-            'id': request_id
-        }
-        response.update(result)
-        
-        return jsonify(response)
+        response = dispatch_json_rpc(data)
+        return ('', 204) if is_notification(data) else jsonify(response)
         
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
+        data = request.get_json(silent=True)
         return jsonify({
             'jsonrpc': '2.0',
             'error': {
                 'code': -32000,
                 'message': f'Internal error: {str(e)}'
             },
-            'id': request.get_json().get('id') if request.is_json else None
+            'id': data.get('id') if isinstance(data, dict) else None
         })
 
 @app.route('/stats', methods=['GET'])
 def get_stats():
     try:
-        # 从Redis获取所有提交记录
-        xmr_keys = redis_client.keys(f"{XMR_PREFIX}*")
-        tari_keys = redis_client.keys(f"{TARI_PREFIX}*")
+        # 从Redis获取当前轮次的所有提交记录
+        xmr_shares = get_round_shares('xmr')
+        tari_shares = get_round_shares('tari')
         
-        logger.debug(f"Found {len(xmr_keys)} XMR keys and {len(tari_keys)} TARI keys in Redis")
+        logger.debug(f"Found {len(xmr_shares)} XMR users and {len(tari_shares)} TARI users in Redis")
         
         # 计算活跃用户数（有提交记录的用户）
         active_users = set()
-        for key in xmr_keys + tari_keys:
-            username = key.split(':')[-1]
-            active_users.add(username)
+        for username in list(xmr_shares) + list(tari_shares):
+            active_users.add(username.split(':')[-1])
         
         # 计算总提交数
-        total_shares = 0
-        for key in xmr_keys + tari_keys:
-            shares = int(redis_client.get(key) or 0)
-            total_shares += shares
-            logger.debug(f"User {key.split(':')[-1]} has {shares} shares")
+        total_shares = sum(xmr_shares.values()) + sum(tari_shares.values())
         
         logger.info(f"Stats requested. Active users: {len(active_users)}, Total shares: {total_shares}")
         
@@ -615,49 +1179,21 @@ def get_stats():
 @app.route('/users', methods=['GET'])
 def get_users():
     try:
-        # 从Redis获取所有提交记录
-        xmr_keys = redis_client.keys(f"{XMR_PREFIX}*")
-        tari_keys = redis_client.keys(f"{TARI_PREFIX}*")
+        # 从Redis获取当前轮次的所有提交记录
+        xmr_shares = get_round_shares('xmr')
+        tari_shares = get_round_shares('tari')
         
-        logger.debug(f"Found {len(xmr_keys)} XMR keys and {len(tari_keys)} TARI keys in Redis")
+        logger.debug(f"Found {len(xmr_shares)} XMR users and {len(tari_shares)} TARI users in Redis")
         
         active_users = {}
-        
-        # 处理XMR提交
-        for key in xmr_keys:
-            # 只删除前缀，保留完整的用户名
-            username = key.replace(XMR_PREFIX, '')
-            shares = int(redis_client.get(key) or 0)
-            
-            if username not in active_users:
-                active_users[username] = {
-                    "xmr_shares": shares,
-                    "tari_shares": 0,
-                    "total_shares": shares
-                }
-                logger.debug(f"New user found: {username} with {shares} XMR shares")
-            else:
-                active_users[username]["xmr_shares"] = shares
-                active_users[username]["total_shares"] += shares
-                logger.debug(f"Updated user {username} XMR shares to {shares}")
-        
-        # 处理TARI提交
-        for key in tari_keys:
-            # 只删除前缀，保留完整的用户名
-            username = key.replace(TARI_PREFIX, '')
-            shares = int(redis_client.get(key) or 0)
-            
-            if username not in active_users:
-                active_users[username] = {
-                    "xmr_shares": 0,
-                    "tari_shares": shares,
-                    "total_shares": shares
-                }
-                logger.debug(f"New user found: {username} with {shares} TARI shares")
-            else:
-                active_users[username]["tari_shares"] = shares
-                active_users[username]["total_shares"] += shares
-                logger.debug(f"Updated user {username} TARI shares to {shares}")
+        for username in set(xmr_shares) | set(tari_shares):
+            xmr = xmr_shares.get(username, 0)
+            tari = tari_shares.get(username, 0)
+            active_users[username] = {
+                "xmr_shares": xmr,
+                "tari_shares": tari,
+                "total_shares": xmr + tari
+            }
         
         logger.info(f"User list requested. Active users: {len(active_users)}")
         
@@ -685,6 +1221,115 @@ def xmr_stats():
             'error': str(e)
         }), 500
 
+# 以最小单位存储的金额列: (表, 列, 币种)，币种为 None 时按该行的 type 列区分
+MONEY_COLUMNS = [
+    ('account', 'xmr_balance', 'xmr'),
+    ('account', 'tari_balance', 'tari'),
+    ('blocks', 'rewards', None),
+    ('rewards', 'reward', None),
+    ('payment', 'amount', None),
+    ('balance_ledger', 'amount', None),
+]
+
+# 依赖金额列的视图，转换列类型前需要先删除，之后由 init_database 重新创建
+MONEY_VIEWS = ['account_decimal', 'rewards_decimal', 'blocks_decimal', 'payment_decimal', 'account_balance']
+
+# 按行的 type 列取得该行金额的最小单位数
+ROW_UNITS_SQL = f"CASE type WHEN 'tari' THEN {TARI_ATOMIC_UNITS} ELSE {XMR_ATOMIC_UNITS} END"
+
+def migrate_money_columns(cur):
+    """把旧的 DECIMAL(20,12) 金额列原地转换为 BIGINT 最小单位，已转换或不存在的列跳过"""
+    cur.execute("""
+        SELECT table_name, column_name
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        AND data_type = 'numeric'
+        AND table_name = ANY(%s)
+    """, (list({table for table, _, _ in MONEY_COLUMNS}),))
+    numeric_columns = set(cur.fetchall())
+    pending = [(table, column, chain) for table, column, chain in MONEY_COLUMNS if (table, column) in numeric_columns]
+    if not pending:
+        return
+    
+    for view in MONEY_VIEWS:
+        cur.execute(sql.SQL("DROP VIEW IF EXISTS {}").format(sql.Identifier(view)))
+    for table, column, chain in pending:
+        units = sql.SQL(ROW_UNITS_SQL) if chain is None else sql.Literal(XMR_ATOMIC_UNITS if chain == 'xmr' else TARI_ATOMIC_UNITS)
+        cur.execute(sql.SQL("""
+            ALTER TABLE {table}
+            ALTER COLUMN {column} TYPE BIGINT USING ROUND({column} * {units})::BIGINT
+        """).format(table=sql.Identifier(table), column=sql.Identifier(column), units=units))
+        logger.info(f"已将 {table}.{column} 转换为 BIGINT 最小单位")
+
+# blocks.value 为每个share的最小单位数，不是整数，保留为 NUMERIC；
+# 旧库中是 web/update_db.sql 创建的 DECIMAL(20,8)，存的是每个share的币值
+BLOCK_VALUE_PRECISION = (30, 12)
+
+def migrate_block_value(cur):
+    """把旧的 blocks.value 从每个share的币值转换为最小单位数，按行的 type 列区分币种，已转换或不存在时跳过
+
+    必须在 migrate_money_columns 之后调用 (需要 rewards 已是最小单位)。
+    金额列转换后、本迁移之前写入的区块已经是最小单位: value * total_shares 与 rewards 同一量级，
+    而旧行只有 rewards 的 1/10^6 (Tari) 或 1/10^12 (XMR)，按此区分，只转换旧行。
+    """
+    cur.execute("""
+        SELECT numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'blocks' AND column_name = 'value'
+    """)
+    row = cur.fetchone()
+    if row is None or tuple(row) == BLOCK_VALUE_PRECISION:
+        return
+    cur.execute(f"""
+        ALTER TABLE blocks
+        ALTER COLUMN value TYPE NUMERIC{BLOCK_VALUE_PRECISION}
+        USING CASE WHEN value * total_shares * 1000 < rewards THEN value * {ROW_UNITS_SQL} ELSE value END
+    """)
+    logger.info("已将 blocks.value 转换为每个share的最小单位数")
+
+def migrate_blocks_key(cur):
+    """把 blocks 的键从全局唯一的 block_height 迁移为 (type, block_height)，rewards 的外键随之改为复合外键
+
+    旧表中同一高度只能有一条区块，XMR 与 Tari 区块高度相同时后到的区块会被 ON CONFLICT 丢弃。
+    已迁移的表直接跳过。
+    """
+    cur.execute("""
+        SELECT conname, contype, conrelid::regclass::text, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE (conrelid = 'blocks'::regclass AND contype IN ('p', 'u'))
+           OR (confrelid = 'blocks'::regclass AND contype = 'f')
+    """)
+    constraints = cur.fetchall()
+    if any(contype == 'p' and definition == 'PRIMARY KEY (type, block_height)'
+           for _, contype, _, definition in constraints):
+        return
+    
+    # 先删除引用 blocks 的外键，再删除旧的主键/唯一约束
+    for name, contype, table, _ in sorted(constraints, key=lambda c: c[1] != 'f'):
+        cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(
+            sql.Identifier(table), sql.Identifier(name)))
+    cur.execute("ALTER TABLE blocks ADD PRIMARY KEY (type, block_height)")
+    
+    # 旧外键只检查高度，可能存在类型与区块不符的奖励记录；此时外键只约束新写入的记录
+    cur.execute("""
+        SELECT COUNT(*)
+        FROM rewards r
+        WHERE NOT EXISTS (
+            SELECT 1 FROM blocks b
+            WHERE b.type = r.type AND b.block_height = r.block_height
+        )
+    """)
+    orphans = cur.fetchone()[0]
+    cur.execute(f"""
+        ALTER TABLE rewards
+        ADD CONSTRAINT rewards_type_block_height_fkey
+        FOREIGN KEY (type, block_height) REFERENCES blocks (type, block_height)
+        {'NOT VALID' if orphans else ''}
+    """)
+    if orphans:
+        logger.warning(f"rewards 表中有 {orphans} 条记录找不到同类型的区块，外键未校验已有记录")
+    logger.info("已将 blocks 的主键迁移为 (type, block_height)")
+
 def init_database():
     """初始化数据库表结构"""
     try:
@@ -696,8 +1341,20 @@ def init_database():
             CREATE TABLE IF NOT EXISTS account (
                 id SERIAL PRIMARY KEY,
                 username VARCHAR(255) UNIQUE NOT NULL,
-                xmr_balance DECIMAL(20,12) DEFAULT 0,
-                tari_balance DECIMAL(20,12) DEFAULT 0,
+                xmr_balance BIGINT DEFAULT 0,
+                tari_balance BIGINT DEFAULT 0,
+                xmr_wallet VARCHAR(255),
+                tari_wallet VARCHAR(255),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # 登录名 -> 用户ID 映射 (Redis user:ids 的镜像)，登录名解析后的用户名和钱包只计算一次
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS account_login (
+                user_id INTEGER PRIMARY KEY,
+                login TEXT UNIQUE NOT NULL,
+                username VARCHAR(255) NOT NULL,
                 xmr_wallet VARCHAR(255),
                 tari_wallet VARCHAR(255),
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -707,12 +1364,13 @@ def init_database():
         # 创建blocks表(如果不存在)
         cur.execute("""
             CREATE TABLE IF NOT EXISTS blocks (
-                id SERIAL PRIMARY KEY,
-                block_height BIGINT UNIQUE NOT NULL,
-                rewards DECIMAL(20,12) NOT NULL,
+                id SERIAL,
+                block_height BIGINT NOT NULL,
+                rewards BIGINT NOT NULL,
                 type VARCHAR(10) NOT NULL,
                 total_shares BIGINT NOT NULL,
-                time TIMESTAMP NOT NULL
+                time TIMESTAMP NOT NULL,
+                PRIMARY KEY (type, block_height)
             )
         """)
         
@@ -723,14 +1381,171 @@ def init_database():
                 block_height BIGINT NOT NULL,
                 type VARCHAR(10) NOT NULL,
                 username VARCHAR(255) NOT NULL,
-                reward DECIMAL(20,12) NOT NULL,
+                reward BIGINT NOT NULL,
                 shares BIGINT NOT NULL,
                 time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (block_height) REFERENCES blocks(block_height),
+                FOREIGN KEY (type, block_height) REFERENCES blocks(type, block_height),
                 FOREIGN KEY (username) REFERENCES account(username)
             )
         """)
         
+        migrate_blocks_key(cur)
+        
+        # 区块轮次快照，用户ID与提交数以并行数组存储，用于重算奖励 (见 round_replay.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS round_snapshots (
+                type VARCHAR(10) NOT NULL,
+                block_height BIGINT NOT NULL,
+                user_ids INTEGER[] NOT NULL,
+                shares BIGINT[] NOT NULL,
+                total_shares BIGINT NOT NULL,
+                fee NUMERIC NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (type, block_height)
+            )
+        """)
+        
+        # 主实例任期号，每次当选加一，作为入账事务的 fencing token (见 leader.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS leader_epochs (
+                role VARCHAR(32) PRIMARY KEY,
+                epoch BIGINT NOT NULL,
+                holder TEXT NOT NULL,
+                elected_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        
+        # 爆块事件队列，日志监控线程写入，入账工作线程用 SKIP LOCKED 领取
+        # source 为最先上报该区块的来源: log (日志), event (结构化事件), rpc, backfill；
+        # first_failed_at 为第一次入账失败的时间，重试超过 max_head_wait_seconds 后放弃
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS block_events (
+                id BIGSERIAL PRIMARY KEY,
+                chain VARCHAR(10) NOT NULL,
+                block_height BIGINT NOT NULL,
+                params JSONB NOT NULL,
+                status VARCHAR(10) NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                processed_at TIMESTAMP,
+                first_failed_at TIMESTAMP,
+                source VARCHAR(16) NOT NULL DEFAULT 'log'
+                    CONSTRAINT block_events_source_check CHECK (source IN ('log', 'event', 'rpc', 'backfill')),
+                UNIQUE (chain, block_height)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_block_events_pending
+            ON block_events (chain, id) WHERE status = 'pending'
+        """)
+        
+        # 余额流水表，只追加，由 LedgerCompactor 汇总到 account 余额 (见 balance_ledger.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS balance_ledger (
+                id BIGSERIAL PRIMARY KEY,
+                username VARCHAR(255) NOT NULL,
+                type VARCHAR(10) NOT NULL,
+                amount BIGINT NOT NULL,
+                reason VARCHAR(20) NOT NULL,
+                ref TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (username) REFERENCES account(username)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_balance_ledger_username
+            ON balance_ledger (username, id)
+        """)
+        # 压缩水位，只有一行: id 不大于 last_compacted_id 的流水已计入 account 余额
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_watermark (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                last_compacted_id BIGINT NOT NULL DEFAULT 0
+            )
+        """)
+        cur.execute("INSERT INTO ledger_watermark DEFAULT VALUES ON CONFLICT DO NOTHING")
+        
+        # 旧库的 DECIMAL 金额列转换为 BIGINT 最小单位
+        migrate_money_columns(cur)
+        migrate_block_value(cur)
+        
+        # 精确余额视图: 已压缩的余额加上水位以上的流水
+        cur.execute("""
+            CREATE OR REPLACE VIEW account_balance AS
+            SELECT a.username,
+                   a.xmr_balance + COALESCE(p.xmr, 0)::BIGINT AS xmr_balance,
+                   a.tari_balance + COALESCE(p.tari, 0)::BIGINT AS tari_balance,
+                   a.xmr_wallet,
+                   a.tari_wallet
+            FROM account a
+            LEFT JOIN (
+                SELECT username,
+                       SUM(amount) FILTER (WHERE type = 'xmr') AS xmr,
+                       SUM(amount) FILTER (WHERE type = 'tari') AS tari
+                FROM balance_ledger
+                WHERE id > (SELECT last_compacted_id FROM ledger_watermark)
+                GROUP BY username
+            ) p ON p.username = a.username
+        """)
+        
+        # 以币为单位的兼容视图，供仍按 DECIMAL 读取金额的外部查询使用
+        cur.execute(f"""
+            CREATE OR REPLACE VIEW account_decimal AS
+            SELECT username,
+                   (xmr_balance::NUMERIC / {XMR_ATOMIC_UNITS})::DECIMAL(20,12) AS xmr_balance,
+                   (tari_balance::NUMERIC / {TARI_ATOMIC_UNITS})::DECIMAL(20,12) AS tari_balance,
+                   xmr_wallet,
+                   tari_wallet
+            FROM account_balance
+        """)
+        cur.execute(f"""
+            CREATE OR REPLACE VIEW rewards_decimal AS
+            SELECT id, block_height, type, username,
+                   (reward::NUMERIC / {ROW_UNITS_SQL})::DECIMAL(20,12) AS reward,
+                   shares
+            FROM rewards
+        """)
+        cur.execute(f"""
+            CREATE OR REPLACE VIEW blocks_decimal AS
+            SELECT block_height, type,
+                   (rewards::NUMERIC / {ROW_UNITS_SQL})::DECIMAL(20,12) AS rewards,
+                   total_shares, time
+            FROM blocks
+        """)
+        cur.execute("SELECT to_regclass('payment') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute(f"""
+                CREATE OR REPLACE VIEW payment_decimal AS
+                SELECT id, username, type,
+                       (amount::NUMERIC / {ROW_UNITS_SQL})::DECIMAL(20,12) AS amount,
+                       txid, time
+                FROM payment
+            """)
+        
+        # 每个用户每个区块只有一条奖励记录，批量入账依赖该约束跳过已存在的记录
+        try:
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS rewards_block_type_username_key
+                ON rewards (block_height, type, username)
+            """)
+        except psycopg2.IntegrityError:
+            logger.error("rewards 表中存在重复的奖励记录，请先运行 fix_duplicate_rewards.py")
+            raise
+        
+        # Tari 区块检查器按高度顺序领取未检查的区块
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'blocks' AND column_name = 'check_status'
+        """)
+        if cur.fetchone():
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_blocks_unchecked
+                ON blocks (type, block_height)
+                WHERE check_status = false
+            """)
+        
         # 创建算力历史记录表
         cur.execute("""
             CREATE TABLE IF NOT EXISTS hashrate_history (
@@ -786,72 +1601,490 @@ def init_base_data():
 # 在应用启动时初始化数据库和基础数据
 init_database()
 init_base_data()
+migrate_legacy_submit_keys()
+
+# 可选的写后聚合，默认关闭
+aggregation_config = config.get('submit_aggregation', {})
+if aggregation_config.get('enabled', False):
+    journal_path = aggregation_config.get('journal', 'submit_journal.log')
+    submit_aggregator = SubmitAggregator(
+        journal_path,
+        aggregation_config.get('flush_interval_ms', 200),
+        # 实例ID需要在重启后保持不变，默认为主机名加日志的绝对路径
+        aggregation_config.get('instance_id') or f"{socket.gethostname()}:{os.path.abspath(journal_path)}"
+    )
+    submit_aggregator.replay_journal()
+    submit_aggregator.register()
+    submit_aggregator.start()
+
+# 可选的Unix域套接字提交入口，路径为空时不启用
+submit_socket_server = None
+if config.get('submit_socket'):
+    submit_socket_server = start_submit_socket(config['submit_socket'])
 
 class LogMonitorThread(threading.Thread):
     def __init__(self):
         super().__init__()
         self.daemon = True
         self.running = True
-        self.log_queue = Queue()
-        self.log_file = './p2pool.log'
+        tailer_config = config.get('log_tailer', {})
+        self.log_file = tailer_config.get('path', './p2pool.log')
+        self.state_file = tailer_config.get('state_file', 'p2pool.log.offset')
+        self.chunk_size = tailer_config.get('chunk_size', 1048576)
         
         # 编译正则表达式模式
-        self.xmr_block_pattern = re.compile(r'got a payout of ([\d.]+) XMR in block (\d+)')
-        self.tari_block_pattern = re.compile(r'Mined Tari block ([a-f0-9]+) at height (\d+)')
+        self.xmr_block_pattern = re.compile(XMR_BLOCK_PATTERN)
+        self.tari_block_pattern = re.compile(TARI_BLOCK_PATTERN)
         
     def run(self):
+        while self.running:
+            # 只有 log_tailer 主实例读取日志，其他实例等待接任
+            if not tailer_leader.wait_for_leadership(1):
+                continue
+            self.tail()
+            
+    def tail(self):
         try:
-            # 打开日志文件
-            with open(self.log_file, 'r') as f:
-                # 移动到文件末尾
-                f.seek(0, 2)
-                
-                while self.running:
-                    line = f.readline()
-                    if not line:
-                        # 如果没有新内容，等待一小段时间
-                        time.sleep(0.1)
-                        continue
-                        
-                    # 将日志行放入队列
-                    self.log_queue.put(line)
-                    
-                    # 处理日志行
-                    self.process_log_line(line)
-                    
+            # 由 inotify 唤醒按块读取，从上次保存的偏移继续，跟随轮转和截断
+            logger.info(f"开始监控日志 {self.log_file}")
+            tailer = LogTailer(self.log_file, self.state_file, self.chunk_size)
+            tailer.follow(self.process_log_lines, lambda: self.running and tailer_leader.is_leader)
         except Exception as e:
             logger.error(f"日志监控线程错误: {str(e)}")
+            time.sleep(1)
+            
+    def process_log_lines(self, lines: List[str]):
+        for line in lines:
+            self.process_log_line(line)
             
     def process_log_line(self, line):
         try:
-            # 检查 XMR 爆块信息
-            xmr_match = self.xmr_block_pattern.search(line)
+            # 检查 XMR 爆块信息，先用固定子串过滤，绝大部分日志行不需要运行正则表达式
+            xmr_match = XMR_BLOCK_MARKER in line and self.xmr_block_pattern.search(line)
             if xmr_match:
-                reward = float(xmr_match.group(1))
+                reward = xmr_match.group(1)
                 height = int(xmr_match.group(2))
                 logger.info(f"检测到 XMR 爆块 - 高度: {height}, 奖励: {reward}")
-                # 直接调用处理函数，让处理函数进行数据库检查
-                handle_xmr_block({'height': height, 'reward': reward})
+                # 写入持久化队列，由入账工作线程处理，日志读取不会被数据库阻塞
+                self.enqueue('xmr', height, {'height': height, 'reward': xmr_match.group(1)})
                 return
                 
             # 检查 TARI 爆块信息
-            tari_match = self.tari_block_pattern.search(line)
+            tari_match = TARI_BLOCK_MARKER in line and self.tari_block_pattern.search(line)
             if tari_match:
                 height = int(tari_match.group(2))
                 block_id = tari_match.group(1)
                 logger.info(f"检测到 TARI 爆块 - 高度: {height}, 区块ID: {block_id}")
-                # 直接调用处理函数，让处理函数进行数据库检查
-                handle_tari_block({'height': height, 'block_id': block_id})
+                # 写入持久化队列，由入账工作线程处理，日志读取不会被数据库阻塞
+                self.enqueue('tari', height, {'height': height, 'block_id': block_id})
                 
         except Exception as e:
             logger.error(f"处理日志行时出错: {str(e)}")
+    
+    def enqueue(self, chain: str, height: int, params: Dict[str, Any]):
+        """写入爆块事件队列，数据库不可用时退避重试直到成功，爆块事件不会被丢弃"""
+        delay = 1
+        while self.running:
+            try:
+                enqueue_block_event(chain, height, params)
+                return
+            except Exception as e:
+                logger.error(f"{chain.upper()} 区块 {height} 写入事件队列失败，{delay} 秒后重试: {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
             
     def stop(self):
         self.running = False
 
-# 创建并启动日志监控线程
+# 爆块事件队列配置
+block_queue_config = config.get('block_queue', {})
+BLOCK_EVENT_MAX_ATTEMPTS = block_queue_config.get('max_attempts', 10)
+BLOCK_EVENT_BACKOFF_BASE = block_queue_config.get('backoff_base_seconds', 5)
+BLOCK_EVENT_BACKOFF_MAX = block_queue_config.get('backoff_max_seconds', 600)
+# 事件第一次入账失败后超过该时间仍未成功时不再重试，标记为 failed，避免一直阻塞同一条链上之后的事件
+BLOCK_EVENT_MAX_HEAD_WAIT = block_queue_config.get('max_head_wait_seconds', 900)
+
+BLOCK_EVENT_HANDLERS = {
+    'xmr': handle_xmr_block,
+    'tari': handle_tari_block
+}
+
+def handle_backfilled_block(chain: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """入账 backfill_blocks.py 补录的历史区块
+
+    历史区块的轮次早已结束，不能切换当前轮次 (那样会把正在进行的一轮记到旧区块上)。
+    快照与区块记录在同一事务中提交，缺失的区块通常没有自己的快照:
+    事件参数中带有 reference_height (backfill_blocks.py --reference) 时，把参考区块的快照复制为本区块的快照，
+    按参考区块的提交分布近似入账并记录警告日志；否则返回不重试的错误，事件标记为 failed 等待人工处理。
+    """
+    block_height = params.get('height')
+    if not block_height:
+        return {'error': '缺少必要的区块信息', 'retry': False}
+    if chain == 'xmr':
+        reward = to_atomic(params.get('reward', 0), XMR_ATOMIC_UNITS)
+        block_id = '-'
+        checked = True
+    else:
+        reward = to_atomic(config['rewards']['tari_block_reward'], TARI_ATOMIC_UNITS)
+        block_id = params.get('block_id')
+        checked = False
+    if not reward:
+        return {'error': '缺少必要的区块信息', 'retry': False}
+    
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT EXISTS (SELECT 1 FROM blocks WHERE type = %s AND block_height = %s)", (chain, block_height))
+        if cur.fetchone()[0]:
+            logger.info(f"补录的 {chain.upper()} 区块 {block_height} 已存在于数据库中，跳过处理")
+            return {'success': True, 'message': 'Block already exists in database', 'block_height': block_height}
+        
+        snapshot = load_snapshots(cur, chain, [block_height]).get(block_height)
+        reference_height = None
+        if snapshot is None:
+            reference_height = params.get('reference_height')
+            if reference_height is not None:
+                snapshot = load_snapshots(cur, chain, [reference_height]).get(reference_height)
+            if snapshot is None:
+                logger.error(f"补录的 {chain.upper()} 区块 {block_height} 没有轮次快照，需要人工核对后入账")
+                return {'error': '补录区块没有轮次快照，需要人工处理', 'retry': False}
+            logger.warning(f"补录的 {chain.upper()} 区块 {block_height} 没有轮次快照，"
+                           f"按参考区块 {reference_height} 的提交分布近似入账")
+            # 复制为本区块的快照，之后的重算 (round_replay.py) 得到相同的结果
+            save_round_snapshot(cur, chain, block_height, dict(zip(snapshot[0], snapshot[1])), snapshot[2])
+        
+        total_shares = sum(snapshot[1])
+        # 区块时间取不到，记录入账时间；TARI 区块仍由 TariBlockChecker 验证
+        cur.execute("""
+            INSERT INTO blocks (block_height, rewards, type, total_shares, time, value, is_valid, check_status, block_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (type, block_height) DO NOTHING
+        """, (block_height, reward, chain, total_shares, datetime.now(),
+              Decimal(reward) / Decimal(total_shares), checked, checked, block_id))
+        replayed = replay_rewards(cur, chain, [block_height])
+        if not replayed:
+            conn.rollback()
+            return {'error': '轮次快照中的用户ID没有映射，需要人工处理', 'retry': False}
+        credited = restore_rewards(cur, chain, replayed)
+        crediting_leader.check_fence(cur)
+        conn.commit()
+        if reference_height is None:
+            logger.info(f"补录的 {chain.upper()} 区块 {block_height} 已按保存的轮次快照入账")
+        else:
+            logger.warning(f"补录的 {chain.upper()} 区块 {block_height} 已按参考区块 {reference_height} 近似入账")
+        return {'success': True, 'block_height': block_height, 'total_shares': total_shares, 'credited': credited,
+                'reference_height': reference_height}
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"处理补录的 {chain.upper()} 区块时出错: {str(e)}")
+        return {'error': str(e)}
+    finally:
+        conn.close()
+
+def enqueue_block_event(chain: str, block_height: int, params: Dict[str, Any], source: str = 'log') -> bool:
+    """把爆块事件写入 block_events 表，返回是否为新事件
+
+    新事件的轮次快照在入队事务提交之前切换 (见 block_queue.py)，工作线程领取事件时快照一定已经存在
+    """
+    conn = get_db_connection()
+    try:
+        created = block_queue.enqueue_block_event(conn, redis_client, chain, block_height, params, source,
+                                                  flush_submit_aggregator)
+    finally:
+        conn.close()
+    if not created:
+        logger.info(f"{chain.upper()} 区块 {block_height} 的事件已在队列中 (来源: {source})")
+    return created
+
+def queue_block_request(chain: str, params: Any) -> Dict[str, Any]:
+    """把通过接口上报的爆块写入事件队列"""
+    height = params.get('height') if isinstance(params, dict) else None
+    if not height:
+        return {'error': '缺少必要的区块信息'}
+    created = enqueue_block_event(chain, int(height), params, 'rpc')
+    return {
+        'success': True,
+        'queued': created,
+        'block_height': int(height)
+    }
+
+# 结构化爆块事件入口配置
+block_event_config = config.get('block_event_intake', {})
+BLOCK_EVENT_INTAKE_ENABLED = block_event_config.get('enabled', True)
+BLOCK_EVENT_ALLOWED_HOSTS = set(block_event_config.get('allowed_hosts', ['127.0.0.1', '::1']))
+
+def parse_block_event(chain: str, params: Any) -> Dict[str, Any]:
+    """校验 xmr_block / tari_block 事件，返回写入队列的参数，格式错误时抛出 ValueError
+
+    参数: height (必填), reward (XMR 必填，以币为单位), block_id (Tari 必填，十六进制), timestamp (可选，Unix 秒)
+    """
+    if not isinstance(params, dict):
+        raise ValueError('params must be an object')
+    height = params.get('height')
+    if isinstance(height, bool) or not isinstance(height, int) or height <= 0:
+        raise ValueError('height must be a positive integer')
+    event = {'height': height}
+    
+    reward = params.get('reward')
+    if reward is not None:
+        try:
+            if to_atomic(reward, XMR_ATOMIC_UNITS if chain == 'xmr' else TARI_ATOMIC_UNITS) <= 0:
+                raise ValueError
+        except (InvalidOperation, ValueError, OverflowError):
+            raise ValueError('reward must be a positive amount')
+        event['reward'] = str(reward)
+    elif chain == 'xmr':
+        raise ValueError('reward is required')
+    
+    block_id = params.get('block_id')
+    if block_id is not None:
+        if not isinstance(block_id, str) or not re.fullmatch(r'[0-9a-fA-F]{64}', block_id):
+            raise ValueError('block_id must be a 64 character hex string')
+        event['block_id'] = block_id.lower()
+    elif chain == 'tari':
+        raise ValueError('block_id is required')
+    
+    timestamp = params.get('timestamp')
+    if timestamp is not None:
+        if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)) or timestamp <= 0:
+            raise ValueError('timestamp must be a Unix time in seconds')
+        event['timestamp'] = int(timestamp)
+    return event
+
+def handle_block_event(chain: str, params: Any) -> Dict[str, Any]:
+    """处理 xmr_block / tari_block 方法: 结构化的爆块事件直接写入事件队列，不再依赖日志匹配
+
+    只接受本机 (allowed_hosts) 的请求，与日志监控线程上报的同一区块只入队一次
+    """
+    if not BLOCK_EVENT_INTAKE_ENABLED or request.remote_addr not in BLOCK_EVENT_ALLOWED_HOSTS:
+        logger.warning(f"拒绝来自 {request.remote_addr} 的 {chain}_block 事件")
+        return {
+            'error': {
+                'code': -32601,
+                'message': f'Method not found: {chain}_block'
+            }
+        }
+    try:
+        event = parse_block_event(chain, params)
+    except ValueError as e:
+        return {
+            'error': {
+                'code': -32602,
+                'message': f'Invalid params: {str(e)}'
+            }
+        }
+    try:
+        created = enqueue_block_event(chain, event['height'], event, 'event')
+    except Exception as e:
+        logger.error(f"{chain.upper()} 区块 {event['height']} 事件写入队列失败: {str(e)}")
+        return {
+            'error': {
+                'code': -32000,
+                'message': f'Internal error: {str(e)}'
+            }
+        }
+    if created:
+        logger.info(f"收到 {chain.upper()} 爆块事件 - 高度: {event['height']}")
+    return {
+        'result': {
+            'status': 'OK',
+            'queued': created,
+            'block_height': event['height']
+        }
+    }
+
+def archive_round_snapshot(cur, chain: str, block_height) -> Optional[str]:
+    """在调用方的事务中把放弃入账的区块在Redis中的快照转存到 round_snapshots 表，返回提交后需要释放的快照键名
+
+    封存代的回收下限取未入账快照中最小的起始代，失败事件的快照一直留在Redis中会使之后所有的代都无法回收。
+    读取Redis失败时返回 None，快照保留到下次启动时由 archive_failed_snapshots 处理
+    """
+    range_key = get_range_key(chain, block_height)
+    try:
+        round_shares = get_snapshot_shares(range_key)
+    except redis.RedisError as e:
+        logger.error(f"读取 {chain.upper()} 区块 {block_height} 的轮次快照失败，暂不转存: {str(e)}")
+        return None
+    if round_shares:
+        save_round_snapshot(cur, chain, block_height, round_shares, config['pool_fees'])
+        logger.warning(f"{chain.upper()} 区块 {block_height} 的轮次快照已转存到 round_snapshots，"
+                       f"共 {len(round_shares)} 个用户")
+    return range_key
+
+def archive_failed_snapshots():
+    """启动时转存并释放已标记为 failed 的事件仍留在Redis中的快照"""
+    try:
+        pending = set(redis_client.zrange(ROUND_PENDING_KEY, 0, -1))
+        if not pending:
+            return
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT chain, block_height FROM block_events WHERE status = 'failed'")
+            failed = [(chain, block_height) for chain, block_height in cur.fetchall()
+                      if get_range_key(chain, block_height) in pending]
+            archived = [archive_round_snapshot(cur, chain, block_height) for chain, block_height in failed]
+            conn.commit()
+        finally:
+            conn.close()
+        for range_key in archived:
+            if range_key is not None:
+                release_round_snapshot(range_key)
+        if failed:
+            logger.info(f"已转存并释放 {len(failed)} 个失败事件的轮次快照")
+    except Exception as e:
+        logger.error(f"转存失败事件的轮次快照失败: {str(e)}")
+
+class BlockEventWorker(threading.Thread):
+    """从 block_events 表取出爆块事件并入账
+
+    用 FOR UPDATE SKIP LOCKED 领取事件，多个工作线程 (或多个进程) 不会重复处理；
+    每条链只有队首事件可以被领取，保证同一条链按爆块顺序入账。轮次在入队事务提交之前已经切换，
+    入账使用入队时的快照。失败的事件按指数退避重试，超过最大次数或第一次失败后超过 max_head_wait_seconds
+    后标记为 failed 保留在表中，不再阻塞之后的事件。失败事件的快照转存到 round_snapshots 表并从Redis释放，
+    不会阻止封存代的回收；人工处理时把事件改回 pending 并把 source 改为 backfill，即按转存的快照入账。
+    """
+    def __init__(self, index: int, poll_interval: float = 0.5):
+        super().__init__()
+        self.daemon = True
+        self.running = True
+        self.name = f"BlockEventWorker-{index}"
+        self.poll_interval = poll_interval
+        
+    def run(self):
+        while self.running:
+            if not crediting_leader.wait_for_leadership(1):
+                continue
+            try:
+                if not self.process_next():
+                    time.sleep(self.poll_interval)
+            except Exception as e:
+                logger.error(f"爆块事件工作线程错误: {str(e)}")
+                time.sleep(self.poll_interval)
+                
+    def process_next(self) -> bool:
+        """处理一个到期的事件，没有可处理的事件时返回 False"""
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, chain, block_height, params, attempts, source,
+                       EXTRACT(EPOCH FROM NOW() - COALESCE(first_failed_at, NOW()))
+                FROM block_events e
+                WHERE status = 'pending'
+                AND next_attempt_at <= NOW()
+                AND NOT EXISTS (
+                    SELECT 1 FROM block_events p
+                    WHERE p.chain = e.chain AND p.status = 'pending' AND p.id < e.id
+                )
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            """)
+            row = cur.fetchone()
+            if row is None:
+                conn.rollback()
+                return False
+            
+            # waited: 第一次失败之后已经重试的时间，这段时间内同一条链之后的事件都在等待
+            event_id, chain, block_height, params, attempts, source, waited = row
+            waited = float(waited)
+            if isinstance(params, str):
+                params = json.loads(params)
+            
+            # 入账在处理函数自己的连接和事务中完成，这里的事务只持有事件行锁
+            # 补录的历史区块不能切换当前轮次，只按保存的快照入账
+            try:
+                if source == 'backfill':
+                    result = handle_backfilled_block(chain, params)
+                else:
+                    result = BLOCK_EVENT_HANDLERS[chain](params)
+            except Exception as e:
+                result = {'error': str(e)}
+            
+            # 入账期间失去主实例身份: 不记录本次尝试，由新的主实例处理
+            if not crediting_leader.is_leader:
+                conn.rollback()
+                return False
+            
+            attempts += 1
+            archived_key = None
+            if not result.get('error'):
+                cur.execute("""
+                    UPDATE block_events
+                    SET status = 'done', attempts = %s, last_error = NULL, processed_at = NOW()
+                    WHERE id = %s
+                """, (attempts, event_id))
+                logger.info(f"{chain.upper()} 区块 {block_height} 入账完成")
+            elif (result.get('retry', True) and attempts < BLOCK_EVENT_MAX_ATTEMPTS
+                  and waited < BLOCK_EVENT_MAX_HEAD_WAIT):
+                # 下次重试不晚于最长等待时间，到时仍失败就放弃
+                delay = min(BLOCK_EVENT_BACKOFF_BASE * 2 ** (attempts - 1), BLOCK_EVENT_BACKOFF_MAX,
+                            max(int(BLOCK_EVENT_MAX_HEAD_WAIT - waited), 1))
+                cur.execute("""
+                    UPDATE block_events
+                    SET attempts = %s, last_error = %s, next_attempt_at = NOW() + %s * INTERVAL '1 second',
+                        first_failed_at = COALESCE(first_failed_at, NOW())
+                    WHERE id = %s
+                """, (attempts, str(result['error']), delay, event_id))
+                logger.warning(f"{chain.upper()} 区块 {block_height} 第 {attempts} 次入账失败，{delay} 秒后重试: {result['error']}")
+            else:
+                archived_key = archive_round_snapshot(cur, chain, block_height)
+                cur.execute("""
+                    UPDATE block_events
+                    SET status = 'failed', attempts = %s, last_error = %s, processed_at = NOW()
+                    WHERE id = %s
+                """, (attempts, str(result['error']), event_id))
+                logger.error(f"{chain.upper()} 区块 {block_height} 入账失败 (第 {attempts} 次，已重试 {int(waited)} 秒)，"
+                             f"已放弃: {result['error']}")
+            conn.commit()
+            if archived_key is not None:
+                release_round_snapshot(archived_key)
+            return True
+        finally:
+            conn.close()
+        
+    def stop(self):
+        self.running = False
+
+# 主实例选举: 只有一个实例读取日志、只有一个实例入账，其余实例只处理提交和查询
+leader_config = config.get('leader_election', {})
+tailer_leader = LeaderElection(
+    ROLE_LOG_TAILER,
+    get_db_connection,
+    leader_config.get('check_interval', 5),
+    leader_config.get('enabled', True)
+)
+crediting_leader = LeaderElection(
+    ROLE_BLOCK_CREDITING,
+    get_db_connection,
+    leader_config.get('check_interval', 5),
+    leader_config.get('enabled', True)
+)
+tailer_leader.start()
+crediting_leader.start()
+
+# 创建并启动日志监控线程，p2pool 通过 xmr_block / tari_block 上报爆块时可以关闭
 log_monitor = LogMonitorThread()
-log_monitor.start()
+if config.get('log_tailer', {}).get('enabled', True):
+    log_monitor.start()
+
+# 转存之前失败的事件留下的快照，然后创建并启动爆块事件工作线程
+archive_failed_snapshots()
+block_workers = [BlockEventWorker(i) for i in range(block_queue_config.get('workers', 2))]
+for worker in block_workers:
+    worker.start()
+
+# 创建并启动余额流水压缩线程
+ledger_config = config.get('balance_ledger', {})
+ledger_compactor = LedgerCompactor(
+    get_db_connection,
+    ledger_config.get('compact_interval', 5),
+    ledger_config.get('batch_size', 50000),
+    lambda: crediting_leader.is_leader,
+    ledger_config.get('lock_timeout_ms', 1000)
+)
+ledger_compactor.start()
 
 def process_block(block_data):
     try:
@@ -884,199 +2117,38 @@ def process_block(block_data):
         return False
 
 class TariBlockChecker(threading.Thread):
+    """定期并发验证所有未检查的 Tari 区块 (见 tari_verifier.py)，只由 block_crediting 主实例运行"""
     def __init__(self, db_config):
         super().__init__()
         self.daemon = True
         self.running = True
         self.db_config = db_config
-        self.api_url = "https://explore.tari.com/blocks/{height}?json"
-        self.check_interval = 60  # 检查间隔（秒）
-
-    def buffer_to_hex(self, buffer_data):
-        """将 Buffer 数据转换为十六进制字符串"""
-        if not isinstance(buffer_data, dict) or 'data' not in buffer_data:
-            return ''
-        return ''.join([f'{x:02x}' for x in buffer_data['data']])
-    def get_block_data(block_height: int) -> Dict[str, Any]:
-        """获取指定高度的区块数据"""
-        url = f'https://textexplore.tari.com/blocks/{block_height}?json'
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"获取区块数据失败: {e}")
-            return None
-    def get_block_from_api(self, height):
-        """从 API 获取区块数据"""
-        try:
-            url = f'https://textexplore.tari.com/blocks/{height}?json'
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            # 检查响应内容类型
-            content_type = response.headers.get('content-type', '')
-            if 'application/json' not in content_type:
-                logger.warning(f"API 响应不是 JSON 格式: {content_type}")
-                return None
-                
-            # 尝试解析 JSON
-            try:
-                data = response.json()
-                if not data:
-                    logger.warning(f"API 返回空数据: {response.text[:100]}")
-                    return None
-                return data
-            except json.JSONDecodeError as e:
-                logger.warning(f"JSON 解析错误: {e}, 响应内容: {response.text[:100]}")
-                return None
-                
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"获取区块 {height} 数据失败: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"处理 API 响应时发生未知错误: {e}")
-            return None
-
-
-    def update_block_status(self, block_id, is_valid, remote_hash=None):
-        """更新区块状态"""
-        try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            if is_valid:
-                cur.execute("""
-                    UPDATE blocks 
-                    SET check_status = true, 
-                        is_valid = true
-                    WHERE block_id = %s
-                """, (block_id,))
-            else:
-                cur.execute("""
-                    UPDATE blocks 
-                    SET check_status = true, 
-                        is_valid = false
-                    WHERE block_id = %s
-                """, (block_id,))
-            
-            conn.commit()
-            logger.info(f"区块 {block_id} 状态已更新: is_valid={is_valid} remote_hash={remote_hash}")
-            
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"更新区块状态失败: {e}")
-        finally:
-            cur.close()
-            conn.close()
-
-    def check_block(self):
-        """检查一个区块"""
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT id, block_height, block_id 
-            FROM blocks 
-            WHERE check_status = false 
-            AND type = 'tari'
-            ORDER BY block_height ASC 
-            LIMIT 1
-        """)
-        block = cur.fetchone()
-        if not block:
-            logger.info("没有需要检查的区块")
-            return
-        block_hash = block[2]
-
-        logger.info(f"开始检查区块 {block[1]}")  # block[1] 是 block_height
-        api_data = self.get_block_from_api(block[1])
-        
-        if not api_data:
-            logger.info(f"远程未找到区块 {block[1]}，跳过")
-            return
+        verifier_config = config.get('tari_verifier', {})
+        self.check_interval = verifier_config.get('check_interval', 60)  # 检查间隔（秒）
+        self.verifier = TariVerifier(
+            get_db_connection,
+            verifier_config.get('api_url', DEFAULT_TARI_API_URL),
+            verifier_config.get('concurrency', 8),
+            verifier_config.get('rate_per_second', 10),
+            verifier_config.get('timeout', 10),
+            verifier_config.get('batch_size', 100),
+            open_header_cache(config)
+        )
 
+    def check_blocks(self):
+        """验证所有未检查的区块，每批结果提交前检查主实例任期"""
         try:
-            header = api_data.get('header', {})
-            remote_hash = self.buffer_to_hex(header.get('hash', {}))
-            
-            if not remote_hash:
-                logger.info(f"区块 {block[1]} 未找到远程 哈希 重试")
-                return
-            elif remote_hash != block_hash:
-                logger.warning(f"区块 {block[1]} 远程哈希无效")
-                self.handle_invalid_block(block_hash, block[1])
-                return
-
-            # 更新区块状态
-            self.update_block_status(block[2], True, remote_hash)
-            logger.info(f"区块 {block[1]} 验证成功")
-
-        except Exception as e:
-            logger.error(f"检查区块 {block[1]} 时发生错误: {e}")
-            # 如果发生错误，将区块标记为无效
-            return
-            self.handle_invalid_block(block[0], block[1])
-
-    def handle_invalid_block(self, block_id, block_height):
-        """处理无效区块"""
-        try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            # 1. 更新区块状态为无效
-            cur.execute("""
-                UPDATE blocks 
-                SET check_status = true, 
-                    is_valid = false
-                WHERE block_id = %s
-            """, (block_id,))
-            
-            # 2. 获取该区块的所有奖励记录
-            cur.execute("""
-                SELECT username, reward, type
-                FROM rewards 
-                WHERE block_height = %s
-            """, (block_height,))
-            rewards = cur.fetchall()
-            
-            # 3. 回滚用户余额
-            for reward in rewards:
-                username, amount, reward_type = reward
-                if reward_type == 'tari':
-                    cur.execute("""
-                        UPDATE account 
-                        SET tari_balance = tari_balance - %s
-                        WHERE username = %s
-                    """, (amount, username))
-                elif reward_type == 'xmr':
-                    cur.execute("""
-                        UPDATE account 
-                        SET xmr_balance = xmr_balance - %s
-                        WHERE username = %s
-                    """, (amount, username))
-            
-            # 4. 删除奖励记录
-            cur.execute("""
-                UPDATE rewards 
-                        set reward = 0
-                WHERE block_height = %s
-            """, (block_height,))
-            
-            conn.commit()
-            logger.info(f"区块 {block_id} 已标记为无效并清理相关数据")
-            
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"处理无效区块 {block_height} 时发生错误: {e}")
-        finally:
-            cur.close()
-            conn.close()
+            self.verifier.run_once(before_commit=crediting_leader.check_fence)
+        except LeadershipLost:
+            logger.warning("验证 TARI 区块期间失去主实例身份，未提交的结果已回滚")
 
     def run(self):
         """运行检查器"""
         while self.running:
+            if not crediting_leader.wait_for_leadership(1):
+                continue
             try:
-                self.check_block()
+                self.check_blocks()
             except Exception as e:
                 logger.error(f"检查器运行错误: {e}")
             time.sleep(self.check_interval)
@@ -1095,9 +2167,10 @@ def get_user_info(username):
         
         # 获取用户信息
         cur.execute("""
-            SELECT username, xmr_balance, tari_balance, xmr_wallet, tari_wallet, fee, created_at
-            FROM account 
-            WHERE username = %s
+            SELECT a.username, b.xmr_balance, b.tari_balance, a.xmr_wallet, a.tari_wallet, a.fee, a.created_at
+            FROM account a
+            JOIN account_balance b ON b.username = a.username
+            WHERE a.username = %s
         """, (username,))
         
         user = cur.fetchone()
@@ -1105,16 +2178,15 @@ def get_user_info(username):
             return jsonify({'error': '用户不存在'}), 404
             
         # 获取用户当前算力
-        xmr_shares = int(redis_client.get(f"{XMR_PREFIX}{username}") or 0)
-        tari_shares = int(redis_client.get(f"{TARI_PREFIX}{username}") or 0)
+        submit_counts = get_submit_counts(username)
         
         # 计算当前算力（假设每个share代表1H/s）
-        current_hashrate = xmr_shares + tari_shares
+        current_hashrate = submit_counts['xmr'] + submit_counts['tari']
         
         return jsonify({
             'username': user['username'],
-            'xmr_balance': float(user['xmr_balance']),
-            'tari_balance': float(user['tari_balance']),
+            'xmr_balance': coins(user['xmr_balance'], 'xmr'),
+            'tari_balance': coins(user['tari_balance'], 'tari'),
             'xmr_wallet': user['xmr_wallet'],
             'tari_wallet': user['tari_wallet'],
             'fee': float(user['fee']),
@@ -1139,7 +2211,7 @@ def get_user_rewards(username):
         cur.execute("""
             SELECT r.block_height, r.type, r.reward, r.shares, r.time, b.rewards as block_reward
             FROM rewards r
-            JOIN blocks b ON r.block_height = b.block_height AND r.type = b.type
+            JOIN blocks b ON b.type = r.type AND b.block_height = r.block_height
             WHERE r.username = %s
             ORDER BY r.time DESC
             LIMIT 100
@@ -1151,10 +2223,10 @@ def get_user_rewards(username):
             'rewards': [{
                 'block_height': reward['block_height'],
                 'type': reward['type'],
-                'reward': float(reward['reward']),
+                'reward': coins(reward['reward'], reward['type']),
                 'shares': reward['shares'],
                 'time': reward['time'].isoformat() if reward['time'] else None,
-                'block_reward': float(reward['block_reward'])
+                'block_reward': coins(reward['block_reward'], reward['type'])
             } for reward in rewards]
         })
         
@@ -1186,7 +2258,7 @@ def get_user_payments(username):
             'payments': [{
                 'tx_id': payment['tx_id'],
                 'type': payment['type'],
-                'amount': float(payment['amount']),
+                'amount': coins(payment['amount'], payment['type']),
                 'time': payment['time'].isoformat() if payment['time'] else None
             } for payment in payments]
         })
@@ -1211,5 +2283,14 @@ if __name__ == '__main__':
     finally:
         # 确保在服务器关闭时停止所有线程
         log_monitor.stop()
+        for worker in block_workers:
+            worker.stop()
+        ledger_compactor.stop()
+        tailer_leader.stop()
+        crediting_leader.stop()
+        if submit_socket_server is not None:
+            submit_socket_server.shutdown()
+        if submit_aggregator is not None:
+            submit_aggregator.stop()
         if 'tari_checker' in locals():
             tari_checker.stop()
\ No newline at end of file
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""从历史 p2pool.log 中找出没有入账的爆块
+
+并行扫描历史日志 (包括 gzip 压缩的轮转文件)，找出 LogMonitorThread 识别的两种爆块日志行:
+    got a payout of <奖励> XMR in block <高度>
+    Mined Tari block <区块ID> at height <高度>
+与 blocks 表比对后输出缺失的区块，加 --enqueue 时以 source='backfill' 写入 block_events 队列。
+api_server.py 不会为补录的区块切换当前轮次。轮次快照与区块记录在同一事务中提交，
+缺失的区块没有自己的快照，默认入队后只标记为 failed，等待人工核对。
+
+加 --reference 时为每个缺失的区块选择参考区块并写入事件参数 reference_height，api_server.py
+按参考区块快照的提交分布近似入账。参考区块是同一条链上之后第一个有快照的区块 (缺失区块没有切换轮次，
+它那一轮的提交都计入了这个区块)，之后没有时取之前最近的一个。参考区块会随缺失区块一起输出，入队前请先核对。
+
+未压缩的文件用 mmap 映射后按 --chunk-size 切分，各块在行边界对齐后分给多个进程扫描；
+gzip 文件无法随机访问，每个文件由一个进程流式解压扫描，多个文件之间并行。
+扫描时先用 bytes.find 查找固定子串，只对命中的行运行正则表达式，绝大部分日志行只经过一次子串查找。
+
+用法:
+    python backfill_blocks.py logs/p2pool.log*                  # 输出缺失的区块
+    python backfill_blocks.py --json logs/*.gz > missing.jsonl  # 以JSON行输出
+    python backfill_blocks.py --enqueue logs/p2pool.log*        # 把缺失的区块写入入账队列 (等待人工处理)
+    python backfill_blocks.py --reference --enqueue logs/*      # 按参考区块近似入账
+"""
+import argparse
+import gzip
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from log_tailer import XMR_BLOCK_PATTERN, TARI_BLOCK_PATTERN, XMR_BLOCK_MARKER, TARI_BLOCK_MARKER
+
+logger = logging.getLogger(__name__)
+
+# 固定子串预筛选，命中后再用与 LogMonitorThread 相同的正则表达式解析
+XMR_MARKER = XMR_BLOCK_MARKER.encode()
+TARI_MARKER = TARI_BLOCK_MARKER.encode()
+XMR_REGEX = re.compile(XMR_BLOCK_PATTERN.encode())
+TARI_REGEX = re.compile(TARI_BLOCK_PATTERN.encode())
+
+# 每次从 gzip 流中读取的解压后字节数
+GZIP_READ_SIZE = 16 * 1024 * 1024
+
+# (链, 高度, 区块参数, 日志行, 文件, 字节偏移)
+Event = Tuple[str, int, Dict[str, object], str, str, int]
+
+
+def parse_line(line: bytes, path: str, offset: int) -> Optional[Event]:
+    match = XMR_REGEX.search(line)
+    if match:
+        height = int(match.group(2))
+        return ('xmr', height, {'height': height, 'reward': match.group(1).decode()},
+                line.decode('utf-8', errors='replace').rstrip(), path, offset)
+    match = TARI_REGEX.search(line)
+    if match:
+        height = int(match.group(2))
+        return ('tari', height, {'height': height, 'block_id': match.group(1).decode()},
+                line.decode('utf-8', errors='replace').rstrip(), path, offset)
+    return None
+
+
+def scan_buffer(data, start: int, end: int, path: str, base_offset: int = 0) -> List[Event]:
+    """扫描子串起始位置落在 data[start:end] 中的爆块日志行，data 可以是 bytes 或 mmap
+
+    每处子串只会被起始位置所在的块找到，跨越块边界的行由该块读取完整的一行
+    """
+    events = []
+    for marker in (XMR_MARKER, TARI_MARKER):
+        # 允许子串跨越块的结尾，但起始位置必须在本块内
+        limit = end + len(marker) - 1
+        pos = data.find(marker, start, limit)
+        while pos != -1:
+            line_start = data.rfind(b'\n', 0, pos) + 1
+            line_end = data.find(b'\n', pos)
+            if line_end == -1:
+                line_end = len(data)
+            event = parse_line(data[line_start:line_end], path, base_offset + line_start)
+            if event is not None:
+                events.append(event)
+            pos = data.find(marker, line_end, limit)
+    return events
+
+
+def scan_chunk(path: str, start: int, end: int) -> List[Event]:
+    """扫描未压缩文件中 [start, end) 范围内开头的所有行"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return scan_buffer(data, start, end, path)
+
+
+def scan_gzip(path: str) -> List[Event]:
+    """流式解压扫描一个 gzip 文件，每次处理一大块完整的行"""
+    events = []
+    offset = 0        # 解压后的字节偏移
+    tail = b''
+    with gzip.open(path, 'rb') as f:
+        while True:
+            chunk = f.read(GZIP_READ_SIZE)
+            if not chunk:
+                break
+            data = tail + chunk
+            end = data.rfind(b'\n') + 1
+            if end:
+                events.extend(scan_buffer(data, 0, end, path, offset))
+                offset += end
+            tail = data[end:]
+    if tail:
+        events.extend(scan_buffer(tail, 0, len(tail), path, offset))
+    return events
+
+
+def plan_tasks(paths: List[str], chunk_size: int) -> List[tuple]:
+    """把日志文件拆分为扫描任务: 未压缩文件按块拆分，gzip 文件整个作为一个任务"""
+    tasks = []
+    for path in paths:
+        if path.endswith('.gz'):
+            tasks.append((scan_gzip, path))
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_size):
+            tasks.append((scan_chunk, path, start, min(start + chunk_size, size)))
+    return tasks
+
+
+def run_task(task: tuple) -> List[Event]:
+    return task[0](*task[1:])
+
+
+def scan_logs(paths: List[str], workers: int, chunk_size: int) -> List[Event]:
+    """并行扫描所有日志文件，每个区块只保留第一次出现的日志行"""
+    tasks = plan_tasks(paths, chunk_size)
+    found = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for events in executor.map(run_task, tasks):
+            for event in events:
+                found.setdefault((event[0], event[1]), event)
+    return sorted(found.values(), key=lambda event: (event[0], event[1]))
+
+
+def find_missing(cur, events: List[Event]) -> List[Tuple[Event, bool]]:
+    """返回不在 blocks 表中的爆块，以及每个区块是否已在 block_events 队列中"""
+    missing = []
+    for chain in ('xmr', 'tari'):
+        heights = [event[1] for event in events if event[0] == chain]
+        if not heights:
+            continue
+        cur.execute("""
+            SELECT block_height FROM blocks
+            WHERE type = %s AND block_height = ANY(%s)
+        """, (chain, heights))
+        credited = {row[0] for row in cur.fetchall()}
+        cur.execute("""
+            SELECT block_height FROM block_events
+            WHERE chain = %s AND block_height = ANY(%s)
+        """, (chain, heights))
+        queued = {row[0] for row in cur.fetchall()}
+        missing.extend((event, event[1] in queued)
+                       for event in events if event[0] == chain and event[1] not in credited)
+    return missing
+
+
+def find_reference_blocks(cur, missing: List[Tuple[Event, bool]]) -> Dict[Tuple[str, int], int]:
+    """为每个缺失的区块选择参考区块: 同一条链上之后第一个有轮次快照的区块，没有时取之前最近的一个"""
+    references = {}
+    for chain in ('xmr', 'tari'):
+        heights = [event[1] for event, _ in missing if event[0] == chain]
+        if not heights:
+            continue
+        cur.execute("""
+            SELECT h, COALESCE(
+                (SELECT MIN(block_height) FROM round_snapshots WHERE type = %s AND block_height > h),
+                (SELECT MAX(block_height) FROM round_snapshots WHERE type = %s AND block_height < h))
+            FROM unnest(%s::BIGINT[]) AS h
+        """, (chain, chain, heights))
+        references.update(((chain, height), reference) for height, reference in cur.fetchall()
+                          if reference is not None)
+    return references
+
+
+def enqueue_missing(cur, missing: List[Tuple[Event, bool]], references: Dict[Tuple[str, int], int]) -> int:
+    """把缺失且尚未入队的区块写入 block_events，有参考区块时写入 reference_height，返回新入队的数量"""
+    rows = []
+    for (chain, height, params, *_), queued in missing:
+        if queued:
+            continue
+        if (chain, height) in references:
+            params = dict(params, reference_height=references[(chain, height)])
+        rows.append((chain, height, json.dumps(params), 'backfill'))
+    if not rows:
+        return 0
+    # execute_values 分页执行，rowcount 只是最后一页的行数，用 RETURNING 统计所有页
+    inserted = execute_values(cur, """
+        INSERT INTO block_events (chain, block_height, params, source)
+        VALUES %s
+        ON CONFLICT (chain, block_height) DO NOTHING
+        RETURNING id
+    """, rows, fetch=True)
+    return len(inserted)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    parser = argparse.ArgumentParser(description='从历史日志中找出没有入账的爆块')
+    parser.add_argument('paths', nargs='+', help='日志文件，.gz 结尾的按 gzip 解压')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='扫描进程数')
+    parser.add_argument('--chunk-size', type=int, default=64, help='未压缩文件每个扫描块的大小 (MiB)')
+    parser.add_argument('--enqueue', action='store_true', help='把缺失的区块写入 block_events 队列')
+    parser.add_argument('--reference', action='store_true',
+                        help='为缺失的区块选择参考区块，入队后按参考区块的提交分布近似入账')
+    parser.add_argument('--json', action='store_true', help='每个缺失的区块输出一行JSON')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    args = parser.parse_args()
+
+    paths = [path for path in args.paths if os.path.isfile(path) and os.path.getsize(path) > 0]
+    start = time.perf_counter()
+    events = scan_logs(paths, args.workers, args.chunk_size * 1024 * 1024)
+    scanned = sum(os.path.getsize(path) for path in paths)
+    logger.info(f"扫描 {len(paths)} 个文件 ({scanned / 1024 ** 3:.2f} GiB) 用时 {time.perf_counter() - start:.1f} 秒，"
+                f"找到 {len(events)} 个爆块")
+
+    with open(args.config, 'r') as f:
+        db = json.load(f)['database']
+    conn = psycopg2.connect(host=db['host'], port=db['port'], database=db['database'],
+                            user=db['user'], password=db['password'])
+    try:
+        cur = conn.cursor()
+        missing = find_missing(cur, events)
+        references = find_reference_blocks(cur, missing) if args.reference else {}
+        for (chain, height, params, line, path, offset), queued in missing:
+            reference = references.get((chain, height))
+            if args.json:
+                print(json.dumps({'chain': chain, 'height': height, 'params': params, 'queued': queued,
+                                  'reference_height': reference, 'file': path, 'offset': offset, 'line': line},
+                                 ensure_ascii=False))
+            else:
+                note = ' (已在队列中)' if queued else ''
+                if reference is not None:
+                    note += f' (参考区块 {reference})'
+                print(f"{chain.upper()} {height}{note}  {path}:{offset}  {line}")
+        logger.info(f"缺失 {len(missing)} 个区块，其中 {sum(1 for _, queued in missing if queued)} 个已在入账队列中")
+        if args.reference and len(references) < len(missing):
+            logger.warning(f"{len(missing) - len(references)} 个区块没有可用的参考区块，入队后需要人工处理")
+        if args.enqueue:
+            enqueued = enqueue_missing(cur, missing, references)
+            conn.commit()
+            logger.info(f"已将 {enqueued} 个区块写入入账队列")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"比对区块失败: {str(e)}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""只追加的余额流水账
+
+奖励、支付、冲正和人工调整都以带符号的流水写入 balance_ledger 表，写入方之间不再争用
+account 表中同一行的行锁，也不会为每次入账产生一个新的 account 行版本。
+account 表中的 xmr_balance / tari_balance 只由压缩器更新: 它定期把 id 大于水位
+(ledger_watermark.last_compacted_id) 的流水按用户汇总，用一条语句加到余额上并推进水位，
+两步在同一事务中完成。已压缩的流水不再被更新，压缩不会为每条流水产生新的行版本。
+
+id 由序列分配，提交顺序可能与 id 顺序不同。写入方在事务中持有共享 advisory lock，
+压缩器在推进水位前取得排他锁，保证水位以下不会再出现未提交的流水。
+
+需要精确余额的地方 (支付脚本、用户信息接口) 读取 account_balance 视图，
+即 account 中已压缩的余额加上水位以上的流水，不受压缩延迟影响。
+
+用法:
+    python balance_ledger.py --compact    # 立即压缩全部未压缩的流水
+    python balance_ledger.py --status     # 查看未压缩的流水数量
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from typing import Callable, Iterable, Optional, Tuple
+
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+LEDGER_TYPES = ('xmr', 'tari')
+
+# 写入方 (共享) 和压缩器 (排他) 使用的 advisory lock，与 leader.py 相同用 hashtext 生成键
+LEDGER_LOCK = 'balance_ledger'
+
+# 流水原因
+REASON_REWARD = 'reward'          # 区块奖励
+REASON_PAYMENT = 'payment'        # 支付 (含手续费)
+REASON_REVERSAL = 'reversal'      # 无效区块的奖励冲正
+REASON_REFUND = 'refund'          # 失败支付退回
+REASON_ADJUSTMENT = 'adjustment'  # 人工修正
+
+
+def lock_for_append(cur):
+    """写入流水前在调用方的事务中取得共享锁，事务结束时释放；直接 INSERT balance_ledger 的语句之前也必须调用"""
+    cur.execute("SELECT pg_advisory_xact_lock_shared(hashtext(%s))", (LEDGER_LOCK,))
+
+
+def append_entries(cur, entries: Iterable[Tuple[str, str, int, str, Optional[str]]]) -> int:
+    """在调用方的事务中追加多条 (用户名, 类型, 带符号的最小单位金额, 原因, 关联标识) 流水，返回写入条数"""
+    rows = [(username, chain, int(amount), reason, None if ref is None else str(ref))
+            for username, chain, amount, reason, ref in entries
+            if amount]
+    if not rows:
+        return 0
+    lock_for_append(cur)
+    execute_values(cur, """
+        INSERT INTO balance_ledger (username, type, amount, reason, ref)
+        VALUES %s
+    """, rows, page_size=10000)
+    return len(rows)
+
+
+def append_entry(cur, username: str, chain: str, amount: int, reason: str, ref=None) -> int:
+    """追加一条流水，金额为最小单位整数，为正表示增加余额，为负表示扣减"""
+    return append_entries(cur, [(username, chain, amount, reason, ref)])
+
+
+def compact(cur, batch_size: int = 50000, lock_timeout_ms: int = 1000) -> int:
+    """把水位以上最多 batch_size 条流水汇总到 account 余额上并推进水位，返回压缩的条数
+
+    先取得排他锁，等待已写入流水的事务结束，最多等待 lock_timeout_ms (超时抛出 LockNotAvailable)；
+    等待期间新的写入方排在压缩器之后。流水的用户名没有 account 行时抛出 RuntimeError，不推进水位。
+    """
+    cur.execute("SET LOCAL lock_timeout = %s", (f'{int(lock_timeout_ms)}ms',))
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (LEDGER_LOCK,))
+    cur.execute("SET LOCAL lock_timeout = DEFAULT")
+    cur.execute("""
+        WITH watermark AS (
+            SELECT last_compacted_id FROM ledger_watermark FOR UPDATE
+        ), batch AS (
+            SELECT l.id, l.username, l.type, l.amount
+            FROM balance_ledger l, watermark w
+            WHERE l.id > w.last_compacted_id
+            ORDER BY l.id
+            LIMIT %s
+        ), totals AS (
+            SELECT username,
+                   COALESCE(SUM(amount) FILTER (WHERE type = 'xmr'), 0)::BIGINT AS xmr,
+                   COALESCE(SUM(amount) FILTER (WHERE type = 'tari'), 0)::BIGINT AS tari
+            FROM batch
+            GROUP BY username
+        ), updated AS (
+            UPDATE account
+            SET xmr_balance = account.xmr_balance + totals.xmr,
+                tari_balance = account.tari_balance + totals.tari
+            FROM totals
+            WHERE account.username = totals.username
+            RETURNING account.username
+        ), advanced AS (
+            UPDATE ledger_watermark
+            SET last_compacted_id = (SELECT MAX(id) FROM batch)
+            WHERE EXISTS (SELECT 1 FROM batch)
+        )
+        SELECT (SELECT COUNT(*) FROM batch),
+               ARRAY(SELECT username FROM totals EXCEPT SELECT username FROM updated)
+    """, (batch_size,))
+    compacted, missing = cur.fetchone()
+    if missing:
+        raise RuntimeError(f"{len(missing)} 个流水用户没有 account 记录，压缩中止: {', '.join(sorted(missing)[:20])}")
+    return int(compacted)
+
+
+def discard_pending(cur) -> int:
+    """把水位推进到当前最后一条流水，这些流水不计入余额，返回条数
+
+    供直接重写 account 余额的维护脚本在同一事务中调用，避免之后再被压缩器重复计入；
+    排他锁持有到事务结束，期间写入的流水在重写之后才可见。
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (LEDGER_LOCK,))
+    cur.execute("""
+        WITH watermark AS (
+            SELECT last_compacted_id FROM ledger_watermark FOR UPDATE
+        ), pending AS (
+            SELECT COUNT(*) AS entries, MAX(l.id) AS last_id
+            FROM balance_ledger l, watermark w
+            WHERE l.id > w.last_compacted_id
+        ), advanced AS (
+            UPDATE ledger_watermark
+            SET last_compacted_id = pending.last_id
+            FROM pending
+            WHERE pending.last_id IS NOT NULL
+        )
+        SELECT entries FROM pending
+    """)
+    return int(cur.fetchone()[0])
+
+
+def pending_count(cur) -> int:
+    cur.execute("""
+        SELECT COUNT(*)
+        FROM balance_ledger
+        WHERE id > (SELECT last_compacted_id FROM ledger_watermark)
+    """)
+    return cur.fetchone()[0]
+
+
+class LedgerCompactor(threading.Thread):
+    """定期把流水压缩到 account 余额的后台线程
+
+    connect 返回一个新的数据库连接；每批在单独的事务中提交，一次压缩中途失败不影响已提交的批次。
+    is_active 返回 False 时跳过本轮压缩，多实例部署时只由主实例压缩。
+    写入方事务超过 lock_timeout_ms 仍未结束时跳过本轮，下一轮再压缩。
+    """
+    def __init__(self, connect: Callable, interval: float = 5, batch_size: int = 50000,
+                 is_active: Optional[Callable[[], bool]] = None, lock_timeout_ms: int = 1000):
+        super().__init__()
+        self.daemon = True
+        self.running = True
+        self.name = "LedgerCompactor"
+        self.connect = connect
+        self.interval = interval
+        self.batch_size = batch_size
+        self.is_active = is_active
+        self.lock_timeout_ms = lock_timeout_ms
+
+    def compact_all(self) -> int:
+        conn = self.connect()
+        total = 0
+        try:
+            cur = conn.cursor()
+            while True:
+                compacted = compact(cur, self.batch_size, self.lock_timeout_ms)
+                conn.commit()
+                total += compacted
+                if compacted < self.batch_size:
+                    return total
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            logger.debug("等待写入流水的事务结束超时，本轮跳过压缩")
+            return total
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def run(self):
+        while self.running:
+            if self.is_active is not None and not self.is_active():
+                time.sleep(self.interval)
+                continue
+            try:
+                compacted = self.compact_all()
+                if compacted:
+                    logger.debug(f"已压缩 {compacted} 条余额流水")
+            except Exception as e:
+                logger.error(f"压缩余额流水失败: {str(e)}")
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='余额流水压缩')
+    parser.add_argument('--compact', action='store_true', help='立即压缩全部未压缩的流水')
+    parser.add_argument('--status', action='store_true', help='查看未压缩的流水数量')
+    parser.add_argument('--batch-size', type=int, default=50000, help='每个事务压缩的流水条数')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    args = parser.parse_args()
+    if not args.compact and not args.status:
+        parser.print_help()
+        return
+
+    with open(args.config, 'r') as f:
+        db = json.load(f)['database']
+
+    def connect():
+        return psycopg2.connect(host=db['host'], port=db['port'], database=db['database'],
+                                user=db['user'], password=db['password'])
+
+    try:
+        if args.compact:
+            compacted = LedgerCompactor(connect, batch_size=args.batch_size).compact_all()
+            print(f"已压缩 {compacted} 条流水")
+        conn = connect()
+        try:
+            print(f"未压缩的流水: {pending_count(conn.cursor())} 条")
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"压缩余额流水失败: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
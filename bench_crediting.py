@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""爆块入账基准测试与规模模拟
+
+在独立的 Postgres 数据库和 Redis 库中构造一轮合成数据: 与真实矿工一样长的
+"<XMR地址>:<Tari地址>" 登录名，提交数服从长尾 (Pareto) 分布，部分矿工已有账户。
+然后调用 api_server.py 中真实的 handle_xmr_block / handle_tari_block 入账，
+记录每个阶段的耗时 (Redis读取、登录名解析、奖励分配、账户写入、奖励写入、提交)，
+最后压缩余额流水并计入 balance_update 阶段。
+
+每次入账输出一行JSON (含当前 git 提交)，可追加到文件中，比较不同版本以发现性能回退。
+
+api_server.py 在导入时连接数据库和Redis并启动后台线程，因此本工具在临时目录中生成
+指向基准库的 config.json 后再导入，并关闭主实例选举、爆块队列工作线程和写后聚合。
+基准库每次运行前都会被清空，不能与生产库相同。
+
+用法:
+    python bench_crediting.py --miners 1000,10000,100000
+    python bench_crediting.py --chain tari --miners 10000 --repeat 5 --output bench.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from balance_ledger import LedgerCompactor
+from user_registry import parse_login
+
+logger = logging.getLogger('bench_crediting')
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+XMR_ADDRESS_LENGTH = 95
+TARI_ADDRESS_LENGTH = 91
+
+# 每次运行前清空的表，顺序无关 (CASCADE)
+BENCH_TABLES = ['account_login', 'rewards', 'balance_ledger', 'round_snapshots', 'block_events', 'blocks', 'account']
+
+# 每次入账使用不同的高度，避免命中"区块已存在"的快速路径
+BASE_HEIGHT = 1000000
+
+
+def generate_logins(rng: random.Random, miners: int):
+    """生成 miners 个互不相同的 "<XMR地址>:<Tari地址>" 登录名"""
+    logins = []
+    for _ in range(miners):
+        xmr = '4' + ''.join(rng.choices(BASE58_ALPHABET, k=XMR_ADDRESS_LENGTH - 1))
+        tari = ''.join(rng.choices(BASE58_ALPHABET, k=TARI_ADDRESS_LENGTH))
+        logins.append(f"{xmr}:{tari}")
+    return logins
+
+
+def generate_shares(rng: random.Random, miners: int, skew: float):
+    """长尾分布的提交数: 少数大矿工贡献大部分提交，skew 越小越集中"""
+    return [max(1, int(rng.paretovariate(skew) * 10)) for _ in range(miners)]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ''
+
+
+def ensure_database(db_config: dict, name: str):
+    """在同一服务器上创建基准库 (如果不存在)"""
+    conn = psycopg2.connect(host=db_config['host'], port=db_config['port'], database=db_config['database'],
+                            user=db_config['user'], password=db_config['password'])
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+        if not cur.fetchone():
+            cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+            logger.info(f"已创建基准库 {name}")
+    finally:
+        conn.close()
+
+
+def write_bench_config(config: dict, database: str, redis_db: int) -> str:
+    """生成指向基准库的配置目录，关闭与入账计时无关的后台任务，返回目录路径"""
+    bench_config = json.loads(json.dumps(config))
+    bench_config['database']['database'] = database
+    bench_config['redis'] = dict(config.get('redis', {}), db=redis_db)
+    bench_config['leader_election'] = {'enabled': False}
+    bench_config['block_queue'] = dict(config.get('block_queue', {}), workers=0)
+    # 余额流水由本工具在入账后显式压缩
+    bench_config['balance_ledger'] = dict(config.get('balance_ledger', {}), compact_interval=86400)
+    bench_config['submit_aggregation'] = {'enabled': False}
+    bench_config['submit_socket'] = ''
+
+    workdir = tempfile.mkdtemp(prefix='bench_crediting_')
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(bench_config, f, indent=4)
+    # 日志监控线程读取工作目录下的 p2pool.log
+    open(os.path.join(workdir, 'p2pool.log'), 'w').close()
+    return workdir
+
+
+def reset(api):
+    """清空基准 Redis 库和基准数据库中的入账相关表"""
+    api.redis_client.flushdb()
+    api.user_registry.clear_cache()
+    conn = api.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("TRUNCATE {} CASCADE").format(
+                sql.SQL(', ').join(sql.Identifier(table) for table in BENCH_TABLES)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def seed_round(api, logins, shares, existing_ratio: float):
+    """注册登录名、为部分矿工预先创建账户，并把整轮提交数写入Redis"""
+    user_ids = []
+    for i in range(0, len(logins), 10000):
+        # 新ID会像提交路径一样同步到 account_login
+        user_ids.extend(api.user_registry.get_ids(logins[i:i + 10000]))
+
+    existing = [parse_login(login) for login in logins[:int(len(logins) * existing_ratio)]]
+    if existing:
+        conn = api.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO account (username, xmr_wallet, tari_wallet)
+                    VALUES %s
+                    ON CONFLICT (username) DO NOTHING
+                """, existing, page_size=10000)
+            conn.commit()
+        finally:
+            conn.close()
+
+    pipe = api.redis_client.pipeline(transaction=False)
+    for i in range(0, len(user_ids), 10000):
+        pipe.hset(api.TOTAL_SHARES_KEY, mapping=dict(zip(user_ids[i:i + 10000], shares[i:i + 10000])))
+    pipe.execute()
+
+
+def run_once(api, chain: str, height: int, batch_size: int) -> dict:
+    """入账一个区块并压缩余额流水，返回入账结果和各阶段耗时"""
+    if chain == 'xmr':
+        params = {'height': height, 'reward': '0.6'}
+        handler = api.handle_xmr_block
+    else:
+        params = {'height': height, 'block_id': f"{height:064x}"}
+        handler = api.handle_tari_block
+
+    start = time.perf_counter()
+    result = handler(params)
+    credit_seconds = time.perf_counter() - start
+    if result.get('error'):
+        raise RuntimeError(f"{chain.upper()} 区块 {height} 入账失败: {result['error']}")
+
+    start = time.perf_counter()
+    compacted = LedgerCompactor(api.get_db_connection, batch_size=batch_size).compact_all()
+    balance_seconds = time.perf_counter() - start
+
+    phases = dict(result.get('timings', {}))
+    phases['balance_update'] = round(balance_seconds, 6)
+    return {
+        'credited': result.get('credited'),
+        'total_shares': result.get('total_shares'),
+        'ledger_entries': compacted,
+        'credit_seconds': round(credit_seconds, 6),
+        'total_seconds': round(credit_seconds + balance_seconds, 6),
+        'phases': phases
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='爆块入账基准测试与规模模拟')
+    parser.add_argument('--config', default='config.json', help='配置文件路径，基准库与生产库在同一服务器上')
+    parser.add_argument('--miners', default='1000,10000,100000', help='逗号分隔的矿工数量')
+    parser.add_argument('--chain', choices=['xmr', 'tari'], default='xmr', help='入账的区块类型')
+    parser.add_argument('--repeat', type=int, default=3, help='每个规模入账的次数')
+    parser.add_argument('--skew', type=float, default=1.2, help='提交数Pareto分布的形状参数，越小越集中')
+    parser.add_argument('--existing', type=float, default=0.8, help='已有账户的矿工比例')
+    parser.add_argument('--database', help='基准数据库名，默认为 <生产库名>_bench')
+    parser.add_argument('--redis-db', type=int, default=15, help='基准使用的Redis库编号')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--output', help='把JSON结果追加到该文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    database = args.database or f"{config['database']['database']}_bench"
+    if database == config['database']['database']:
+        parser.error('基准库会被清空，不能与生产库相同')
+    if args.redis_db == config.get('redis', {}).get('db', 0):
+        parser.error('基准Redis库会被清空，不能与生产使用的Redis库相同')
+    miner_counts = [int(count) for count in args.miners.split(',') if count.strip()]
+
+    ensure_database(config['database'], database)
+    workdir = write_bench_config(config, database, args.redis_db)
+    output = open(args.output, 'a') if args.output else sys.stdout
+    commit = git_commit()
+
+    # api_server.py 在导入时读取工作目录下的 config.json 并初始化基准库的表结构
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import api_server as api
+    batch_size = config.get('balance_ledger', {}).get('batch_size', 50000)
+
+    rng = random.Random(args.seed)
+    height = BASE_HEIGHT
+    try:
+        for miners in miner_counts:
+            logins = generate_logins(rng, miners)
+            shares = generate_shares(rng, miners, args.skew)
+            for run in range(1, args.repeat + 1):
+                reset(api)
+                seed_round(api, logins, shares, args.existing)
+                height += 1
+                record = {
+                    'chain': args.chain,
+                    'miners': miners,
+                    'run': run,
+                    'skew': args.skew,
+                    'existing': args.existing,
+                    'commit': commit,
+                    'started_at': datetime.now().isoformat()
+                }
+                record.update(run_once(api, args.chain, height, batch_size))
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                output.flush()
+                logger.info(f"{miners} 个矿工第 {run} 次: 入账 {record['credit_seconds']:.3f} 秒, "
+                            f"余额压缩 {record['phases']['balance_update']:.3f} 秒")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
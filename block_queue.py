@@ -0,0 +1,90 @@
+"""爆块事件队列 block_events 的写入
+
+api_server.py 的日志监控线程和爆块接口、monitor.py 都通过 enqueue_block_event 写入队列，
+由 api_server.py 的 BlockEventWorker 入账。
+
+新事件在入队事务提交之前切换该链的轮次 (见 round_shares.seal_round)，事件对工作线程可见时快照一定已经存在，
+工作线程 (可能在另一个进程中) 直接使用这个快照，不会再切换一次；排队和重试期间的提交都计入下一轮。
+入队事务提交失败时撤销刚切换的快照，快照中的提交重新计入当前轮次。
+"""
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+import redis
+
+from redis_keys import AGGREGATORS_KEY, FLUSH_REQUEST_KEY, FLUSH_ACK_KEY, get_aggregator_alive_key
+from round_shares import seal_round, restore_round
+
+logger = logging.getLogger(__name__)
+
+
+def request_cluster_flush(client, timeout: float, own_id: Optional[str] = None):
+    """请求所有写后聚合实例 (除 own_id 外) 刷新，等待所有存活实例确认或超时
+
+    切换轮次前调用，保证快照包含所有已接受的提交。超时未确认的实例的增量仍在其日志中，会计入下一轮，不会丢失
+    """
+    members = [m for m in client.smembers(AGGREGATORS_KEY) if m != own_id]
+    if not members:
+        return
+    request = client.incr(FLUSH_REQUEST_KEY)
+    deadline = time.monotonic() + timeout
+    while True:
+        pipe = client.pipeline(transaction=False)
+        for member in members:
+            pipe.exists(get_aggregator_alive_key(member))
+        pipe.hmget(FLUSH_ACK_KEY, members)
+        results = pipe.execute()
+        acks = results[-1]
+        waiting = [member for member, alive, ack in zip(members, results[:-1], acks)
+                   if alive and int(ack or 0) < request]
+        if not waiting:
+            return
+        if time.monotonic() >= deadline:
+            logger.warning(f"等待聚合实例刷新超时，未确认的提交将计入下一轮: {', '.join(waiting)}")
+            return
+        time.sleep(0.01)
+
+
+def enqueue_block_event(conn, client, chain: str, block_height: int, params: Dict[str, Any], source: str = 'log',
+                        flush: Optional[Callable[[], None]] = None) -> bool:
+    """在 conn 上把爆块事件写入 block_events 表并提交，同一条链同一高度只入队一次，返回是否为新事件
+
+    日志监控和结构化事件接口可能先后上报同一个区块，由 (chain, block_height) 唯一约束去重，
+    后到的 INSERT 等待先到的事务提交后跳过，只有新事件切换轮次。补录的历史区块和已入账的区块不切换轮次。
+    flush 只在需要切换轮次时于切换前调用，用于刷新写后聚合器；Redis 不可用时事件照常入队，由工作线程入账时切换轮次。
+    """
+    sealed = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO block_events (chain, block_height, params, source)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (chain, block_height) DO NOTHING
+            """, (chain, block_height, json.dumps(params), source))
+            created = cur.rowcount == 1
+            if created and source != 'backfill':
+                cur.execute("SELECT EXISTS (SELECT 1 FROM blocks WHERE type = %s AND block_height = %s)",
+                            (chain, block_height))
+                if not cur.fetchone()[0]:
+                    try:
+                        _, sealed = seal_round(client, chain, block_height, flush)
+                    except redis.RedisError as e:
+                        logger.error(f"{chain.upper()} 区块 {block_height} 入队时切换轮次失败，将在入账时切换: {str(e)}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if sealed:
+            undo_seal(client, chain, block_height)
+        raise
+    return created
+
+
+def undo_seal(client, chain: str, block_height: int):
+    """入队失败后撤销切换的快照；本链已再次切换时保留快照，重新入队时复用"""
+    try:
+        if restore_round(client, chain, block_height) < 0:
+            logger.warning(f"{chain.upper()} 区块 {block_height} 入队失败，轮次已再次切换，保留快照供重新入队时使用")
+    except redis.RedisError as e:
+        logger.error(f"{chain.upper()} 区块 {block_height} 入队失败后撤销轮次快照失败: {str(e)}")
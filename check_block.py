@@ -1,60 +1,39 @@
-import requests
 import json
-import base64
+import os
 import argparse
-from typing import Dict, Any
 
-def buffer_to_hex(buffer_data: Dict[str, Any]) -> str:
-    """将 Buffer 数据转换为十六进制字符串"""
-    if not isinstance(buffer_data, dict) or 'data' not in buffer_data:
-        return ''
-    return ''.join([f'{x:02x}' for x in buffer_data['data']])
+from header_cache import DEFAULT_API_URL, fetch_header, open_cache
 
-def get_block_data(block_height: int) -> Dict[str, Any]:
-    """获取指定高度的区块数据"""
-    url = f'https://textexplore.tari.com/blocks/{block_height}?json'
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"获取区块数据失败: {e}")
-        return None
+def load_config(path: str) -> dict:
+    """加载配置文件，不存在时使用默认配置"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
 
-def verify_block(block_height: int) -> bool:
+def verify_block(block_height: int, cache=None, api_url: str = DEFAULT_API_URL) -> bool:
     """验证区块的有效性"""
-    block_data = get_block_data(block_height)
-    if not block_data:
+    # 只需要区块头中的哈希和时间戳，优先使用本地缓存
+    header = fetch_header(block_height, cache, api_url)
+    if not header:
+        print("未找到有效的区块哈希")
         return False
 
     try:
-        # 获取区块头信息
-        header = block_data.get('header', {})
-        if not header:
-            print("未找到区块头信息")
-            return False
-
-        # 获取并转换 hash
-        block_hash = buffer_to_hex(header.get('hash', {}))
-        if not block_hash:
-            print("未找到有效的区块哈希")
-            return False
-
-        # 获取并转换 prev_hash
-        prev_hash = buffer_to_hex(header.get('prev_hash', {}))
+        # 获取 prev_hash
+        prev_hash = header.get('prev_hash')
         if not prev_hash:
             print("未找到有效的前一个区块哈希")
             return False
 
         # 打印验证信息
         print(f"区块高度: {block_height}")
-        print(f"区块哈希: {block_hash}")
+        print(f"区块哈希: {header['hash']}")
         print(f"前一个区块哈希: {prev_hash}")
-        print(f"时间戳: {header.get('timestamp', 'N/A')}")
-        print(f"版本: {header.get('version', 'N/A')}")
+        print(f"时间戳: {header.get('timestamp') or 'N/A'}")
 
         # 这里可以添加更多的验证逻辑
-        # 例如：验证时间戳、版本号等
+        # 例如：验证时间戳等
 
         return True
 
@@ -66,16 +45,25 @@ def main():
     # 创建命令行参数解析器
     parser = argparse.ArgumentParser(description='验证 Tari 区块的有效性')
     parser.add_argument('block_height', type=int, help='要验证的区块高度')
-    
+    parser.add_argument('--config', default='config.json', help='配置文件路径 (读取区块头缓存配置)')
+    parser.add_argument('--no-cache', action='store_true', help='不使用区块头缓存，直接请求浏览器')
+
     # 解析命令行参数
     args = parser.parse_args()
-    
+    config = load_config(args.config)
+    cache = None if args.no_cache else open_cache(config, os.path.dirname(os.path.abspath(args.config)))
+    api_url = config.get('tari_verifier', {}).get('api_url', DEFAULT_API_URL)
+
     print(f"开始验证区块 {args.block_height}...")
-    
-    if verify_block(args.block_height):
-        print("区块验证成功！")
-    else:
-        print("区块验证失败！")
+
+    try:
+        if verify_block(args.block_height, cache, api_url):
+            print("区块验证成功！")
+        else:
+            print("区块验证失败！")
+    finally:
+        if cache is not None:
+            cache.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
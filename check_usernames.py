@@ -2,7 +2,10 @@ import json
 import psycopg2
 from psycopg2 import Error
 from datetime import datetime, timedelta
-from decimal import Decimal, getcontext
+from decimal import getcontext
+
+from balance_ledger import append_entries, REASON_ADJUSTMENT
+from money import XMR_ATOMIC_UNITS, TARI_ATOMIC_UNITS, to_atomic, format_amount
 
 def read_config():
     with open('config.json', 'r') as f:
@@ -26,7 +29,7 @@ def connect_to_db(db_config):
 def find_account_by_tari_address(connection, tari_address):
     try:
         cursor = connection.cursor()
-        query = "SELECT username, xmr_balance, tari_balance FROM ACCOUNT WHERE tari_wallet = %s"
+        query = "SELECT username, xmr_balance, tari_balance FROM account_balance WHERE tari_wallet = %s"
         cursor.execute(query, (tari_address,))
         result = cursor.fetchone()
         cursor.close()
@@ -54,13 +57,10 @@ def add_reward(connection, username, amount, type, block_height):
 def update_account_balance(connection, username, xmr_amount, tari_amount):
     try:
         cursor = connection.cursor()
-        query = """
-            UPDATE ACCOUNT 
-            SET xmr_balance = xmr_balance + %s,
-                tari_balance = tari_balance + %s
-            WHERE username = %s
-        """
-        cursor.execute(query, (xmr_amount, tari_amount, username))
+        append_entries(cursor, [
+            (username, 'xmr', xmr_amount, REASON_ADJUSTMENT, None),
+            (username, 'tari', tari_amount, REASON_ADJUSTMENT, None)
+        ])
         connection.commit()
         cursor.close()
         return True
@@ -84,8 +84,8 @@ def main():
                 parts = line.strip().split()
                 if len(parts) == 3:
                     tari_address, xmr_amount, tari_amount = parts
-                    xmr_amount = Decimal(float(xmr_amount))
-                    tari_amount = Decimal(float(tari_amount))
+                    xmr_amount = to_atomic(xmr_amount, XMR_ATOMIC_UNITS)
+                    tari_amount = to_atomic(tari_amount, TARI_ATOMIC_UNITS)
                     
                     # Find account by TARI address
                     account = find_account_by_tari_address(connection, tari_address)
@@ -93,20 +93,18 @@ def main():
                     if account:
                         username, current_xmr, current_tari = account
                         print(f"找到用户: {username}")
-                        current_xmr = Decimal(current_xmr)
-                        current_tari = Decimal(current_tari)
 
                         # Add rewards
                         if add_reward(connection, username, xmr_amount, 'xmr', 1):
-                            print(f"已添加 XMR 奖励: {xmr_amount}")
+                            print(f"已添加 XMR 奖励: {format_amount(xmr_amount, 'xmr')}")
                         if add_reward(connection, username, tari_amount, 'tari', 2):
-                            print(f"已添加 TARI 奖励: {tari_amount}")
+                            print(f"已添加 TARI 奖励: {format_amount(tari_amount, 'tari')}")
                         
                         # Update account balance
                         if update_account_balance(connection, username, xmr_amount, tari_amount):
                             print(f"已更新账户余额")
-                            print(f"XMR余额: {current_xmr + xmr_amount}")
-                            print(f"TARI余额: {current_tari + tari_amount}")
+                            print(f"XMR余额: {format_amount(current_xmr + xmr_amount, 'xmr')}")
+                            print(f"TARI余额: {format_amount(current_tari + tari_amount, 'tari')}")
                     else:
                         print(f"未找到TARI地址对应的账户: {tari_address}")
     
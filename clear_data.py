@@ -7,6 +7,9 @@ import sys
 from datetime import datetime
 import os
 
+from redis_keys import (TOTAL_SHARES_KEY, GENERATION_KEY, GENERATION_KEY_PREFIX, ROUND_START_KEY,
+                        ROUND_PENDING_KEY, ROUND_KEY_PREFIX)
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -39,18 +42,19 @@ def clear_redis():
             decode_responses=True
         )
         
-        # 获取所有键
-        xmr_keys = redis_client.keys('xmr:submit:*')
-        tari_keys = redis_client.keys('tari:submit:*')
+        # 当前代、所有封存代和各链轮次起点 (用户ID注册表 user:* 保留，ID与数据库中的 account_login 保持一致)
+        users = redis_client.hlen(TOTAL_SHARES_KEY)
+        generation_keys = list(redis_client.scan_iter(match=f"{GENERATION_KEY_PREFIX}*"))
+        redis_client.delete(TOTAL_SHARES_KEY, GENERATION_KEY, ROUND_START_KEY, ROUND_PENDING_KEY,
+                            *generation_keys)
+        if users or generation_keys:
+            logger.info(f"已删除 {users} 个用户的当前提交记录和 {len(generation_keys)} 代封存记录")
         
-        # 删除所有键
-        if xmr_keys:
-            redis_client.delete(*xmr_keys)
-            logger.info(f"已删除 {len(xmr_keys)} 个 XMR 提交记录")
-            
-        if tari_keys:
-            redis_client.delete(*tari_keys)
-            logger.info(f"已删除 {len(tari_keys)} 个 TARI 提交记录")
+        # 删除尚未入账的区块快照代范围 round:range:<chain>:<height>
+        range_keys = list(redis_client.scan_iter(match=f"{ROUND_KEY_PREFIX}range:*"))
+        if range_keys:
+            redis_client.delete(*range_keys)
+            logger.info(f"已删除 {len(range_keys)} 个轮次快照")
             
         logger.info("Redis 数据清理完成")
         
@@ -84,6 +88,10 @@ def clear_database():
             cur.execute("TRUNCATE TABLE blocks CASCADE")
             logger.info("已清空 blocks 表")
             
+            # 清空余额流水
+            cur.execute("TRUNCATE TABLE balance_ledger")
+            logger.info("已清空 balance_ledger 表")
+            
             # 重置 account 表中的余额
             cur.execute("""
                 UPDATE account 
@@ -6,6 +6,8 @@ import json
 import sys
 from datetime import datetime
 
+from balance_ledger import append_entry, REASON_REVERSAL
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -52,7 +54,7 @@ def get_db_connection():
         logger.error(f"数据库连接失败: {str(e)}")
         raise
 
-def mark_block_invalid(block_id):
+def mark_block_invalid(block_id, block_type=None):
     try:
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=DictCursor)
@@ -62,16 +64,22 @@ def mark_block_invalid(block_id):
         
         try:
             # 获取区块信息
+            # XMR 和 Tari 区块可能高度相同，此时必须指定类型
             cursor.execute("""
                 SELECT type, rewards ,block_height
                 FROM blocks
                 WHERE block_height = %s
-            """, (block_id,))
+                AND (%s IS NULL OR type = %s)
+            """, (block_id, block_type, block_type))
             
-            block_info = cursor.fetchone()
-            if not block_info:
+            blocks = cursor.fetchall()
+            if not blocks:
                 logger.error(f"未找到区块: {block_id}")
                 return False
+            if len(blocks) > 1:
+                logger.error(f"高度 {block_id} 同时存在 XMR 和 TARI 区块，请指定区块类型")
+                return False
+            block_info = blocks[0]
                 
             block_type = block_info['type']
             rewards = block_info['rewards']
@@ -81,36 +89,24 @@ def mark_block_invalid(block_id):
             cursor.execute("""
                 SELECT username, reward
                 FROM rewards
-                WHERE block_height = %s AND type = %s
-            """, (block_height, block_type))
+                WHERE type = %s AND block_height = %s
+            """, (block_type, block_height))
             
             rewards = cursor.fetchall()
             logger.info(f"找到 {len(rewards)} 条奖励记录")
             
             # 更新奖励记录
             for reward in rewards:
-                old_reward = float(reward['reward'])
                 cursor.execute("""
                     UPDATE rewards
                     SET reward = 0
-                    WHERE block_height = %s 
-                    AND type = %s
+                    WHERE type = %s
+                    AND block_height = %s 
                     AND username = %s
-                """, (block_height, block_type, reward['username']))
+                """, (block_type, block_height, reward['username']))
                 
-                # 更新用户余额
-                if block_type == 'xmr':
-                    cursor.execute("""
-                        UPDATE account
-                        SET xmr_balance = xmr_balance - %s
-                        WHERE username = %s
-                    """, (old_reward, reward['username']))
-                else:  # tari
-                    cursor.execute("""
-                        UPDATE account
-                        SET tari_balance = tari_balance - %s
-                        WHERE username = %s
-                    """, (old_reward, reward['username']))
+                # 追加冲正流水
+                append_entry(cursor, reward['username'], block_type, -reward['reward'], REASON_REVERSAL, block_height)
             
             # 更新区块状态
             cursor.execute("""
@@ -119,8 +115,8 @@ def mark_block_invalid(block_id):
                     rewards = 0,
                     is_valid = FALSE,
                     check_status = FALSE
-                WHERE block_height = %s
-            """, (block_height,))
+                WHERE type = %s AND block_height = %s
+            """, (block_type, block_height))
             
             # 提交事务
             conn.commit()
@@ -141,12 +137,13 @@ def mark_block_invalid(block_id):
             conn.close()
 
 def main():
-    if len(sys.argv) != 2:
-        print("使用方法: python delete_block.py <block_id>")
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] not in ('xmr', 'tari')):
+        print("使用方法: python delete_block.py <block_id> [xmr|tari]")
         sys.exit(1)
         
     block_id = sys.argv[1]
-    if mark_block_invalid(block_id):
+    block_type = sys.argv[2] if len(sys.argv) == 3 else None
+    if mark_block_invalid(block_id, block_type):
         print(f"成功将区块 {block_id} 标记为无效")
     else:
         print(f"标记区块 {block_id} 无效失败")
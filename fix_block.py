@@ -4,6 +4,10 @@ from psycopg2.extras import DictCursor
 import logging
 import json
 from datetime import datetime
+from decimal import Decimal
+
+from balance_ledger import append_entry, REASON_ADJUSTMENT
+from money import TARI_ATOMIC_UNITS
 
 # 配置日志
 logging.basicConfig(
@@ -42,9 +46,9 @@ def fix_block():
             # 1. 更新区块奖励
             cursor.execute("""
                 UPDATE blocks
-                SET rewards = 13850
+                SET rewards = %s
                 WHERE block_height = 6379 AND type = 'tari'
-            """)
+            """, (13850 * TARI_ATOMIC_UNITS,))
             
             if cursor.rowcount == 0:
                 logger.error("未找到指定区块")
@@ -62,8 +66,8 @@ def fix_block():
             
             # 3. 更新奖励记录
             for reward in rewards:
-                old_reward = float(reward['reward'])
-                new_reward = old_reward * 13.85
+                old_reward = reward['reward']
+                new_reward = int(old_reward * Decimal('13.85'))
                 cursor.execute("""
                     UPDATE rewards
                     SET reward = %s
@@ -72,12 +76,8 @@ def fix_block():
                     AND username = %s
                 """, (new_reward, reward['username']))
                 
-                # 4. 更新用户余额
-                cursor.execute("""
-                    UPDATE account
-                    SET tari_balance = tari_balance - %s + %s
-                    WHERE username = %s
-                """, (old_reward, new_reward, reward['username']))
+                # 4. 追加调整流水
+                append_entry(cursor, reward['username'], 'tari', new_reward - old_reward, REASON_ADJUSTMENT, 6379)
             
             # 提交事务
             conn.commit()
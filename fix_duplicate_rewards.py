@@ -5,6 +5,8 @@ import logging
 import json
 from datetime import datetime
 
+from balance_ledger import discard_pending
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -74,7 +76,8 @@ def fix_duplicate_rewards():
             """, (dup['id'],))
             logger.info(f"删除重复记录: 用户={dup['username']}, 区块={dup['block_height']}, 类型={dup['type']}")
         
-        # 3. 重新计算用户余额
+        # 3. 按奖励记录重新计算用户余额，压缩水位推进到最后一条流水，避免压缩器再次计入
+        discard_pending(cur)
         cur.execute("""
             WITH user_balances AS (
                 SELECT 
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""Tari 区块浏览器区块头的本地缓存
+
+TariBlockChecker、tari_grpc/check_tari_blocks.py、tari_grpc/restore_tari_block.py 和 check_block.py
+都向浏览器请求同一批高度的区块，响应是包含 Buffer 字节数组的大段 JSON，而这些工具只用到区块头中的
+hash、prev_hash 和 timestamp。本模块把这三个字段按高度保存在 SQLite 文件中 (WAL 模式，多个进程可以共用)，
+前面加一层进程内 LRU，复查和审计不再重复请求浏览器。
+
+只有重组深度以内的区块头会失效:
+    获取时距出块已超过 reorg_depth * block_time 秒的区块头视为最终确定，之后一直使用缓存
+    较新的区块头只在获取后 recent_ttl 秒内有效，过期后重新获取，直到确定为止
+    写入高度 h 的区块头时，如果缓存中 h-1 的哈希与其 prev_hash 不一致，说明发生了重组，删除 h-1 的缓存；
+    如果 h 的哈希变了，删除其上 reorg_depth 个高度的缓存。这两种情况都只删除尚未确定的区块头
+
+用法:
+    python header_cache.py --stats
+    python header_cache.py --invalidate-from 12345   # 手动删除该高度及以上的缓存
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = 'https://textexplore.tari.com/blocks/{height}?json'
+
+
+def buffer_to_hex(buffer_data) -> str:
+    """将 Buffer 数据转换为十六进制字符串"""
+    if not isinstance(buffer_data, dict) or 'data' not in buffer_data:
+        return ''
+    return ''.join([f'{x:02x}' for x in buffer_data['data']])
+
+
+def parse_header(data: Any) -> Optional[Dict[str, Any]]:
+    """从浏览器的区块 JSON 中取出缓存的字段，没有区块哈希时返回 None"""
+    header = data.get('header') if isinstance(data, dict) else None
+    if not isinstance(header, dict):
+        return None
+    block_hash = buffer_to_hex(header.get('hash', {}))
+    if not block_hash:
+        return None
+    try:
+        timestamp = int(header.get('timestamp'))
+    except (TypeError, ValueError):
+        timestamp = None
+    return {
+        'hash': block_hash,
+        'prev_hash': buffer_to_hex(header.get('prev_hash', {})),
+        'timestamp': timestamp
+    }
+
+
+class HeaderCache:
+    """按高度缓存的 Tari 区块头，SQLite 持久化，前面是进程内 LRU，线程安全"""
+    def __init__(self, path: str, lru_size: int = 10000, reorg_depth: int = 60,
+                 block_time: int = 120, recent_ttl: int = 60):
+        self.path = path
+        self.lru_size = lru_size
+        self.final_age = reorg_depth * block_time
+        self.reorg_depth = reorg_depth
+        self.recent_ttl = recent_ttl
+        self.lru: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tari_headers (
+                height INTEGER PRIMARY KEY,
+                hash TEXT NOT NULL,
+                prev_hash TEXT NOT NULL,
+                timestamp INTEGER,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def is_final(self, entry: Dict[str, Any]) -> bool:
+        """获取时已在重组深度之外的区块头不会再变化"""
+        return entry['timestamp'] is not None and entry['fetched_at'] - entry['timestamp'] >= self.final_age
+
+    def remember(self, height: int, entry: Dict[str, Any]):
+        self.lru[height] = entry
+        self.lru.move_to_end(height)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def load(self, height: int) -> Optional[Dict[str, Any]]:
+        entry = self.lru.get(height)
+        if entry is not None:
+            self.lru.move_to_end(height)
+            return entry
+        row = self.conn.execute(
+            "SELECT hash, prev_hash, timestamp, fetched_at FROM tari_headers WHERE height = ?", (height,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = {'hash': row[0], 'prev_hash': row[1], 'timestamp': row[2], 'fetched_at': row[3]}
+        self.remember(height, entry)
+        return entry
+
+    def lookup(self, height: int) -> Optional[Dict[str, Any]]:
+        entry = self.load(height)
+        if entry is None or not (self.is_final(entry) or time.time() - entry['fetched_at'] < self.recent_ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {'hash': entry['hash'], 'prev_hash': entry['prev_hash'], 'timestamp': entry['timestamp']}
+
+    def get(self, height: int) -> Optional[Dict[str, Any]]:
+        """返回可用的缓存区块头 {hash, prev_hash, timestamp}，没有或已过期时返回 None"""
+        with self.lock:
+            return self.lookup(height)
+
+    def get_many(self, heights: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """一次查询多个高度，返回 高度 -> 区块头，只包含可用的缓存"""
+        with self.lock:
+            headers = {height: self.lookup(height) for height in heights}
+        return {height: header for height, header in headers.items() if header is not None}
+
+    def put(self, height: int, header: Dict[str, Any]):
+        """写入刚从浏览器获取的区块头，检测与相邻高度的缓存是否因重组而不一致"""
+        entry = {'hash': header['hash'], 'prev_hash': header.get('prev_hash') or '',
+                 'timestamp': header.get('timestamp'), 'fetched_at': time.time()}
+        with self.lock:
+            previous = self.load(height)
+            if previous is not None and previous['hash'] != entry['hash']:
+                # 该高度被重组替换，建立在旧区块上的较高区块也不再可信
+                logger.warning(f"TARI 高度 {height} 的区块哈希已变化，删除其上 {self.reorg_depth} 个高度的缓存")
+                self.delete_range(height + 1, height + self.reorg_depth, only_recent=True)
+            parent = self.load(height - 1)
+            if (parent is not None and not self.is_final(parent)
+                    and entry['prev_hash'] and parent['hash'] != entry['prev_hash']):
+                logger.warning(f"TARI 高度 {height - 1} 的缓存与新区块的 prev_hash 不一致，已删除")
+                self.delete_range(height - 1, height - 1)
+            self.conn.execute("""
+                INSERT OR REPLACE INTO tari_headers (height, hash, prev_hash, timestamp, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (height, entry['hash'], entry['prev_hash'], entry['timestamp'], entry['fetched_at']))
+            self.conn.commit()
+            self.remember(height, entry)
+
+    def delete_range(self, low: int, high: Optional[int] = None, only_recent: bool = False) -> int:
+        """删除 [low, high] 范围内的缓存，only_recent 为 True 时保留已确定的区块头"""
+        query = "DELETE FROM tari_headers WHERE height >= ?"
+        params = [low]
+        if high is not None:
+            query += " AND height <= ?"
+            params.append(high)
+        if only_recent:
+            query += " AND NOT (timestamp IS NOT NULL AND fetched_at - timestamp >= ?)"
+            params.append(self.final_age)
+        cur = self.conn.execute(query, params)
+        self.conn.commit()
+        for height, entry in list(self.lru.items()):
+            if height >= low and (high is None or height <= high) and not (only_recent and self.is_final(entry)):
+                del self.lru[height]
+        return cur.rowcount
+
+    def invalidate_from(self, height: int) -> int:
+        """删除该高度及以上的缓存，返回删除的条数"""
+        with self.lock:
+            return self.delete_range(height)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            total, final = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(CASE WHEN fetched_at - timestamp >= ? THEN 1 ELSE 0 END), 0) "
+                "FROM tari_headers", (self.final_age,)
+            ).fetchone()
+            return {'entries': total, 'final': final, 'lru_entries': len(self.lru),
+                    'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_cache(config: Dict[str, Any], base_dir: str = '.') -> Optional[HeaderCache]:
+    """按 config.json 中的 header_cache 配置打开缓存，相对路径相对于配置文件所在目录，未启用时返回 None"""
+    settings = config.get('header_cache', {})
+    if not settings.get('enabled', True):
+        return None
+    path = settings.get('path', 'tari_headers.sqlite')
+    if not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    return HeaderCache(
+        path,
+        settings.get('lru_size', 10000),
+        settings.get('reorg_depth', 60),
+        settings.get('block_time', 120),
+        settings.get('recent_ttl', 60)
+    )
+
+
+def fetch_header(height: int, cache: Optional[HeaderCache] = None, api_url: str = DEFAULT_API_URL,
+                 timeout: float = 10) -> Optional[Dict[str, Any]]:
+    """同步获取一个区块头，优先使用缓存，浏览器没有该区块或请求失败时返回 None"""
+    if cache is not None:
+        header = cache.get(height)
+        if header is not None:
+            return header
+    try:
+        response = requests.get(api_url.format(height=height), timeout=timeout)
+        response.raise_for_status()
+        if 'application/json' not in response.headers.get('content-type', ''):
+            logger.warning("API 响应不是 JSON 格式")
+            return None
+        header = parse_header(response.json())
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"获取区块 {height} 数据失败: {e}")
+        return None
+    if header is None:
+        logger.warning(f"区块 {height} 未找到远程哈希")
+        return None
+    if cache is not None:
+        cache.put(height, header)
+    return header
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Tari 区块头缓存')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    parser.add_argument('--stats', action='store_true', help='查看缓存条数和已确定的条数')
+    parser.add_argument('--invalidate-from', type=int, help='删除该高度及以上的缓存')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    cache = open_cache(config, os.path.dirname(os.path.abspath(args.config)))
+    if cache is None:
+        print("区块头缓存未启用")
+        return
+    try:
+        if args.invalidate_from is not None:
+            print(f"已删除 {cache.invalidate_from(args.invalidate_from)} 条缓存")
+        print(json.dumps(cache.stats(), ensure_ascii=False))
+    finally:
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
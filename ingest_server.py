@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""share提交专用的asyncio入口服务
+
+只处理 /json_rpc 上的 submit / submit_batch 以及 JSON-RPC 2.0 数组批量请求，
+请求和响应格式与 api_server.py 完全一致，stratum 服务端无需修改，只需把
+--share-report-url 指向本服务。爆块入账、统计查询等仍由 api_server.py 负责。
+
+同一事件循环内并发到达的提交会合并为一次 Redis pipeline 往返，
+单核即可承受每秒数万次提交。安装了 uvloop 时自动使用。
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+import psycopg2
+import redis.asyncio as aioredis
+
+from share_dedup import (AsyncRedisDedupSet, get_batch_key, get_share_id, check_batch_entries,
+                         fill_batch_results, invalid_params, submit_counts_result)
+from user_registry import AsyncUserRegistry, write_user_logins
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler('ingest_server.log')
+    ]
+)
+
+logger = logging.getLogger('ingest_server')
+
+# 设置第三方库的日志级别
+logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+
+# 加载配置文件
+def load_config():
+    try:
+        with open('config.json', 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"加载配置文件失败: {str(e)}")
+        raise
+
+config = load_config()
+ingest_config = config.get('ingest', {})
+
+# Redis连接配置
+redis_config = config.get('redis', {})
+REDIS_HOST = redis_config.get('host', 'localhost')
+REDIS_PORT = redis_config.get('port', 6379)
+REDIS_DB = redis_config.get('db', 0)
+REDIS_MAX_CONNECTIONS = ingest_config.get('redis_max_connections', 16)
+
+# 按 share_id / batch_id 丢弃客户端重发的提交，去重过滤器保存在Redis中，与 api_server.py 及其他实例共享
+dedup_config = config.get('share_dedup', {})
+DEDUP_WINDOW_SECONDS = dedup_config.get('window_seconds', 600)
+DEDUP_CAPACITY = dedup_config.get('capacity', 1000000)
+DEDUP_ERROR_RATE = dedup_config.get('error_rate', 0.001)
+
+# JSON-RPC 数组批量请求的最大条数，与 api_server.py 相同
+MAX_JSON_RPC_BATCH = config.get('json_rpc', {}).get('max_batch_size', 1000)
+
+LISTEN_HOST = ingest_config.get('host', '127.0.0.1')
+LISTEN_PORT = ingest_config.get('port', 5001)
+
+
+def mirror_user_logins(new_users: Dict[int, str]):
+    """把新分配的用户ID同步到 account_login 表，在线程池中运行，与 api_server.py 的同步路径相同"""
+    try:
+        db = config['database']
+        conn = psycopg2.connect(host=db['host'], port=db['port'], database=db['database'],
+                                user=db['user'], password=db['password'])
+        try:
+            with conn.cursor() as cur:
+                write_user_logins(cur, new_users)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        # 入账时会补齐缺失的映射，这里失败不影响提交
+        logger.error(f"同步 {len(new_users)} 个新用户ID到数据库失败: {str(e)}")
+
+
+def error_response(code: int, message: str, request_id=None) -> Dict[str, Any]:
+    """构造JSON-RPC错误响应"""
+    return {
+        'jsonrpc': '2.0',
+        'error': {
+            'code': code,
+            'message': message
+        },
+        'id': request_id
+    }
+
+
+class SubmitCoalescer:
+    """把同一时刻并发到达的提交合并为一次Redis往返
+
+    每个请求把 (username, count, share_id) 放入待提交列表并等待结果；只有一个刷新任务在运行，
+    它每次取走当前积累的全部条目，用一次去重Lua调用 (见 share_dedup.CLAIM_SCRIPT) 执行去重和所有 HINCRBY。
+    """
+
+    def __init__(self, client: aioredis.Redis):
+        self.client = client
+        self.dedup = AsyncRedisDedupSet(client, DEDUP_WINDOW_SECONDS, DEDUP_CAPACITY, DEDUP_ERROR_RATE)
+        self.registry = AsyncUserRegistry(client, ingest_config.get('user_id_cache_size', 100000),
+                                          on_new_users=self.mirror_new_users)
+        self.mirror_tasks = set()
+        self.pending: List[Tuple[str, int, Optional[str], asyncio.Future]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+
+    async def increment(self, entries: List[Dict[str, Any]]) -> List[Optional[Dict[str, int]]]:
+        """提交一组 {username, count, share_id}，返回每个条目的 submit_counts (见 share_dedup.submit_counts_result)
+
+        share_id 重复的条目不计数，结果为 None
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for entry in entries:
+            future = loop.create_future()
+            self.pending.append((entry['username'], entry['count'], entry.get('share_id'), future))
+            futures.append(future)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush())
+        return [None if total is None else submit_counts_result(total) for total in await asyncio.gather(*futures)]
+
+    def mirror_new_users(self, new_users: Dict[int, str]):
+        """新用户ID交给线程池写入数据库，不阻塞事件循环和本次提交"""
+        task = asyncio.get_running_loop().run_in_executor(None, mirror_user_logins, new_users)
+        self.mirror_tasks.add(task)
+        task.add_done_callback(self.mirror_tasks.discard)
+
+    async def flush(self):
+        try:
+            while self.pending:
+                # 让出一次事件循环，使同一批就绪的请求都进入本次Lua调用
+                await asyncio.sleep(0)
+                batch, self.pending = self.pending, []
+                try:
+                    user_ids = await self.registry.get_ids(username for username, _, _, _ in batch)
+                    results = await self.dedup.claim([(share_id, user_id, count)
+                                                      for user_id, (_, count, share_id, _) in zip(user_ids, batch)])
+                    for (_, _, _, future), total in zip(batch, results):
+                        if not future.done():
+                            future.set_result(total)
+                except Exception as e:
+                    logger.error(f"Redis error while incrementing submit counts: {str(e)}")
+                    for _, _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            self.flush_task = None
+
+
+async def handle_submit(coalescer: SubmitCoalescer, params: Any) -> Dict[str, Any]:
+    """处理submit方法的请求"""
+    try:
+        username = params.get('username') if isinstance(params, dict) else None
+        if not isinstance(username, str) or not username:
+            logger.warning("Invalid submission: missing username")
+            return {
+                'error': {
+                    'code': -32602,
+                    'message': 'Invalid params: username is required'
+                }
+            }
+
+        try:
+            share_id = get_share_id(params)
+        except ValueError as e:
+            return invalid_params(str(e))
+
+        # 重发的提交只返回成功，不再计数
+        submit_counts = (await coalescer.increment([{'username': username, 'count': 1, 'share_id': share_id}]))[0]
+        if submit_counts is None:
+            return {
+                'result': {
+                    'status': 'OK',
+                    'message': 'Duplicate share ignored',
+                    'duplicate': True
+                }
+            }
+        return {
+            'result': {
+                'status': 'OK',
+                'message': 'Submission recorded successfully',
+                'submit_counts': submit_counts
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error processing submission: {str(e)}")
+        return {
+            'error': {
+                'code': -32000,
+                'message': f'Internal error: {str(e)}'
+            }
+        }
+
+
+async def handle_submit_batch(coalescer: SubmitCoalescer, params: Any) -> Dict[str, Any]:
+    """处理submit_batch方法的请求，params为 {username, count} 列表或 {'shares': [...]}"""
+    try:
+        shares = params.get('shares') if isinstance(params, dict) else params
+        if not isinstance(shares, list):
+            logger.warning("Invalid batch submission: shares must be a list")
+            return {
+                'error': {
+                    'code': -32602,
+                    'message': 'Invalid params: shares must be a list'
+                }
+            }
+
+        # 整批重发时按 batch_id 丢弃
+        try:
+            batch_key = get_batch_key(params)
+        except ValueError as e:
+            return invalid_params(str(e))
+        if batch_key is not None and not await coalescer.dedup.add(batch_key):
+            return {
+                'result': {
+                    'status': 'OK',
+                    'message': 'Duplicate batch ignored',
+                    'duplicate': True,
+                    'accepted': 0,
+                    'rejected': 0,
+                    'results': []
+                }
+            }
+
+        results, candidates = check_batch_entries(shares)
+        accepted = duplicates = 0
+        if candidates:
+            try:
+                submit_counts = await coalescer.increment(
+                    [dict(entry, share_id=share_id) for _, entry, share_id in candidates])
+            except Exception:
+                if batch_key is not None:
+                    await coalescer.dedup.discard(batch_key)
+                raise
+            accepted, duplicates = fill_batch_results(results, candidates, submit_counts)
+
+        return {
+            'result': {
+                'status': 'OK',
+                'message': 'Batch submission recorded',
+                'accepted': accepted,
+                'duplicates': duplicates,
+                'rejected': len(shares) - accepted - duplicates,
+                'results': results
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error processing batch submission: {str(e)}")
+        return {
+            'error': {
+                'code': -32000,
+                'message': f'Internal error: {str(e)}'
+            }
+        }
+
+
+def is_notification(data: Any) -> bool:
+    """没有 id 成员的请求是通知，按JSON-RPC 2.0照常处理但不返回响应"""
+    return isinstance(data, dict) and 'id' not in data and bool(data.get('method'))
+
+
+async def dispatch_json_rpc(coalescer: SubmitCoalescer, data: Any) -> Dict[str, Any]:
+    """处理单个JSON-RPC请求对象，返回响应对象"""
+    if not isinstance(data, dict):
+        return error_response(-32600, 'Invalid Request')
+
+    method = data.get('method')
+    params = data.get('params', {})
+    request_id = data.get('id')
+
+    if not method:
+        return error_response(-32600, 'Invalid Request: method is required', request_id)
+
+    if method == 'submit':
+        result = await handle_submit(coalescer, params)
+    elif method == 'submit_batch':
+        result = await handle_submit_batch(coalescer, params)
+    else:
+        return error_response(-32601, f'Method not found: {method}', request_id)
+
+    response = {
+        'jsonrpc': '2.0',
+        'id': request_id
+    }
+    response.update(result)
+    return response
+
+
+async def json_rpc(request: web.Request) -> web.Response:
+    """处理JSON-RPC请求，数组批量请求中的各项并发处理，submit 会被合并为同一次Redis往返；通知不返回响应"""
+    coalescer = request.app['coalescer']
+    try:
+        data = json.loads(await request.read())
+    except ValueError:
+        return web.json_response(error_response(-32700, 'Parse error'))
+
+    try:
+        # JSON-RPC 2.0 数组批量请求
+        if isinstance(data, list):
+            if not data:
+                return web.json_response(error_response(-32600, 'Invalid Request: empty batch'))
+            if len(data) > MAX_JSON_RPC_BATCH:
+                return web.json_response(error_response(
+                    -32600, f'Invalid Request: batch exceeds {MAX_JSON_RPC_BATCH} requests'))
+            responses = await asyncio.gather(*(dispatch_json_rpc(coalescer, item) for item in data))
+            responses = [response for item, response in zip(data, responses) if not is_notification(item)]
+            # 全部是通知时不返回任何内容
+            return web.json_response(responses) if responses else web.Response(status=204)
+
+        if not isinstance(data, dict):
+            return web.json_response(error_response(-32700, 'Parse error'))
+
+        response = await dispatch_json_rpc(coalescer, data)
+        return web.Response(status=204) if is_notification(data) else web.json_response(response)
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return web.json_response(error_response(
+            -32000,
+            f'Internal error: {str(e)}',
+            data.get('id') if isinstance(data, dict) else None
+        ))
+
+
+async def on_startup(app: web.Application):
+    pool = aioredis.ConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        decode_responses=True
+    )
+    client = aioredis.Redis(connection_pool=pool)
+    await client.ping()
+    logger.info("Successfully connected to Redis")
+    app['redis'] = client
+    app['coalescer'] = SubmitCoalescer(client)
+
+
+async def on_cleanup(app: web.Application):
+    # 等待尚未完成的 account_login 同步
+    await asyncio.gather(*app['coalescer'].mirror_tasks)
+    await app['redis'].aclose()
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_post('/json_rpc', json_rpc)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    if uvloop is not None:
+        uvloop.install()
+        logger.info("使用 uvloop 事件循环")
+    logger.info(f"share提交服务监听 {LISTEN_HOST}:{LISTEN_PORT}")
+    web.run_app(create_app(), host=LISTEN_HOST, port=LISTEN_PORT, access_log=None, print=None)
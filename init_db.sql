@@ -8,23 +8,33 @@ CREATE DATABASE p2pool;
 CREATE TABLE account (
     id SERIAL PRIMARY KEY,
     username VARCHAR(255) NOT NULL UNIQUE,
-    xmr_balance DECIMAL(20, 12) DEFAULT 0,
-    tari_balance DECIMAL(20, 12) DEFAULT 0,
+    xmr_balance BIGINT DEFAULT 0,
+    tari_balance BIGINT DEFAULT 0,
     xmr_wallet VARCHAR(255),
     tari_wallet VARCHAR(255),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 创建登录名 -> 用户ID 映射表 (Redis user:ids 的镜像)
+CREATE TABLE account_login (
+    user_id INTEGER PRIMARY KEY,
+    login TEXT NOT NULL UNIQUE,
+    username VARCHAR(255) NOT NULL,
+    xmr_wallet VARCHAR(255),
+    tari_wallet VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- 创建区块记录表
 CREATE TABLE blocks (
-    
-    block_height BIGINT PRIMARY KEY,
-    rewards DECIMAL(20, 12) NOT NULL,
+    block_height BIGINT NOT NULL,
+    rewards BIGINT NOT NULL,
     type VARCHAR(10) NOT NULL CHECK (type IN ('xmr', 'tari')),
     time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     total_shares BIGINT NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (type, block_height)
 );
 
 -- 创建收益记录表
@@ -33,19 +43,77 @@ CREATE TABLE rewards (
     block_height BIGINT NOT NULL,
     type VARCHAR(10) NOT NULL CHECK (type IN ('xmr', 'tari')),
     username VARCHAR(255) NOT NULL,
-    reward DECIMAL(20, 12) NOT NULL,
+    reward BIGINT NOT NULL,
     shares BIGINT NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (block_height) REFERENCES blocks(block_height),
+    UNIQUE (block_height, type, username),
+    FOREIGN KEY (type, block_height) REFERENCES blocks(type, block_height),
     FOREIGN KEY (username) REFERENCES account(username)
 );
 
+-- 创建区块轮次快照表 (用户ID与提交数为并行数组)
+CREATE TABLE round_snapshots (
+    type VARCHAR(10) NOT NULL CHECK (type IN ('xmr', 'tari')),
+    block_height BIGINT NOT NULL,
+    user_ids INTEGER[] NOT NULL,
+    shares BIGINT[] NOT NULL,
+    total_shares BIGINT NOT NULL,
+    fee NUMERIC NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (type, block_height)
+);
+
+-- 创建主实例任期表，每次当选任期号加一，作为入账事务的 fencing token (见 leader.py)
+CREATE TABLE leader_epochs (
+    role VARCHAR(32) PRIMARY KEY,
+    epoch BIGINT NOT NULL,
+    holder TEXT NOT NULL,
+    elected_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- 创建爆块事件队列表
+CREATE TABLE block_events (
+    id BIGSERIAL PRIMARY KEY,
+    chain VARCHAR(10) NOT NULL CHECK (chain IN ('xmr', 'tari')),
+    block_height BIGINT NOT NULL,
+    params JSONB NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMP,
+    first_failed_at TIMESTAMP,
+    source VARCHAR(16) NOT NULL DEFAULT 'log'
+        CONSTRAINT block_events_source_check CHECK (source IN ('log', 'event', 'rpc', 'backfill')),
+    UNIQUE (chain, block_height)
+);
+
+-- 创建余额流水表 (只追加，由压缩器汇总到 account 余额，见 balance_ledger.py)
+CREATE TABLE balance_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    username VARCHAR(255) NOT NULL,
+    type VARCHAR(10) NOT NULL CHECK (type IN ('xmr', 'tari')),
+    amount BIGINT NOT NULL,
+    reason VARCHAR(20) NOT NULL,
+    ref TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (username) REFERENCES account(username)
+);
+
+-- 创建流水压缩水位 (只有一行: id 不大于 last_compacted_id 的流水已计入 account 余额)
+CREATE TABLE ledger_watermark (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    last_compacted_id BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO ledger_watermark DEFAULT VALUES;
+
 -- 创建支付记录表
 CREATE TABLE payment (
     id SERIAL PRIMARY KEY,
     username VARCHAR(255) NOT NULL,
     type VARCHAR(10) NOT NULL CHECK (type IN ('xmr', 'tari')),
-    amount DECIMAL(20, 12) NOT NULL,
+    amount BIGINT NOT NULL,
     txid VARCHAR(255) NOT NULL,
     time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
@@ -53,12 +121,57 @@ CREATE TABLE payment (
 );
 
 -- 创建索引
-CREATE INDEX idx_blocks_type ON blocks(type);
 CREATE INDEX idx_blocks_time ON blocks(time);
 CREATE INDEX idx_rewards_block_height ON rewards(block_height);
 CREATE INDEX idx_rewards_username ON rewards(username);
 CREATE INDEX idx_payment_username ON payment(username);
 CREATE INDEX idx_payment_time ON payment(time);
+CREATE INDEX idx_block_events_pending ON block_events(chain, id) WHERE status = 'pending';
+CREATE INDEX idx_balance_ledger_username ON balance_ledger(username, id);
+
+-- 创建精确余额视图: 已压缩的余额加上水位以上的流水
+CREATE VIEW account_balance AS
+SELECT a.username,
+       a.xmr_balance + COALESCE(p.xmr, 0)::BIGINT AS xmr_balance,
+       a.tari_balance + COALESCE(p.tari, 0)::BIGINT AS tari_balance,
+       a.xmr_wallet,
+       a.tari_wallet
+FROM account a
+LEFT JOIN (
+    SELECT username,
+           SUM(amount) FILTER (WHERE type = 'xmr') AS xmr,
+           SUM(amount) FILTER (WHERE type = 'tari') AS tari
+    FROM balance_ledger
+    WHERE id > (SELECT last_compacted_id FROM ledger_watermark)
+    GROUP BY username
+) p ON p.username = a.username;
+
+-- 创建以币为单位的兼容视图 (金额列均以最小单位存储: XMR 10^12, Tari 10^6)
+CREATE VIEW account_decimal AS
+SELECT username,
+       (xmr_balance::NUMERIC / 1000000000000)::DECIMAL(20, 12) AS xmr_balance,
+       (tari_balance::NUMERIC / 1000000)::DECIMAL(20, 12) AS tari_balance,
+       xmr_wallet,
+       tari_wallet
+FROM account_balance;
+
+CREATE VIEW rewards_decimal AS
+SELECT id, block_height, type, username,
+       (reward::NUMERIC / CASE type WHEN 'tari' THEN 1000000 ELSE 1000000000000 END)::DECIMAL(20, 12) AS reward,
+       shares
+FROM rewards;
+
+CREATE VIEW blocks_decimal AS
+SELECT block_height, type,
+       (rewards::NUMERIC / CASE type WHEN 'tari' THEN 1000000 ELSE 1000000000000 END)::DECIMAL(20, 12) AS rewards,
+       total_shares, time
+FROM blocks;
+
+CREATE VIEW payment_decimal AS
+SELECT id, username, type,
+       (amount::NUMERIC / CASE type WHEN 'tari' THEN 1000000 ELSE 1000000000000 END)::DECIMAL(20, 12) AS amount,
+       txid, time
+FROM payment;
 
 -- 创建更新时间触发器函数
 CREATE OR REPLACE FUNCTION update_updated_at_column()
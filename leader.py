@@ -0,0 +1,122 @@
+"""多实例部署时的主实例选举
+
+api_server.py 可以同时运行多个实例分担提交写入和接口查询，但日志监控和爆块入账只能由一个实例执行。
+每个角色 (log_tailer / block_crediting) 对应一个 Postgres 会话级 advisory lock，
+持有锁的连接断开时锁自动释放，其他实例在下一次检查时接任。
+
+每次当选都会在 leader_epochs 表中把该角色的任期号加一，作为 fencing token:
+入账事务提交前调用 check_fence，以 FOR SHARE 读取任期号并与本实例当选时的任期号比较，
+旧主实例在失去锁后 (例如网络分区时尚未察觉) 提交的事务会被拒绝。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ROLE_LOG_TAILER = 'log_tailer'
+ROLE_BLOCK_CREDITING = 'block_crediting'
+
+
+class LeadershipLost(Exception):
+    """本实例已不是该角色的主实例"""
+
+
+class LeaderElection(threading.Thread):
+    """竞选一个角色并维持主实例身份的后台线程
+
+    connect 返回一个新的数据库连接，选举使用独立的自动提交连接持有锁；
+    enabled 为 False 时本实例始终是主实例且不做 fencing 检查，用于单实例部署。
+    """
+    def __init__(self, role: str, connect: Callable, interval: float = 5, enabled: bool = True):
+        super().__init__()
+        self.daemon = True
+        self.running = True
+        self.name = f"LeaderElection-{role}"
+        self.role = role
+        self.connect = connect
+        self.interval = interval
+        self.enabled = enabled
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.conn = None
+        self.token: Optional[int] = None
+        self.elected = threading.Event()
+        if not enabled:
+            self.elected.set()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.elected.is_set()
+
+    def wait_for_leadership(self, timeout: Optional[float] = None) -> bool:
+        return self.elected.wait(timeout)
+
+    def run(self):
+        if not self.enabled:
+            return
+        while self.running:
+            try:
+                if self.conn is None:
+                    self.conn = self.connect()
+                    self.conn.autocommit = True
+                cur = self.conn.cursor()
+                if not self.is_leader:
+                    self.try_acquire(cur)
+                else:
+                    # 定期探测连接，连接断开意味着锁已被释放
+                    cur.execute("SELECT 1")
+                cur.close()
+            except Exception as e:
+                self.demote(f"选举连接异常: {str(e)}")
+            time.sleep(self.interval)
+
+    def try_acquire(self, cur):
+        cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (self.role,))
+        if not cur.fetchone()[0]:
+            return
+        cur.execute("""
+            INSERT INTO leader_epochs (role, epoch, holder, elected_at)
+            VALUES (%s, 1, %s, NOW())
+            ON CONFLICT (role) DO UPDATE
+            SET epoch = leader_epochs.epoch + 1,
+                holder = EXCLUDED.holder,
+                elected_at = EXCLUDED.elected_at
+            RETURNING epoch
+        """, (self.role, self.holder))
+        self.token = cur.fetchone()[0]
+        self.elected.set()
+        logger.info(f"{self.holder} 当选 {self.role} 主实例，任期 {self.token}")
+
+    def demote(self, reason: str):
+        if self.is_leader:
+            logger.warning(f"{self.holder} 不再是 {self.role} 主实例: {reason}")
+        elif self.enabled:
+            logger.debug(f"{self.role} 选举失败: {reason}")
+        self.elected.clear()
+        self.token = None
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def check_fence(self, cur):
+        """在调用方的事务中确认任期号未变化，否则抛出 LeadershipLost 使事务回滚"""
+        if not self.enabled:
+            return
+        token = self.token
+        if token is None:
+            raise LeadershipLost(f"本实例不是 {self.role} 主实例")
+        cur.execute("SELECT epoch FROM leader_epochs WHERE role = %s FOR SHARE", (self.role,))
+        row = cur.fetchone()
+        if row is None or row[0] != token:
+            raise LeadershipLost(f"{self.role} 任期 {token} 已结束")
+
+    def stop(self):
+        self.running = False
+        if self.enabled:
+            self.demote("实例停止")
@@ -0,0 +1,235 @@
+"""p2pool.log 跟踪读取
+
+由 inotify 事件唤醒，每次按大块读取新增内容，只把完整的行交给回调。
+回调处理完一批行后，把文件的 inode 和已处理到的字节偏移写入状态文件 (先写临时文件再原子替换)，
+重启后从上次的位置继续读取，停机期间写入的爆块日志不会丢失。
+
+轮转和截断:
+    文件被改名轮转 (p2pool.log -> p2pool.log.1 并新建 p2pool.log)  先读完旧文件的剩余内容，再从头读取新文件
+    停机期间发生轮转                                              在同目录中按 inode 找到旧文件读完剩余内容
+    文件被截断 (copytruncate)                                     从头读取
+回调中的处理需要是幂等的: 状态文件只在一批行处理完后更新，进程崩溃时最后一批行会被再次读取。
+
+inotify 通过 ctypes 调用 libc，不可用时 (非 Linux) 退化为按 poll_interval 轮询。
+"""
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 爆块日志行，LogMonitorThread 和 backfill_blocks.py 共用
+XMR_BLOCK_PATTERN = r'got a payout of ([\d.]+) XMR in block (\d+)'
+TARI_BLOCK_PATTERN = r'Mined Tari block ([a-f0-9]+) at height (\d+)'
+# 爆块日志行中的固定子串，先用 in / find 过滤，命中后再运行正则表达式
+XMR_BLOCK_MARKER = ' XMR in block '
+TARI_BLOCK_MARKER = 'Mined Tari block '
+
+# inotify 事件掩码 (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class Inotify:
+    """监视一个目录的 inotify 实例，wait 在有事件或超时后返回"""
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        # 监视目录而不是文件本身，轮转后新建的同名文件也能收到事件
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f'inotify_add_watch {directory} 失败')
+
+    def wait(self, timeout: float) -> bool:
+        """等待事件并清空事件队列，返回是否有事件"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        while True:
+            try:
+                if not os.read(self.fd, 64 * 1024):
+                    break
+            except BlockingIOError:
+                break
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LogTailer:
+    """跟踪读取一个日志文件，断点续读并处理轮转和截断
+
+    state_path 为空时不保存进度，每次启动都从文件末尾开始 (与旧的行为相同)。
+    """
+    def __init__(self, path: str, state_path: Optional[str] = None,
+                 chunk_size: int = 1024 * 1024, poll_interval: float = 1.0):
+        self.path = path
+        self.state_path = state_path
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.inode = None
+        self.offset = 0          # 已处理完的完整行结束处的字节偏移
+        self.buffer = b''        # 已读取但还不是完整行的内容
+
+    def load_state(self) -> Optional[dict]:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取日志进度文件 {self.state_path} 失败，从文件末尾开始: {str(e)}")
+            return None
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'path': self.path, 'inode': self.inode, 'offset': self.offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def find_rotated(self, inode: int) -> Optional[str]:
+        """在日志所在目录中按 inode 查找轮转后的旧文件"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        for entry in os.scandir(directory):
+            try:
+                if entry.is_file() and entry.inode() == inode:
+                    return entry.path
+            except OSError:
+                continue
+        return None
+
+    def open(self, path: str, offset: int):
+        self.close()
+        self.fd = os.open(path, os.O_RDONLY)
+        self.inode = os.fstat(self.fd).st_ino
+        self.offset = offset
+        self.buffer = b''
+        os.lseek(self.fd, offset, os.SEEK_SET)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def start(self, on_lines: Callable[[List[str]], None], keep_running: Callable[[], bool]):
+        """按保存的进度打开日志文件，停机期间发生的轮转先读完旧文件"""
+        state = self.load_state()
+        current = os.stat(self.path)
+        if state is None:
+            self.open(self.path, current.st_size)
+            self.save_state()
+            logger.info(f"没有日志进度记录，从 {self.path} 末尾开始读取")
+            return
+
+        if state['inode'] == current.st_ino:
+            offset = state['offset'] if state['offset'] <= current.st_size else 0
+            self.open(self.path, offset)
+            logger.info(f"从 {self.path} 的偏移 {offset} 继续读取")
+            return
+
+        rotated = self.find_rotated(state['inode'])
+        if rotated is not None:
+            logger.info(f"{self.path} 在停机期间已轮转，先读完 {rotated} 偏移 {state['offset']} 之后的内容")
+            self.open(rotated, state['offset'])
+            if not self.drain(on_lines, keep_running):
+                return
+        else:
+            logger.warning(f"找不到停机前读取的日志文件 (inode {state['inode']})，其剩余内容无法读取")
+        self.open(self.path, 0)
+        self.save_state()
+
+    def read_available(self) -> List[str]:
+        """读取当前文件中所有新增的完整行"""
+        lines = []
+        while True:
+            chunk = os.read(self.fd, self.chunk_size)
+            if not chunk:
+                break
+            data = self.buffer + chunk
+            end = data.rfind(b'\n') + 1
+            if end:
+                lines.extend(data[:end].decode('utf-8', errors='replace').splitlines())
+            self.buffer = data[end:]
+            if len(chunk) < self.chunk_size:
+                break
+        return lines
+
+    def drain(self, on_lines: Callable[[List[str]], None], keep_running: Callable[[], bool]) -> bool:
+        """处理当前文件中所有新增的完整行并保存进度，处理被中断时返回 False 且不保存进度"""
+        while True:
+            lines = self.read_available()
+            if not lines:
+                return True
+            on_lines(lines)
+            if not keep_running():
+                return False
+            self.offset = os.lseek(self.fd, 0, os.SEEK_CUR) - len(self.buffer)
+            self.save_state()
+
+    def check_rotation(self, on_lines: Callable[[List[str]], None], keep_running: Callable[[], bool]) -> bool:
+        """检查文件是否被轮转或截断，必要时切换到新文件，返回是否继续"""
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            # 旧文件已改名、新文件尚未创建，继续读旧文件
+            return True
+        if current.st_ino != self.inode:
+            # 写入方可能在改名后还写了最后几行，读完旧文件再切换
+            if not self.drain(on_lines, keep_running):
+                return False
+            if self.buffer:
+                logger.warning(f"轮转前的日志文件以不完整的行结尾，已丢弃 {len(self.buffer)} 字节")
+            logger.info(f"{self.path} 已轮转，从新文件开头读取")
+            self.open(self.path, 0)
+            self.save_state()
+        elif current.st_size < self.offset + len(self.buffer):
+            logger.info(f"{self.path} 已被截断，从头读取")
+            self.open(self.path, 0)
+            self.save_state()
+        return True
+
+    def follow(self, on_lines: Callable[[List[str]], None], keep_running: Callable[[], bool]):
+        """持续读取日志，直到 keep_running 返回 False"""
+        try:
+            inotify = Inotify(os.path.dirname(os.path.abspath(self.path)))
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify 不可用，改为每 {self.poll_interval} 秒轮询: {str(e)}")
+            inotify = None
+        try:
+            self.start(on_lines, keep_running)
+            while keep_running():
+                if not self.drain(on_lines, keep_running):
+                    return
+                if not self.check_rotation(on_lines, keep_running):
+                    return
+                # 超时后也检查一次，防止错过事件 (例如目录本身被替换)
+                if inotify is not None:
+                    inotify.wait(self.poll_interval)
+                else:
+                    select.select([], [], [], self.poll_interval)
+        finally:
+            if inotify is not None:
+                inotify.close()
+            self.close()
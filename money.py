@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""金额统一以整数最小单位 (piconero / microTari) 表示
+
+account、rewards、blocks、payment 和 balance_ledger 中的金额列都是 BIGINT 最小单位，
+Python 代码中金额始终是 int，只在输出 (接口JSON、日志、钱包RPC) 时转换为以币为单位。
+同一张表中 XMR 和 Tari 的行按各自 type 的最小单位存储。
+
+旧的 DECIMAL(20,12) 列在 api_server.py 启动时原地迁移；需要按币读取的外部查询
+可使用 *_decimal 兼容视图 (account_decimal / rewards_decimal / blocks_decimal / payment_decimal)。
+
+用法: python money.py --benchmark 1000000    # 对比 NUMERIC 与 BIGINT 的 SUM 查询耗时
+"""
+import argparse
+import json
+import time
+from decimal import Decimal, ROUND_DOWN
+
+XMR_ATOMIC_UNITS = 10 ** 12   # 1 XMR = 10^12 piconero
+TARI_ATOMIC_UNITS = 10 ** 6   # 1 XTM = 10^6 microTari
+
+ATOMIC_UNITS = {
+    'xmr': XMR_ATOMIC_UNITS,
+    'tari': TARI_ATOMIC_UNITS
+}
+
+DECIMALS = {
+    'xmr': 12,
+    'tari': 6
+}
+
+
+def to_atomic(amount, units: int) -> int:
+    """把以币为单位的金额转换为最小单位整数，不足一个最小单位的部分舍去"""
+    return int((Decimal(str(amount)) * units).to_integral_value(rounding=ROUND_DOWN))
+
+
+def from_atomic(atomic: int, units: int) -> Decimal:
+    """把最小单位整数转换为以币为单位的精确Decimal"""
+    return Decimal(int(atomic)) / Decimal(units)
+
+
+def chain_to_atomic(amount, chain: str) -> int:
+    return to_atomic(amount, ATOMIC_UNITS[chain])
+
+
+def chain_from_atomic(atomic, chain: str) -> Decimal:
+    return from_atomic(atomic or 0, ATOMIC_UNITS[chain])
+
+
+def coins(atomic, chain: str) -> float:
+    """最小单位转换为以币为单位的float，只用于接口输出"""
+    return float(chain_from_atomic(atomic, chain))
+
+
+def format_amount(atomic, chain: str) -> str:
+    """最小单位格式化为以币为单位的字符串，保留该币种的全部小数位"""
+    return f"{chain_from_atomic(atomic, chain):.{DECIMALS[chain]}f}"
+
+
+def benchmark(conn, rows: int, users: int = 10000, repeat: int = 5):
+    """在临时表中分别以 NUMERIC(20,12) 和 BIGINT 存储同样的金额，对比仪表盘常用的 SUM 查询"""
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TEMP TABLE money_benchmark (
+            username TEXT NOT NULL,
+            type VARCHAR(10) NOT NULL,
+            amount_numeric DECIMAL(20,12) NOT NULL,
+            amount_atomic BIGINT NOT NULL
+        ) ON COMMIT DROP
+    """)
+    cur.execute("""
+        INSERT INTO money_benchmark (username, type, amount_numeric, amount_atomic)
+        SELECT 'user' || (i %% %s),
+               CASE WHEN i %% 2 = 0 THEN 'xmr' ELSE 'tari' END,
+               v / 1e12,
+               v
+        FROM (SELECT i, (random() * 1e12)::BIGINT AS v FROM generate_series(1, %s) AS i) s
+    """, (users, rows))
+    cur.execute("ANALYZE money_benchmark")
+
+    queries = {
+        '总额 SUM': "SELECT SUM({column}) FROM money_benchmark",
+        '按用户 GROUP BY': "SELECT username, SUM({column}) FROM money_benchmark GROUP BY username",
+        '按类型 FILTER': "SELECT SUM({column}) FILTER (WHERE type = 'xmr'), SUM({column}) FILTER (WHERE type = 'tari') FROM money_benchmark",
+    }
+    print(f"{rows} 行, {users} 个用户, 每个查询取 {repeat} 次中最快的一次:")
+    for name, query in queries.items():
+        timings = {}
+        for column in ('amount_numeric', 'amount_atomic'):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cur.execute(query.format(column=column))
+                cur.fetchall()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[column] = best
+        print(f"  {name:<16} NUMERIC {timings['amount_numeric'] * 1000:8.1f} ms   "
+              f"BIGINT {timings['amount_atomic'] * 1000:8.1f} ms   "
+              f"{timings['amount_numeric'] / timings['amount_atomic']:.1f}x")
+    conn.rollback()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='金额最小单位工具')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='用N行临时数据对比 NUMERIC 与 BIGINT 的 SUM 查询')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    args = parser.parse_args()
+    if args.benchmark:
+        import psycopg2
+        with open(args.config, 'r') as f:
+            db = json.load(f)['database']
+        conn = psycopg2.connect(host=db['host'], port=db['port'], database=db['database'],
+                                user=db['user'], password=db['password'])
+        try:
+            benchmark(conn, args.benchmark)
+        finally:
+            conn.close()
+    else:
+        parser.print_help()
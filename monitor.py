@@ -9,9 +9,14 @@ import logging
 import re
 import threading
 import time
-from queue import Queue
 import psycopg2
 from psycopg2 import pool
+import redis
+
+from block_queue import enqueue_block_event as enqueue_event, request_cluster_flush
+from leader import LeaderElection, ROLE_LOG_TAILER
+from log_tailer import (LogTailer, XMR_BLOCK_PATTERN, TARI_BLOCK_PATTERN,
+                        XMR_BLOCK_MARKER, TARI_BLOCK_MARKER)
 
 # 创建日志记录器
 logger = logging.getLogger('monitor')
@@ -34,22 +39,39 @@ console_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
-# 从配置文件加载数据库配置
+# 从配置文件加载配置
 def load_config():
     try:
         with open('config.json', 'r') as f:
-            config = json.load(f)
-            return config.get('database', {})
+            return json.load(f)
     except Exception as e:
         logger.error(f"加载配置文件失败: {str(e)}")
         raise
 
+CONFIG = load_config()
+
 # 数据库配置
-DB_CONFIG = load_config()
+DB_CONFIG = CONFIG.get('database', {})
+
+# 日志读取配置，与 api_server.py 共用同一个进度文件
+TAILER_CONFIG = CONFIG.get('log_tailer', {})
 
 # 全局数据库连接池
 db_pool = None
 
+# 入队时切换轮次，与 api_server.py 使用同一个Redis库
+REDIS_CONFIG = CONFIG.get('redis', {})
+redis_client = redis.Redis(
+    host=REDIS_CONFIG.get('host', 'localhost'),
+    port=REDIS_CONFIG.get('port', 6379),
+    db=REDIS_CONFIG.get('db', 0),
+    decode_responses=True
+)
+CLUSTER_FLUSH_TIMEOUT = CONFIG.get('submit_aggregation', {}).get('cluster_flush_timeout_ms', 2000) / 1000.0
+
+# 与 api_server.py 竞选同一个 log_tailer 角色，同一时间只有一个进程读取日志
+tailer_leader = LeaderElection(ROLE_LOG_TAILER, lambda: psycopg2.connect(**DB_CONFIG))
+
 class TariWalletTest:
     def __init__(self, grpc_address="127.0.0.1:18143"):
         self.channel = grpc.insecure_channel(grpc_address)
@@ -96,54 +118,51 @@ class LogMonitorThread(threading.Thread):
         super().__init__()
         self.daemon = True
         self.running = True
-        self.log_queue = Queue()
-        self.log_file = './p2pool.log'
+        self.log_file = TAILER_CONFIG.get('path', './p2pool.log')
+        self.state_file = TAILER_CONFIG.get('state_file', 'p2pool.log.offset')
+        self.chunk_size = TAILER_CONFIG.get('chunk_size', 1048576)
         
         # 编译正则表达式模式
-        self.xmr_block_pattern = re.compile(r'got a payout of ([\d.]+) XMR in block (\d+)')
-        self.tari_block_pattern = re.compile(r'Mined Tari block ([a-f0-9]+) at height (\d+)')
+        self.xmr_block_pattern = re.compile(XMR_BLOCK_PATTERN)
+        self.tari_block_pattern = re.compile(TARI_BLOCK_PATTERN)
         
     def run(self):
+        while self.running:
+            if not tailer_leader.wait_for_leadership(1):
+                continue
+            self.tail()
+            
+    def tail(self):
         try:
-            # 打开日志文件
-            with open(self.log_file, 'r') as f:
-                # 移动到文件末尾
-                f.seek(0, 2)
-                
-                while self.running:
-                    line = f.readline()
-                    if not line:
-                        # 如果没有新内容，等待一小段时间
-                        time.sleep(0.1)
-                        continue
-                        
-                    # 处理日志行
-                    self.process_log_line(line)
-                    
+            # 由 inotify 唤醒按块读取，从上次保存的偏移继续，跟随轮转和截断；
+            # 写入队列失败时不保存进度，重新读取时再次写入
+            tailer = LogTailer(self.log_file, self.state_file, self.chunk_size)
+            tailer.follow(self.process_log_lines, lambda: self.running and tailer_leader.is_leader)
         except Exception as e:
             logger.error(f"日志监控线程错误: {str(e)}")
+            time.sleep(1)
+            
+    def process_log_lines(self, lines):
+        for line in lines:
+            self.process_log_line(line)
             
     def process_log_line(self, line):
-        try:
-            # 检查 XMR 爆块信息
-            xmr_match = self.xmr_block_pattern.search(line)
-            if xmr_match:
-                reward = float(xmr_match.group(1))
-                height = int(xmr_match.group(2))
-                logger.info(f"检测到 XMR 爆块 - 高度: {height}, 奖励: {reward}")
-                handle_xmr_block({'height': height, 'reward': reward})
-                return
-                
-            # 检查 TARI 爆块信息
-            tari_match = self.tari_block_pattern.search(line)
-            if tari_match:
-                height = int(tari_match.group(2))
-                block_id = tari_match.group(1)
-                logger.info(f"检测到 TARI 爆块 - 高度: {height}, 区块ID: {block_id}")
-                handle_tari_block({'height': height, 'block_id': block_id})
-                
-        except Exception as e:
-            logger.error(f"处理日志行时出错: {str(e)}")
+        # 检查 XMR 爆块信息，先用固定子串过滤，绝大部分日志行不需要运行正则表达式
+        xmr_match = XMR_BLOCK_MARKER in line and self.xmr_block_pattern.search(line)
+        if xmr_match:
+            reward = xmr_match.group(1)
+            height = int(xmr_match.group(2))
+            logger.info(f"检测到 XMR 爆块 - 高度: {height}, 奖励: {reward}")
+            handle_xmr_block({'height': height, 'reward': reward})
+            return
+            
+        # 检查 TARI 爆块信息
+        tari_match = TARI_BLOCK_MARKER in line and self.tari_block_pattern.search(line)
+        if tari_match:
+            height = int(tari_match.group(2))
+            block_id = tari_match.group(1)
+            logger.info(f"检测到 TARI 爆块 - 高度: {height}, 区块ID: {block_id}")
+            handle_tari_block({'height': height, 'block_id': block_id})
             
     def stop(self):
         self.running = False
@@ -162,79 +181,41 @@ def init_db():
         logger.error(f"Database connection failed: {str(e)}")
         raise
 
-def handle_xmr_block(block_data):
-    """处理 XMR 区块数据"""
+def enqueue_block_event(chain, block_data):
+    """把爆块写入 block_events 队列，由 api_server.py 的入账工作线程计算奖励
+
+    与 api_server.py 共用 block_queue.enqueue_block_event: 入队事务提交前刷新各实例的写后聚合器并切换轮次
+    """
     conn = None
     try:
         conn = db_pool.getconn()
-        with conn.cursor() as cur:
-            # 检查区块是否已存在
-            cur.execute("""
-                SELECT id FROM blocks 
-                WHERE block_height = %s AND type = 'xmr'
-            """, (block_data['height'],))
-            
-            if cur.fetchone():
-                logger.info(f"XMR 区块 {block_data['height']} 已存在")
-                return
-                
-            # 插入新区块
-            cur.execute("""
-                INSERT INTO blocks (block_height, block_id, type, check_status, is_valid, rewards)
-                VALUES (%s, %s, 'xmr', true, true, 0)
-                RETURNING id
-            """, (block_data['height'], str(block_data['height'])))
-            
-            conn.commit()
-            logger.info(f"XMR 区块 {block_data['height']} 已记录")
-            
+        created = enqueue_event(conn, redis_client, chain, block_data['height'], block_data, 'log',
+                                lambda: request_cluster_flush(redis_client, CLUSTER_FLUSH_TIMEOUT))
+        if created:
+            logger.info(f"{chain.upper()} 区块 {block_data['height']} 已加入入账队列")
+        else:
+            logger.info(f"{chain.upper()} 区块 {block_data['height']} 已在入账队列中")
     except Exception as e:
-        logger.error(f"处理 XMR 区块时出错: {str(e)}")
-        if conn:
-            conn.rollback()
+        logger.error(f"处理 {chain.upper()} 区块时出错: {str(e)}")
+        raise
     finally:
         if conn:
             db_pool.putconn(conn)
 
+def handle_xmr_block(block_data):
+    """处理 XMR 区块数据"""
+    enqueue_block_event('xmr', block_data)
+
 def handle_tari_block(block_data):
     """处理 TARI 区块数据"""
-    conn = None
-    try:
-        conn = db_pool.getconn()
-        with conn.cursor() as cur:
-            # 检查区块是否已存在
-            cur.execute("""
-                SELECT id FROM blocks 
-                WHERE block_height = %s AND type = 'tari'
-            """, (block_data['height'],))
-            
-            if cur.fetchone():
-                logger.info(f"TARI 区块 {block_data['height']} 已存在")
-                return
-                
-            # 插入新区块
-            cur.execute("""
-                INSERT INTO blocks (block_height, block_id, type, check_status, is_valid, rewards)
-                VALUES (%s, %s, 'tari', false, false, 0)
-                RETURNING id
-            """, (block_data['height'], block_data['block_id']))
-            
-            conn.commit()
-            logger.info(f"TARI 区块 {block_data['height']} 已记录")
-            
-    except Exception as e:
-        logger.error(f"处理 TARI 区块时出错: {str(e)}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            db_pool.putconn(conn)
+    enqueue_block_event('tari', block_data)
 
 def main():
     """主函数"""
     try:
         # 初始化数据库连接
         init_db()
+        tailer_leader.start()
         
         # 创建并启动日志监控线程
         log_monitor = LogMonitorThread()
@@ -247,6 +228,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("正在关闭程序...")
         log_monitor.stop()
+        tailer_leader.stop()
     except Exception as e:
         logger.error(f"程序运行错误: {str(e)}")
     finally:
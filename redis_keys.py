@@ -0,0 +1,75 @@
+"""提交计数和用户ID注册表的Redis键名，api_server.py、ingest_server.py、web 等脚本都从这里导入
+
+提交计数按代 (generation) 存储，field均为 user_registry 分配的整数用户ID，而不是约200字节的登录名:
+    shares:uid              当前代: 上次切换轮次之后每个用户的提交数，每个share只需一次HINCRBY
+    shares:gen              最后一个已封存的代号
+    shares:gen:<g>          已封存的第 g 代，任意一条链爆块时当前代整体改名为新的一代 (O(1))
+    round:start             链 -> 该链当前轮次的第一代，链当前轮次提交数 = 从该代起所有封存代 + 当前代
+    round:range:<chain>:<h> 区块快照对应的代范围 {start, end}，保留到入账提交成功后再删除
+    round:pending           尚未入账的快照 (有序集合，分值为起始代)，决定哪些代可以回收
+    shares:gen:collected    已回收到的代号
+
+写后聚合 (见 api_server.py 的 SubmitAggregator):
+    shares:journal_seq:<实例ID>  该聚合实例已应用到Redis的日志序号
+    shares:aggregators          正在运行的聚合实例ID集合
+    shares:aggregator:<实例ID>  聚合实例的存活键，实例停止或崩溃后过期，入账时不再等待它
+    shares:flush_request        集群刷新请求号，爆块切换轮次前 INCR (见 block_queue.request_cluster_flush)
+    shares:flush_ack            聚合实例ID -> 该实例刷新后确认的请求号
+
+提交去重 (见 share_dedup.py):
+    dedup:<桶号>            一个时间桶内 share_id / batch_id 的Bloom过滤器位图，大小由 share_dedup.capacity 决定
+    dedup:released          写入失败后撤销的标识摘要，再次出现时不当作重复
+
+用户ID注册表 (见 user_registry.py):
+    user:ids                登录名 -> ID
+    user:names              ID -> 登录名
+    user:next_id            最后分配的ID
+"""
+
+TOTAL_SHARES_KEY = "shares:uid"
+GENERATION_KEY = "shares:gen"
+GENERATION_KEY_PREFIX = "shares:gen:"
+COLLECTED_GENERATION_KEY = "shares:gen:collected"
+ROUND_START_KEY = "round:start"
+ROUND_PENDING_KEY = "round:pending"
+ROUND_KEY_PREFIX = "round:"
+CHAINS = ('xmr', 'tari')
+
+JOURNAL_SEQ_KEY_PREFIX = "shares:journal_seq:"
+AGGREGATORS_KEY = "shares:aggregators"
+AGGREGATOR_ALIVE_KEY_PREFIX = "shares:aggregator:"
+FLUSH_REQUEST_KEY = "shares:flush_request"
+FLUSH_ACK_KEY = "shares:flush_ack"
+
+DEDUP_KEY_PREFIX = "dedup:"
+DEDUP_RELEASED_KEY = "dedup:released"
+
+USER_IDS_KEY = "user:ids"
+USER_NAMES_KEY = "user:names"
+USER_NEXT_ID_KEY = "user:next_id"
+
+
+def get_generation_key(generation: int) -> str:
+    """获取已封存的一代提交计数的Redis hash键名"""
+    return f"{GENERATION_KEY_PREFIX}{generation}"
+
+
+def get_dedup_bucket_key(bucket: int) -> str:
+    """获取一个去重时间桶的Bloom过滤器位图键名"""
+    return f"{DEDUP_KEY_PREFIX}{bucket}"
+
+
+def get_journal_seq_key(instance_id: str) -> str:
+    """获取聚合实例已应用日志序号的键名"""
+    return f"{JOURNAL_SEQ_KEY_PREFIX}{instance_id}"
+
+
+def get_aggregator_alive_key(instance_id: str) -> str:
+    """获取聚合实例存活键的键名"""
+    return f"{AGGREGATOR_ALIVE_KEY_PREFIX}{instance_id}"
+
+
+def get_range_key(chain: str, block_height) -> str:
+    """获取区块快照代范围的Redis hash键名"""
+    return f"{ROUND_KEY_PREFIX}range:{chain.lower()}:{block_height}"
+
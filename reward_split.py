@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""按提交数分配区块奖励，全部以整数最小单位 (piconero / microTari) 计算
+
+与 C++ 端 SideChain::split_reward 一样不产生舍入误差: 先按比例向下取整，
+剩余的最小单位按余数从大到小逐个分配 (最大余数法)，余数相同时按输入顺序，
+结果只取决于输入，每次计算都相同，分配总额恰好等于可分配奖励。
+
+用法: python reward_split.py --benchmark 100000
+"""
+import argparse
+import time
+from decimal import Decimal, ROUND_DOWN
+from typing import List, Sequence
+
+import numpy as np
+
+from money import XMR_ATOMIC_UNITS, to_atomic
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def split_reward(reward: int, shares: Sequence[int]) -> np.ndarray:
+    """把 reward 个最小单位按 shares 比例分配，返回与 shares 等长的整数数组，总和恰好为 reward"""
+    weights = np.asarray(shares, dtype=np.int64)
+    if weights.size == 0:
+        return weights
+    if (weights < 0).any():
+        raise ValueError("shares must not be negative")
+    total = int(weights.sum())
+    if total <= 0:
+        raise ValueError("total shares must be positive")
+
+    # reward * shares 可能超出int64，此时改用Python大整数 (object数组) 计算
+    if reward > INT64_MAX // max(int(weights.max()), 1):
+        weights = weights.astype(object)
+    products = weights * reward
+    rewards = products // total
+    remainders = products - rewards * total
+
+    # 向下取整后剩余的最小单位数一定小于人数，按余数从大到小各补1，余数相同时按输入顺序
+    leftover = reward - int(rewards.sum())
+    if leftover > 0:
+        order = np.argsort(-remainders, kind='stable')
+        rewards[order[:leftover]] += 1
+    return rewards
+
+
+def split_round_rewards(reward: int, fee, shares: Sequence[int]) -> List[int]:
+    """扣除矿池费用后按提交数分配一轮的奖励，reward 和返回值都是最小单位整数
+
+    可分配总额向下取整到最小单位，舍去的部分归矿池
+    """
+    distributable = int((Decimal(int(reward)) * (Decimal('1') - Decimal(str(fee)))).to_integral_value(rounding=ROUND_DOWN))
+    return split_reward(distributable, shares).tolist()
+
+
+def benchmark(miners: int):
+    rng = np.random.default_rng(0)
+    shares = rng.integers(1, 100000, size=miners)
+    reward = to_atomic('0.6', XMR_ATOMIC_UNITS)
+
+    start = time.perf_counter()
+    rewards = split_reward(reward, shares)
+    split_time = time.perf_counter() - start
+    assert int(rewards.sum()) == reward
+
+    start = time.perf_counter()
+    split_round_rewards(reward, 0.08, shares)
+    round_time = time.perf_counter() - start
+
+    # 旧实现: 逐个用户用Decimal计算 value * shares * (1 - fee)
+    start = time.perf_counter()
+    value = Decimal('0.6') / Decimal(int(shares.sum()))
+    fee = Decimal('0.08')
+    for s in shares.tolist():
+        value * Decimal(s) * (Decimal('1') - fee)
+    decimal_time = time.perf_counter() - start
+
+    print(f"{miners} 个矿工:")
+    print(f"  split_reward (整数最小单位)        {split_time * 1000:.1f} ms")
+    print(f"  split_round_rewards (含费用扣除)    {round_time * 1000:.1f} ms")
+    print(f"  逐用户Decimal计算 (旧实现)         {decimal_time * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='区块奖励分配')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='对N个矿工运行基准测试')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        parser.print_help()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""区块轮次快照的持久化与奖励重算
+
+每个区块入账时把Redis中的轮次快照 (用户ID -> 提交数) 以两个并行数组写入 round_snapshots 表，
+与奖励记录在同一事务中提交。之后任何区块的奖励都可以从确切的快照重新计算，
+不再需要用"参考区块"近似。批量重算只需三次查询 (快照、区块、用户ID映射)，
+数百个区块可在数秒内完成。
+
+用法:
+    python round_replay.py --type tari 1000 1001 1002         # 对比重算结果与 rewards 表
+    python round_replay.py --type tari --restore 1000 1001    # 补写缺失或已清零的奖励记录并追加余额流水
+"""
+import argparse
+import json
+import logging
+import sys
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from balance_ledger import REASON_REWARD, lock_for_append
+from money import ATOMIC_UNITS
+from reward_split import split_round_rewards
+
+logger = logging.getLogger(__name__)
+
+def save_round_snapshot(cur, chain: str, block_height, round_shares: Dict[int, int], fee):
+    """在入账事务中保存区块的轮次快照，用户ID按升序存储；重复入账时保留第一次的快照"""
+    user_ids = sorted(round_shares)
+    cur.execute("""
+        INSERT INTO round_snapshots (type, block_height, user_ids, shares, total_shares, fee)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (type, block_height) DO NOTHING
+    """, (chain, block_height, user_ids, [round_shares[user_id] for user_id in user_ids],
+          sum(round_shares.values()), Decimal(str(fee))))
+
+
+def load_snapshots(cur, chain: str, block_heights: Iterable[int]) -> Dict[int, Tuple[List[int], List[int], Decimal]]:
+    """一次查询读取多个区块的快照，返回 {区块高度: (用户ID列表, 提交数列表, 费率)}"""
+    cur.execute("""
+        SELECT block_height, user_ids, shares, fee
+        FROM round_snapshots
+        WHERE type = %s AND block_height = ANY(%s)
+    """, (chain, list(block_heights)))
+    return {row[0]: (row[1], row[2], row[3]) for row in cur.fetchall()}
+
+
+def replay_rewards(cur, chain: str, block_heights: Iterable[int]) -> Dict[int, List[Tuple[str, int, int]]]:
+    """从快照重新计算区块奖励，返回 {区块高度: [(用户名, 提交数, 最小单位奖励)]}
+
+    奖励使用 blocks 表中记录的区块奖励和快照中保存的费率，与入账时使用相同的整数分配算法。
+    没有快照的区块不出现在结果中。
+    """
+    block_heights = list(block_heights)
+    snapshots = load_snapshots(cur, chain, block_heights)
+    if not snapshots:
+        return {}
+
+    cur.execute("""
+        SELECT block_height, rewards
+        FROM blocks
+        WHERE type = %s AND block_height = ANY(%s)
+    """, (chain, list(snapshots)))
+    block_rewards = dict(cur.fetchall())
+
+    all_ids = set()
+    for user_ids, _, _ in snapshots.values():
+        all_ids.update(user_ids)
+    cur.execute("""
+        SELECT user_id, username
+        FROM account_login
+        WHERE user_id = ANY(%s)
+    """, (list(all_ids),))
+    usernames = dict(cur.fetchall())
+
+    results = {}
+    for block_height, (user_ids, shares, fee) in snapshots.items():
+        if block_height not in block_rewards:
+            logger.warning(f"{chain.upper()} 区块 {block_height} 有快照但不在 blocks 表中，跳过")
+            continue
+
+        # 多个登录名可能对应同一用户名，与入账时一样按用户名合并
+        user_shares = {}
+        for user_id, count in zip(user_ids, shares):
+            username = usernames.get(user_id)
+            if username is None:
+                logger.warning(f"{chain.upper()} 区块 {block_height} 的用户ID {user_id} 没有映射，跳过")
+                continue
+            user_shares[username] = user_shares.get(username, 0) + count
+        if not user_shares:
+            continue
+
+        names = list(user_shares)
+        rewards = split_round_rewards(block_rewards[block_height], fee, [user_shares[name] for name in names])
+        results[block_height] = [(name, user_shares[name], reward) for name, reward in zip(names, rewards)]
+    return results
+
+
+def restore_rewards(cur, chain: str, replayed: Dict[int, List[Tuple[str, int, int]]]) -> int:
+    """把重算结果写入 rewards 表，并只为新写入或被恢复的记录追加余额流水，返回追加的流水条数
+
+    缺失的记录直接插入；Tari 区块被判无效时奖励记录保留但清零 (冲正流水已追加)，这些记录按重算结果覆盖；
+    奖励不为0的已有记录保持不变，重复执行不会重复入账。
+    快照中还没有 account 记录的用户 (例如入账失败后人工处理的区块) 按 account_login 中的钱包创建
+    """
+    rows = [(block_height, chain, username, reward, shares)
+            for block_height, entries in replayed.items()
+            for username, shares, reward in entries]
+    if not rows:
+        return 0
+    cur.execute("""
+        INSERT INTO account (username, xmr_wallet, tari_wallet)
+        SELECT DISTINCT ON (username) username, xmr_wallet, tari_wallet
+        FROM account_login
+        WHERE username = ANY(%s)
+        ORDER BY username, user_id
+        ON CONFLICT (username) DO NOTHING
+    """, (sorted({row[2] for row in rows}),))
+    lock_for_append(cur)
+    execute_values(cur, f"""
+        WITH written AS (
+            INSERT INTO rewards (block_height, type, username, reward, shares)
+            VALUES %s
+            ON CONFLICT (block_height, type, username) DO UPDATE
+            SET reward = EXCLUDED.reward,
+                shares = EXCLUDED.shares
+            WHERE rewards.reward = 0
+            RETURNING block_height, type, username, reward
+        )
+        INSERT INTO balance_ledger (username, type, amount, reason, ref)
+        SELECT username, type, reward, '{REASON_REWARD}', block_height::text
+        FROM written
+        WHERE reward <> 0
+    """, rows, page_size=len(rows))
+    return cur.rowcount
+
+
+def compare_rewards(cur, chain: str, replayed: Dict[int, List[Tuple[str, int, int]]]):
+    """打印重算结果与 rewards 表中已有记录的差异"""
+    cur.execute("""
+        SELECT block_height, username, reward, shares
+        FROM rewards
+        WHERE type = %s AND block_height = ANY(%s)
+    """, (chain, list(replayed)))
+    recorded = {}
+    for block_height, username, reward, shares in cur.fetchall():
+        recorded.setdefault(block_height, {})[username] = (reward, shares)
+
+    for block_height in sorted(replayed):
+        existing = recorded.get(block_height, {})
+        missing = 0
+        different = 0
+        for username, shares, reward in replayed[block_height]:
+            if username not in existing:
+                missing += 1
+            elif existing[username][0] != reward or existing[username][1] != shares:
+                different += 1
+        print(f"{chain.upper()} 区块 {block_height}: 用户 {len(replayed[block_height])}, 缺失 {missing}, 不一致 {different}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='从持久化的轮次快照重算区块奖励')
+    parser.add_argument('--type', choices=sorted(ATOMIC_UNITS), required=True, help='区块类型')
+    parser.add_argument('--restore', action='store_true', help='补写缺失或已清零的奖励记录并追加余额流水')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    parser.add_argument('heights', nargs='+', type=int, help='区块高度')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        db = json.load(f)['database']
+    conn = psycopg2.connect(host=db['host'], port=db['port'], database=db['database'],
+                            user=db['user'], password=db['password'])
+    try:
+        cur = conn.cursor()
+        replayed = replay_rewards(cur, args.type, args.heights)
+        missing = sorted(set(args.heights) - set(replayed))
+        if missing:
+            print(f"没有快照的区块: {', '.join(map(str, missing))}")
+        compare_rewards(cur, args.type, replayed)
+        if args.restore:
+            credited = restore_rewards(cur, args.type, replayed)
+            conn.commit()
+            print(f"已补写奖励并追加 {credited} 条余额流水")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"重算奖励失败: {str(e)}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""按代存储的提交计数的读取与回收 (键名见 redis_keys.py)
+
+每个share只对当前代 shares:uid 做一次HINCRBY。任意一条链爆块时，api_server.py 用一个O(1)的Lua脚本
+把当前代改名为新的封存代，记录该区块快照的代范围，并把该链的轮次起点移到下一代；
+Redis 中的阻塞时间与用户数无关。链当前轮次的提交数 = 从该链起点开始的所有封存代 + 当前代，
+只在读取时按用户求和，封存代的数量等于其他链在本链一轮内爆块的次数。
+
+不再被任何链的当前轮次和未入账快照引用的代由 collect_generations 用 UNLINK 回收 (在Redis后台释放内存)。
+切换、撤销和释放快照的函数由 api_server.py 和 block_queue.py (monitor.py) 共用。
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from redis_keys import (TOTAL_SHARES_KEY, GENERATION_KEY, GENERATION_KEY_PREFIX, COLLECTED_GENERATION_KEY,
+                        ROUND_START_KEY, ROUND_PENDING_KEY, CHAINS, get_generation_key, get_range_key)
+
+# 爆块时在一个Lua脚本中原子完成: 把当前代整体改名为新的封存代，记录本链快照的代范围，
+# 并把本链轮次起点移到下一代；新的提交立即计入新的当前代。脚本只做常数次操作，与用户数无关。
+# 快照已存在(上次入账失败后重试)时直接复用，不会吞掉新一轮的提交。
+# 封存代的键名在脚本中生成，只能用于单实例Redis (不支持Redis Cluster)。
+# KEYS[1]=当前代 KEYS[2]=代号 KEYS[3]=各链起点 KEYS[4]=快照代范围 KEYS[5]=未入账快照
+# ARGV[1]=链 ARGV[2]=封存代键名前缀
+SEAL_ROUND_SCRIPT = """
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    return 0
+end
+local generation = redis.call('INCR', KEYS[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], ARGV[2] .. generation)
+end
+local start = tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '1')
+redis.call('HSET', KEYS[4], 'start', start, 'end', generation)
+redis.call('ZADD', KEYS[5], start, KEYS[4])
+redis.call('HSET', KEYS[3], ARGV[1], generation + 1)
+return 1
+"""
+
+# 撤销刚切换的快照: 本链起点仍紧接在快照之后时把起点移回快照的起始代，快照中的代重新计入本链当前轮次。
+# 本链之后又切换过轮次时无法撤销，返回 -1，快照保持不变；快照不存在时返回 0
+# KEYS[1]=各链起点 KEYS[2]=快照代范围 KEYS[3]=未入账快照 ARGV[1]=链
+RESTORE_ROUND_SCRIPT = """
+local range = redis.call('HMGET', KEYS[2], 'start', 'end')
+if not range[1] then
+    return 0
+end
+if tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '1') ~= tonumber(range[2]) + 1 then
+    return -1
+end
+redis.call('HSET', KEYS[1], ARGV[1], range[1])
+redis.call('DEL', KEYS[2])
+redis.call('ZREM', KEYS[3], KEYS[2])
+return 1
+"""
+
+
+# 回收不再被引用的封存代: 链的起点和未入账快照的起始代只会增大，小于其中最小值的代不会再被读取。
+# 读取最早的未入账快照、各链起点和回收标记与 UNLINK 在同一个脚本中完成，
+# 不会漏掉回收期间其他链切换出的快照 (SEAL_ROUND_SCRIPT 同时写入快照并移动起点)。
+# 返回 {起始代, 结束代}，没有可回收的代时返回 nil
+# KEYS[1]=已回收到的代号 KEYS[2]=未入账快照 KEYS[3]=各链起点 ARGV[1]=封存代键名前缀 ARGV[2..]=链
+COLLECT_GENERATIONS_SCRIPT = """
+local needed = nil
+for i = 2, #ARGV do
+    local start = tonumber(redis.call('HGET', KEYS[3], ARGV[i]) or '1')
+    if needed == nil or start < needed then
+        needed = start
+    end
+end
+local oldest = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+if oldest[2] and tonumber(oldest[2]) < needed then
+    needed = tonumber(oldest[2])
+end
+local low = tonumber(redis.call('GET', KEYS[1]) or '0') + 1
+if low >= needed then
+    return nil
+end
+for generation = low, needed - 1 do
+    redis.call('UNLINK', ARGV[1] .. generation)
+end
+redis.call('SET', KEYS[1], needed - 1)
+return {low, needed - 1}
+"""
+
+
+def seal_round(client, chain: str, block_height,
+               flush: Optional[Callable[[], None]] = None) -> Tuple[str, bool]:
+    """原子切换链的轮次，返回 (快照代范围的键名, 是否本次新切换)；该区块的快照已存在时直接复用
+
+    flush 只在需要切换时于切换前调用 (刷新写后聚合器)，复用已有快照时不调用
+    """
+    range_key = get_range_key(chain, block_height)
+    if flush is not None:
+        if client.exists(range_key):
+            return range_key, False
+        flush()
+    result = client.register_script(SEAL_ROUND_SCRIPT)(
+        keys=[TOTAL_SHARES_KEY, GENERATION_KEY, ROUND_START_KEY, range_key, ROUND_PENDING_KEY],
+        args=[chain, GENERATION_KEY_PREFIX]
+    )
+    return range_key, result == 1
+
+
+def restore_round(client, chain: str, block_height) -> int:
+    """撤销尚未使用的区块快照，返回 1 (已撤销)、0 (快照不存在) 或 -1 (本链已再次切换，快照保留)"""
+    return int(client.register_script(RESTORE_ROUND_SCRIPT)(
+        keys=[ROUND_START_KEY, get_range_key(chain, block_height), ROUND_PENDING_KEY],
+        args=[chain]
+    ))
+
+
+def release_range(client, range_key: str) -> Optional[Tuple[int, int]]:
+    """入账提交成功后删除快照，返回随之回收的代范围 (见 collect_generations)"""
+    pipe = client.pipeline()
+    pipe.zrem(ROUND_PENDING_KEY, range_key)
+    pipe.delete(range_key)
+    pipe.execute()
+    return collect_generations(client)
+
+
+def load_round_layout(client) -> Tuple[int, Dict[str, int]]:
+    """返回 (最后封存的代号, 各链当前轮次的第一代)"""
+    pipe = client.pipeline(transaction=False)
+    pipe.get(GENERATION_KEY)
+    pipe.hgetall(ROUND_START_KEY)
+    current, starts = pipe.execute()
+    return int(current or 0), {chain: int(starts.get(chain, 1)) for chain in CHAINS}
+
+
+def read_generations(client, read) -> Tuple[int, Dict[str, int], list]:
+    """在一个事务中对当前代和所有链仍在引用的封存代执行 read(pipe, key)
+
+    返回 (代号, 各链起点, 结果)，结果[0]是当前代，结果[i]是第 min(起点)+i-1 代。
+    读取期间有链切换轮次时重新读取，保证各代的结果属于同一时刻
+    """
+    while True:
+        current, starts = load_round_layout(client)
+        pipe = client.pipeline(transaction=True)
+        read(pipe, TOTAL_SHARES_KEY)
+        for generation in range(min(starts.values()), current + 1):
+            read(pipe, get_generation_key(generation))
+        pipe.get(GENERATION_KEY)
+        results = pipe.execute()
+        if int(results[-1] or 0) == current:
+            return current, starts, results[:-1]
+
+
+def get_users_round_shares(client, user_ids: List, chains: Iterable[str] = CHAINS) -> Dict[str, List[int]]:
+    """返回 {链: 与 user_ids 一一对应的当前轮次提交数}"""
+    chains = list(chains)
+    if not user_ids:
+        return {chain: [] for chain in chains}
+    current, starts, results = read_generations(client, lambda pipe, key: pipe.hmget(key, user_ids))
+    low = min(starts.values())
+    live = [int(value or 0) for value in results[0]]
+    shares = {}
+    for chain in chains:
+        counts = list(live)
+        for generation in range(starts[chain], current + 1):
+            for i, value in enumerate(results[generation - low + 1]):
+                if value:
+                    counts[i] += int(value)
+        shares[chain] = [max(count, 0) for count in counts]
+    return shares
+
+
+def sum_generations(hashes: Iterable[Dict]) -> Dict[int, int]:
+    """把多代的 {用户ID: 提交数} 按用户求和，只保留提交数为正的用户"""
+    totals = {}
+    for fields in hashes:
+        for user_id, count in fields.items():
+            user_id = int(user_id)
+            totals[user_id] = totals.get(user_id, 0) + int(count)
+    return {user_id: count for user_id, count in totals.items() if count > 0}
+
+
+def get_chain_round_shares(client, chain: str) -> Dict[int, int]:
+    """读取链当前轮次所有用户的提交数，以用户ID为键"""
+    current, starts, results = read_generations(client, lambda pipe, key: pipe.hgetall(key))
+    low = min(starts.values())
+    return sum_generations([results[0]] + results[starts[chain] - low + 1:])
+
+
+def get_range_shares(client, start: int, end: int) -> Dict[int, int]:
+    """读取区块快照 (封存代 start..end) 中所有用户的提交数，以用户ID为键"""
+    pipe = client.pipeline(transaction=False)
+    for generation in range(start, end + 1):
+        pipe.hgetall(get_generation_key(generation))
+    return sum_generations(pipe.execute())
+
+
+def get_active_user_ids(client) -> List[str]:
+    """当前轮次 (任意链) 有提交记录的用户ID"""
+    _, _, results = read_generations(client, lambda pipe, key: pipe.hkeys(key))
+    user_ids = set()
+    for keys in results:
+        user_ids.update(keys)
+    return sorted(user_ids, key=int)
+
+
+def collect_generations(client) -> Optional[Tuple[int, int]]:
+    """回收不再被引用的封存代，返回回收的代范围，没有可回收的代时返回 None (见 COLLECT_GENERATIONS_SCRIPT)"""
+    result = client.register_script(COLLECT_GENERATIONS_SCRIPT)(
+        keys=[COLLECTED_GENERATION_KEY, ROUND_PENDING_KEY, ROUND_START_KEY],
+        args=[GENERATION_KEY_PREFIX, *CHAINS]
+    )
+    if not result:
+        return None
+    return int(result[0]), int(result[1])
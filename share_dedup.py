@@ -0,0 +1,289 @@
+"""提交去重: 多个进程共享的、固定内存的Redis时间分桶Bloom过滤器
+
+stratum 服务端在请求失败后可能重发已经到达服务端的提交。提交可以携带 share_id
+(job_id + nonce + extra_nonce) 或 batch_id，服务端据此丢弃重复的提交。
+
+api_server.py、ingest_server.py 以及它们的多个实例可能收到同一次提交的重发，去重记录保存在Redis中:
+window_seconds 被分成 DEDUP_BUCKETS 个时间桶，每个桶是一个 dedup:<桶号> 位图 (Bloom过滤器)，
+大小由 capacity (一个窗口内的标识数) 和 error_rate 决定，与提交速率无关，过期后整桶删除。
+查询覆盖当前桶和之前的 DEDUP_BUCKETS 个桶，最多占用 (DEDUP_BUCKETS + 1) 个位图的内存。
+误判会把极少数新提交当作重复丢弃，概率约为 error_rate。
+
+去重和计数在同一个Lua脚本中完成 (claim)，一批提交只需一次Redis往返。
+Bloom过滤器不能删除，discard 把标识的摘要放入 dedup:released 集合，下次出现时不再当作重复。
+"""
+import hashlib
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis_keys import TOTAL_SHARES_KEY, DEDUP_RELEASED_KEY, CHAINS, get_dedup_bucket_key
+
+# 一个去重窗口分成的时间桶数
+DEDUP_BUCKETS = 4
+
+# 对每个条目: 在所有时间桶中查询k个位，全部为1且不在已撤销集合中时为重复，否则写入当前桶；
+# 非重复且带计数field的条目执行HINCRBY。返回与条目一一对应的 -1 (重复)、HINCRBY结果或0 (不计数)
+# KEYS[1]=总计数 KEYS[2]=已撤销摘要集合 KEYS[3..]=时间桶，当前桶在前
+# ARGV[1]=k ARGV[2]=当前桶的过期秒数，之后每个条目 k+3 个参数:
+# 摘要 (空串表示不去重)、k个位偏移、计数field (空串表示不计数)、增量
+CLAIM_SCRIPT = """
+local k = tonumber(ARGV[1])
+local results = {}
+for i = 3, #ARGV, k + 3 do
+    local new = true
+    if ARGV[i] ~= '' then
+        for b = 3, #KEYS do
+            local found = true
+            for j = 1, k do
+                if redis.call('GETBIT', KEYS[b], ARGV[i + j]) == 0 then
+                    found = false
+                    break
+                end
+            end
+            if found then
+                new = redis.call('SREM', KEYS[2], ARGV[i]) == 1
+                break
+            end
+        end
+        if new then
+            for j = 1, k do
+                redis.call('SETBIT', KEYS[3], ARGV[i + j], 1)
+            end
+        end
+    end
+    if not new then
+        results[#results + 1] = -1
+    elseif ARGV[i + k + 1] ~= '' then
+        results[#results + 1] = redis.call('HINCRBY', KEYS[1], ARGV[i + k + 1], ARGV[i + k + 2])
+    else
+        results[#results + 1] = 0
+    end
+end
+redis.call('EXPIRE', KEYS[3], ARGV[2])
+return results
+"""
+
+
+# 组成提交标识的字段，出现时必须是字符串或非负整数 (bool 不算整数)
+SHARE_ID_FIELDS = ('share_id', 'job_id', 'nonce', 'extra_nonce')
+
+
+def is_id_value(value: Any) -> bool:
+    """标识字段的值是否为字符串或非负整数；0 和空字符串也是有效的值"""
+    if isinstance(value, str):
+        return True
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def get_id_field_error(params: Dict[str, Any]) -> Optional[str]:
+    """检查提交标识字段的类型，有效时返回 None，否则返回错误信息"""
+    for field in SHARE_ID_FIELDS:
+        value = params.get(field)
+        if value is not None and not is_id_value(value):
+            return f'{field} must be a string or non-negative integer'
+    return None
+
+
+def get_share_id(params: Dict[str, Any]) -> Optional[str]:
+    """从submit参数中取得提交标识 share:<用户名>:<share_id 或 job_id:nonce:extra_nonce>，没有时返回 None
+
+    不同矿工的 job_id / nonce 可能相同，标识中带上用户名，避免把其他矿工的提交当作重复丢弃。
+    标识字段类型错误时抛出 ValueError
+    """
+    username = params.get('username')
+    if not username:
+        return None
+    error = get_id_field_error(params)
+    if error is not None:
+        raise ValueError(error)
+    share_id = params.get('share_id')
+    if share_id is not None:
+        return f"share:{username}:{share_id}"
+    parts = [params.get('job_id'), params.get('nonce'), params.get('extra_nonce')]
+    if all(part is not None for part in parts):
+        return f"share:{username}:" + ':'.join(str(part) for part in parts)
+    return None
+
+
+def get_batch_key(params: Any) -> Optional[str]:
+    """submit_batch 整批重发时的去重键 batch:<batch_id>，没有 batch_id 时返回 None，类型错误时抛出 ValueError"""
+    batch_id = params.get('batch_id') if isinstance(params, dict) else None
+    if batch_id is None:
+        return None
+    if not is_id_value(batch_id):
+        raise ValueError('batch_id must be a string or non-negative integer')
+    return f"batch:{batch_id}"
+
+
+# 条目格式: (去重标识或 None, 计数field (用户ID) 或 None, 增量)
+ClaimEntry = Tuple[Optional[str], Optional[int], int]
+
+
+class DedupFilter:
+    """同步和asyncio版本共用的过滤器参数和脚本参数构造"""
+
+    def __init__(self, window_seconds: float = 600, capacity: int = 1000000, error_rate: float = 0.001):
+        self.window = max(float(window_seconds), 1.0)
+        self.bucket_seconds = self.window / DEDUP_BUCKETS
+        per_bucket = max(int(capacity) // DEDUP_BUCKETS, 1)
+        self.bits = max(math.ceil(-per_bucket * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.bits / per_bucket * math.log(2)), 1)
+        # 当前桶在之后的 DEDUP_BUCKETS 个桶内仍会被查询
+        self.ttl = math.ceil(self.bucket_seconds * (DEDUP_BUCKETS + 2))
+
+    @staticmethod
+    def digest(key: str) -> bytes:
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+    def bucket_keys(self) -> List[str]:
+        current = int(time.time() // self.bucket_seconds)
+        return [get_dedup_bucket_key(bucket) for bucket in range(current, current - DEDUP_BUCKETS - 1, -1)]
+
+    def claim_args(self, entries: List[ClaimEntry]) -> Tuple[List[str], List[Any]]:
+        keys = [TOTAL_SHARES_KEY, DEDUP_RELEASED_KEY] + self.bucket_keys()
+        args = [self.hashes, self.ttl]
+        for key, field, increment in entries:
+            if key is None:
+                args += [''] + [0] * self.hashes
+            else:
+                digest = self.digest(key)
+                h1 = int.from_bytes(digest[:8], 'little')
+                h2 = int.from_bytes(digest[8:], 'little') | 1
+                args += [digest.hex()] + [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+            args += ['', 0] if field is None else [field, increment]
+        return keys, args
+
+    @staticmethod
+    def claim_results(results: List[int]) -> List[Optional[int]]:
+        return [None if result < 0 else result for result in results]
+
+
+class RedisDedupSet(DedupFilter):
+    """同步Redis客户端 (api_server.py) 使用的去重过滤器"""
+
+    def __init__(self, client, window_seconds: float = 600, capacity: int = 1000000, error_rate: float = 0.001):
+        super().__init__(window_seconds, capacity, error_rate)
+        self.client = client
+        self.script = client.register_script(CLAIM_SCRIPT)
+
+    def claim(self, entries: List[ClaimEntry]) -> List[Optional[int]]:
+        """在一次Lua调用中记录多个标识，并为首次出现且带计数field的条目执行HINCRBY
+
+        返回与条目一一对应的结果: 重复为 None，计数后的总数，或不计数时为0；同一批中重复的标识只有第一个计数
+        """
+        if not entries:
+            return []
+        keys, args = self.claim_args(entries)
+        return self.claim_results(self.script(keys=keys, args=args))
+
+    def add(self, key: str) -> bool:
+        """记录标识，首次出现返回 True，重复返回 False"""
+        return self.claim([(key, None, 0)])[0] is not None
+
+    def add_many(self, keys: List[str]) -> List[bool]:
+        """在一次Lua调用中记录多个标识，同一批中重复的标识只有第一个返回 True"""
+        return [result is not None for result in self.claim([(key, None, 0) for key in keys])]
+
+    def discard(self, *keys: str):
+        """提交写入失败时撤销记录，使客户端的重试不会被当作重复丢弃"""
+        if keys:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.sadd(DEDUP_RELEASED_KEY, *[self.digest(key).hex() for key in keys])
+            pipe.expire(DEDUP_RELEASED_KEY, self.ttl)
+            pipe.execute()
+
+
+class AsyncRedisDedupSet(DedupFilter):
+    """异步Redis客户端 (ingest_server.py) 使用的去重过滤器，接口与 RedisDedupSet 相同"""
+
+    def __init__(self, client, window_seconds: float = 600, capacity: int = 1000000, error_rate: float = 0.001):
+        super().__init__(window_seconds, capacity, error_rate)
+        self.client = client
+        self.script = client.register_script(CLAIM_SCRIPT)
+
+    async def claim(self, entries: List[ClaimEntry]) -> List[Optional[int]]:
+        if not entries:
+            return []
+        keys, args = self.claim_args(entries)
+        return self.claim_results(await self.script(keys=keys, args=args))
+
+    async def add(self, key: str) -> bool:
+        return (await self.claim([(key, None, 0)]))[0] is not None
+
+    async def add_many(self, keys: List[str]) -> List[bool]:
+        return [result is not None for result in await self.claim([(key, None, 0) for key in keys])]
+
+    async def discard(self, *keys: str):
+        if keys:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.sadd(DEDUP_RELEASED_KEY, *[self.digest(key).hex() for key in keys])
+            pipe.expire(DEDUP_RELEASED_KEY, self.ttl)
+            await pipe.execute()
+
+
+def invalid_params(message: str) -> Dict[str, Any]:
+    return {
+        'error': {
+            'code': -32602,
+            'message': f'Invalid params: {message}'
+        }
+    }
+
+
+def submit_counts_result(count: int) -> Dict[str, int]:
+    """提交响应中 submit_counts 的格式: CHAINS 中每条链一个键，与旧版响应相同，例如 {'xmr': n, 'tari': n}
+
+    所有链共用一个计数，各链的值相同: 未启用写后聚合时为该用户当前代 (上次任意一条链爆块以来) 的提交数，
+    启用时为本实例尚未写入Redis的增量。只表示提交已被计入，链的轮次提交数由 api_server.get_submit_counts 查询。
+    """
+    return {chain: count for chain in CHAINS}
+
+
+def get_entry_error(entry: Any) -> Optional[Dict[str, Any]]:
+    """逐项检查submit_batch条目的字段类型，有效时返回 None，否则返回该条目的错误结果"""
+    if not isinstance(entry, dict):
+        return invalid_params('entry must be an object')
+    username = entry.get('username')
+    if not isinstance(username, str) or not username:
+        return invalid_params('username is required')
+    count = entry.get('count', 1)
+    if not isinstance(count, int) or isinstance(count, bool) or count <= 0:
+        return invalid_params('count must be a positive integer')
+    error = get_id_field_error(entry)
+    return invalid_params(error) if error is not None else None
+
+
+def check_batch_entries(shares: List[Any]) -> Tuple[List[Any], List[Tuple[int, Dict[str, Any], Optional[str]]]]:
+    """校验submit_batch条目，返回 (预填错误的结果列表, [(下标, 条目, share_id 或 None)])"""
+    results = [None] * len(shares)
+    candidates = []
+    for i, entry in enumerate(shares):
+        results[i] = get_entry_error(entry)
+        if results[i] is None:
+            candidates.append((i, {'username': entry['username'], 'count': entry.get('count', 1)},
+                               get_share_id(entry)))
+    return results, candidates
+
+
+def fill_batch_results(results: List[Any], candidates: List[Tuple[int, Dict[str, Any], Optional[str]]],
+                       submit_counts: List[Optional[Dict[str, int]]]) -> Tuple[int, int]:
+    """按去重计数的结果 (与候选条目一一对应，重复为 None) 填写条目结果，返回 (接受条数, 重复条数)"""
+    accepted = 0
+    duplicates = 0
+    for (i, entry, _), counts in zip(candidates, submit_counts):
+        if counts is None:
+            results[i] = {
+                'status': 'OK',
+                'username': entry['username'],
+                'duplicate': True
+            }
+            duplicates += 1
+        else:
+            results[i] = {
+                'status': 'OK',
+                'username': entry['username'],
+                'submit_counts': counts
+            }
+            accepted += 1
+    return accepted, duplicates
@@ -81,6 +81,11 @@ void p2pool_usage()
 		"--rpc-ssl-fingerprint base64-encoded fingerprint of the Monero node's certificate (optional, use it for certificate pinning)\n"
 #endif
 		"--no-stratum-http     Disable HTTP on Stratum ports\n"
+		"--share-report-url    JSON-RPC URL of the local share accounting API, default is http://127.0.0.1:5000/json_rpc (empty string disables share reporting)\n"
+		"--share-report-interval N How often (in milliseconds) coalesced share counts are sent to the share accounting API, default is 200\n"
+#ifndef _WIN32
+		"--share-report-socket path Send share counts to this Unix domain socket of the share accounting API instead of --share-report-url\n"
+#endif
 		"--help                Show this help message\n\n"
 		"Example command line:\n\n"
 		"%s --host 127.0.0.1 --rpc-port 18081 --zmq-port 18083 --wallet YOUR_WALLET_ADDRESS --stratum 0.0.0.0:%d --p2p 0.0.0.0:%d\n\n",
@@ -238,6 +238,23 @@ Params::Params(int argc, char* const argv[])
 			ok = true;
 		}
 
+		if ((strcmp(argv[i], "--share-report-url") == 0) && (i + 1 < argc)) {
+			m_shareReportUrl = argv[++i];
+			ok = true;
+		}
+
+		if ((strcmp(argv[i], "--share-report-interval") == 0) && (i + 1 < argc)) {
+			m_shareReportInterval = std::min(std::max(strtoul(argv[++i], nullptr, 10), 1UL), 60000UL);
+			ok = true;
+		}
+
+#ifndef _WIN32
+		if ((strcmp(argv[i], "--share-report-socket") == 0) && (i + 1 < argc)) {
+			m_shareReportSocket = argv[++i];
+			ok = true;
+		}
+#endif
+
 		if (!ok) {
 			// Wait to avoid log messages overlapping with printf() calls and making a mess on screen
 			std::this_thread::sleep_for(std::chrono::milliseconds(10));
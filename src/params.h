@@ -101,6 +101,11 @@ struct Params
 	std::string m_tlsCertKey;
 #endif
 	bool m_enableStratumHTTP = true;
+	std::string m_shareReportUrl = "http://127.0.0.1:5000/json_rpc";
+	uint32_t m_shareReportInterval = 200;
+#ifndef _WIN32
+	std::string m_shareReportSocket;
+#endif
 };
 
 } // namespace p2pool
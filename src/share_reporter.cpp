@@ -0,0 +1,386 @@
+/*
+ * This file is part of the Monero P2Pool <https://github.com/SChernykh/p2pool>
+ * Copyright (c) 2021-2024 SChernykh <https://github.com/SChernykh>
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, version 3.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+ * General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "common.h"
+#include "share_reporter.h"
+#include "uv_util.h"
+#include <curl/curl.h>
+
+#ifndef _WIN32
+#include <errno.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
+#endif
+
+LOG_CATEGORY(ShareReporter)
+
+namespace p2pool {
+
+namespace {
+
+size_t write_callback(char* /*ptr*/, size_t size, size_t nmemb, void* /*userdata*/)
+{
+	return size * nmemb;
+}
+
+void append_json_string(std::string& out, const std::string& s)
+{
+	out += '"';
+	for (const char c : s) {
+		switch (c) {
+		case '"':  out += "\\\""; break;
+		case '\\': out += "\\\\"; break;
+		default:
+			// Control characters are not valid in usernames, skip them
+			if (static_cast<uint8_t>(c) >= 0x20) {
+				out += c;
+			}
+			break;
+		}
+	}
+	out += '"';
+}
+
+CURLcode post(CURL* curl, const std::string& request)
+{
+	curl_easy_setopt(curl, CURLOPT_POSTFIELDS, request.c_str());
+	curl_easy_setopt(curl, CURLOPT_POSTFIELDSIZE, static_cast<long>(request.length()));
+
+	return curl_easy_perform(curl);
+}
+
+} // namespace
+
+ShareReporter::ShareReporter(const std::string& url, const std::string& socket_path, uint32_t flush_interval_ms)
+	: m_head(nullptr)
+	, m_url(url)
+	, m_socketPath(socket_path)
+	, m_flushIntervalMs(std::max(flush_interval_ms, 1U))
+	, m_curl(nullptr)
+	, m_headers(nullptr)
+	, m_batchPrefix()
+	, m_batchSeq(0)
+	, m_retryCount(0)
+	, m_socket(-1)
+	, m_worker{}
+	, m_workerStop(0)
+{
+	// Batch ids must not repeat across restarts, the server uses them to drop resent batches
+	{
+		std::mt19937_64 rng(RandomDeviceSeed::instance);
+
+		char buf[32];
+		log::Stream s(buf);
+		s << log::Hex(rng()) << '-';
+		m_batchPrefix.assign(buf, s.m_pos);
+	}
+
+	uv_mutex_init_checked(&m_workerLock);
+	uv_cond_init_checked(&m_workerCond);
+
+	const int err = uv_thread_create(&m_worker, run_wrapper, this);
+	if (err) {
+		LOGERR(1, "failed to start worker thread, error " << uv_err_name(err));
+		throw std::exception();
+	}
+
+	LOGINFO(1, "reporting shares to " << (m_socketPath.empty() ? m_url : m_socketPath) << " every " << m_flushIntervalMs << " ms");
+}
+
+ShareReporter::~ShareReporter()
+{
+	LOGINFO(1, "stopping");
+
+	m_workerStop.exchange(1);
+	{
+		MutexLock lock(m_workerLock);
+		uv_cond_signal(&m_workerCond);
+	}
+	uv_thread_join(&m_worker);
+
+	// Worker thread flushed everything it could before exiting, free what was pushed after that
+	Entry* e = m_head.exchange(nullptr);
+	while (e) {
+		Entry* next = e->m_next;
+		delete e;
+		e = next;
+	}
+
+	uv_mutex_destroy(&m_workerLock);
+	uv_cond_destroy(&m_workerCond);
+
+	LOGINFO(1, "stopped");
+}
+
+void ShareReporter::report(const char* user, uint64_t hashes)
+{
+	if (!user || !*user) {
+		return;
+	}
+
+	Entry* e = new Entry();
+	e->m_hashes = hashes;
+
+	const size_t n = strnlen(user, USER_SIZE - 1);
+	memcpy(e->m_user, user, n);
+	e->m_user[n] = '\0';
+
+	// Lock-free push, the worker thread takes the whole list at once
+	Entry* head = m_head.load(std::memory_order_relaxed);
+	do {
+		e->m_next = head;
+	} while (!m_head.compare_exchange_weak(head, e, std::memory_order_release, std::memory_order_relaxed));
+}
+
+void ShareReporter::run_wrapper(void* arg)
+{
+	reinterpret_cast<ShareReporter*>(arg)->run();
+	LOGINFO(1, "worker thread stopped");
+}
+
+void ShareReporter::run()
+{
+	LOGINFO(1, "worker thread ready");
+
+	set_thread_name("Share reporter");
+
+	// HTTP transport is only set up when no Unix domain socket is configured
+	if (m_socketPath.empty()) {
+		m_curl = curl_easy_init();
+		if (!m_curl) {
+			LOGERR(1, "curl_easy_init() failed, shares will not be reported");
+			return;
+		}
+
+		m_headers = curl_slist_append(nullptr, "Content-Type: application/json");
+
+		// The same easy handle is reused for every request, so libcurl keeps the connection alive between flushes
+		curl_easy_setopt(m_curl, CURLOPT_URL, m_url.c_str());
+		curl_easy_setopt(m_curl, CURLOPT_HTTPHEADER, m_headers);
+		curl_easy_setopt(m_curl, CURLOPT_WRITEFUNCTION, write_callback);
+		curl_easy_setopt(m_curl, CURLOPT_POST, 1L);
+		curl_easy_setopt(m_curl, CURLOPT_TCP_KEEPALIVE, 1L);
+		curl_easy_setopt(m_curl, CURLOPT_TIMEOUT, 3L);
+		curl_easy_setopt(m_curl, CURLOPT_CONNECTTIMEOUT, 2L);
+		curl_easy_setopt(m_curl, CURLOPT_NOSIGNAL, 1L);
+	}
+
+	const int64_t timeout = static_cast<int64_t>(m_flushIntervalMs) * 1'000'000;
+
+	for (;;) {
+		{
+			MutexLock lock(m_workerLock);
+
+			if ((m_workerStop.load() != 0) || (uv_cond_timedwait(&m_workerCond, &m_workerLock, timeout) != UV_ETIMEDOUT)) {
+				break;
+			}
+		}
+
+		flush();
+	}
+
+	// Final flush on shutdown
+	flush();
+
+	if (m_curl) {
+		curl_slist_free_all(m_headers);
+		m_headers = nullptr;
+
+		curl_easy_cleanup(m_curl);
+		m_curl = nullptr;
+	}
+
+#ifndef _WIN32
+	if (m_socket >= 0) {
+		close(m_socket);
+		m_socket = -1;
+	}
+#endif
+}
+
+void ShareReporter::flush()
+{
+	Entry* e = m_head.exchange(nullptr, std::memory_order_acquire);
+
+	while (e) {
+		Pending& p = m_pending[e->m_user];
+		++p.m_count;
+		p.m_hashes += e->m_hashes;
+
+		Entry* next = e->m_next;
+		delete e;
+		e = next;
+	}
+
+	// A batch that may have reached the server is resent unchanged first, so the server can drop it by its batch_id
+	if (!m_retryRequest.empty()) {
+		const CURLcode res = post(m_curl, m_retryRequest);
+		if (res == CURLE_OK) {
+			m_retryRequest.clear();
+		}
+		else if (++m_retryCount >= MAX_RETRIES) {
+			LOGWARN(4, "giving up on a batch after " << m_retryCount << " attempts: " << curl_easy_strerror(res));
+			m_retryRequest.clear();
+		}
+		else {
+			return;
+		}
+	}
+
+	if (m_pending.empty()) {
+		return;
+	}
+
+	if (m_socketPath.empty() ? send_pending() : send_pending_socket()) {
+		m_pending.clear();
+	}
+}
+
+bool ShareReporter::send_pending()
+{
+	char buf[64];
+
+	m_request.clear();
+	m_request += "{\"jsonrpc\":\"2.0\",\"id\":\"0\",\"method\":\"submit_batch\",\"params\":{\"batch_id\":\"";
+	m_request += m_batchPrefix;
+	{
+		log::Stream s(buf);
+		s << ++m_batchSeq;
+		m_request.append(buf, s.m_pos);
+	}
+	m_request += "\",\"shares\":[";
+
+	bool first = true;
+
+	for (const auto& it : m_pending) {
+		if (!first) {
+			m_request += ',';
+		}
+		first = false;
+
+		m_request += "{\"username\":";
+		append_json_string(m_request, it.first);
+
+		log::Stream s(buf);
+		s << ",\"count\":" << it.second.m_count << ",\"diff\":" << it.second.m_hashes << '}';
+		m_request.append(buf, s.m_pos);
+	}
+
+	m_request += "]}}";
+
+	const CURLcode res = post(m_curl, m_request);
+	if (res == CURLE_OK) {
+		return true;
+	}
+
+	// The request never reached the server, keep the shares and send them in the next batch
+	if (res == CURLE_COULDNT_CONNECT) {
+		LOGWARN(4, "couldn't connect to " << m_url << ", will retry " << m_pending.size() << " users on the next flush");
+		return false;
+	}
+
+	// The server may have counted this batch already, resend exactly the same request (same batch_id) on the next flush
+	LOGWARN(4, "failed to report shares for " << m_pending.size() << " users: " << curl_easy_strerror(res) << ", will resend the batch");
+	m_retryRequest.swap(m_request);
+	m_retryCount = 0;
+	return true;
+}
+
+bool ShareReporter::send_pending_socket()
+{
+#ifdef _WIN32
+	LOGERR(1, "Unix domain sockets are not supported on this platform, dropping shares for " << m_pending.size() << " users");
+	return true;
+#else
+	if (m_socket < 0) {
+		sockaddr_un addr{};
+		if (m_socketPath.length() >= sizeof(addr.sun_path)) {
+			LOGERR(1, "socket path " << m_socketPath << " is too long");
+			return true;
+		}
+
+		const int fd = socket(AF_UNIX, SOCK_STREAM, 0);
+		if (fd < 0) {
+			LOGWARN(4, "failed to create socket, error " << errno);
+			return false;
+		}
+
+		addr.sun_family = AF_UNIX;
+		memcpy(addr.sun_path, m_socketPath.c_str(), m_socketPath.length());
+
+		if (connect(fd, reinterpret_cast<sockaddr*>(&addr), sizeof(addr)) != 0) {
+			LOGWARN(4, "couldn't connect to " << m_socketPath << ", will retry " << m_pending.size() << " users on the next flush");
+			close(fd);
+			return false;
+		}
+
+		m_socket = fd;
+	}
+
+	m_request.clear();
+
+	char buf[64];
+
+	for (const auto& it : m_pending) {
+		// Tabs and newlines are field and record separators in this protocol
+		bool valid = true;
+		for (const char c : it.first) {
+			if ((c == '\t') || (c == '\n') || (c == '\r')) {
+				valid = false;
+				break;
+			}
+		}
+		if (!valid) {
+			continue;
+		}
+
+		m_request += it.first;
+
+		log::Stream s(buf);
+		s << '\t' << it.second.m_count << '\t' << it.second.m_hashes << '\n';
+		m_request.append(buf, s.m_pos);
+	}
+
+	const char* p = m_request.data();
+	size_t left = m_request.length();
+
+	while (left > 0) {
+		const ssize_t n = send(m_socket, p, left, 0);
+		if (n < 0) {
+			if (errno == EINTR) {
+				continue;
+			}
+
+			const bool nothing_sent = (left == m_request.length());
+
+			LOGWARN(4, "failed to write to " << m_socketPath << ", error " << errno);
+			close(m_socket);
+			m_socket = -1;
+
+			// Same rule as for HTTP: only retry if the server couldn't have seen any of these shares
+			return !nothing_sent;
+		}
+		p += n;
+		left -= static_cast<size_t>(n);
+	}
+
+	return true;
+#endif
+}
+
+} // namespace p2pool
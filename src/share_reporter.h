@@ -0,0 +1,86 @@
+/*
+ * This file is part of the Monero P2Pool <https://github.com/SChernykh/p2pool>
+ * Copyright (c) 2021-2024 SChernykh <https://github.com/SChernykh>
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, version 3.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+ * General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program. If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#pragma once
+
+struct curl_slist;
+
+namespace p2pool {
+
+// Reports accepted stratum shares to the local accounting API (api_server.py)
+// report() is lock-free and never blocks the stratum loop: shares are pushed onto an intrusive MPSC stack,
+// and a background worker drains it every m_flushIntervalMs, coalesces counts per user
+// and sends them as a single "submit_batch" JSON-RPC request over one reused keep-alive connection.
+// Every batch carries a unique batch_id; a batch that failed after it may have reached the server is resent unchanged,
+// and the server drops the copy it has already counted.
+// If a Unix domain socket path is set, the same batch is written there as "user\tcount\tdiff\n" lines instead
+class ShareReporter : public nocopy_nomove
+{
+public:
+	ShareReporter(const std::string& url, const std::string& socket_path, uint32_t flush_interval_ms);
+	~ShareReporter();
+
+	void report(const char* user, uint64_t hashes);
+
+private:
+	enum { USER_SIZE = 256 };
+	enum { MAX_RETRIES = 5 };
+
+	struct Entry
+	{
+		Entry* m_next;
+		uint64_t m_hashes;
+		char m_user[USER_SIZE];
+	};
+
+	struct Pending
+	{
+		uint64_t m_count = 0;
+		uint64_t m_hashes = 0;
+	};
+
+	std::atomic<Entry*> m_head;
+
+	std::string m_url;
+	std::string m_socketPath;
+	uint32_t m_flushIntervalMs;
+
+	// Only accessed by the worker thread
+	unordered_map<std::string, Pending> m_pending;
+	std::string m_request;
+	void* m_curl; // CURL* is a typedef for void*
+	curl_slist* m_headers;
+	std::string m_batchPrefix;
+	uint64_t m_batchSeq;
+	std::string m_retryRequest;
+	uint32_t m_retryCount;
+	int m_socket;
+
+	uv_thread_t m_worker;
+
+	uv_mutex_t m_workerLock;
+	uv_cond_t m_workerCond;
+	std::atomic<uint32_t> m_workerStop;
+
+	static void run_wrapper(void* arg);
+	void run();
+	void flush();
+	bool send_pending();
+	bool send_pending_socket();
+};
+
+} // namespace p2pool
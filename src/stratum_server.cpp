@@ -23,9 +23,9 @@
 #include "params.h"
 #include "p2pool_api.h"
 #include "p2p_server.h"
+#include "share_reporter.h"
 
 #include "rapidjson_wrapper.h"
-#include <curl/curl.h>
 
 LOG_CATEGORY(StratumServer)
 
@@ -45,15 +45,6 @@ static constexpr int32_t BAN_THRESHOLD_POINTS = -15;
 
 namespace p2pool {
 
-namespace {
-    // 在函数外部定义回调函数
-    size_t write_callback(char* ptr, size_t size, size_t nmemb, void* userdata) {
-        (void)ptr;      // 避免未使用参数的警告
-        (void)userdata; // 避免未使用参数的警告
-        return size * nmemb;
-    }
-}
-
 StratumServer::StratumServer(p2pool* pool)
 	: TCPServer(DEFAULT_BACKLOG, StratumClient::allocate, std::string())
 	, m_pool(pool)
@@ -70,6 +61,7 @@ StratumServer::StratumServer(p2pool* pool)
 	, m_totalFailedSidechainShares(0)
 	, m_totalStratumShares(0)
 	, m_apiLastUpdateTime(0)
+	, m_shareReporter(nullptr)
 {
 	// Need a bigger buffer for the TLS handshake
 	m_callbackBuf.resize(STRATUM_CALLBACK_BUF_SIZE);
@@ -94,6 +86,17 @@ StratumServer::StratumServer(p2pool* pool)
 	m_showWorkersAsync.data = this;
 
 	const Params& params = pool->params();
+
+#ifndef _WIN32
+	const std::string& share_report_socket = params.m_shareReportSocket;
+#else
+	const std::string share_report_socket;
+#endif
+
+	if (!params.m_shareReportUrl.empty() || !share_report_socket.empty()) {
+		m_shareReporter = new ShareReporter(params.m_shareReportUrl, share_report_socket, params.m_shareReportInterval);
+	}
+
 	start_listening(params.m_stratumAddresses, params.m_upnp && params.m_upnpStratum);
 }
 
@@ -101,6 +104,8 @@ StratumServer::~StratumServer()
 {
 	shutdown_tcp();
 
+	delete m_shareReporter;
+
 	{
 		MutexLock lock(m_blobsQueueLock);
 
@@ -418,40 +423,6 @@ bool StratumServer::on_submit(StratumClient* client, uint32_t id, const char* jo
 					return s.m_pos;
 				});
 		}
-		// 发送用户提交信息到本地 API
-		CURL* curl = curl_easy_init();
-		if (curl) {
-			const char* username = client->m_customUser;
-			if (username[0] != '\0') {
-			// 构建JSON-RPC请求
-			char json_request[512];
-			snprintf(json_request, sizeof(json_request), 
-				"{\"jsonrpc\":\"2.0\",\"id\":\"0\",\"method\":\"submit\",\"params\":{\"username\":\"%s\"}}", 
-					username);
-				
-				struct curl_slist* headers = curl_slist_append(nullptr, "Content-Type: application/json");
-				curl_easy_setopt(curl, CURLOPT_URL, "http://127.0.0.1:5000/json_rpc");
-				curl_easy_setopt(curl, CURLOPT_POSTFIELDS, json_request);
-				curl_easy_setopt(curl, CURLOPT_HTTPHEADER, headers);
-				curl_easy_setopt(curl, CURLOPT_WRITEFUNCTION, write_callback);
-				curl_easy_setopt(curl, CURLOPT_POST, 1L);
-				curl_easy_setopt(curl, CURLOPT_TIMEOUT, 3L);
-				curl_easy_setopt(curl, CURLOPT_CONNECTTIMEOUT, 2L);
-				
-				CURLcode res = curl_easy_perform(curl);
-				if (res != CURLE_OK) {
-					LOGWARN(4, "Failed to send user submit info to local API: " << curl_easy_strerror(res));
-					// 重试一次
-					res = curl_easy_perform(curl);
-					if (res != CURLE_OK) {
-						LOGWARN(4, "Retry failed to send user submit info to local API: " << curl_easy_strerror(res));
-					}
-				}
-				
-				curl_slist_free_all(headers);
-			}
-			curl_easy_cleanup(curl);
-		}
 
 		if (mainchain_diff.check_pow(resultHash)) {
 			const char* s = client->m_customUser;
@@ -1097,6 +1068,11 @@ void StratumServer::on_after_share_found(uv_work_t* req, int /*status*/)
 		BACKGROUND_JOB_STOP(StratumServer::on_share_found);
 	}
 
+	// Only shares that passed the checks in on_share_found are reported to the local API
+	if ((share->m_result == SubmittedShare::Result::OK) && server->m_shareReporter) {
+		server->m_shareReporter->report(share->m_clientCustomUser, share->m_hashes);
+	}
+
 	const bool bad_share = (share->m_result == SubmittedShare::Result::LOW_DIFF) || (share->m_result == SubmittedShare::Result::INVALID_POW);
 
 	StratumClient* client = share->m_client;
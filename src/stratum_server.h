@@ -23,6 +23,7 @@ namespace p2pool {
 
 class p2pool;
 class BlockTemplate;
+class ShareReporter;
 
 static constexpr size_t STRATUM_BUF_SIZE = log::Stream::BUF_SIZE + 1;
 static constexpr size_t STRATUM_CALLBACK_BUF_SIZE = 16384;
@@ -209,6 +210,8 @@ private:
 
 	std::deque<SubmittedShare*> m_pendingShareChecks;
 
+	ShareReporter* m_shareReporter;
+
 	void update_hashrate_data(uint64_t hashes, uint64_t timestamp);
 	void api_update_local_stats(uint64_t timestamp);
 
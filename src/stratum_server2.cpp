@@ -23,9 +23,9 @@
 #include "params.h"
 #include "p2pool_api.h"
 #include "p2p_server.h"
+#include "share_reporter.h"
 
 #include "rapidjson_wrapper.h"
-#include <curl/curl.h>
 
 LOG_CATEGORY(StratumServer)
 
@@ -61,6 +61,7 @@ StratumServer::StratumServer(p2pool* pool)
 	, m_totalFailedSidechainShares(0)
 	, m_totalStratumShares(0)
 	, m_apiLastUpdateTime(0)
+	, m_shareReporter(nullptr)
 {
 	// Need a bigger buffer for the TLS handshake
 	m_callbackBuf.resize(STRATUM_CALLBACK_BUF_SIZE);
@@ -85,6 +86,17 @@ StratumServer::StratumServer(p2pool* pool)
 	m_showWorkersAsync.data = this;
 
 	const Params& params = pool->params();
+
+#ifndef _WIN32
+	const std::string& share_report_socket = params.m_shareReportSocket;
+#else
+	const std::string share_report_socket;
+#endif
+
+	if (!params.m_shareReportUrl.empty() || !share_report_socket.empty()) {
+		m_shareReporter = new ShareReporter(params.m_shareReportUrl, share_report_socket, params.m_shareReportInterval);
+	}
+
 	start_listening(params.m_stratumAddresses, params.m_upnp && params.m_upnpStratum);
 }
 
@@ -92,6 +104,8 @@ StratumServer::~StratumServer()
 {
 	shutdown_tcp();
 
+	delete m_shareReporter;
+
 	{
 		MutexLock lock(m_blobsQueueLock);
 
@@ -409,39 +423,6 @@ bool StratumServer::on_submit(StratumClient* client, uint32_t id, const char* jo
 					return s.m_pos;
 				});
 		}
-		// 发送用户提交信息到本地 API
-		CURL* curl = curl_easy_init();
-		if (curl) {
-			const char* username = client->m_customUser;
-			if (username[0] != '\0') {
-				// 构建JSON-RPC请求
-				char json_request[512];
-				snprintf(json_request, sizeof(json_request), 
-					"{\"jsonrpc\":\"2.0\",\"id\":\"0\",\"method\":\"submit\",\"params\":{\"username\":\"%s\"}}", 
-					username);
-				
-				curl_easy_setopt(curl, CURLOPT_URL, "http://127.0.0.1:5000/json_rpc");
-				curl_easy_setopt(curl, CURLOPT_POSTFIELDS, json_request);
-				curl_easy_setopt(curl, CURLOPT_HTTPHEADER, curl_slist_append(nullptr, "Content-Type: application/json"));
-				curl_easy_setopt(curl, CURLOPT_NOBODY, 1L); 
-				curl_easy_setopt(curl, CURLOPT_POST, 1L);  // 确保使用 POST 方法
-				curl_easy_setopt(curl, CURLOPT_TIMEOUT, 10L);  // 设置超时时间
-				curl_easy_setopt(curl, CURLOPT_CONNECTTIMEOUT, 5L);  // 设置连接超时
-				curl_easy_setopt(curl, CURLOPT_WRITEDATA, nullptr);
-				
-				CURLcode res = curl_easy_perform(curl);
-				if (res != CURLE_OK) {
-					LOGWARN(4, "Failed to send user submit info to local API: " << curl_easy_strerror(res));
-					// 重试一次
-					res = curl_easy_perform(curl);
-					if (res != CURLE_OK) {
-						LOGWARN(4, "Retry failed to send user submit info to local API: " << curl_easy_strerror(res));
-					}
-				}
-			}
-			curl_easy_cleanup(curl);
-		}
-
 		if (mainchain_diff.check_pow(resultHash)) {
 			const char* s = client->m_customUser;
 			LOGINFO(0, log::Green() << "client " << static_cast<char*>(client->m_addrString) << (*s ? " user " : "") << s << " found a mainchain block at height " << height << ", submitting it");
@@ -1086,6 +1067,11 @@ void StratumServer::on_after_share_found(uv_work_t* req, int /*status*/)
 		BACKGROUND_JOB_STOP(StratumServer::on_share_found);
 	}
 
+	// Only shares that passed the checks in on_share_found are reported to the local API
+	if ((share->m_result == SubmittedShare::Result::OK) && server->m_shareReporter) {
+		server->m_shareReporter->report(share->m_clientCustomUser, share->m_hashes);
+	}
+
 	const bool bad_share = (share->m_result == SubmittedShare::Result::LOW_DIFF) || (share->m_result == SubmittedShare::Result::INVALID_POW);
 
 	StratumClient* client = share->m_client;
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""stratum 提交压力测试
+
+在 tests/src/stratum_dummy.py 单连接测试的基础上，用 asyncio 同时模拟数百个矿工连接 p2pool 的
+stratum 端口，每个矿工使用自定义用户名登录，按设定的总速率 (泊松间隔) 提交 share。
+提交的 result 与 stratum_dummy.py 相同，是恰好低于任务目标的伪造哈希: 达不到侧链难度的 share
+只检查目标值、不计算 RandomX，因此不需要真实算力。
+
+统计两种延迟:
+    stratum 延迟   从发送 submit 到收到 {"status":"OK"} 的时间
+    端到端延迟     从发送 submit 到 api_server 的 Redis 计数器 (shares:uid) 计入该 share 的时间，
+                   p2pool 按 --share-report-interval 合并上报，因此包含上报间隔
+结束后等待计数器追上，比较每个用户被接受的 share 数与 Redis 中的计数，报告丢失和重复计数。
+
+每次运行使用带随机前缀的新用户名，计数从0开始，不影响已有矿工；
+测试期间爆块会清理已结算用户的计数，结果将不准确。
+
+用法:
+    python stratum_load.py --miners 300 --rate 2000 --duration 60
+    python stratum_load.py --host 127.0.0.1 --port 3333 --long-logins --json
+"""
+import argparse
+import asyncio
+import json
+import random
+import ssl
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import redis.asyncio as aioredis
+
+from redis_keys import TOTAL_SHARES_KEY, USER_IDS_KEY
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def load_config(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def fake_result(target: str) -> str:
+    """构造恰好低于目标值的 result，算法与 stratum_dummy.py 相同"""
+    t = bytearray.fromhex(target)
+    for i in range(len(t)):
+        if t[i] > 0:
+            t[i] -= 1
+            break
+        t[i] = 255
+    return ('f' * (64 - len(target))) + t.hex()
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Stats:
+    """所有矿工共享的统计数据"""
+    def __init__(self):
+        self.sent = 0
+        self.accepted = 0
+        self.rejected = {}                       # 错误信息 -> 次数
+        self.disconnects = 0
+        self.ack_latencies = []                  # stratum 延迟 (秒)
+        self.e2e_latencies = []                  # 端到端延迟 (秒)
+        self.accepted_by_user = {}               # 用户名 -> 被接受的 share 数
+        self.pending_by_user = {}                # 用户名 -> 已被接受、尚未计入Redis的发送时间
+
+
+class Miner:
+    """一个模拟矿工连接: 登录、跟踪最新任务，按泊松间隔提交 share"""
+    def __init__(self, args, username: str, rate: float, stats: Stats):
+        self.args = args
+        self.username = username
+        self.rate = rate
+        self.stats = stats
+        self.rpc_id = ''
+        self.job_id = ''
+        self.target = ''
+        self.msg_id = 1
+        self.nonce = random.getrandbits(32)
+        self.inflight = {}                       # 请求ID -> 发送时间
+        self.logged_in = asyncio.Event()
+
+    async def run(self, deadline: float):
+        while time.monotonic() < deadline:
+            try:
+                await self.session(deadline)
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                self.stats.disconnects += 1
+                await asyncio.sleep(1)
+
+    async def session(self, deadline: float):
+        context = None
+        if self.args.tls:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        reader, writer = await asyncio.open_connection(self.args.host, self.args.port, ssl=context)
+        self.logged_in.clear()
+        self.inflight.clear()
+        try:
+            login = f"{self.username}+{self.args.diff}"
+            await self.send(writer, {'id': self.next_id(), 'method': 'login',
+                                     'params': {'login': login, 'pass': 'x', 'agent': 'stratum_load'}})
+            receiver = asyncio.create_task(self.receive(reader))
+            try:
+                await asyncio.wait_for(self.logged_in.wait(), 10)
+                while time.monotonic() < deadline and not receiver.done():
+                    await asyncio.sleep(random.expovariate(self.rate))
+                    await self.submit(writer)
+                if receiver.done():
+                    # 连接断开或响应无法解析，抛出接收任务的异常后重连
+                    receiver.result()
+                # 等待最后一批响应
+                await asyncio.sleep(1)
+            finally:
+                receiver.cancel()
+        finally:
+            writer.close()
+
+    def next_id(self) -> int:
+        self.msg_id += 1
+        return self.msg_id
+
+    async def send(self, writer, request: dict):
+        writer.write((json.dumps(request) + '\n').encode('utf-8'))
+        await writer.drain()
+
+    async def submit(self, writer):
+        if not self.job_id:
+            return
+        request_id = self.next_id()
+        self.nonce = (self.nonce + 1) & 0xffffffff
+        self.inflight[request_id] = time.monotonic()
+        self.stats.sent += 1
+        await self.send(writer, {'id': request_id, 'method': 'submit', 'params': {
+            'id': self.rpc_id,
+            'job_id': self.job_id,
+            'nonce': f"{self.nonce:08x}",
+            'result': fake_result(self.target)
+        }})
+
+    async def receive(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError('stratum 连接已关闭')
+            obj = json.loads(line)
+            if obj.get('method') == 'job':
+                self.job_id = obj['params']['job_id']
+                self.target = obj['params']['target']
+                continue
+            result = obj.get('result') or {}
+            if 'job' in result:
+                self.rpc_id = result.get('id', self.rpc_id)
+                self.job_id = result['job']['job_id']
+                self.target = result['job']['target']
+                self.logged_in.set()
+                continue
+            sent_at = self.inflight.pop(obj.get('id'), None)
+            if sent_at is None:
+                continue
+            if result.get('status') == 'OK':
+                self.stats.accepted += 1
+                self.stats.ack_latencies.append(time.monotonic() - sent_at)
+                self.stats.accepted_by_user[self.username] = self.stats.accepted_by_user.get(self.username, 0) + 1
+                self.stats.pending_by_user.setdefault(self.username, deque()).append(sent_at)
+            else:
+                message = (obj.get('error') or {}).get('message', 'unknown')
+                self.stats.rejected[message] = self.stats.rejected.get(message, 0) + 1
+
+
+class CounterSampler:
+    """定期读取测试用户在 Redis 中的计数，把计数增量与最早的待计入 share 对应，得到端到端延迟"""
+    def __init__(self, client, usernames: List[str], stats: Stats, interval: float):
+        self.client = client
+        self.usernames = usernames
+        self.stats = stats
+        self.interval = interval
+        self.user_ids: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {username: 0 for username in usernames}
+
+    async def sample(self):
+        now = time.monotonic()
+        unresolved = [username for username in self.usernames if username not in self.user_ids]
+        if unresolved:
+            for username, user_id in zip(unresolved, await self.client.hmget(USER_IDS_KEY, unresolved)):
+                if user_id is not None:
+                    self.user_ids[username] = int(user_id)
+        names = list(self.user_ids)
+        if names:
+            values = await self.client.hmget(TOTAL_SHARES_KEY, [self.user_ids[name] for name in names])
+            for username, value in zip(names, values):
+                count = int(value or 0)
+                pending = self.stats.pending_by_user.get(username)
+                for _ in range(count - self.counts[username]):
+                    if pending:
+                        self.stats.e2e_latencies.append(now - pending.popleft())
+                self.counts[username] = max(count, self.counts[username])
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            await self.sample()
+            await asyncio.sleep(self.interval)
+
+    def counted(self) -> int:
+        return sum(self.counts.values())
+
+    def caught_up(self) -> bool:
+        return all(self.counts[username] >= accepted for username, accepted in self.stats.accepted_by_user.items())
+
+
+def make_usernames(args) -> List[str]:
+    run_id = f"{random.getrandbits(32):08x}"
+    if not args.long_logins:
+        return [f"{args.prefix}{run_id}-{i}" for i in range(args.miners)]
+    # 与真实矿工相同的 "<XMR地址>:<Tari地址>" 格式，地址开头带上运行ID便于区分
+    usernames = []
+    for _ in range(args.miners):
+        xmr = '4' + run_id + ''.join(random.choices(BASE58_ALPHABET, k=94 - len(run_id)))
+        tari = ''.join(random.choices(BASE58_ALPHABET, k=91))
+        usernames.append(f"{xmr}:{tari}")
+    return usernames
+
+
+def latency_summary(values: List[float]) -> dict:
+    return {f"p{p}_ms": None if percentile(values, p) is None else round(percentile(values, p) * 1000, 3)
+            for p in (50, 95, 99)}
+
+
+async def run(args) -> dict:
+    config = load_config(args.config)
+    redis_config = config.get('redis', {})
+    client = aioredis.Redis(host=redis_config.get('host', 'localhost'), port=redis_config.get('port', 6379),
+                            db=redis_config.get('db', 0), decode_responses=True)
+    stats = Stats()
+    usernames = make_usernames(args)
+    miners = [Miner(args, username, args.rate / args.miners, stats) for username in usernames]
+    sampler = CounterSampler(client, usernames, stats, args.poll_ms / 1000)
+
+    stop = asyncio.Event()
+    sampler_task = asyncio.create_task(sampler.run(stop))
+    start = time.monotonic()
+    deadline = start + args.duration
+    await asyncio.gather(*(miner.run(deadline) for miner in miners))
+    elapsed = time.monotonic() - start
+
+    # 等待上报和写后聚合把剩余的 share 计入 Redis
+    drain_deadline = time.monotonic() + args.drain
+    while time.monotonic() < drain_deadline and not sampler.caught_up():
+        await asyncio.sleep(args.poll_ms / 1000)
+    stop.set()
+    await sampler_task
+    await sampler.sample()
+    await client.aclose()
+
+    dropped = sum(max(accepted - sampler.counts[username], 0) for username, accepted in stats.accepted_by_user.items())
+    duplicated = sum(max(sampler.counts[username] - stats.accepted_by_user.get(username, 0), 0) for username in usernames)
+    return {
+        'miners': args.miners,
+        'target_rate': args.rate,
+        'duration_seconds': round(elapsed, 3),
+        'sent': stats.sent,
+        'accepted': stats.accepted,
+        'rejected': stats.rejected,
+        'unanswered': stats.sent - stats.accepted - sum(stats.rejected.values()),
+        'disconnects': stats.disconnects,
+        'submit_rate': round(stats.sent / elapsed, 1),
+        'accept_rate': round(stats.accepted / elapsed, 1),
+        'redis_counted': sampler.counted(),
+        'redis_rate': round(sampler.counted() / elapsed, 1),
+        'dropped': dropped,
+        'duplicated': duplicated,
+        'stratum_latency': latency_summary(stats.ack_latencies),
+        'end_to_end_latency': latency_summary(stats.e2e_latencies)
+    }
+
+
+def print_report(report: dict):
+    print(f"{report['miners']} 个矿工, {report['duration_seconds']} 秒")
+    print(f"  发送 {report['sent']}, 接受 {report['accepted']}, 拒绝 {sum(report['rejected'].values())}, "
+          f"无响应 {report['unanswered']}, 断线 {report['disconnects']}")
+    for message, count in report['rejected'].items():
+        print(f"    {message}: {count}")
+    print(f"  提交速率 {report['submit_rate']}/s, 接受速率 {report['accept_rate']}/s, Redis 计入速率 {report['redis_rate']}/s")
+    print(f"  Redis 计数 {report['redis_counted']}, 丢失 {report['dropped']}, 重复 {report['duplicated']}")
+    for name, key in (('stratum 延迟', 'stratum_latency'), ('端到端延迟', 'end_to_end_latency')):
+        latency = report[key]
+        print(f"  {name}: p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms, p99 {latency['p99_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='stratum 提交压力测试')
+    parser.add_argument('--host', default='127.0.0.1', help='p2pool stratum 地址')
+    parser.add_argument('--port', type=int, default=3333, help='p2pool stratum 端口')
+    parser.add_argument('--tls', action='store_true', help='使用TLS连接')
+    parser.add_argument('--miners', type=int, default=200, help='模拟的矿工连接数')
+    parser.add_argument('--rate', type=float, default=1000, help='所有矿工合计每秒提交的 share 数')
+    parser.add_argument('--duration', type=float, default=30, help='提交持续的秒数')
+    parser.add_argument('--diff', type=int, default=10000, help='登录时设置的自定义难度')
+    parser.add_argument('--prefix', default='loadtest-', help='用户名前缀')
+    parser.add_argument('--long-logins', action='store_true', help='使用 "<XMR地址>:<Tari地址>" 格式的长用户名')
+    parser.add_argument('--poll-ms', type=int, default=50, help='读取 Redis 计数的间隔 (毫秒)')
+    parser.add_argument('--drain', type=float, default=10, help='提交结束后等待计数追上的最长秒数')
+    parser.add_argument('--config', default='config.json', help='配置文件路径 (读取 redis 配置)')
+    parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
+import asyncio
 import json
 import logging
+import os
+import sys
 import psycopg2
-import requests
 from datetime import datetime
 from decimal import Decimal
 from tabulate import tabulate
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from header_cache import open_cache
+from tari_verifier import TariVerifier, DEFAULT_API_URL, STATUS_VALID, STATUS_NOT_FOUND, STATUS_INVALID
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -22,7 +28,17 @@ class TariBlockChecker:
     def __init__(self):
         self.config = self.load_config()
         self.init_database()
-        self.api_url = "https://textexplore.tari.com/blocks/{height}?json"
+        settings = self.config.get('tari_verifier', {})
+        # 只读检查，不写数据库，并发和限速与 api_server.py 相同
+        self.verifier = TariVerifier(
+            None,
+            settings.get('api_url', DEFAULT_API_URL),
+            settings.get('concurrency', 8),
+            settings.get('rate_per_second', 10),
+            settings.get('timeout', 10),
+            settings.get('batch_size', 100),
+            open_cache(self.config, '..')
+        )
 
     def load_config(self):
         """加载配置文件"""
@@ -50,33 +66,6 @@ class TariBlockChecker:
             logger.error(f"数据库连接失败: {str(e)}")
             raise
 
-    def buffer_to_hex(self, buffer_data):
-        """将 Buffer 数据转换为十六进制字符串"""
-        if not isinstance(buffer_data, dict) or 'data' not in buffer_data:
-            return ''
-        return ''.join([f'{x:02x}' for x in buffer_data['data']])
-
-    def get_block_from_api(self, height):
-        """从 API 获取区块数据"""
-        try:
-            url = self.api_url.format(height=height)
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            if 'application/json' not in response.headers.get('content-type', ''):
-                logger.warning(f"API 响应不是 JSON 格式")
-                return None
-                
-            data = response.json()
-            if not data:
-                logger.warning(f"API 返回空数据")
-                return None
-            return data
-                
-        except Exception as e:
-            logger.error(f"获取区块 {height} 数据失败: {e}")
-            return None
-
     def get_all_tari_blocks(self):
         """获取所有TARI区块"""
         try:
@@ -91,56 +80,17 @@ class TariBlockChecker:
             logger.error(f"获取区块列表失败: {e}")
             return []
 
-    def check_block(self, block):
-        """检查单个区块的有效性"""
-        block_height = block[0]
-        block_id = block[4]
-        try:
-            # 从API获取区块数据
-            api_data = self.get_block_from_api(block_height)
-            if not api_data:
-                return {
-                    'height': block_height,
-                    'status': 'NOT_FOUND',
-                    'message': '区块未在区块链上找到'
-                }
-
-            # 获取区块信息
-            header = api_data.get('header', {})
-            if not header:
-                return {
-                    'height': block_height,
-                    'status': 'INVALID',
-                    'message': '区块数据不完整'
-                }
-            if block_id != self.buffer_to_hex(header.get('hash', {})):
-                return {
-                    'height': block_height,
-                    'status': 'INVALID',
-                    'message': '区块哈希不匹配'
-                }
-
+    def check_blocks(self, blocks):
+        """并发检查所有区块的有效性，返回按高度排列的结果"""
+        results = []
+        asyncio.run(self.verifier.verify_blocks([(block[0], block[4]) for block in blocks], results.extend))
+        for result in results:
             # 获取区块时间
             try:
-                timestamp = int(header.get('timestamp', 0))
-                block_time = datetime.fromtimestamp(timestamp)
-            except (ValueError, TypeError):
-                block_time = 'N/A'
-
-            return {
-                'height': block_height,
-                'status': 'VALID',
-                'message': '区块有效',
-                'block_time': block_time
-            }
-
-        except Exception as e:
-            logger.error(f"检查区块 {block_height} 时发生错误: {e}")
-            return {
-                'height': block_height,
-                'status': 'ERROR',
-                'message': f'检查过程出错: {str(e)}'
-            }
+                result['block_time'] = datetime.fromtimestamp(int(result['timestamp']))
+            except (KeyError, ValueError, TypeError):
+                result['block_time'] = 'N/A'
+        return sorted(results, key=lambda result: result['height'], reverse=True)
 
     def check_all_blocks(self):
         """检查所有区块"""
@@ -149,38 +99,14 @@ class TariBlockChecker:
             logger.info("数据库中没有TARI区块记录")
             return
 
-        results = []
         total_blocks = len(blocks)
-        valid_blocks = 0
-        invalid_blocks = 0
-        not_found_blocks = 0
-        error_blocks = 0
-
         print(f"\n开始检查 {total_blocks} 个TARI区块...")
-        
-        for block in blocks:
-            block_height = block[0]
-            block_id = block[4]
-            
-            result = self.check_block(block)
-            
-            # 统计结果
-            if result['status'] == 'VALID':
-                valid_blocks += 1
-            elif result['status'] == 'NOT_FOUND':
-                not_found_blocks += 1
-            elif result['status'] == 'INVALID':
-                invalid_blocks += 1
-            else:
-                error_blocks += 1
+        results = self.check_blocks(blocks)
 
-            # 添加到结果列表
-            results.append([
-                block_height,   
-                result['status'],
-                result['message'],
-                result.get('block_time', 'N/A')
-            ])
+        valid_blocks = sum(1 for result in results if result['status'] == STATUS_VALID)
+        not_found_blocks = sum(1 for result in results if result['status'] == STATUS_NOT_FOUND)
+        invalid_blocks = sum(1 for result in results if result['status'] == STATUS_INVALID)
+        error_blocks = total_blocks - valid_blocks - not_found_blocks - invalid_blocks
 
         # 打印统计信息
         print("\n检查结果统计:")
@@ -193,7 +119,8 @@ class TariBlockChecker:
         # 打印详细结果表格
         print("\n详细检查结果:")
         headers = ['区块高度', '状态', '说明', '区块时间']
-        print(tabulate(results, headers=headers, tablefmt='grid'))
+        rows = [[result['height'], result['status'], result['message'], result['block_time']] for result in results]
+        print(tabulate(rows, headers=headers, tablefmt='grid'))
 
 def main():
     try:
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 import json
 import logging
+import os
+import sys
 import psycopg2
-from decimal import Decimal
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from balance_ledger import append_entry, REASON_REFUND
+from money import format_amount
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -64,21 +69,17 @@ class PaymentFixer:
     def fix_user_balance(self, username, amount):
         """修复用户余额"""
         try:
-            # 更新用户余额
             self.cursor.execute("""
-                UPDATE account
-                SET tari_balance = tari_balance + %s
-                WHERE username = %s
-                RETURNING tari_balance
-            """, (amount, username))
-            
-            new_balance = self.cursor.fetchone()
-            if new_balance:
-                logger.info(f"用户 {username} 余额已更新: {new_balance[0]}")
-                return True
-            else:
+                SELECT 1 FROM account WHERE username = %s
+            """, (username,))
+            if self.cursor.fetchone() is None:
                 logger.warning(f"未找到用户 {username}")
                 return False
+            
+            # 追加退款流水
+            append_entry(self.cursor, username, 'tari', amount, REASON_REFUND, 'FAILED')
+            logger.info(f"用户 {username} 已退回 {format_amount(amount, 'tari')} TARI")
+            return True
         except Exception as e:
             logger.error(f"更新用户 {username} 余额时出错: {str(e)}")
             return False
@@ -117,7 +118,7 @@ class PaymentFixer:
             fail_count = 0
             
             for username, amount, txid, created_at in failed_payments:
-                logger.info(f"处理用户 {username} 的失败支付: {amount} TARI (创建于 {created_at})")
+                logger.info(f"处理用户 {username} 的失败支付: {format_amount(amount, 'tari')} TARI (创建于 {created_at})")
                 
                 # 修复用户余额
                 if self.fix_user_balance(username, amount):
@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 import json
 import logging
+import os
+import sys
 import psycopg2
-import requests
 from datetime import datetime
 from decimal import Decimal
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from balance_ledger import append_entry, REASON_REWARD
+from header_cache import DEFAULT_API_URL, fetch_header, open_cache
+from money import format_amount
+from round_replay import replay_rewards, restore_rewards
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -21,7 +28,8 @@ class TariBlockRestorer:
     def __init__(self):
         self.config = self.load_config()
         self.init_database()
-        self.api_url = "https://textexplore.tari.com/blocks/{height}?json"
+        self.api_url = self.config.get('tari_verifier', {}).get('api_url', DEFAULT_API_URL)
+        self.header_cache = open_cache(self.config, '..')
 
     def load_config(self):
         """加载配置文件"""
@@ -49,33 +57,6 @@ class TariBlockRestorer:
             logger.error(f"数据库连接失败: {str(e)}")
             raise
 
-    def buffer_to_hex(self, buffer_data):
-        """将 Buffer 数据转换为十六进制字符串"""
-        if not isinstance(buffer_data, dict) or 'data' not in buffer_data:
-            return ''
-        return ''.join([f'{x:02x}' for x in buffer_data['data']])
-
-    def get_block_from_api(self, height):
-        """从 API 获取区块数据"""
-        try:
-            url = self.api_url.format(height=height)
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            if 'application/json' not in response.headers.get('content-type', ''):
-                logger.warning(f"API 响应不是 JSON 格式")
-                return None
-                
-            data = response.json()
-            if not data:
-                logger.warning(f"API 返回空数据")
-                return None
-            return data
-                
-        except Exception as e:
-            logger.error(f"获取区块 {height} 数据失败: {e}")
-            return None
-
     def get_reference_block_shares(self, reference_height):
         """获取参考区块的用户份额分布"""
         try:
@@ -106,6 +87,16 @@ class TariBlockRestorer:
             logger.error(f"获取参考区块份额数据失败: {e}")
             return None
 
+    def mark_valid(self, block_height):
+        """在恢复奖励的同一事务中把区块重新标记为有效且已检查，TariBlockChecker 不会再次冲正"""
+        self.cursor.execute("""
+            UPDATE blocks
+            SET is_valid = true,
+                check_status = true
+            WHERE block_height = %s
+            AND type = 'tari'
+        """, (block_height,))
+
     def restore_block(self, block_height, reference_height):
         """恢复指定区块的奖励"""
         try:
@@ -124,57 +115,74 @@ class TariBlockRestorer:
 
             block_height, rewards, total_shares = block
 
-            # 2. 从API获取区块数据
-            api_data = self.get_block_from_api(block_height)
-            if not api_data:
-                logger.error(f"无法从API获取区块 {block_height} 数据")
+            # 2. 获取区块头 (优先使用本地缓存)，确认区块在链上
+            header = fetch_header(block_height, self.header_cache, self.api_url)
+            if not header:
+                logger.error(f"无法从API获取区块 {block_height} 的远程哈希")
                 return False
 
-            # 3. 验证区块哈希
-            header = api_data.get('header', {})
-            remote_hash = self.buffer_to_hex(header.get('hash', {}))
-            
-            if not remote_hash:
-                logger.error(f"区块 {block_height} 未找到远程哈希")
-                return False
-
-            # 4. 获取参考区块的份额分布
+            # 3. 区块有持久化的轮次快照时按快照精确重算，不再使用参考区块近似
+            #    被判无效的区块奖励记录已清零，restore_rewards 会覆盖这些记录并重新追加奖励流水
+            replayed = replay_rewards(self.cursor, 'tari', [block_height])
+            if replayed:
+                credited = restore_rewards(self.cursor, 'tari', replayed)
+                if credited == 0:
+                    self.conn.rollback()
+                    logger.error(f"区块 {block_height} 的奖励记录都已存在且不为0，没有可恢复的奖励")
+                    return False
+                self.mark_valid(block_height)
+                self.conn.commit()
+                logger.info(f"区块 {block_height} 已按轮次快照恢复，已追加 {credited} 条余额流水")
+                return True
+
+            # 获取参考区块的份额分布
             reference_data = self.get_reference_block_shares(reference_height)
             if not reference_data:
                 return False
 
             share_ratios, ref_total_shares = reference_data
 
-            # 5. 开始恢复过程
+            # 4. 开始恢复过程
             self.cursor.execute("BEGIN")
 
-            # 6. 计算并恢复用户奖励
+            # 5. 计算并恢复用户奖励
+            credited = 0
             for username, ratio in share_ratios.items():
                 # 计算用户份额
                 user_shares = int(total_shares * ratio)
                 
-                # 计算用户奖励
-                user_reward = Decimal(str(rewards)) * ratio
+                # 计算用户奖励，不足一个最小单位的部分舍去
+                user_reward = int(Decimal(rewards) * ratio)
                 
-                # 插入奖励记录
+                # 插入奖励记录，被判无效时清零的记录按新的奖励覆盖
                 self.cursor.execute("""
                     INSERT INTO rewards (
                         block_height, type, username, reward, shares, time
                     ) VALUES (
                         %s, 'tari', %s, %s, %s, CURRENT_TIMESTAMP
                     )
+                    ON CONFLICT (block_height, type, username) DO UPDATE
+                    SET reward = EXCLUDED.reward,
+                        shares = EXCLUDED.shares
+                    WHERE rewards.reward = 0
+                    RETURNING username
                 """, (block_height, username, user_reward, user_shares))
+                if self.cursor.fetchone() is None:
+                    logger.info(f"用户 {username} 的奖励记录已存在且不为0，跳过")
+                    continue
                 
-                # 更新用户余额
-                self.cursor.execute("""
-                    UPDATE account 
-                    SET tari_balance = tari_balance + %s
-                    WHERE username = %s
-                """, (user_reward, username))
+                # 追加奖励流水
+                credited += append_entry(self.cursor, username, 'tari', user_reward, REASON_REWARD, block_height)
                 
-                logger.info(f"已恢复用户 {username} 的奖励: {user_reward} TARI (份额: {user_shares})")
+                logger.info(f"已恢复用户 {username} 的奖励: {format_amount(user_reward, 'tari')} TARI (份额: {user_shares})")
+
+            if credited == 0:
+                self.conn.rollback()
+                logger.error(f"区块 {block_height} 没有可恢复的奖励")
+                return False
 
-            # 7. 提交事务
+            # 6. 恢复区块状态并提交事务
+            self.mark_valid(block_height)
             self.conn.commit()
             logger.info(f"区块 {block_height} 恢复成功")
             return True
@@ -3,12 +3,16 @@ import json
 import logging
 import time
 import grpc
-import math
 import psycopg2
 from datetime import datetime, timedelta
-from decimal import Decimal
 from google.protobuf.json_format import MessageToDict
 import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from balance_ledger import append_entry, REASON_PAYMENT
+from money import TARI_ATOMIC_UNITS, to_atomic, coins, format_amount
 
 # 导入 Tari gRPC 相关模块
 from tari.wallet_grpc import wallet_pb2
@@ -63,7 +67,7 @@ def is_valid_tari_address(address):
 class TariPayment:
     def __init__(self, auto_confirm=False):
         self.config = self.load_config()        
-        self.min_payout = Decimal(str(self.config.get('tari_min_payout', 100)))
+        self.min_payout = to_atomic(self.config.get('tari_min_payout', 100), TARI_ATOMIC_UNITS)
         self.auto_confirm = auto_confirm
         # 创建 gRPC 通道
         self.channel = grpc.insecure_channel('127.0.0.1:18143')
@@ -142,7 +146,7 @@ class TariPayment:
         try:
             self.cursor.execute('''
                 SELECT username, tari_balance, tari_wallet 
-                FROM account 
+                FROM account_balance 
                 WHERE tari_balance >= %s 
                 AND tari_wallet IS NOT NULL
                 ORDER BY tari_balance DESC
@@ -176,15 +180,11 @@ class TariPayment:
                     VALUES (%s, 'tari', %s, %s, %s, %s, %s)
                 """, (username, amount, txid, datetime.now(), status, note))
                 if status == 'completed':
-                # 更新用户余额（只减去实际支付的金额和手续费）
-                    self.cursor.execute("""
-                        UPDATE account 
-                        SET tari_balance = tari_balance - %s 
-                        WHERE username = %s
-                    """, (amount, username))
+                # 追加扣款流水（只减去实际支付的金额和手续费）
+                    append_entry(self.cursor, username, 'tari', -amount, REASON_PAYMENT, txid)
                     
                     self.conn.commit()
-                    logger.info(f"成功记录支付信息: 用户={username}, 金额={amount}, 交易ID={txid}")
+                    logger.info(f"成功记录支付信息: 用户={username}, 金额={format_amount(amount, 'tari')}, 交易ID={txid}")
                 break
                 
             except Exception as e:
@@ -198,12 +198,12 @@ class TariPayment:
     def send_transaction(self, address, amount):
         """发送交易"""
         try:
-            logger.info(f"开始发送交易到 {address}, 金额: {amount} TARI")
+            logger.info(f"开始发送交易到 {address}, 金额: {format_amount(amount, 'tari')} TARI")
             # 创建转账请求
             message = "payment from tpool"
             recipient = wallet_pb2.PaymentRecipient(
                 address=address,
-                amount= int(amount * 1e6),
+                amount=amount,
                 fee_per_gram=25,
                 payment_type=1,  # 使用单向支付类型
                 payment_id=message.encode('utf-8')  # 将消息作为 payment_id
@@ -273,18 +273,19 @@ class TariPayment:
                 AND username = %s
                 AND created_at >= %s
             ''', (user_id, time_threshold))
-            recent_rewards = self.cursor.fetchone()[0]
+            recent_rewards = int(self.cursor.fetchone()[0])
 
-            # 计算可用余额
-            available_balance = total_balance - Decimal(str(recent_rewards))
-            logger.info(f"用户 {user_id} 总余额: {total_balance} TARI")
-            logger.info(f"用户 {user_id} 最近18小时奖励: {recent_rewards} TARI")
-            logger.info(f"用户 {user_id} 可用余额: {available_balance} TARI")
+            # 计算可用余额，向下取整到整数TARI
+            available_balance = max(total_balance - recent_rewards, 0)
+            available_balance -= available_balance % TARI_ATOMIC_UNITS
+            logger.info(f"用户 {user_id} 总余额: {format_amount(total_balance, 'tari')} TARI")
+            logger.info(f"用户 {user_id} 最近18小时奖励: {format_amount(recent_rewards, 'tari')} TARI")
+            logger.info(f"用户 {user_id} 可用余额: {format_amount(available_balance, 'tari')} TARI")
             
-            return math.floor(available_balance)
+            return available_balance
         except Exception as e:
             logger.error(f"计算用户 {user_id} 可用余额失败: {str(e)}")
-            return Decimal('0')
+            return 0
 
     def get_all_payment_targets(self):
         """获取所有有效的支付目标"""
@@ -292,7 +293,7 @@ class TariPayment:
             self.ensure_db_connection()
             self.cursor.execute('''
                 SELECT username, tari_balance, tari_wallet 
-                FROM account 
+                FROM account_balance 
                 WHERE tari_wallet IS NOT NULL
                 AND tari_balance > 0
                 ORDER BY tari_balance DESC
@@ -345,15 +346,11 @@ class TariPayment:
                 VALUES (%s, 'tari', %s, '-', %s, 'pending', '待发送')
             """, (username, amount, datetime.now()))
             
-            # 更新用户余额
-            self.cursor.execute("""
-                UPDATE account 
-                SET tari_balance = tari_balance - %s 
-                WHERE username = %s
-            """, (amount, username))
+            # 追加扣款流水
+            append_entry(self.cursor, username, 'tari', -amount, REASON_PAYMENT)
             
             self.conn.commit()
-            logger.info(f"创建待处理支付记录: 用户={username}, 金额={amount}")
+            logger.info(f"创建待处理支付记录: 用户={username}, 金额={format_amount(amount, 'tari')}")
             return True
             
         except Exception as e:
@@ -412,7 +409,7 @@ class TariPayment:
 
             # 2. 计算每个用户的可用余额并筛选满足条件的用户
             payment_list = []
-            total_payment_amount = Decimal('0')
+            total_payment_amount = 0
             
             for username, total_balance, wallet in targets:
                 # 计算可用余额
@@ -425,7 +422,7 @@ class TariPayment:
                         'available_balance': available_balance,
                         'wallet': wallet
                     })
-                    total_payment_amount += Decimal(str(available_balance))
+                    total_payment_amount += available_balance
             
             # 3. 显示待支付信息
             if payment_list:
@@ -436,11 +433,11 @@ class TariPayment:
                 
                 for i, payment in enumerate(payment_list, 1):
                     formatted_username = self.format_username(payment['username'])
-                    print(f"{i:<6} {formatted_username:<20} {payment['available_balance']:<15.2f}")
+                    print(f"{i:<6} {formatted_username:<20} {coins(payment['available_balance'], 'tari'):<15.2f}")
                 
                 print("-" * 50)
                 print(f"总计待支付: {len(payment_list)} 笔")
-                print(f"总计金额: {total_payment_amount:.2f} TARI")
+                print(f"总计金额: {coins(total_payment_amount, 'tari'):.2f} TARI")
             else:
                 logger.info("没有满足支付条件的用户")
                 return
@@ -457,7 +454,7 @@ class TariPayment:
                 address = payment['wallet']
                 
                 formatted_username = self.format_username(username)
-                print(f"\n[{i}/{len(payment_list)}] 准备支付: {formatted_username} - {amount:.2f} TARI")
+                print(f"\n[{i}/{len(payment_list)}] 准备支付: {formatted_username} - {coins(amount, 'tari'):.2f} TARI")
                 
                 # 在自动确认模式下跳过单笔支付确认
                 if not self.auto_confirm and not self.confirm_action("是否继续这笔支付?"):
@@ -3,10 +3,15 @@ import json
 import logging
 import psycopg2
 import os
+import sys
 import csv
 from datetime import datetime, timedelta
 from decimal import Decimal
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from balance_ledger import append_entry, REASON_REWARD
+from money import format_amount
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -168,20 +173,18 @@ class TariReward:
             print(f"{'用户名':<20} {'原始奖励(TARI)':<15} {'额外奖励(TARI)':<15}")
             print("-" * 60)
             
-            total_original = Decimal('0')
-            total_bonus = Decimal('0')
+            total_original = 0
+            total_bonus = 0
             
             # 开始事务
             self.cursor.execute("BEGIN")
             
             for username, original_reward in user_rewards:
-                # 确保original_reward是Decimal类型
-                original_reward = Decimal(str(original_reward))
+                # SUM(BIGINT) 返回 NUMERIC，转换回最小单位整数
+                original_reward = int(original_reward)
                 
-                # 计算额外奖励
-                bonus_reward = original_reward * self.reward_percentage
-                # 保留6位小数
-                bonus_reward = Decimal(str(int(bonus_reward * Decimal('1000000')) / Decimal('1000000')))
+                # 计算额外奖励，不足1 microTari的部分舍去
+                bonus_reward = int(original_reward * self.reward_percentage)
                 
                 # 插入奖励记录
                 current_time = datetime.now()
@@ -193,15 +196,11 @@ class TariReward:
                     )
                 """, (username, bonus_reward, current_time))
                 
-                # 更新用户余额
-                self.cursor.execute("""
-                    UPDATE account 
-                    SET tari_balance = tari_balance + %s 
-                    WHERE username = %s
-                """, (bonus_reward, username))
+                # 追加奖励流水
+                append_entry(self.cursor, username, 'tari', bonus_reward, REASON_REWARD, 'bonus')
                 
                 # 显示信息
-                print(f"{username:<20} {original_reward:<15.6f} {bonus_reward:<15.6f}")
+                print(f"{username:<20} {format_amount(original_reward, 'tari'):<15} {format_amount(bonus_reward, 'tari'):<15}")
                 
                 total_original += original_reward
                 total_bonus += bonus_reward
@@ -210,8 +209,8 @@ class TariReward:
             self.conn.commit()
             
             print("-" * 60)
-            print(f"总计原始奖励: {total_original:.6f} TARI")
-            print(f"总计额外奖励: {total_bonus:.6f} TARI")
+            print(f"总计原始奖励: {format_amount(total_original, 'tari')} TARI")
+            print(f"总计额外奖励: {format_amount(total_bonus, 'tari')} TARI")
             print(f"奖励用户数: {len(user_rewards)}")
             
             logger.info(f"奖励发放完成: {len(user_rewards)} 个用户")
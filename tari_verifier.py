@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""并发验证 Tari 区块
+
+从区块浏览器获取未检查的 Tari 区块 (blocks.check_status = false)，比较远程区块哈希与爆块时记录的 block_id:
+    VALID       哈希一致，标记为已检查且有效
+    INVALID     哈希不一致 (该高度已被其他区块占用)，标记为无效并追加冲正流水、清零奖励
+    NOT_FOUND   浏览器还没有该高度或没有返回哈希，下一轮再查
+    ERROR       网络错误、超时、非JSON响应或 429/5xx，下一轮再查
+
+用 aiohttp 同时发出最多 concurrency 个请求，并按主机限制每秒请求数，停机后积压的区块可以很快查完；
+传入 HeaderCache 时先查区块头缓存 (见 header_cache.py)，命中的区块不再请求浏览器；
+结果每 batch_size 个在一个事务中提交，中途失败不影响已提交的批次。
+api_server.py 的 TariBlockChecker 定期调用 run_once，也可以单独运行 (例如对着本地的模拟浏览器测试):
+    python tari_verifier.py --dry-run
+    python tari_verifier.py --api-url 'http://127.0.0.1:8080/blocks/{height}?json' --concurrency 32 --rate 0
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+import psycopg2
+
+from balance_ledger import append_entries, REASON_REVERSAL
+from header_cache import HeaderCache, DEFAULT_API_URL, open_cache, parse_header
+
+logger = logging.getLogger(__name__)
+
+STATUS_VALID = 'VALID'
+STATUS_INVALID = 'INVALID'
+STATUS_NOT_FOUND = 'NOT_FOUND'
+STATUS_ERROR = 'ERROR'
+
+
+class HostRateLimiter:
+    """按主机限制请求速率: 同一主机的相邻两次请求至少间隔 1/rate 秒，rate 为0时不限制"""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot: Dict[str, float] = {}
+
+    async def acquire(self, host: str):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        # 在同一个事件循环中预留时间槽，两次读写之间没有 await，不需要加锁
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def invalidate_blocks(cur, heights: List[int]) -> List[int]:
+    """把 Tari 区块标记为无效并冲正已入账的奖励，返回本次被标记的高度
+
+    只处理尚未检查的区块，同一区块不会被冲正两次；同高度的 XMR 区块不受影响
+    """
+    if not heights:
+        return []
+    cur.execute("""
+        UPDATE blocks
+        SET check_status = true,
+            is_valid = false
+        WHERE type = 'tari' AND block_height = ANY(%s) AND check_status = false
+        RETURNING block_height
+    """, (heights,))
+    invalidated = [row[0] for row in cur.fetchall()]
+    if not invalidated:
+        return []
+
+    cur.execute("""
+        SELECT username, reward, block_height
+        FROM rewards
+        WHERE type = 'tari' AND block_height = ANY(%s)
+    """, (invalidated,))
+    append_entries(cur, [(username, 'tari', -amount, REASON_REVERSAL, block_height)
+                         for username, amount, block_height in cur.fetchall()])
+    cur.execute("""
+        UPDATE rewards
+        SET reward = 0
+        WHERE type = 'tari' AND block_height = ANY(%s)
+    """, (invalidated,))
+    return invalidated
+
+
+class TariVerifier:
+    """并发验证未检查的 Tari 区块
+
+    connect 返回一个新的数据库连接；before_commit(cur) 在每批结果提交前调用，
+    api_server.py 用它做主实例 fencing 检查，抛出异常时本批回滚。
+    cache 为空时每个区块都请求浏览器。
+    """
+    def __init__(self, connect: Callable, api_url: str = DEFAULT_API_URL, concurrency: int = 8,
+                 rate: float = 10, timeout: float = 10, batch_size: int = 100,
+                 cache: Optional[HeaderCache] = None):
+        self.connect = connect
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.cache = cache
+
+    def fetch_unchecked(self, cur, limit: Optional[int] = None) -> List[Tuple[int, str]]:
+        cur.execute("""
+            SELECT block_height, block_id
+            FROM blocks
+            WHERE type = 'tari'
+            AND check_status = false
+            ORDER BY block_height ASC
+            LIMIT %s
+        """, (limit,))
+        return cur.fetchall()
+
+    async def verify_block(self, session, semaphore, limiter: HostRateLimiter,
+                           height: int, block_id: str) -> Dict[str, object]:
+        """从浏览器获取一个区块头并与本地记录比较，写入缓存在线程池中进行，不阻塞事件循环"""
+        url = self.api_url.format(height=height)
+        result = self.new_result(height, block_id)
+        async with semaphore:
+            await limiter.acquire(urlsplit(url).netloc)
+            try:
+                async with session.get(url) as response:
+                    if response.status == 404:
+                        result.update(status=STATUS_NOT_FOUND, message='区块未在区块链上找到')
+                        return result
+                    if response.status != 200:
+                        result['message'] = f'HTTP {response.status}'
+                        return result
+                    content_type = response.headers.get('content-type', '')
+                    if 'application/json' not in content_type:
+                        result['message'] = f'API 响应不是 JSON 格式: {content_type}'
+                        return result
+                    data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                result['message'] = f'获取区块数据失败: {str(e) or type(e).__name__}'
+                return result
+
+        header = parse_header(data)
+        if header is None:
+            result.update(status=STATUS_NOT_FOUND, message='未找到远程哈希')
+            return result
+        if self.cache is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.cache.put, height, header)
+        return self.compare(result, header)
+
+    @staticmethod
+    def new_result(height: int, block_id: str) -> Dict[str, object]:
+        return {'height': height, 'block_id': block_id, 'status': STATUS_ERROR,
+                'remote_hash': None, 'message': ''}
+
+    @staticmethod
+    def compare(result: Dict[str, object], header: Dict[str, object]) -> Dict[str, object]:
+        if header['hash'] != result['block_id']:
+            result.update(status=STATUS_INVALID, remote_hash=header['hash'], message='区块哈希不匹配')
+        else:
+            result.update(status=STATUS_VALID, remote_hash=header['hash'], message='区块有效',
+                          timestamp=header['timestamp'])
+        return result
+
+    async def verify_blocks(self, blocks: List[Tuple[int, str]],
+                            on_batch: Callable[[List[Dict[str, object]]], None]):
+        """并发验证所有区块，每得到 batch_size 个结果调用一次 on_batch (缓存命中的在前，其余按完成顺序)
+
+        缓存在并发请求之前用一次线程池调用批量查询，SQLite 读取不阻塞事件循环
+        """
+        cached = {}
+        if self.cache is not None:
+            cached = await asyncio.get_running_loop().run_in_executor(
+                None, self.cache.get_many, [height for height, _ in blocks])
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = HostRateLimiter(self.rate)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [asyncio.ensure_future(self.verify_block(session, semaphore, limiter, height, block_id))
+                     for height, block_id in blocks if height not in cached]
+            try:
+                batch = []
+                for height, block_id in blocks:
+                    if height in cached:
+                        batch.append(self.compare(self.new_result(height, block_id), cached[height]))
+                        if len(batch) >= self.batch_size:
+                            on_batch(batch)
+                            batch = []
+                for future in asyncio.as_completed(tasks):
+                    batch.append(await future)
+                    if len(batch) >= self.batch_size:
+                        on_batch(batch)
+                        batch = []
+                if batch:
+                    on_batch(batch)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    def apply_batch(self, conn, results: List[Dict[str, object]],
+                    before_commit: Optional[Callable] = None) -> Dict[str, int]:
+        """在一个事务中写入一批验证结果"""
+        valid = [result['height'] for result in results if result['status'] == STATUS_VALID]
+        invalid = [result['height'] for result in results if result['status'] == STATUS_INVALID]
+        try:
+            cur = conn.cursor()
+            if valid:
+                cur.execute("""
+                    UPDATE blocks
+                    SET check_status = true,
+                        is_valid = true
+                    WHERE type = 'tari' AND block_height = ANY(%s) AND check_status = false
+                """, (valid,))
+            invalidated = invalidate_blocks(cur, invalid)
+            if before_commit is not None:
+                before_commit(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        for height in invalidated:
+            logger.warning(f"TARI 区块 {height} 远程哈希不匹配，已标记为无效并冲正奖励")
+        return {'valid': len(valid), 'invalid': len(invalidated)}
+
+    def run_once(self, before_commit: Optional[Callable] = None, limit: Optional[int] = None,
+                 dry_run: bool = False) -> Dict[str, int]:
+        """验证所有未检查的区块，返回各状态的数量"""
+        conn = self.connect()
+        try:
+            blocks = self.fetch_unchecked(conn.cursor(), limit)
+            conn.rollback()
+            counts = {STATUS_VALID: 0, STATUS_INVALID: 0, STATUS_NOT_FOUND: 0, STATUS_ERROR: 0}
+            if not blocks:
+                return counts
+            start = time.perf_counter()
+
+            def on_batch(results):
+                for result in results:
+                    counts[result['status']] += 1
+                    if result['status'] == STATUS_ERROR:
+                        logger.warning(f"检查 TARI 区块 {result['height']} 失败: {result['message']}")
+                if dry_run:
+                    for result in results:
+                        print(f"{result['height']}\t{result['status']}\t{result['message']}")
+                else:
+                    self.apply_batch(conn, results, before_commit)
+
+            asyncio.run(self.verify_blocks(blocks, on_batch))
+            logger.info(f"检查 {len(blocks)} 个 TARI 区块用时 {time.perf_counter() - start:.1f} 秒: "
+                        f"有效 {counts[STATUS_VALID]}, 无效 {counts[STATUS_INVALID]}, "
+                        f"未找到 {counts[STATUS_NOT_FOUND]}, 错误 {counts[STATUS_ERROR]}")
+            return counts
+        finally:
+            conn.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='并发验证未检查的 Tari 区块')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    parser.add_argument('--api-url', help='区块浏览器地址模板，包含 {height}')
+    parser.add_argument('--concurrency', type=int, help='同时进行的请求数')
+    parser.add_argument('--rate', type=float, help='每个主机每秒最多请求数，0为不限制')
+    parser.add_argument('--limit', type=int, help='最多检查的区块数')
+    parser.add_argument('--dry-run', action='store_true', help='只输出结果，不更新数据库')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    db = config['database']
+    cache = open_cache(config, os.path.dirname(os.path.abspath(args.config)))
+    settings = config.get('tari_verifier', {})
+
+    def connect():
+        return psycopg2.connect(host=db['host'], port=db['port'], database=db['database'],
+                                user=db['user'], password=db['password'])
+
+    verifier = TariVerifier(
+        connect,
+        args.api_url or settings.get('api_url', DEFAULT_API_URL),
+        args.concurrency or settings.get('concurrency', 8),
+        args.rate if args.rate is not None else settings.get('rate_per_second', 10),
+        settings.get('timeout', 10),
+        settings.get('batch_size', 100),
+        cache
+    )
+    try:
+        verifier.run_once(limit=args.limit, dry_run=args.dry_run)
+    except Exception as e:
+        logger.error(f"验证 TARI 区块失败: {str(e)}")
+        sys.exit(1)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import gzip
+
+from backfill_blocks import scan_logs, find_missing, find_reference_blocks, enqueue_missing
+from redis_keys import ROUND_PENDING_KEY
+from round_replay import save_round_snapshot
+
+TARI_BLOCK_ID = 'ab' * 32
+
+LOG = (
+    '2026-01-01 00:00:00 P2Pool got a payout of 0.6 XMR in block 100\n'
+    '2026-01-01 00:01:00 SideChain noise line\n'
+    f'2026-01-01 00:02:00 Merge Mined Tari block {TARI_BLOCK_ID} at height 200\n'
+    '2026-01-01 00:03:00 P2Pool got a payout of 0.7 XMR in block 101\n'
+)
+
+
+def test_scan_finds_blocks_across_chunks_and_gzip_files(tmp_path):
+    plain = tmp_path / 'p2pool.log'
+    plain.write_text(LOG)
+    rotated = tmp_path / 'p2pool.log.1.gz'
+    with gzip.open(rotated, 'wt') as f:
+        f.write(LOG + '2026-01-01 00:04:00 P2Pool got a payout of 0.8 XMR in block 102')
+    # 很小的块，覆盖行跨越块边界的路径
+    for chunk_size in (7, 50, 1 << 20):
+        events = scan_logs([str(plain), str(rotated)], 2, chunk_size)
+        assert [(chain, height, params) for chain, height, params, *_ in events] == [
+            ('tari', 200, {'height': 200, 'block_id': TARI_BLOCK_ID}),
+            ('xmr', 100, {'height': 100, 'reward': '0.6'}),
+            ('xmr', 101, {'height': 101, 'reward': '0.7'}),
+            ('xmr', 102, {'height': 102, 'reward': '0.8'}),
+        ]
+    # 压缩文件的偏移是解压后的字节偏移
+    (event,) = [event for event in scan_logs([str(rotated)], 1, 1 << 20) if event[1] == 102]
+    assert event[5] == len(LOG)
+
+
+def event(chain, height, params):
+    return (chain, height, dict(params, height=height), '', 'p2pool.log', 0)
+
+
+def test_missing_blocks_are_enqueued_with_reference(api, db):
+    cur = db.cursor()
+    cur.execute("INSERT INTO blocks (block_height, rewards, type, total_shares, time) VALUES (100, 1, 'xmr', 1, NOW())")
+    cur.execute("INSERT INTO block_events (chain, block_height, params, source) VALUES ('xmr', 102, '{}', 'log')")
+    for height in (99, 103):
+        save_round_snapshot(cur, 'xmr', height, {1: 1}, 0)
+    events = [event('xmr', height, {'reward': '0.6'}) for height in (100, 101, 102, 104)]
+    events.append(event('tari', 200, {'block_id': TARI_BLOCK_ID}))
+
+    missing = find_missing(cur, events)
+    assert [(e[0], e[1], queued) for e, queued in missing] == \
+        [('xmr', 101, False), ('xmr', 102, True), ('xmr', 104, False), ('tari', 200, False)]
+    # 优先取之后第一个有快照的区块，之后没有时取之前最近的一个
+    references = find_reference_blocks(cur, missing)
+    assert references == {('xmr', 101): 103, ('xmr', 102): 103, ('xmr', 104): 103}
+    assert enqueue_missing(cur, missing, references) == 3
+    assert enqueue_missing(cur, missing, references) == 0
+    cur.execute("SELECT chain, block_height, params, source FROM block_events ORDER BY id")
+    assert cur.fetchall()[1:] == [
+        ('xmr', 101, {'height': 101, 'reward': '0.6', 'reference_height': 103}, 'backfill'),
+        ('xmr', 104, {'height': 104, 'reward': '0.6', 'reference_height': 103}, 'backfill'),
+        ('tari', 200, {'height': 200, 'block_id': TARI_BLOCK_ID}, 'backfill'),
+    ]
+
+
+def test_backfilled_block_is_credited_from_reference_without_cutting_round(api, db):
+    api.mirror_user_logins({1: 'alice', 2: 'bob'})
+    cur = db.cursor()
+    save_round_snapshot(cur, 'tari', 150, {1: 1, 2: 3}, 0)
+    cur.execute("""
+        INSERT INTO block_events (chain, block_height, params, source)
+        VALUES ('tari', 140, %s, 'backfill'), ('tari', 130, %s, 'backfill')
+    """, (f'{{"height": 140, "block_id": "{TARI_BLOCK_ID}", "reference_height": 150}}',
+          f'{{"height": 130, "block_id": "{TARI_BLOCK_ID}"}}'))
+    db.commit()
+    api.increment_submit_counts_batch([{'username': 'alice', 'count': 4}])
+
+    worker = api.BlockEventWorker(0)
+    assert worker.process_next() and worker.process_next()
+    cur.execute("SELECT block_height, status FROM block_events ORDER BY block_height")
+    assert cur.fetchall() == [(130, 'failed'), (140, 'done')]
+    # 快照中的用户在入账时创建账户，奖励按参考区块的提交分布 1:3 和快照中保存的费率 (0) 分配
+    cur.execute("SELECT username, tari_balance FROM account_balance ORDER BY username")
+    assert cur.fetchall() == [('alice', 3450000000), ('bob', 10350000000)]
+    cur.execute("SELECT shares FROM round_snapshots WHERE type = 'tari' AND block_height = 140")
+    assert cur.fetchone()[0] == [1, 3]
+    db.commit()
+    assert api.get_submit_counts('alice') == {'xmr': 4, 'tari': 4}
+    assert api.redis_client.zcard(ROUND_PENDING_KEY) == 0
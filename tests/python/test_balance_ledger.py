@@ -0,0 +1,93 @@
+import pytest
+
+from balance_ledger import LedgerCompactor, append_entries, compact, discard_pending, pending_count
+from conftest import connect
+
+
+def create_accounts(db, *usernames):
+    cur = db.cursor()
+    for username in usernames:
+        cur.execute("INSERT INTO account (username) VALUES (%s)", (username,))
+    db.commit()
+
+
+def balances(db, view='account'):
+    cur = db.cursor()
+    cur.execute(f"SELECT username, xmr_balance, tari_balance FROM {view} ORDER BY username")
+    rows = {username: (xmr, tari) for username, xmr, tari in cur.fetchall()}
+    db.commit()
+    return rows
+
+
+def watermark(db):
+    cur = db.cursor()
+    cur.execute("SELECT last_compacted_id FROM ledger_watermark")
+    value = cur.fetchone()[0]
+    db.commit()
+    return value
+
+
+def test_compact_folds_by_watermark_without_updating_entries(api, db):
+    create_accounts(db, 'alice', 'bob')
+    cur = db.cursor()
+    append_entries(cur, [('alice', 'xmr', 100, 'reward', 1), ('bob', 'tari', 7, 'reward', 1),
+                         ('alice', 'xmr', -30, 'payment', 'tx'), ('alice', 'tari', 0, 'reward', 2)])
+    db.commit()
+    assert balances(db, 'account_balance') == {'alice': (70, 0), 'bob': (0, 7)}
+    cur.execute("SELECT id, xmin::text FROM balance_ledger ORDER BY id")
+    versions = cur.fetchall()
+    db.commit()
+
+    compactor = LedgerCompactor(api.get_db_connection, batch_size=2)
+    assert compactor.compact_all() == 3
+    assert watermark(db) == 3
+    assert balances(db) == {'alice': (70, 0), 'bob': (0, 7)}
+    assert balances(db, 'account_balance') == {'alice': (70, 0), 'bob': (0, 7)}
+    # 压缩只推进水位，流水行没有产生新版本
+    cur.execute("SELECT id, xmin::text FROM balance_ledger ORDER BY id")
+    assert cur.fetchall() == versions
+    assert pending_count(cur) == 0
+    db.commit()
+
+
+def test_compactor_waits_for_uncommitted_entries(api, db):
+    create_accounts(db, 'alice')
+    writer = connect(api.config['database'])
+    try:
+        # 先分配到较小 id 的流水后提交，压缩器不能越过它推进水位
+        append_entries(writer.cursor(), [('alice', 'xmr', 5, 'reward', 1)])
+        cur = db.cursor()
+        append_entries(cur, [('alice', 'xmr', 10, 'reward', 2)])
+        db.commit()
+
+        compactor = LedgerCompactor(api.get_db_connection, lock_timeout_ms=100)
+        assert compactor.compact_all() == 0
+        assert watermark(db) == 0
+
+        writer.commit()
+        assert compactor.compact_all() == 2
+        assert balances(db) == {'alice': (15, 0)}
+    finally:
+        writer.close()
+
+
+def test_compact_fails_loudly_for_username_without_account(api, db):
+    create_accounts(db, 'alice')
+    cur = db.cursor()
+    cur.execute("ALTER TABLE balance_ledger DROP CONSTRAINT balance_ledger_username_fkey")
+    append_entries(cur, [('alice', 'xmr', 5, 'reward', 1), ('ghost', 'xmr', 9, 'reward', 1)])
+    with pytest.raises(RuntimeError, match='ghost'):
+        compact(cur)
+
+
+def test_discard_pending_advances_watermark(api, db):
+    create_accounts(db, 'alice')
+    cur = db.cursor()
+    append_entries(cur, [('alice', 'xmr', 5, 'reward', 1), ('alice', 'tari', 3, 'reward', 1)])
+    db.commit()
+    assert discard_pending(cur) == 2
+    db.commit()
+    assert watermark(db) == 2
+    assert balances(db, 'account_balance') == {'alice': (0, 0)}
+    assert LedgerCompactor(api.get_db_connection).compact_all() == 0
+
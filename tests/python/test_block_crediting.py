@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+XMR_WALLET = '4' + 'A' * 94
+TARI_WALLET = '12' + 'B' * 89
+WALLET_LOGIN = f'{XMR_WALLET}:{TARI_WALLET}'
+
+
+def submit(api, login, count):
+    api.increment_submit_counts_batch([{'username': login, 'count': count}])
+
+
+def query(db, sql, args=()):
+    cur = db.cursor()
+    cur.execute(sql, args)
+    rows = cur.fetchall()
+    db.commit()
+    return rows
+
+
+def test_xmr_block_credits_whole_round(api, db):
+    submit(api, 'alice', 2)
+    submit(api, WALLET_LOGIN, 1)
+    result = api.handle_xmr_block({'height': 100, 'reward': '0.6'})
+    assert result['success'] and result['credited'] == 2 and result['total_shares'] == 3
+
+    # 0.6 XMR 扣除8%手续费后按 2:1 分配，单位为 piconero
+    assert query(db, "SELECT username, reward, shares FROM rewards ORDER BY shares DESC") == \
+        [('alice', 368000000000, 2), (TARI_WALLET, 184000000000, 1)]
+    assert query(db, "SELECT username, type, amount, ref FROM balance_ledger ORDER BY id") == \
+        [('alice', 'xmr', 368000000000, '100'), (TARI_WALLET, 'xmr', 184000000000, '100')]
+    assert query(db, "SELECT username, xmr_wallet, tari_wallet FROM account ORDER BY id") == \
+        [('alice', None, None), (TARI_WALLET, XMR_WALLET, TARI_WALLET)]
+    assert query(db, "SELECT rewards, total_shares FROM blocks WHERE type = 'xmr' AND block_height = 100") == \
+        [(600000000000, 3)]
+    assert query(db, "SELECT shares, total_shares FROM round_snapshots WHERE type = 'xmr' AND block_height = 100") == \
+        [([2, 1], 3)]
+    assert api.get_submit_counts('alice') == {'xmr': 0, 'tari': 2}
+
+
+def test_credited_block_is_not_credited_twice(api, db):
+    submit(api, 'alice', 2)
+    assert api.handle_xmr_block({'height': 100, 'reward': '0.6'})['success']
+    submit(api, 'alice', 5)
+    result = api.handle_xmr_block({'height': 100, 'reward': '0.6'})
+    assert result['message'] == 'Block already exists in database'
+    assert query(db, "SELECT COUNT(*), SUM(amount) FROM balance_ledger") == [(1, 552000000000)]
+    # 重复的事件不切换轮次，新一轮的提交保留
+    assert api.get_submit_counts('alice') == {'xmr': 5, 'tari': 7}
+
+
+def test_tari_block_backfills_wallets_of_existing_accounts(api, db):
+    cur = db.cursor()
+    cur.execute("INSERT INTO account (username, xmr_wallet) VALUES (%s, '')", (TARI_WALLET,))
+    db.commit()
+    submit(api, WALLET_LOGIN, 2)
+    submit(api, 'alice', 1)
+    result = api.handle_tari_block({'height': 200, 'block_id': 'ab' * 32})
+    assert result['success'] and result['credited'] == 2
+
+    # 13800 Tari 扣除8%手续费后按 2:1 分配，单位为 microTari
+    assert query(db, "SELECT username, tari_balance FROM account_balance ORDER BY username") == \
+        [(TARI_WALLET, 8464000000), ('alice', 4232000000)]
+    assert query(db, "SELECT username, xmr_wallet, tari_wallet, fee FROM account ORDER BY id") == \
+        [(TARI_WALLET, XMR_WALLET, TARI_WALLET, Decimal('0.08')), ('alice', '', '', Decimal('0.08'))]
+    assert query(db, "SELECT block_id, is_valid FROM blocks WHERE type = 'tari'") == [('ab' * 32, False)]
+    assert api.get_submit_counts('alice') == {'xmr': 1, 'tari': 0}
+
+
+def test_round_without_shares_is_not_credited(api, db):
+    result = api.handle_xmr_block({'height': 100, 'reward': '0.6'})
+    assert result == {'error': '没有找到提交记录', 'retry': False}
+    assert api.handle_xmr_block({'height': 101})['retry'] is False
+    assert query(db, "SELECT COUNT(*) FROM blocks") == [(0,)]
@@ -0,0 +1,71 @@
+import pytest
+
+from redis_keys import get_range_key
+
+TARI_BLOCK_ID = 'AB' * 32
+
+
+def block_request(method, params, request_id=1):
+    return {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': request_id}
+
+
+def test_parse_block_event(api_server):
+    parse = api_server.parse_block_event
+    assert parse('xmr', {'height': 100, 'reward': 0.6, 'extra': 1}) == {'height': 100, 'reward': '0.6'}
+    assert parse('tari', {'height': 200, 'block_id': TARI_BLOCK_ID, 'timestamp': 1700000000.5}) == \
+        {'height': 200, 'block_id': TARI_BLOCK_ID.lower(), 'timestamp': 1700000000}
+    for chain, params, field in (
+        ('xmr', [100], 'params'),
+        ('xmr', {'height': '100', 'reward': '0.6'}, 'height'),
+        ('xmr', {'height': True, 'reward': '0.6'}, 'height'),
+        ('xmr', {'height': 0, 'reward': '0.6'}, 'height'),
+        ('xmr', {'height': 100}, 'reward'),
+        ('xmr', {'height': 100, 'reward': '-1'}, 'reward'),
+        ('xmr', {'height': 100, 'reward': 'abc'}, 'reward'),
+        ('tari', {'height': 200}, 'block_id'),
+        ('tari', {'height': 200, 'block_id': 'xyz'}, 'block_id'),
+        ('tari', {'height': 200, 'block_id': TARI_BLOCK_ID, 'timestamp': 'now'}, 'timestamp'),
+    ):
+        with pytest.raises(ValueError, match=field):
+            parse(chain, params)
+
+
+def test_block_event_is_queued_once(api, db):
+    api.increment_submit_counts_batch([{'username': 'alice', 'count': 3}])
+    http = api.app.test_client()
+    response = http.post('/json_rpc', json=block_request('xmr_block', {'height': 100, 'reward': '0.6'})).get_json()
+    assert response['result'] == {'status': 'OK', 'queued': True, 'block_height': 100}
+    # 入队时切换轮次，日志监控随后上报的同一区块不再入队
+    assert api.redis_client.exists(get_range_key('xmr', 100))
+    assert not api.enqueue_block_event('xmr', 100, {'height': 100, 'reward': '0.6'}, 'log')
+    response = http.post('/json_rpc', json=block_request('xmr_block', {'height': 100, 'reward': '0.6'})).get_json()
+    assert response['result']['queued'] is False
+
+    assert api.BlockEventWorker(0).process_next()
+    cur = db.cursor()
+    cur.execute("SELECT source, status FROM block_events")
+    assert cur.fetchall() == [('event', 'done')]
+    cur.execute("SELECT username, shares FROM rewards")
+    assert cur.fetchall() == [('alice', 3)]
+
+
+def test_block_event_is_rejected_from_other_hosts(api, db):
+    http = api.app.test_client()
+    response = http.post('/json_rpc', json=block_request('tari_block', {'height': 200, 'block_id': TARI_BLOCK_ID}),
+                         environ_base={'REMOTE_ADDR': '10.0.0.5'}).get_json()
+    assert response['error']['code'] == -32601
+    response = http.post('/json_rpc', json=block_request('tari_block', {'height': 200})).get_json()
+    assert response['error']['code'] == -32602
+    cur = db.cursor()
+    cur.execute("SELECT COUNT(*) FROM block_events")
+    assert cur.fetchone()[0] == 0
+
+
+def test_block_event_stores_normalized_params(api, db):
+    http = api.app.test_client()
+    params = {'height': 200, 'block_id': TARI_BLOCK_ID, 'reward': '13800', 'note': 'ignored'}
+    assert http.post('/json_rpc', json=block_request('tari_block', params)).get_json()['result']['queued']
+    cur = db.cursor()
+    cur.execute("SELECT chain, block_height, params, source FROM block_events")
+    assert cur.fetchall() == [('tari', 200, {'height': 200, 'block_id': TARI_BLOCK_ID.lower(), 'reward': '13800'},
+                               'event')]
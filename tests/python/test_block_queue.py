@@ -0,0 +1,142 @@
+import threading
+
+import pytest
+
+from redis_keys import ROUND_PENDING_KEY, get_range_key
+
+
+def submit(api, login, count):
+    api.increment_submit_counts_batch([{'username': login, 'count': count}])
+
+
+def fetch_rewards(db, chain, block_height):
+    cur = db.cursor()
+    cur.execute("SELECT username, shares FROM rewards WHERE type = %s AND block_height = %s",
+                (chain, block_height))
+    rows = dict(cur.fetchall())
+    db.commit()
+    return rows
+
+
+def test_event_is_not_claimable_before_enqueue_snapshot(api, db, monkeypatch):
+    submit(api, 'alice', 5)
+    flushing = threading.Event()
+    release = threading.Event()
+
+    def slow_flush():
+        flushing.set()
+        release.wait(5)
+
+    # 集群刷新最多等待 cluster_flush_timeout_ms，这段时间内工作线程不能领取事件
+    monkeypatch.setattr(api, 'flush_submit_aggregator', slow_flush)
+    enqueue = threading.Thread(target=api.enqueue_block_event, args=('xmr', 100, {'height': 100, 'reward': '0.6'}))
+    enqueue.start()
+    assert flushing.wait(5)
+    worker = api.BlockEventWorker(0)
+    assert not worker.process_next()
+
+    release.set()
+    enqueue.join(5)
+    assert api.redis_client.exists(get_range_key('xmr', 100))
+    # 入队之后的提交计入下一轮，工作线程入账时复用入队时的快照，不再切换轮次
+    submit(api, 'alice', 2)
+    assert worker.process_next()
+
+    assert fetch_rewards(db, 'xmr', 100) == {'alice': 5}
+    assert api.get_submit_counts('alice') == {'xmr': 2, 'tari': 7}
+    assert api.redis_client.zcard(ROUND_PENDING_KEY) == 0
+    assert not api.redis_client.exists(get_range_key('xmr', 100))
+
+
+def test_crediting_flushes_only_when_cutting_round(api, monkeypatch):
+    flushes = []
+    monkeypatch.setattr(api, 'flush_submit_aggregator', lambda: flushes.append(1))
+    submit(api, 'alice', 3)
+    assert api.enqueue_block_event('xmr', 100, {'height': 100, 'reward': '0.6'})
+    assert len(flushes) == 1
+    # 复用入队时切换的快照，不再刷新聚合器
+    assert api.handle_xmr_block({'height': 100, 'reward': '0.6'})['credited'] == 1
+    assert len(flushes) == 1
+    # 入队时切换失败的区块在入账时切换，切换前刷新
+    submit(api, 'alice', 2)
+    assert api.handle_xmr_block({'height': 101, 'reward': '0.6'})['credited'] == 1
+    assert len(flushes) == 2
+
+
+def test_duplicate_event_does_not_cut_round_again(api):
+    submit(api, 'alice', 3)
+    assert api.enqueue_block_event('tari', 200, {'height': 200, 'block_id': 'ab' * 32}, 'event')
+    submit(api, 'alice', 4)
+    assert not api.enqueue_block_event('tari', 200, {'height': 200, 'block_id': 'ab' * 32}, 'log')
+    assert api.get_submit_counts('alice') == {'xmr': 7, 'tari': 4}
+
+
+def test_failed_commit_restores_round(api, monkeypatch):
+    submit(api, 'alice', 3)
+
+    class FailingConnection:
+        """快照在提交之前切换，之后入队事务提交失败"""
+        def __init__(self, conn):
+            self.conn = conn
+
+        def cursor(self):
+            return self.conn.cursor()
+
+        def commit(self):
+            raise RuntimeError('connection lost')
+
+        def rollback(self):
+            self.conn.rollback()
+
+        def close(self):
+            self.conn.close()
+
+    get_db_connection = api.get_db_connection
+    monkeypatch.setattr(api, 'get_db_connection', lambda: FailingConnection(get_db_connection()))
+    with pytest.raises(RuntimeError):
+        api.enqueue_block_event('xmr', 101, {'height': 101, 'reward': '0.6'})
+    assert not api.redis_client.exists(get_range_key('xmr', 101))
+    assert api.get_submit_counts('alice') == {'xmr': 3, 'tari': 3}
+
+
+def test_failed_event_archives_and_releases_snapshot(api, db):
+    submit(api, 'alice', 5)
+    # 缺少奖励的事件不重试，直接标记为 failed
+    assert api.enqueue_block_event('xmr', 300, {'height': 300})
+    submit(api, 'alice', 1)
+    worker = api.BlockEventWorker(0)
+    assert worker.process_next()
+
+    cur = db.cursor()
+    cur.execute("SELECT status FROM block_events WHERE chain = 'xmr' AND block_height = 300")
+    assert cur.fetchone()[0] == 'failed'
+    cur.execute("SELECT shares, total_shares FROM round_snapshots WHERE type = 'xmr' AND block_height = 300")
+    assert cur.fetchone() == ([5], 5)
+    db.commit()
+    assert api.redis_client.zcard(ROUND_PENDING_KEY) == 0
+    assert not api.redis_client.exists(get_range_key('xmr', 300))
+
+    # 人工处理: 改回 pending 并按转存的快照入账，快照中的新用户在入账时创建账户
+    cur.execute("""
+        UPDATE block_events SET status = 'pending', source = 'backfill', params = '{"height": 300, "reward": "0.6"}'
+        WHERE chain = 'xmr' AND block_height = 300
+    """)
+    db.commit()
+    assert worker.process_next()
+    assert fetch_rewards(db, 'xmr', 300) == {'alice': 5}
+    assert api.get_submit_counts('alice') == {'xmr': 1, 'tari': 6}
+
+
+def test_startup_archives_snapshots_of_failed_events(api, db):
+    submit(api, 'alice', 4)
+    api.snapshot_round('tari', 400)
+    cur = db.cursor()
+    cur.execute("""
+        INSERT INTO block_events (chain, block_height, params, status)
+        VALUES ('tari', 400, '{"height": 400}', 'failed')
+    """)
+    db.commit()
+    api.archive_failed_snapshots()
+    cur.execute("SELECT shares FROM round_snapshots WHERE type = 'tari' AND block_height = 400")
+    assert cur.fetchone()[0] == [4]
+    assert api.redis_client.zcard(ROUND_PENDING_KEY) == 0
@@ -0,0 +1,58 @@
+def restore_height_key(cur):
+    """在测试事务中改回旧版以 block_height 为主键、rewards 只引用高度的表结构，测试结束时随事务回滚"""
+    cur.execute("""
+        ALTER TABLE rewards DROP CONSTRAINT rewards_type_block_height_fkey;
+        ALTER TABLE blocks DROP CONSTRAINT blocks_pkey;
+        ALTER TABLE blocks ADD CONSTRAINT blocks_pkey PRIMARY KEY (block_height);
+        ALTER TABLE rewards ADD CONSTRAINT rewards_block_height_fkey
+            FOREIGN KEY (block_height) REFERENCES blocks (block_height);
+        INSERT INTO account (username) VALUES ('alice');
+        INSERT INTO blocks (block_height, rewards, type, total_shares, time) VALUES (100, 600, 'xmr', 3, NOW());
+    """)
+
+
+def blocks_constraints(cur):
+    cur.execute("""
+        SELECT conname, pg_get_constraintdef(oid), convalidated
+        FROM pg_constraint
+        WHERE conrelid = 'blocks'::regclass OR confrelid = 'blocks'::regclass
+        ORDER BY conname
+    """)
+    return cur.fetchall()
+
+
+def test_same_height_on_both_chains_after_migration(api, db):
+    cur = db.cursor()
+    restore_height_key(cur)
+    cur.execute("""
+        INSERT INTO rewards (block_height, type, username, reward, shares) VALUES (100, 'xmr', 'alice', 600, 3)
+    """)
+    api.migrate_blocks_key(cur)
+    assert blocks_constraints(cur) == [
+        ('blocks_pkey', 'PRIMARY KEY (type, block_height)', True),
+        ('rewards_type_block_height_fkey',
+         'FOREIGN KEY (type, block_height) REFERENCES blocks(type, block_height)', True),
+    ]
+    # 旧表中与 XMR 区块同高度的 Tari 区块会被丢弃
+    cur.execute("INSERT INTO blocks (block_height, rewards, type, total_shares, time) VALUES (100, 9, 'tari', 1, NOW())")
+    cur.execute("SELECT COUNT(*) FROM blocks WHERE block_height = 100")
+    assert cur.fetchone()[0] == 2
+
+    # 已迁移的表直接跳过
+    api.migrate_blocks_key(cur)
+    assert len(blocks_constraints(cur)) == 2
+
+
+def test_rewards_with_mismatched_type_keep_unvalidated_key(api, db):
+    cur = db.cursor()
+    restore_height_key(cur)
+    # 旧外键只检查高度，类型不符的奖励记录也能写入
+    cur.execute("""
+        INSERT INTO rewards (block_height, type, username, reward, shares) VALUES (100, 'tari', 'alice', 9, 1)
+    """)
+    api.migrate_blocks_key(cur)
+    assert ('rewards_type_block_height_fkey',
+            'FOREIGN KEY (type, block_height) REFERENCES blocks(type, block_height) NOT VALID',
+            False) in blocks_constraints(cur)
+    cur.execute("SELECT COUNT(*) FROM rewards")
+    assert cur.fetchone()[0] == 1
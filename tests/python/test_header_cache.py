@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import header_cache
+from header_cache import HeaderCache
+
+REORG_DEPTH = 5
+BLOCK_TIME = 120
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1700000000.0]
+    monkeypatch.setattr(header_cache.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = HeaderCache(str(tmp_path / 'headers.sqlite'), lru_size=100, reorg_depth=REORG_DEPTH,
+                        block_time=BLOCK_TIME, recent_ttl=60)
+    yield cache
+    cache.close()
+
+
+def header(height, fork='a', timestamp=None, prev_fork=None):
+    return {'hash': f'{fork}{height}', 'prev_hash': f'{prev_fork or fork}{height - 1}',
+            'timestamp': int(time.time()) if timestamp is None else timestamp}
+
+
+def old_header(height, fork='a', prev_fork=None):
+    """获取时已超过重组深度的区块头"""
+    return header(height, fork, int(time.time()) - REORG_DEPTH * BLOCK_TIME, prev_fork)
+
+
+def cached_hashes(cache, heights):
+    return {height: entry['hash'] for height, entry in cache.get_many(heights).items()}
+
+
+def test_is_final(cache, clock):
+    final_age = REORG_DEPTH * BLOCK_TIME
+    assert cache.is_final({'timestamp': clock[0] - final_age, 'fetched_at': clock[0]})
+    assert not cache.is_final({'timestamp': clock[0] - final_age + 1, 'fetched_at': clock[0]})
+    assert not cache.is_final({'timestamp': None, 'fetched_at': clock[0]})
+
+
+def test_recent_headers_expire_final_headers_do_not(cache, clock):
+    cache.put(1, old_header(1))
+    cache.put(2, header(2))
+    clock[0] += 61
+    assert cache.get(1) == {'hash': 'a1', 'prev_hash': 'a0', 'timestamp': old_header(1)['timestamp'] - 61}
+    assert cache.get(2) is None
+
+
+def test_hash_change_drops_recent_headers_above(cache, clock):
+    cache.put(11, header(11))
+    cache.put(12, old_header(12))
+    cache.put(13, header(13, prev_fork='x'))
+    cache.put(10 + REORG_DEPTH + 1, header(10 + REORG_DEPTH + 1))
+    cache.put(10, header(10))
+    cache.put(10, header(10, 'b'))
+    # 重组深度以内未确定的区块头被删除，已确定的和更高的保留
+    assert cached_hashes(cache, range(10, 17)) == {10: 'b10', 12: 'a12', 16: 'a16'}
+    assert cache.load(11) is None
+
+
+def test_same_hash_keeps_headers_above(cache, clock):
+    cache.put(10, header(10))
+    cache.put(11, header(11))
+    cache.put(10, header(10))
+    assert cached_hashes(cache, [10, 11]) == {10: 'a10', 11: 'a11'}
+
+
+def test_prev_hash_mismatch_drops_recent_parent(cache, clock):
+    cache.put(20, header(20))
+    cache.put(21, header(21, 'b', prev_fork='b'))
+    assert cached_hashes(cache, [20, 21]) == {21: 'b21'}
+
+    cache.put(30, old_header(30))
+    cache.put(31, header(31, 'b', prev_fork='b'))
+    assert cached_hashes(cache, [30, 31]) == {30: 'a30', 31: 'b31'}
+
+
+def test_entries_persist_across_instances(cache, clock, tmp_path):
+    cache.put(1, old_header(1))
+    other = HeaderCache(cache.path, reorg_depth=REORG_DEPTH, block_time=BLOCK_TIME)
+    try:
+        assert other.get(1)['hash'] == 'a1'
+        assert other.invalidate_from(1) == 1
+    finally:
+        other.close()
@@ -0,0 +1,95 @@
+import asyncio
+
+from redis_keys import TOTAL_SHARES_KEY
+
+
+def submit_request(request_id, username, **params):
+    request = {'jsonrpc': '2.0', 'method': 'submit', 'params': dict(params, username=username)}
+    if request_id is not None:
+        request['id'] = request_id
+    return request
+
+
+def test_concurrent_submits_are_deduplicated(ingest):
+    post, client = ingest
+    batch = [submit_request(1, 'alice', share_id='s1'), submit_request(2, 'alice', share_id='s1'),
+             submit_request(3, 'bob', job_id='j', nonce=0, extra_nonce=0)]
+    status, responses = asyncio.run(post(batch))
+    assert status == 200
+    assert [response['id'] for response in responses] == [1, 2, 3]
+    assert sorted('duplicate' in response['result'] for response in responses[:2]) == [False, True]
+    assert responses[2]['result']['submit_counts'] == {'xmr': 1, 'tari': 1}
+    assert sorted(asyncio.run(client.hvals(TOTAL_SHARES_KEY))) == ['1', '1']
+
+
+def test_batch_submission_with_invalid_entries(ingest):
+    post, _ = ingest
+    params = {'batch_id': 0, 'shares': [{'username': 'alice', 'count': 3}, {'username': 'alice', 'count': -1}]}
+    status, response = asyncio.run(post({'jsonrpc': '2.0', 'method': 'submit_batch', 'params': params, 'id': 7}))
+    result = response['result']
+    assert (result['accepted'], result['rejected']) == (1, 1)
+    assert result['results'][0]['submit_counts'] == {'xmr': 3, 'tari': 3}
+    assert result['results'][1]['error']['code'] == -32602
+    # batch_id 为 0 的整批重发也被丢弃
+    status, response = asyncio.run(post({'jsonrpc': '2.0', 'method': 'submit_batch', 'params': params, 'id': 8}))
+    assert response['result']['duplicate']
+
+
+def test_notifications_get_no_response(ingest):
+    post, client = ingest
+    status, responses = asyncio.run(post([submit_request(1, 'alice'), submit_request(None, 'bob'),
+                                          {'jsonrpc': '2.0', 'id': 3}]))
+    assert [response['id'] for response in responses] == [1, 3]
+    assert responses[1]['error']['code'] == -32600
+    assert asyncio.run(post([submit_request(None, 'bob')])) == (204, None)
+    assert asyncio.run(post(submit_request(None, 'bob'))) == (204, None)
+    assert len(asyncio.run(client.hvals(TOTAL_SHARES_KEY))) == 2
+
+
+def test_batch_size_is_limited(ingest, ingest_server):
+    post, client = ingest
+    batch = [submit_request(i, 'alice') for i in range(ingest_server.MAX_JSON_RPC_BATCH + 1)]
+    status, response = asyncio.run(post(batch))
+    assert response['error']['code'] == -32600
+    assert asyncio.run(client.hvals(TOTAL_SHARES_KEY)) == []
+
+
+def test_concurrent_submits_share_one_redis_call(ingest_server, monkeypatch):
+    import fakeredis
+    monkeypatch.setattr(ingest_server, 'mirror_user_logins', lambda new_users: None)
+
+    async def run():
+        coalescer = ingest_server.SubmitCoalescer(fakeredis.aioredis.FakeRedis(decode_responses=True))
+        calls = []
+        claim = coalescer.dedup.claim
+
+        async def counting_claim(entries):
+            calls.append(len(entries))
+            return await claim(entries)
+
+        coalescer.dedup.claim = counting_claim
+        results = await asyncio.gather(*(
+            ingest_server.handle_submit(coalescer, {'username': f'user{i % 3}', 'share_id': i}) for i in range(20)))
+        return calls, results
+
+    calls, results = asyncio.run(run())
+    assert calls == [20]
+    # 三个用户分别提交 7、7、6 次，每次返回该用户的累计数
+    totals = sorted(result['result']['submit_counts']['xmr'] for result in results)
+    assert totals == sorted(list(range(1, 8)) * 2 + list(range(1, 7)))
+
+
+def test_new_users_are_mirrored_to_account_login(ingest_server, api, db, database_config, monkeypatch):
+    import fakeredis
+    monkeypatch.setitem(ingest_server.config, 'database', database_config)
+    login = 'x' * 95 + ':' + 't' * 91
+
+    async def run():
+        coalescer = ingest_server.SubmitCoalescer(fakeredis.aioredis.FakeRedis(decode_responses=True))
+        await coalescer.increment([{'username': login, 'count': 1}, {'username': 'bob', 'count': 2}])
+        await asyncio.gather(*coalescer.mirror_tasks)
+
+    asyncio.run(run())
+    cur = db.cursor()
+    cur.execute("SELECT user_id, username, xmr_wallet, tari_wallet FROM account_login ORDER BY user_id")
+    assert cur.fetchall() == [(1, 't' * 91, 'x' * 95, 't' * 91), (2, 'bob', None, None)]
@@ -0,0 +1,95 @@
+import pytest
+
+from leader import LeaderElection, LeadershipLost, ROLE_BLOCK_CREDITING
+from redis_keys import get_range_key
+
+
+@pytest.fixture
+def elections(api):
+    created = []
+
+    def create(role=ROLE_BLOCK_CREDITING, **kwargs):
+        election = LeaderElection(role, api.get_db_connection, **kwargs)
+        created.append(election)
+        return election
+
+    yield create
+    for election in created:
+        election.stop()
+
+
+def campaign(election):
+    """执行一轮选举 (与 run 中的一次循环相同)，不启动后台线程"""
+    election.conn = election.connect()
+    election.conn.autocommit = True
+    election.try_acquire(election.conn.cursor())
+    return election.is_leader
+
+
+def check_fence(election, db):
+    try:
+        election.check_fence(db.cursor())
+    finally:
+        db.rollback()
+
+
+def test_only_one_instance_is_elected(elections, db):
+    first, second = elections(), elections()
+    assert campaign(first) and first.token == 1
+    assert not campaign(second) and second.token is None
+    check_fence(first, db)
+    with pytest.raises(LeadershipLost):
+        check_fence(second, db)
+
+
+def test_stale_leader_is_fenced_off(elections, db):
+    old, new = elections(), elections()
+    assert campaign(old)
+    token = old.token
+    # 旧主实例的选举连接断开，锁被释放，但它还没有察觉
+    old.conn.close()
+    assert campaign(new) and new.token == token + 1
+    with pytest.raises(LeadershipLost):
+        check_fence(old, db)
+    check_fence(new, db)
+
+
+def test_roles_are_elected_independently(elections):
+    assert campaign(elections('log_tailer'))
+    assert campaign(elections(ROLE_BLOCK_CREDITING))
+
+
+def test_disabled_election_is_always_leader(elections, db):
+    election = elections(enabled=False)
+    assert election.is_leader and election.wait_for_leadership(0)
+    check_fence(election, db)
+
+
+def test_background_thread_takes_over_after_leader_stops(elections):
+    old, new = elections(interval=0.05), elections(interval=0.05)
+    old.start()
+    assert old.wait_for_leadership(5)
+    new.start()
+    assert not new.wait_for_leadership(0.2)
+    old.stop()
+    assert new.wait_for_leadership(5) and new.token == 2
+    assert not old.is_leader
+
+
+def test_stale_leader_cannot_commit_credits(api, elections, monkeypatch, db):
+    api.increment_submit_counts_batch([{'username': 'alice', 'count': 2}])
+    old, new = elections(), elections()
+    assert campaign(old)
+    old.conn.close()
+    assert campaign(new)
+    monkeypatch.setattr(api, 'crediting_leader', old)
+
+    assert 'error' in api.handle_xmr_block({'height': 100, 'reward': '0.6'})
+    cur = db.cursor()
+    cur.execute("SELECT COUNT(*) FROM blocks")
+    assert cur.fetchone()[0] == 0
+    db.commit()
+    # 事务回滚后快照保留，由新的主实例入账
+    assert api.redis_client.exists(get_range_key('xmr', 100))
+    monkeypatch.setattr(api, 'crediting_leader', new)
+    assert api.handle_xmr_block({'height': 100, 'reward': '0.6'})['credited'] == 1
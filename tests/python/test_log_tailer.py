@@ -0,0 +1,221 @@
+import json
+import os
+
+import pytest
+
+from log_tailer import LogTailer
+
+
+class Collector:
+    def __init__(self):
+        self.lines = []
+
+    def __call__(self, lines):
+        self.lines.extend(lines)
+
+
+def running():
+    return True
+
+
+def append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def read_state(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = tmp_path / 'p2pool.log'
+    path.write_text('old line 1\nold line 2\n')
+    return str(path), str(tmp_path / 'p2pool.log.state')
+
+
+def make_tailer(path, state_path):
+    # 很小的块，覆盖跨块拼接不完整行的路径
+    return LogTailer(path, state_path, chunk_size=7)
+
+
+def test_first_start_begins_at_end_and_saves_state(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    collector = Collector()
+    tailer.start(collector, running)
+    assert read_state(state_path) == {'path': path, 'inode': os.stat(path).st_ino,
+                                      'offset': os.path.getsize(path)}
+
+    append(path, 'new line\n')
+    assert tailer.drain(collector, running)
+    assert collector.lines == ['new line']
+    assert read_state(state_path)['offset'] == os.path.getsize(path)
+    tailer.close()
+
+
+def test_incomplete_line_waits_for_newline(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    collector = Collector()
+    tailer.start(collector, running)
+    size = os.path.getsize(path)
+
+    append(path, 'complete\npart')
+    tailer.drain(collector, running)
+    assert collector.lines == ['complete']
+    # 进度只到完整行结尾
+    assert read_state(state_path)['offset'] == size + len('complete\n')
+
+    append(path, 'ial\n')
+    tailer.drain(collector, running)
+    assert collector.lines == ['complete', 'partial']
+    tailer.close()
+
+
+def test_restart_resumes_from_saved_offset(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    tailer.start(Collector(), running)
+    append(path, 'before stop\n')
+    tailer.drain(Collector(), running)
+    tailer.close()
+
+    # 停机期间写入的行在重启后读取
+    append(path, 'while stopped\n')
+    restarted = make_tailer(path, state_path)
+    collector = Collector()
+    restarted.start(collector, running)
+    restarted.drain(collector, running)
+    assert collector.lines == ['while stopped']
+    restarted.close()
+
+
+def test_interrupted_batch_does_not_save_state(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    tailer.start(Collector(), running)
+    offset = read_state(state_path)['offset']
+
+    append(path, 'line\n')
+    collector = Collector()
+    assert not tailer.drain(collector, lambda: False)
+    assert collector.lines == ['line']
+    # 进度未保存，重启后会再次处理这一批
+    assert read_state(state_path)['offset'] == offset
+    tailer.close()
+
+
+def test_rename_rotation_reads_old_tail_then_new_file(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    collector = Collector()
+    tailer.start(collector, running)
+
+    append(path, 'before rotate\n')
+    os.rename(path, path + '.1')
+    # 写入方在改名后还写了最后一行
+    append(path + '.1', 'after rename\n')
+    # 新文件尚未创建时继续读旧文件
+    assert tailer.check_rotation(collector, running)
+    assert collector.lines == []
+
+    with open(path, 'w') as f:
+        f.write('new file\n')
+    assert tailer.check_rotation(collector, running)
+    assert collector.lines == ['before rotate', 'after rename']
+    assert read_state(state_path) == {'path': path, 'inode': os.stat(path).st_ino, 'offset': 0}
+
+    tailer.drain(collector, running)
+    assert collector.lines == ['before rotate', 'after rename', 'new file']
+    assert read_state(state_path)['offset'] == len('new file\n')
+    tailer.close()
+
+
+def test_rotation_while_stopped_finds_old_file_by_inode(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    tailer.start(Collector(), running)
+    tailer.close()
+
+    append(path, 'unread old\n')
+    os.rename(path, path + '.1')
+    with open(path, 'w') as f:
+        f.write('first new\n')
+
+    restarted = make_tailer(path, state_path)
+    collector = Collector()
+    restarted.start(collector, running)
+    assert collector.lines == ['unread old']
+    assert read_state(state_path) == {'path': path, 'inode': os.stat(path).st_ino, 'offset': 0}
+    restarted.drain(collector, running)
+    assert collector.lines == ['unread old', 'first new']
+    restarted.close()
+
+
+def test_rotated_file_deleted_while_stopped(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    tailer.start(Collector(), running)
+    tailer.close()
+
+    os.rename(path, path + '.1')
+    with open(path, 'w') as f:
+        f.write('first new\n')
+    os.remove(path + '.1')
+
+    restarted = make_tailer(path, state_path)
+    collector = Collector()
+    restarted.start(collector, running)
+    restarted.drain(collector, running)
+    assert collector.lines == ['first new']
+    restarted.close()
+
+
+def test_truncate_restarts_from_beginning(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    collector = Collector()
+    tailer.start(collector, running)
+    inode = os.stat(path).st_ino
+
+    # copytruncate: 同一个 inode 被截断后继续写入
+    with open(path, 'r+') as f:
+        f.truncate(0)
+    append(path, 'after\n')
+    assert tailer.check_rotation(collector, running)
+    assert read_state(state_path) == {'path': path, 'inode': inode, 'offset': 0}
+    tailer.drain(collector, running)
+    assert collector.lines == ['after']
+    tailer.close()
+
+
+def test_truncated_while_stopped(log):
+    path, state_path = log
+    tailer = make_tailer(path, state_path)
+    tailer.start(Collector(), running)
+    tailer.close()
+
+    with open(path, 'w') as f:
+        f.write('x\n')
+
+    restarted = make_tailer(path, state_path)
+    collector = Collector()
+    restarted.start(collector, running)
+    restarted.drain(collector, running)
+    assert collector.lines == ['x']
+    restarted.close()
+
+
+def test_corrupt_state_starts_at_end(log):
+    path, state_path = log
+    with open(state_path, 'w') as f:
+        f.write('{not json')
+    tailer = make_tailer(path, state_path)
+    collector = Collector()
+    tailer.start(collector, running)
+    tailer.drain(collector, running)
+    assert collector.lines == []
+    assert read_state(state_path)['offset'] == os.path.getsize(path)
+    tailer.close()
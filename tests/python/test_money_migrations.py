@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from psycopg2 import sql
+
+
+def column_type(cur, table, column):
+    cur.execute("""
+        SELECT data_type, numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cur.fetchone()
+
+
+def views(cur):
+    cur.execute("SELECT table_name FROM information_schema.views WHERE table_schema = current_schema()")
+    return sorted(row[0] for row in cur.fetchall())
+
+
+def restore_decimal_columns(api, cur):
+    """在测试事务中把金额列改回旧版的币值小数列，测试结束时随事务回滚"""
+    for view in api.MONEY_VIEWS:
+        cur.execute(sql.SQL("DROP VIEW IF EXISTS {}").format(sql.Identifier(view)))
+    # payment 表由支付脚本创建，测试库中没有
+    for table, column, _ in api.MONEY_COLUMNS:
+        if column_type(cur, table, column) is not None:
+            cur.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN {} TYPE DECIMAL(20,12)").format(
+                sql.Identifier(table), sql.Identifier(column)))
+    cur.execute("ALTER TABLE blocks ALTER COLUMN value TYPE DECIMAL(20,8)")
+
+
+def test_decimal_amounts_convert_to_atomic_units(api, db):
+    cur = db.cursor()
+    restore_decimal_columns(api, cur)
+    cur.execute("""
+        INSERT INTO account (username, xmr_balance, tari_balance) VALUES ('alice', 1.5, 2.25);
+        INSERT INTO blocks (block_height, rewards, type, total_shares, time, value)
+        VALUES (100, 0.6, 'xmr', 3, NOW(), 0.2), (100, 13800, 'tari', 4, NOW(), 3450);
+        INSERT INTO rewards (block_height, type, username, reward, shares)
+        VALUES (100, 'xmr', 'alice', 0.000000000001, 1), (100, 'tari', 'alice', 1.5, 1);
+        INSERT INTO balance_ledger (username, type, amount, reason) VALUES ('alice', 'tari', -0.5, 'payment');
+    """)
+    api.migrate_money_columns(cur)
+    for table, column, _ in api.MONEY_COLUMNS:
+        assert column_type(cur, table, column) in (None, ('bigint', 64, 0))
+    cur.execute("SELECT xmr_balance, tari_balance FROM account")
+    assert cur.fetchone() == (1500000000000, 2250000)
+    cur.execute("SELECT type, reward FROM rewards ORDER BY type")
+    assert cur.fetchall() == [('tari', 1500000), ('xmr', 1)]
+    cur.execute("SELECT amount FROM balance_ledger")
+    assert cur.fetchall() == [(-500000,)]
+
+    # 金额列转换之后、value 迁移之前写入的区块已经是最小单位
+    cur.execute("""
+        INSERT INTO blocks (block_height, rewards, type, total_shares, time, value)
+        VALUES (101, 600000000000, 'xmr', 3, NOW(), 200000000000), (101, 13800000000, 'tari', 4, NOW(), 3450000000)
+    """)
+    api.migrate_block_value(cur)
+    assert column_type(cur, 'blocks', 'value') == ('numeric',) + api.BLOCK_VALUE_PRECISION
+    cur.execute("SELECT type, block_height, rewards, value FROM blocks ORDER BY type, block_height")
+    assert cur.fetchall() == [('tari', 100, 13800000000, Decimal(3450000000)),
+                              ('tari', 101, 13800000000, Decimal(3450000000)),
+                              ('xmr', 100, 600000000000, Decimal(200000000000)),
+                              ('xmr', 101, 600000000000, Decimal(200000000000))]
+
+    # 再次启动时不重复转换
+    api.migrate_money_columns(cur)
+    api.migrate_block_value(cur)
+    cur.execute("SELECT SUM(value) FROM blocks WHERE type = 'xmr'")
+    assert cur.fetchone()[0] == 400000000000
+
+
+def test_migrated_schema_is_left_alone(api, db):
+    cur = db.cursor()
+    existing = views(cur)
+    api.migrate_money_columns(cur)
+    api.migrate_block_value(cur)
+    # 已转换的库不删除视图
+    assert 'account_balance' in existing and views(cur) == existing
@@ -0,0 +1,38 @@
+from redis_keys import get_range_key
+
+
+def test_legacy_per_user_keys_migrate_to_round_counts(api):
+    redis_client = api.redis_client
+    redis_client.set('xmr:submit:alice', 5)
+    redis_client.set('tari:submit:alice', 3)
+    redis_client.set('tari:submit:bob', 4)
+    redis_client.set('xmr:submit:carol', 1)
+    api.migrate_legacy_submit_keys()
+
+    assert api.get_submit_counts('alice') == {'xmr': 5, 'tari': 3}
+    assert api.get_submit_counts('bob') == {'xmr': 0, 'tari': 4}
+    assert api.get_submit_counts('carol') == {'xmr': 1, 'tari': 0}
+    assert api.get_round_shares('xmr') == {'alice': 5, 'carol': 1}
+    assert not redis_client.keys('xmr:submit:*') and not redis_client.keys('tari:submit:*')
+
+    # 迁移之后的一个提交同时计入两条链，再次启动不会重复迁移
+    api.increment_submit_counts_batch([{'username': 'alice', 'count': 1}])
+    api.migrate_legacy_submit_keys()
+    assert api.get_submit_counts('alice') == {'xmr': 6, 'tari': 4}
+
+
+def test_legacy_keys_merge_into_existing_generations(api):
+    redis_client = api.redis_client
+    # 新版本已经在运行，XMR 爆块后的快照尚未入账
+    api.increment_submit_counts_batch([{'username': 'alice', 'count': 2}])
+    api.snapshot_round('xmr', 100)
+    api.increment_submit_counts_batch([{'username': 'alice', 'count': 1}])
+    # 旧版本进程写入的计数
+    redis_client.set('tari:submit:alice', 4)
+    redis_client.set('xmr:submit:bob', 3)
+    api.migrate_legacy_submit_keys()
+
+    assert api.get_submit_counts('alice') == {'xmr': 1, 'tari': 7}
+    assert api.get_submit_counts('bob') == {'xmr': 3, 'tari': 0}
+    alice = api.user_registry.get_ids(['alice'])[0]
+    assert api.get_snapshot_shares(get_range_key('xmr', 100)) == {alice: 2}
@@ -0,0 +1,85 @@
+import random
+from decimal import Decimal, ROUND_DOWN
+
+import numpy as np
+import pytest
+
+from reward_split import INT64_MAX, split_reward, split_round_rewards
+
+
+def test_parts_sum_to_reward():
+    rng = random.Random(0)
+    for _ in range(200):
+        shares = [rng.randint(0, 10 ** 6) for _ in range(rng.randint(1, 50))]
+        shares[0] += 1
+        reward = rng.randint(0, 10 ** 13)
+        rewards = split_reward(reward, shares)
+        assert len(rewards) == len(shares)
+        assert int(rewards.sum()) == reward
+        # 每人得到的是按比例向下取整的值或再多1
+        for part, s in zip(rewards.tolist(), shares):
+            assert reward * s // sum(shares) <= part <= reward * s // sum(shares) + 1
+
+
+def test_largest_remainder_gets_leftover():
+    # 10 * [1, 2, 4] / 7 = [1.43, 2.86, 5.71]，剩余的1个单位给余数最大的第二个
+    assert split_reward(10, [1, 2, 4]).tolist() == [1, 3, 6]
+
+
+def test_equal_remainders_follow_input_order():
+    assert split_reward(10, [1, 1, 1]).tolist() == [4, 3, 3]
+    assert split_reward(11, [1, 1, 1]).tolist() == [4, 4, 3]
+    assert split_reward(2, [5, 1, 5, 5]).tolist() == [1, 0, 1, 0]
+
+
+def test_result_is_deterministic():
+    shares = list(range(1, 1000))
+    first = split_reward(123456789, shares).tolist()
+    assert split_reward(123456789, shares).tolist() == first
+    assert split_reward(123456789, np.array(shares)).tolist() == first
+
+
+def test_no_participants():
+    rewards = split_reward(1000, [])
+    assert rewards.size == 0
+    assert split_round_rewards(1000, 0.08, []) == []
+
+
+def test_single_participant_gets_everything():
+    assert split_reward(1000, [7]).tolist() == [1000]
+    assert split_round_rewards(1000, 0.08, [7]) == [920]
+
+
+def test_zero_shares_get_nothing():
+    assert split_reward(100, [0, 3, 0, 1]).tolist() == [0, 75, 0, 25]
+
+
+def test_invalid_shares():
+    with pytest.raises(ValueError):
+        split_reward(100, [1, -1])
+    with pytest.raises(ValueError):
+        split_reward(100, [0, 0])
+
+
+def test_overflow_falls_back_to_python_integers():
+    shares = [2 ** 40, 3, 2 ** 20]
+    reward = 10 ** 12  # reward * 2**40 超出int64
+    assert reward * max(shares) > INT64_MAX
+    rewards = split_reward(reward, shares)
+    assert rewards.dtype == object
+    assert sum(rewards.tolist()) == reward
+    total = sum(shares)
+    assert rewards.tolist()[0] in (reward * shares[0] // total, reward * shares[0] // total + 1)
+
+
+def test_no_overflow_stays_int64():
+    assert split_reward(10 ** 12, [1, 2, 3]).dtype == np.int64
+
+
+def test_round_rewards_deduct_fee_and_floor():
+    reward = 600000000001
+    fee = 0.08
+    distributable = int((Decimal(reward) * (Decimal('1') - Decimal(str(fee)))).to_integral_value(rounding=ROUND_DOWN))
+    rewards = split_round_rewards(reward, fee, [3, 5, 7])
+    assert all(isinstance(part, int) for part in rewards)
+    assert sum(rewards) == distributable == 552000000000
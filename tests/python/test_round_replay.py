@@ -0,0 +1,81 @@
+from round_replay import replay_rewards, restore_rewards, save_round_snapshot
+
+
+def submit(api, login, count):
+    api.increment_submit_counts_batch([{'username': login, 'count': count}])
+
+
+def query(db, sql, args=()):
+    cur = db.cursor()
+    cur.execute(sql, args)
+    rows = cur.fetchall()
+    db.commit()
+    return rows
+
+
+def insert_block(cur, chain, block_height, reward, total_shares):
+    cur.execute("""
+        INSERT INTO blocks (block_height, rewards, type, total_shares, time)
+        VALUES (%s, %s, %s, %s, NOW())
+    """, (block_height, reward, chain, total_shares))
+
+
+def test_replay_matches_credited_rewards(api, db):
+    submit(api, 'alice', 2)
+    submit(api, 'bob', 1)
+    assert api.handle_xmr_block({'height': 100, 'reward': '0.6'})['success']
+    cur = db.cursor()
+    replayed = replay_rewards(cur, 'xmr', [100, 101])
+    assert sorted(replayed[100]) == sorted(query(db, "SELECT username, shares, reward FROM rewards"))
+    assert list(replayed) == [100]
+    # 已入账的记录保持不变，重复执行不会重复入账
+    assert restore_rewards(cur, 'xmr', replayed) == 0
+    db.commit()
+    assert query(db, "SELECT COUNT(*) FROM balance_ledger") == [(2,)]
+
+
+def test_restore_rewrites_zeroed_and_missing_rewards(api, db):
+    submit(api, 'alice', 2)
+    submit(api, 'bob', 1)
+    assert api.handle_tari_block({'height': 200, 'block_id': 'ab' * 32})['success']
+    cur = db.cursor()
+    # 区块被判无效时奖励清零并追加冲正流水；bob 的记录被误删
+    cur.execute("UPDATE rewards SET reward = 0 WHERE username = 'alice'")
+    cur.execute("DELETE FROM rewards WHERE username = 'bob'")
+    cur.execute("""
+        INSERT INTO balance_ledger (username, type, amount, reason, ref)
+        SELECT username, 'tari', -amount, 'reversal', ref FROM balance_ledger
+    """)
+    db.commit()
+    assert query(db, "SELECT SUM(tari_balance) FROM account_balance") == [(0,)]
+
+    assert restore_rewards(cur, 'tari', replay_rewards(cur, 'tari', [200])) == 2
+    db.commit()
+    assert query(db, "SELECT username, tari_balance FROM account_balance ORDER BY username") == \
+        [('alice', 8464000000), ('bob', 4232000000)]
+    assert restore_rewards(cur, 'tari', replay_rewards(cur, 'tari', [200])) == 0
+
+
+def test_replay_merges_logins_and_skips_unknown_ids(api, db):
+    cur = db.cursor()
+    cur.execute("""
+        INSERT INTO account_login (user_id, login, username) VALUES (1, 'alice.rig1', 'alice'), (2, 'alice.rig2', 'alice')
+    """)
+    save_round_snapshot(cur, 'xmr', 100, {1: 3, 2: 1, 9: 4}, 0)
+    insert_block(cur, 'xmr', 100, 1000, 8)
+    assert replay_rewards(cur, 'xmr', [100]) == {100: [('alice', 4, 1000)]}
+    # 快照按第一次入账保存
+    save_round_snapshot(cur, 'xmr', 100, {1: 1}, 0)
+    assert replay_rewards(cur, 'xmr', [100]) == {100: [('alice', 4, 1000)]}
+
+
+def test_restore_creates_missing_accounts(api, db):
+    xmr_wallet, tari_wallet = '4' + 'A' * 94, '12' + 'B' * 89
+    api.mirror_user_logins({1: f'{xmr_wallet}:{tari_wallet}', 2: 'bob'})
+    cur = db.cursor()
+    save_round_snapshot(cur, 'xmr', 100, {1: 1, 2: 1}, 0)
+    insert_block(cur, 'xmr', 100, 1000, 2)
+    assert restore_rewards(cur, 'xmr', replay_rewards(cur, 'xmr', [100])) == 2
+    db.commit()
+    assert query(db, "SELECT username, xmr_wallet, tari_wallet, xmr_balance FROM account_balance ORDER BY username") == \
+        [(tari_wallet, xmr_wallet, tari_wallet, 500), ('bob', None, None, 500)]
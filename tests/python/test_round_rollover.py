@@ -0,0 +1,51 @@
+import threading
+
+from redis_keys import get_range_key
+
+
+def test_submits_racing_a_rollover_land_in_exactly_one_round(api):
+    submitters = 4
+    per_submitter = 200
+    start = threading.Barrier(submitters + 1)
+
+    def submit():
+        start.wait()
+        for _ in range(per_submitter):
+            api.increment_submit_counts_batch([{'username': 'alice', 'count': 1}])
+
+    threads = [threading.Thread(target=submit) for _ in range(submitters)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    heights = range(1, 6)
+    for height in heights:
+        api.snapshot_round('xmr', height)
+    for thread in threads:
+        thread.join(10)
+
+    total = submitters * per_submitter
+    sealed = sum(sum(api.get_snapshot_shares(get_range_key('xmr', height)).values()) for height in heights)
+    counts = api.get_submit_counts('alice')
+    assert sealed + counts['xmr'] == total
+    # 另一条链没有爆块，整轮计数不受 XMR 切换影响
+    assert counts['tari'] == total
+
+
+def test_rollover_of_each_chain_is_independent(api):
+    api.increment_submit_counts_batch([{'username': 'alice', 'count': 3}, {'username': 'bob', 'count': 1}])
+    api.snapshot_round('tari', 10)
+    api.increment_submit_counts_batch([{'username': 'alice', 'count': 2}])
+    api.snapshot_round('xmr', 20)
+    api.increment_submit_counts_batch([{'username': 'bob', 'count': 4}])
+
+    alice, bob = api.user_registry.get_ids(['alice', 'bob'])
+    assert api.get_snapshot_shares(get_range_key('tari', 10)) == {alice: 3, bob: 1}
+    assert api.get_snapshot_shares(get_range_key('xmr', 20)) == {alice: 5, bob: 1}
+    assert api.get_round_shares('tari') == {'alice': 2, 'bob': 4}
+    assert api.get_round_shares('xmr') == {'bob': 4}
+
+    # 释放 TARI 快照后，XMR 快照引用的代仍然保留
+    api.release_round_snapshot(get_range_key('tari', 10))
+    assert api.get_snapshot_shares(get_range_key('xmr', 20)) == {alice: 5, bob: 1}
+    api.release_round_snapshot(get_range_key('xmr', 20))
+    assert api.get_round_shares('tari') == {'alice': 2, 'bob': 4}
@@ -0,0 +1,188 @@
+import pytest
+
+from round_shares import (get_users_round_shares, get_chain_round_shares, get_range_shares,
+                          get_active_user_ids, collect_generations, seal_round, restore_round, release_range)
+from redis_keys import (TOTAL_SHARES_KEY, GENERATION_KEY, COLLECTED_GENERATION_KEY, ROUND_START_KEY,
+                        ROUND_PENDING_KEY, get_generation_key, get_range_key)
+
+
+class FakeRedis:
+    """只实现 round_shares 用到的命令，pipeline 中的命令按顺序立即执行"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hmget(self, key, fields):
+        return [self.data.get(key, {}).get(str(field)) for field in fields]
+
+    def hkeys(self, key):
+        return list(self.data.get(key, {}))
+
+    def seal(self, chain_starts, generations):
+        """按爆块顺序写入封存代，chain_starts 为各链当前轮次的第一代"""
+        for generation, fields in enumerate(generations, 1):
+            self.data[get_generation_key(generation)] = {str(k): str(v) for k, v in fields.items()}
+        self.data[GENERATION_KEY] = str(len(generations))
+        self.data[ROUND_START_KEY] = {chain: str(start) for chain, start in chain_starts.items()}
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.results = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def call(*args, **kwargs):
+            self.results.append(method(*args, **kwargs))
+        return call
+
+    def execute(self):
+        results, self.results = self.results, []
+        return results
+
+
+def make_client():
+    # 第1代: XMR和TARI共同的一轮，XMR在第1代末爆块
+    # 第2代: 只属于TARI，TARI在第2代末爆块；之后两条链都从第3代开始，当前代是第3代之后的提交
+    client = FakeRedis()
+    client.seal({'xmr': 2, 'tari': 1}, [{1: 5, 2: 3}, {1: 2, 3: 4}])
+    client.data[TOTAL_SHARES_KEY] = {'1': '1', '4': '7'}
+    return client
+
+
+def test_users_round_shares_sum_generations_from_chain_start():
+    shares = get_users_round_shares(make_client(), [1, 2, 3, 4, 5])
+    assert shares['xmr'] == [3, 0, 4, 7, 0]
+    assert shares['tari'] == [8, 3, 4, 7, 0]
+
+
+def test_chain_round_shares_match_per_user_reads():
+    client = make_client()
+    assert get_chain_round_shares(client, 'xmr') == {1: 3, 3: 4, 4: 7}
+    assert get_chain_round_shares(client, 'tari') == {1: 8, 2: 3, 3: 4, 4: 7}
+    assert get_active_user_ids(client) == ['1', '2', '3', '4']
+
+
+def test_negative_generation_counts_are_clamped_after_summing():
+    client = FakeRedis()
+    # 迁移得到的差值代可以是负数，只有求和后的结果才截断为0
+    client.seal({'xmr': 1, 'tari': 2}, [{1: -2, 2: -5}, {1: 6, 2: 3}])
+    assert get_users_round_shares(client, [1, 2]) == {'xmr': [4, 0], 'tari': [6, 3]}
+    assert get_range_shares(client, 1, 2) == {1: 4}
+
+
+def test_collect_generations_keeps_pending_snapshots():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    client = fakeredis.FakeRedis(decode_responses=True)
+    for key, fields in make_client().data.items():
+        if isinstance(fields, dict):
+            client.hset(key, mapping=fields)
+        else:
+            client.set(key, fields)
+    client.hset(ROUND_START_KEY, mapping={'xmr': 3, 'tari': 3})
+    client.zadd(ROUND_PENDING_KEY, {'round:range:tari:7': 1})
+    assert collect_generations(client) is None
+
+    client.delete(ROUND_PENDING_KEY)
+    client.zadd(ROUND_PENDING_KEY, {'round:range:xmr:9': 2})
+    assert collect_generations(client) == (1, 1)
+    assert not client.exists(get_generation_key(1))
+    assert client.exists(get_generation_key(2))
+
+    client.delete(ROUND_PENDING_KEY)
+    assert collect_generations(client) == (2, 2)
+    assert client.get(COLLECTED_GENERATION_KEY) == '2'
+    assert collect_generations(client) is None
+
+
+def test_seal_and_restore_round():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    client = fakeredis.FakeRedis(decode_responses=True)
+    client.hincrby(TOTAL_SHARES_KEY, 1, 5)
+    range_key, sealed = seal_round(client, 'xmr', 100)
+    assert sealed
+    assert seal_round(client, 'xmr', 100) == (range_key, False)
+    client.hincrby(TOTAL_SHARES_KEY, 1, 2)
+    assert get_users_round_shares(client, [1]) == {'xmr': [2], 'tari': [7]}
+
+    # 撤销后快照中的提交重新计入本链当前轮次
+    assert restore_round(client, 'xmr', 100) == 1
+    assert get_users_round_shares(client, [1]) == {'xmr': [7], 'tari': [7]}
+    assert not client.exists(range_key)
+    assert client.zcard(ROUND_PENDING_KEY) == 0
+    assert restore_round(client, 'xmr', 100) == 0
+
+    # 本链之后又切换过轮次时不能撤销
+    seal_round(client, 'xmr', 101)
+    seal_round(client, 'xmr', 102)
+    assert restore_round(client, 'xmr', 101) == -1
+    assert client.exists(get_range_key('xmr', 101))
+    # TARI 的当前轮次仍引用所有封存代，释放快照后不能回收
+    assert release_range(client, get_range_key('xmr', 101)) is None
+    assert release_range(client, get_range_key('xmr', 102)) is None
+    assert client.zcard(ROUND_PENDING_KEY) == 0
+    assert get_users_round_shares(client, [1]) == {'xmr': [0], 'tari': [7]}
+
+
+def interleaving_client():
+    """fakeredis 客户端，hook 在下一次Redis往返 (单条命令或一次 pipeline) 完成后执行一次"""
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+
+    class InterleavingRedis(fakeredis.FakeRedis):
+        hook = None
+
+        def fire(self):
+            hook, self.hook = self.hook, None
+            if hook is not None:
+                hook()
+
+        def execute_command(self, *args, **kwargs):
+            result = super().execute_command(*args, **kwargs)
+            self.fire()
+            return result
+
+        def pipeline(self, *args, **kwargs):
+            pipe = super().pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def execute_then_fire(*args, **kwargs):
+                results = execute(*args, **kwargs)
+                self.fire()
+                return results
+            pipe.execute = execute_then_fire
+            return pipe
+
+    return InterleavingRedis(decode_responses=True)
+
+
+def test_collect_keeps_generations_of_round_sealed_concurrently():
+    client = interleaving_client()
+    # XMR 的一轮跨越TARI的两次爆块，TARI 的两个快照都已入账
+    client.hincrby(TOTAL_SHARES_KEY, 1, 10)
+    seal_round(client, 'tari', 100)
+    client.hincrby(TOTAL_SHARES_KEY, 1, 5)
+    seal_round(client, 'tari', 101)
+    assert release_range(client, get_range_key('tari', 100)) is None
+    client.zrem(ROUND_PENDING_KEY, get_range_key('tari', 101))
+    client.delete(get_range_key('tari', 101))
+
+    # 回收期间 XMR 爆块切换轮次，新的快照引用第1、2代
+    client.hook = lambda: seal_round(client, 'xmr', 200)
+    collect_generations(client)
+    assert client.hgetall(get_range_key('xmr', 200)) == {'start': '1', 'end': '3'}
+    assert get_range_shares(client, 1, 3) == {1: 15}
+    assert release_range(client, get_range_key('xmr', 200)) == (1, 2)
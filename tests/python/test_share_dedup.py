@@ -0,0 +1,199 @@
+import asyncio
+
+import pytest
+
+import share_dedup
+from redis_keys import TOTAL_SHARES_KEY, DEDUP_KEY_PREFIX
+from share_dedup import (RedisDedupSet, AsyncRedisDedupSet, DEDUP_BUCKETS, get_batch_key, get_share_id,
+                         check_batch_entries, fill_batch_results, submit_counts_result)
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可以拨动的时间，用于测试时间桶轮换"""
+    now = [1000000.0]
+    monkeypatch.setattr(share_dedup.time, 'time', lambda: now[0])
+    return now
+
+
+def dedup_keys(client):
+    return [key for key in client.keys(DEDUP_KEY_PREFIX + '*') if key != 'dedup:released']
+
+
+def test_get_share_id():
+    assert get_share_id({'username': 'u1', 'share_id': 'abc'}) == 'share:u1:abc'
+    assert get_share_id({'username': 'u1', 'job_id': 'j1', 'nonce': 7, 'extra_nonce': 0}) == 'share:u1:j1:7:0'
+    # share_id 优先于 job_id + nonce + extra_nonce
+    assert get_share_id({'username': 'u1', 'share_id': 5, 'job_id': 'j1', 'nonce': 7, 'extra_nonce': 0}) == 'share:u1:5'
+    assert get_share_id({'username': 'u1', 'job_id': 'j1', 'nonce': 7}) is None
+    assert get_share_id({'share_id': 'abc'}) is None
+    assert get_share_id({}) is None
+
+
+def test_zero_and_empty_ids_are_present():
+    assert get_share_id({'username': 'u1', 'share_id': 0, 'job_id': 'j1', 'nonce': 7, 'extra_nonce': 0}) == 'share:u1:0'
+    assert get_share_id({'username': 'u1', 'share_id': ''}) == 'share:u1:'
+    assert get_share_id({'username': 'u1', 'job_id': 0, 'nonce': 0, 'extra_nonce': ''}) == 'share:u1:0:0:'
+    assert get_batch_key({'batch_id': 0, 'shares': []}) == 'batch:0'
+
+
+def test_wrong_id_types_are_rejected():
+    for params in ({'username': 'u1', 'share_id': 2.5}, {'username': 'u1', 'share_id': True},
+                   {'username': 'u1', 'share_id': 'a', 'nonce': -1}, {'username': 'u1', 'job_id': ['j']}):
+        with pytest.raises(ValueError):
+            get_share_id(params)
+    with pytest.raises(ValueError):
+        get_batch_key({'batch_id': {'id': 1}, 'shares': []})
+
+
+def test_get_batch_key():
+    assert get_batch_key({'batch_id': 42, 'shares': []}) == 'batch:42'
+    assert get_batch_key({'shares': []}) is None
+    assert get_batch_key([{'username': 'u'}]) is None
+
+
+def test_same_nonce_from_different_users_is_not_duplicate(client):
+    dedup = RedisDedupSet(client)
+    share = {'job_id': 'j1', 'nonce': 7, 'extra_nonce': 0}
+    assert dedup.add(get_share_id(dict(share, username='u1')))
+    assert dedup.add(get_share_id(dict(share, username='u2')))
+    assert not dedup.add(get_share_id(dict(share, username='u1')))
+
+
+def test_duplicate_seen_by_another_process(client):
+    api, ingest = RedisDedupSet(client, window_seconds=60), RedisDedupSet(client, window_seconds=60)
+    assert api.add('share:u1:a')
+    assert not ingest.add('share:u1:a')
+    (key,) = dedup_keys(client)
+    assert 0 < client.ttl(key) <= 60 / DEDUP_BUCKETS * (DEDUP_BUCKETS + 2)
+
+
+def test_discard_allows_retry(client):
+    dedup = RedisDedupSet(client)
+    dedup.add('a')
+    dedup.add('b')
+    dedup.discard('a', 'b')
+    assert dedup.add('a')
+    assert dedup.add('b')
+    # 撤销只放行一次重试
+    assert not dedup.add('a')
+
+
+def test_add_many_marks_repeats_within_batch(client):
+    dedup = RedisDedupSet(client)
+    assert dedup.add('a')
+    assert dedup.add_many(['a', 'b', 'b', 'c']) == [False, True, False, True]
+    assert dedup.add_many([]) == []
+
+
+def test_claim_counts_only_new_entries(client):
+    dedup = RedisDedupSet(client)
+    assert dedup.claim([('s1', 1, 2), ('s1', 1, 5), (None, 1, 3), ('s2', 2, 1), ('s3', None, 0)]) == [2, None, 5, 1, 0]
+    assert dedup.claim([('s1', 1, 1), (None, 2, 4)]) == [None, 5]
+    assert client.hgetall(TOTAL_SHARES_KEY) == {'1': '5', '2': '5'}
+
+
+def test_memory_is_bounded_by_capacity(client, clock):
+    dedup = RedisDedupSet(client, window_seconds=60, capacity=4000, error_rate=0.01)
+    for bucket in range(3 * DEDUP_BUCKETS):
+        dedup.add_many([f'share:u:{bucket}:{i}' for i in range(100)])
+        clock[0] += 60 / DEDUP_BUCKETS
+    # 每个桶的位图大小固定，与写入的标识数无关
+    for key in dedup_keys(client):
+        assert client.strlen(key) <= dedup.bits // 8 + 1
+    assert dedup.bits < 1000 * 10
+
+
+def test_window_rotates_out_old_records(client, clock):
+    dedup = RedisDedupSet(client, window_seconds=60)
+    assert dedup.add('a')
+    clock[0] += 60
+    assert dedup.add('b')
+    assert not dedup.add('a')
+    clock[0] += 60 + 60 / DEDUP_BUCKETS
+    assert dedup.add('a')
+
+
+def test_false_positive_rate(client, clock):
+    dedup = RedisDedupSet(client, capacity=4000, error_rate=0.01)
+    dedup.add_many([f'seen:{i}' for i in range(1000)])
+    (key,) = dedup_keys(client)
+    # 按脚本参数中的位偏移直接查询位图，不把新标识写入过滤器
+    _, args = dedup.claim_args([(f'new:{i}', None, 0) for i in range(2000)])
+    stride = dedup.hashes + 3
+    false_positives = sum(all(client.getbit(key, offset) for offset in args[i + 1:i + 1 + dedup.hashes])
+                          for i in range(2, len(args), stride))
+    assert false_positives < 2000 * 0.03
+
+
+def test_batch_entries_deduplicated_by_share_id(client):
+    dedup = RedisDedupSet(client)
+    shares = [
+        {'username': 'u1', 'share_id': 's1'},
+        {'username': 'u1', 'share_id': 's1'},
+        {'username': '', 'share_id': 's2'},
+        {'username': 'u2', 'count': 0},
+        {'username': 'u2', 'job_id': 'j', 'nonce': 1, 'extra_nonce': 2, 'count': 3},
+    ]
+    results, candidates = check_batch_entries(shares)
+    assert [i for i, _, _ in candidates] == [0, 1, 4]
+    totals = dedup.claim([(share_id, 7, entry['count']) for _, entry, share_id in candidates])
+    counts = [None if total is None else submit_counts_result(total) for total in totals]
+    assert fill_batch_results(results, candidates, counts) == (2, 1)
+    assert results[0] == {'status': 'OK', 'username': 'u1', 'submit_counts': {'xmr': 1, 'tari': 1}}
+    assert results[1] == {'status': 'OK', 'username': 'u1', 'duplicate': True}
+    assert results[2]['error']['code'] == -32602
+    assert results[3]['error']['code'] == -32602
+    assert results[4] == {'status': 'OK', 'username': 'u2', 'submit_counts': {'xmr': 4, 'tari': 4}}
+    # 无效条目不占用 share_id
+    assert dedup.add('share:u2:s2')
+
+
+def test_batch_key_does_not_collide_with_share_id(client):
+    dedup = RedisDedupSet(client)
+    assert dedup.add(get_share_id({'username': 'batch', 'share_id': '7'}))
+    assert dedup.add(get_batch_key({'batch_id': '7', 'shares': []}))
+
+
+def test_async_dedup_shares_records_with_sync_process():
+    server = fakeredis.FakeServer()
+    dedup = AsyncRedisDedupSet(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    RedisDedupSet(fakeredis.FakeRedis(server=server, decode_responses=True)).add('share:u1:s1')
+
+    async def run():
+        results = await dedup.claim([('share:u1:s1', 1, 1), ('share:u1:s2', 1, 1), (None, 2, 1)])
+        await dedup.discard('share:u1:s2')
+        return results, await dedup.add('share:u1:s2')
+
+    assert asyncio.run(run()) == ([None, 1, 1], True)
+
+
+def test_batch_entries_reject_wrong_field_types():
+    shares = [
+        {'username': 123},
+        {'username': ['u1']},
+        'u1',
+        {'username': 'u1', 'count': 1.5},
+        {'username': 'u1', 'count': '2'},
+        {'username': 'u1', 'count': True},
+        {'username': 'u1', 'nonce': {'n': 1}, 'job_id': 'j', 'extra_nonce': 0},
+        {'username': 'u1', 'nonce': -1, 'job_id': 'j', 'extra_nonce': 0},
+        {'username': 'u1', 'share_id': 2.5},
+        {'username': 'u1', 'nonce': 'ff00', 'job_id': 7, 'extra_nonce': 0, 'count': 3},
+    ]
+    results, candidates = check_batch_entries(shares)
+    assert candidates == [(9, {'username': 'u1', 'count': 3}, 'share:u1:7:ff00:0')]
+    for result in results[:9]:
+        assert result['error']['code'] == -32602
+    assert 'username' in results[0]['error']['message']
+    assert 'count' in results[3]['error']['message']
+    assert 'nonce' in results[6]['error']['message']
+    assert 'share_id' in results[8]['error']['message']
@@ -0,0 +1,73 @@
+from redis_keys import DEDUP_KEY_PREFIX
+
+
+def submit_request(request_id, username, share_id=None):
+    params = {'username': username}
+    if share_id is not None:
+        params['share_id'] = share_id
+    return {'jsonrpc': '2.0', 'method': 'submit', 'params': params, 'id': request_id}
+
+
+def test_resent_share_is_counted_once(api):
+    assert api.handle_submit({'username': 'alice', 'share_id': 's1'})['result']['submit_counts'] == {'xmr': 1, 'tari': 1}
+    assert api.handle_submit({'username': 'alice', 'share_id': 's1'})['result']['duplicate']
+    assert api.handle_submit({'username': 'alice'})['result']['submit_counts'] == {'xmr': 2, 'tari': 2}
+    # 去重只占用固定大小的时间桶位图，不按提交创建键
+    assert len(api.redis_client.keys(DEDUP_KEY_PREFIX + '*')) == 1
+
+
+def test_batch_resend_is_dropped(api):
+    params = {'batch_id': 'b1', 'shares': [{'username': 'alice', 'count': 2, 'share_id': 's1'},
+                                           {'username': 'bob'}, {'username': 'bob', 'count': 0}]}
+    result = api.handle_submit_batch(params)['result']
+    assert (result['accepted'], result['duplicates'], result['rejected']) == (2, 0, 1)
+    assert api.handle_submit_batch(params)['result']['duplicate']
+    # 不同的 batch_id 只丢弃其中重复的 share_id
+    result = api.handle_submit_batch(dict(params, batch_id='b2'))['result']
+    assert (result['accepted'], result['duplicates'], result['rejected']) == (1, 1, 1)
+    assert api.get_submit_counts('alice') == {'xmr': 2, 'tari': 2}
+    assert api.get_submit_counts('bob') == {'xmr': 2, 'tari': 2}
+
+
+def test_json_rpc_batch_deduplicates_submits(api):
+    responses = api.dispatch_json_rpc_batch([submit_request(1, 'alice', 's1'), submit_request(2, 'alice', 's1'),
+                                             submit_request(3, 'bob')])
+    assert [response['id'] for response in responses] == [1, 2, 3]
+    assert responses[0]['result']['submit_counts'] == {'xmr': 1, 'tari': 1}
+    assert responses[1]['result']['duplicate']
+    assert responses[2]['result']['submit_counts'] == {'xmr': 1, 'tari': 1}
+
+
+def test_wrong_share_id_type_is_invalid_params(api):
+    assert api.handle_submit({'username': 'alice', 'share_id': 1.5})['error']['code'] == -32602
+    assert api.handle_submit_batch({'batch_id': [1], 'shares': []})['error']['code'] == -32602
+    responses = api.dispatch_json_rpc_batch([submit_request(1, 'alice', 1.5), submit_request(2, 'alice', 0)])
+    assert responses[0]['error']['code'] == -32602
+    assert responses[1]['result']['submit_counts'] == {'xmr': 1, 'tari': 1}
+    assert api.handle_submit({'username': 'alice', 'share_id': 0})['result']['duplicate']
+
+
+def test_json_rpc_notifications_get_no_response(api):
+    http = api.app.test_client()
+    batch = [submit_request(1, 'alice'), {'jsonrpc': '2.0', 'method': 'submit', 'params': {'username': 'bob'}},
+             {'jsonrpc': '2.0', 'method': 'no_such_method'}, {'jsonrpc': '2.0', 'id': 4}]
+    responses = http.post('/json_rpc', json=batch).get_json()
+    assert [response['id'] for response in responses] == [1, 4]
+    assert responses[1]['error']['code'] == -32600
+    # 通知照常计数
+    assert api.get_submit_counts('bob') == {'xmr': 1, 'tari': 1}
+
+    response = http.post('/json_rpc', json=batch[1:3])
+    assert response.status_code == 204 and response.data == b''
+    response = http.post('/json_rpc', json=batch[1])
+    assert response.status_code == 204 and response.data == b''
+    assert api.get_submit_counts('bob') == {'xmr': 3, 'tari': 3}
+
+
+def test_json_rpc_batch_size_is_limited(api):
+    http = api.app.test_client()
+    batch = [submit_request(i, 'alice') for i in range(api.MAX_JSON_RPC_BATCH + 1)]
+    response = http.post('/json_rpc', json=batch).get_json()
+    assert response['error']['code'] == -32600
+    assert api.get_submit_counts('alice') == {'xmr': 0, 'tari': 0}
+    assert len(http.post('/json_rpc', json=batch[1:]).get_json()) == api.MAX_JSON_RPC_BATCH
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from redis_keys import TOTAL_SHARES_KEY, AGGREGATORS_KEY, get_journal_seq_key
+
+
+@pytest.fixture
+def aggregator(api, tmp_path):
+    aggregators = []
+
+    def create(instance_id='a', flush_interval_ms=1000):
+        aggregator = api.SubmitAggregator(str(tmp_path / f'journal-{instance_id}.log'), flush_interval_ms,
+                                          instance_id)
+        aggregators.append(aggregator)
+        return aggregator
+
+    yield create
+    for aggregator in aggregators:
+        aggregator.running = False
+        if aggregator.journal is not None:
+            aggregator.journal.close()
+
+
+def test_submits_are_counted_after_flush(api, aggregator, monkeypatch):
+    agg = aggregator()
+    agg.replay_journal()
+    monkeypatch.setattr(api, 'submit_aggregator', agg)
+    assert api.increment_submit_counts_batch([{'username': 'alice', 'count': 2}, {'username': 'alice', 'count': 1}]) == \
+        [{'xmr': 2, 'tari': 2}, {'xmr': 3, 'tari': 3}]
+    assert api.redis_client.hgetall(TOTAL_SHARES_KEY) == {}
+    agg.flush()
+    assert api.get_submit_counts('alice') == {'xmr': 3, 'tari': 3}
+    # 没有新增量时不写日志也不推进序号
+    agg.flush()
+    assert api.redis_client.get(agg.seq_key) == '1'
+
+
+def test_duplicate_share_is_not_aggregated(api, aggregator, monkeypatch):
+    agg = aggregator()
+    agg.replay_journal()
+    monkeypatch.setattr(api, 'submit_aggregator', agg)
+    assert api.handle_submit({'username': 'alice', 'share_id': 's1'})['result']['submit_counts'] == {'xmr': 1, 'tari': 1}
+    assert api.handle_submit({'username': 'alice', 'share_id': 's1'})['result']['duplicate']
+    agg.flush()
+    assert api.get_submit_counts('alice') == {'xmr': 1, 'tari': 1}
+
+
+def test_failed_flush_retries_with_same_seq(api, aggregator, monkeypatch):
+    agg = aggregator()
+    agg.replay_journal()
+    agg.add([1], [5])
+    apply = agg.apply
+    calls = []
+
+    def lost_reply(seq, deltas):
+        # 脚本已执行但响应丢失
+        calls.append(seq)
+        apply(seq, deltas)
+        if len(calls) == 1:
+            raise ConnectionError('connection reset')
+        return True
+
+    monkeypatch.setattr(agg, 'apply', lost_reply)
+    with pytest.raises(ConnectionError):
+        agg.flush()
+    agg.add([1], [1])
+    agg.flush()
+    agg.flush()
+    assert calls == [1, 1, 2]
+    assert api.redis_client.hget(TOTAL_SHARES_KEY, '1') == '6'
+
+
+def test_replay_applies_only_unapplied_records(api, aggregator, tmp_path):
+    api.redis_client.set(get_journal_seq_key('a'), 1)
+    api.redis_client.hset(TOTAL_SHARES_KEY, '1', 4)
+    # 第1条已写入Redis，第2条崩溃前只写了日志，第3条只写了一半
+    (tmp_path / 'journal-a.log').write_text('1\t{"1":4}\n2\t{"1":2,"2":7}\n3\t{"1":')
+    agg = aggregator()
+    agg.replay_journal()
+    assert api.redis_client.hgetall(TOTAL_SHARES_KEY) == {'1': '6', '2': '7'}
+    assert agg.seq == 2
+    # 日志在重放后清空，新记录的序号接在重放过的记录之后
+    assert (tmp_path / 'journal-a.log').read_text() == ''
+    agg.add([2], [1])
+    agg.flush()
+    assert api.redis_client.get(agg.seq_key) == '3'
+    assert not agg.apply(3, {'2': 1})
+    assert api.redis_client.hget(TOTAL_SHARES_KEY, '2') == '8'
+
+
+def test_cluster_flush_waits_for_other_instances(api, aggregator, monkeypatch):
+    own, other = aggregator('a'), aggregator('b', flush_interval_ms=10)
+    for agg in (own, other):
+        agg.replay_journal()
+        agg.register()
+    monkeypatch.setattr(api, 'submit_aggregator', own)
+    own.add([1], [2])
+    other.add([1], [3])
+    other.start()
+    api.flush_submit_aggregator()
+    assert api.redis_client.hget(TOTAL_SHARES_KEY, '1') == '5'
+
+    other.stop()
+    other.join(5)
+    assert api.redis_client.smembers(AGGREGATORS_KEY) == {'a'}
+    # 已退出的实例不再被等待
+    done = threading.Event()
+    threading.Thread(target=lambda: (api.flush_submit_aggregator(), done.set()), daemon=True).start()
+    assert done.wait(1)
@@ -0,0 +1,58 @@
+import socket
+import time
+
+import pytest
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_parse_line(api_server):
+    parse_line = api_server.SubmitSocketHandler.parse_line
+    assert parse_line(b'alice\t3\t1000') == {'username': 'alice', 'count': 3}
+    assert parse_line(b'alice\r') == {'username': 'alice', 'count': 1}
+    assert parse_line('用户\t2'.encode('utf-8')) == {'username': '用户', 'count': 2}
+    for line in (b'', b'\t1', b'alice\t0', b'alice\t-1', b'alice\tx', b'alice\t1\t1.5', b'\xff\t1'):
+        assert parse_line(line) is None
+
+
+@pytest.fixture
+def submit_socket(api, tmp_path):
+    path = str(tmp_path / 'submit.sock')
+    server = api.start_submit_socket(path)
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def test_lines_split_across_writes_are_counted(api, submit_socket):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(submit_socket)
+    try:
+        sock.sendall(b'alice\t2\t100\nbob\t1\t100\nal')
+        sock.sendall(b'ice\t3\t100\nbob\tbad\t100\n')
+        assert wait_for(lambda: api.get_submit_counts('alice')['xmr'] == 5)
+        assert api.get_submit_counts('bob') == {'xmr': 1, 'tari': 1}
+        # 无效行被跳过，连接不断开
+        sock.sendall(b'bob\t4\n')
+        assert wait_for(lambda: api.get_submit_counts('bob')['xmr'] == 5)
+    finally:
+        sock.close()
+
+
+def test_overlong_line_closes_connection(api, submit_socket):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(submit_socket)
+    try:
+        sock.sendall(b'a' * (api.SubmitSocketHandler.MAX_LINE + 1))
+        sock.settimeout(5)
+        assert sock.recv(1) == b''
+    finally:
+        sock.close()
+    assert api.redis_client.hgetall(api.TOTAL_SHARES_KEY) == {}
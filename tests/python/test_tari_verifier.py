@@ -0,0 +1,384 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+import tari_verifier
+from tari_verifier import (HostRateLimiter, TariVerifier, invalidate_blocks,
+                           STATUS_VALID, STATUS_INVALID, STATUS_NOT_FOUND, STATUS_ERROR)
+from header_cache import HeaderCache
+from balance_ledger import REASON_REVERSAL
+
+
+def block_hash(height):
+    return [height % 256, 0xab, 0xcd]
+
+
+def hex_hash(height):
+    return bytes(block_hash(height)).hex()
+
+
+class StubExplorer:
+    """在后台线程中运行的模拟区块浏览器，按高度返回预设的响应并记录并发数和请求时间"""
+
+    def __init__(self):
+        self.responses = {}   # 高度 -> 'ok' / 'wrong' / 'nohash' / 'html' / HTTP状态码，未设置时为 'ok'
+        self.delay = 0
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.max_inflight = 0
+        self.requests = []    # (高度, time.monotonic())
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait(5)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_get('/blocks/{height}', self.handle)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.started.set()
+        self.loop.run_forever()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}/blocks/{{height}}?json'
+
+    async def handle(self, request):
+        height = int(request.match_info['height'])
+        with self.lock:
+            self.requests.append((height, time.monotonic()))
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            response = self.responses.get(height, 'ok')
+            if isinstance(response, int):
+                return web.Response(status=response, text='error')
+            if response == 'html':
+                return web.Response(text='<html></html>', content_type='text/html')
+            header = {'timestamp': 1700000000 + height}
+            if response != 'nohash':
+                data = block_hash(height) if response == 'ok' else [0xff, 0xff]
+                header['hash'] = {'type': 'Buffer', 'data': data}
+                header['prev_hash'] = {'type': 'Buffer', 'data': block_hash(height - 1)}
+            return web.json_response({'header': header})
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+
+@pytest.fixture
+def explorer():
+    stub = StubExplorer()
+    yield stub
+    stub.close()
+
+
+class FakeCursor:
+    """只实现 tari_verifier 用到的语句的内存数据库"""
+
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.db.statements.append(' '.join(query.split()))
+        if 'SELECT block_height, block_id' in query:
+            self.rows = sorted((h, b['block_id']) for h, b in self.db.blocks.items() if not b['check_status'])
+            if params[0] is not None:
+                self.rows = self.rows[:params[0]]
+        elif 'RETURNING block_height' in query:
+            self.rows = []
+            for height in params[0]:
+                block = self.db.blocks.get(height)
+                if block is not None and not block['check_status']:
+                    block.update(check_status=True, is_valid=False)
+                    self.rows.append((height,))
+        elif 'is_valid = true' in query:
+            for height in params[0]:
+                block = self.db.blocks.get(height)
+                if block is not None and not block['check_status']:
+                    block.update(check_status=True, is_valid=True)
+        elif 'SELECT username, reward, block_height' in query:
+            self.rows = [(u, r, h) for (h, u), r in sorted(self.db.rewards.items()) if h in params[0]]
+        elif 'SET reward = 0' in query:
+            for (h, u) in self.db.rewards:
+                if h in params[0]:
+                    self.db.rewards[(h, u)] = 0
+        else:
+            raise AssertionError(f'unexpected query: {query}')
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    """提交时保存快照，回滚时恢复到上次提交的状态"""
+
+    def __init__(self, db):
+        self.db = db
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db.commits += 1
+        self.db.save()
+
+    def rollback(self):
+        self.db.restore()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDatabase:
+    def __init__(self, heights, rewards=None):
+        self.blocks = {h: {'block_id': hex_hash(h), 'check_status': False, 'is_valid': False} for h in heights}
+        self.rewards = dict(rewards or {})   # (高度, 用户名) -> 奖励
+        self.ledger = []
+        self.statements = []
+        self.commits = 0
+        self.save()
+
+    def save(self):
+        self.saved = ({h: dict(b) for h, b in self.blocks.items()}, dict(self.rewards), list(self.ledger))
+
+    def restore(self):
+        blocks, rewards, ledger = self.saved
+        self.blocks = {h: dict(b) for h, b in blocks.items()}
+        self.rewards = dict(rewards)
+        self.ledger = list(ledger)
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    """记录 invalidate_blocks 追加的余额流水，execute_values 需要真实的 psycopg2 游标"""
+    def append_entries(cur, entries):
+        entries = [entry for entry in entries if entry[2]]
+        cur.db.ledger.extend(entries)
+        return len(entries)
+    monkeypatch.setattr(tari_verifier, 'append_entries', append_entries)
+
+
+def verify(verifier, blocks):
+    batches = []
+    asyncio.run(verifier.verify_blocks(blocks, batches.append))
+    return batches
+
+
+def by_height(batches):
+    return {result['height']: result for batch in batches for result in batch}
+
+
+def test_statuses(explorer):
+    explorer.responses.update({2: 'wrong', 3: 404, 4: 429, 5: 500, 6: 503, 7: 'html', 8: 'nohash'})
+    verifier = TariVerifier(None, explorer.url, concurrency=4, rate=0)
+    results = by_height(verify(verifier, [(h, hex_hash(h)) for h in range(1, 9)]))
+    assert results[1]['status'] == STATUS_VALID
+    assert results[1]['timestamp'] == 1700000001
+    assert results[2]['status'] == STATUS_INVALID
+    assert results[2]['remote_hash'] == 'ffff'
+    assert results[3]['status'] == STATUS_NOT_FOUND
+    assert results[4] == dict(results[4], status=STATUS_ERROR, message='HTTP 429')
+    assert results[5] == dict(results[5], status=STATUS_ERROR, message='HTTP 500')
+    assert results[6] == dict(results[6], status=STATUS_ERROR, message='HTTP 503')
+    assert results[7]['status'] == STATUS_ERROR
+    assert results[8]['status'] == STATUS_NOT_FOUND
+
+
+def test_connection_error_is_retryable():
+    # 没有服务监听的端口
+    verifier = TariVerifier(None, 'http://127.0.0.1:1/blocks/{height}?json', rate=0, timeout=2)
+    results = by_height(verify(verifier, [(1, hex_hash(1))]))
+    assert results[1]['status'] == STATUS_ERROR
+
+
+def test_concurrency_bounded_by_semaphore(explorer):
+    explorer.delay = 0.05
+    verifier = TariVerifier(None, explorer.url, concurrency=4, rate=0)
+    results = by_height(verify(verifier, [(h, hex_hash(h)) for h in range(1, 21)]))
+    assert len(results) == 20
+    assert all(result['status'] == STATUS_VALID for result in results.values())
+    assert explorer.max_inflight == 4
+
+
+def test_per_host_rate_limit(explorer):
+    rate = 20
+    verifier = TariVerifier(None, explorer.url, concurrency=8, rate=rate)
+    verify(verifier, [(h, hex_hash(h)) for h in range(1, 7)])
+    times = sorted(t for _, t in explorer.requests)
+    assert len(times) == 6
+    # 并发数足够时请求仍按 1/rate 的间隔发出 (留出调度误差)
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert min(gaps) >= 1 / rate * 0.8
+    assert times[-1] - times[0] >= 5 / rate * 0.9
+
+
+def test_rate_limiter_is_per_host():
+    async def run():
+        limiter = HostRateLimiter(10)
+        start = time.monotonic()
+        await limiter.acquire('a')
+        await limiter.acquire('b')
+        other_host = time.monotonic() - start
+        await limiter.acquire('a')
+        same_host = time.monotonic() - start
+        return other_host, same_host
+    other_host, same_host = asyncio.run(run())
+    assert other_host < 0.05
+    assert same_host >= 0.09
+
+
+def test_rate_limiter_disabled():
+    async def run():
+        limiter = HostRateLimiter(0)
+        start = time.monotonic()
+        for _ in range(100):
+            await limiter.acquire('a')
+        return time.monotonic() - start
+    assert asyncio.run(run()) < 0.05
+
+
+def test_results_delivered_in_batches(explorer):
+    verifier = TariVerifier(None, explorer.url, concurrency=4, rate=0, batch_size=3)
+    batches = verify(verifier, [(h, hex_hash(h)) for h in range(1, 8)])
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+def test_cache_hits_skip_explorer(explorer, tmp_path):
+    cache = HeaderCache(str(tmp_path / 'headers.sqlite'))
+    try:
+        verifier = TariVerifier(None, explorer.url, concurrency=4, rate=0, cache=cache)
+        blocks = [(h, hex_hash(h)) for h in range(1, 5)]
+        verify(verifier, blocks)
+        assert len(explorer.requests) == 4
+        results = by_height(verify(verifier, blocks))
+        assert len(explorer.requests) == 4
+        assert all(result['status'] == STATUS_VALID for result in results.values())
+    finally:
+        cache.close()
+
+
+def test_cache_is_not_accessed_on_event_loop_thread(explorer, tmp_path):
+    loop_thread = threading.get_ident()
+    calls = []
+
+    class RecordingCache(HeaderCache):
+        def get_many(self, heights):
+            calls.append(('get_many', threading.get_ident()))
+            return super().get_many(heights)
+
+        def put(self, height, header):
+            calls.append(('put', threading.get_ident()))
+            super().put(height, header)
+
+    cache = RecordingCache(str(tmp_path / 'headers.sqlite'))
+    try:
+        verifier = TariVerifier(None, explorer.url, concurrency=4, rate=0, batch_size=2, cache=cache)
+        verify(verifier, [(h, hex_hash(h)) for h in range(1, 4)])
+        batches = verify(verifier, [(h, hex_hash(h)) for h in range(1, 6)])
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert all(result['status'] == STATUS_VALID for batch in batches for result in batch)
+        assert len(explorer.requests) == 5
+        assert [name for name, _ in calls].count('put') == 5
+        assert all(thread != loop_thread for _, thread in calls)
+    finally:
+        cache.close()
+
+
+def test_invalidate_blocks_appends_reversals(ledger):
+    db = FakeDatabase([10, 11, 12], {(10, 'alice'): 700, (10, 'bob'): 300, (10, 'carol'): 0, (11, 'alice'): 50})
+    cur = db.connect().cursor()
+    assert invalidate_blocks(cur, [10, 99]) == [10]
+    assert db.blocks[10] == dict(db.blocks[10], check_status=True, is_valid=False)
+    assert db.ledger == [('alice', 'tari', -700, REASON_REVERSAL, 10), ('bob', 'tari', -300, REASON_REVERSAL, 10)]
+    assert db.rewards[(10, 'alice')] == 0 and db.rewards[(10, 'bob')] == 0
+    assert db.rewards[(11, 'alice')] == 50
+
+    # 已检查的区块不会再次冲正
+    assert invalidate_blocks(cur, [10]) == []
+    assert len(db.ledger) == 2
+    assert invalidate_blocks(cur, []) == []
+
+
+def test_apply_batch_commits_once_per_batch(ledger):
+    db = FakeDatabase([1, 2, 3], {(2, 'alice'): 100})
+    conn = db.connect()
+    fenced = []
+    verifier = TariVerifier(db.connect)
+    results = [
+        {'height': 1, 'status': STATUS_VALID},
+        {'height': 2, 'status': STATUS_INVALID},
+        {'height': 3, 'status': STATUS_ERROR},
+    ]
+    assert verifier.apply_batch(conn, results, fenced.append) == {'valid': 1, 'invalid': 1}
+    assert len(fenced) == 1
+    assert db.commits == 1
+    assert db.blocks[1]['is_valid'] and db.blocks[1]['check_status']
+    assert not db.blocks[2]['is_valid'] and db.blocks[2]['check_status']
+    assert not db.blocks[3]['check_status']
+    assert db.ledger == [('alice', 'tari', -100, REASON_REVERSAL, 2)]
+
+
+def test_apply_batch_rolls_back_when_fence_fails(ledger):
+    db = FakeDatabase([1, 2], {(2, 'alice'): 100})
+    conn = db.connect()
+
+    def lost_leadership(cur):
+        raise RuntimeError('fenced')
+
+    verifier = TariVerifier(db.connect)
+    with pytest.raises(RuntimeError):
+        verifier.apply_batch(conn, [{'height': 1, 'status': STATUS_VALID},
+                                    {'height': 2, 'status': STATUS_INVALID}], lost_leadership)
+    assert db.commits == 0
+    assert not db.blocks[1]['check_status'] and not db.blocks[2]['check_status']
+    assert db.ledger == []
+    assert db.rewards[(2, 'alice')] == 100
+
+
+def test_run_once_end_to_end(explorer, ledger):
+    explorer.responses.update({3: 'wrong', 4: 404, 5: 429})
+    db = FakeDatabase(range(1, 8), {(3, 'alice'): 40, (3, 'bob'): 60})
+    verifier = TariVerifier(db.connect, explorer.url, concurrency=3, rate=0, batch_size=2)
+    counts = verifier.run_once()
+    assert counts == {STATUS_VALID: 4, STATUS_INVALID: 1, STATUS_NOT_FOUND: 1, STATUS_ERROR: 1}
+    # 7 个结果分 4 批提交
+    assert db.commits == 4
+    assert sorted(h for h, b in db.blocks.items() if not b['check_status']) == [4, 5]
+    assert sorted(db.ledger) == [('alice', 'tari', -40, REASON_REVERSAL, 3), ('bob', 'tari', -60, REASON_REVERSAL, 3)]
+
+    # 下一轮只检查仍未确定的区块
+    explorer.responses.clear()
+    assert verifier.run_once() == {STATUS_VALID: 2, STATUS_INVALID: 0, STATUS_NOT_FOUND: 0, STATUS_ERROR: 0}
+    assert all(b['check_status'] for b in db.blocks.values())
+
+
+def test_dry_run_does_not_write(explorer, ledger, capsys):
+    explorer.responses[2] = 'wrong'
+    db = FakeDatabase([1, 2])
+    verifier = TariVerifier(db.connect, explorer.url, rate=0)
+    verifier.run_once(dry_run=True)
+    assert db.commits == 0
+    assert not any(b['check_status'] for b in db.blocks.values())
+    assert '2\tINVALID' in capsys.readouterr().out
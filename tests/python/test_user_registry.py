@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from redis_keys import USER_IDS_KEY
+from user_registry import UserRegistry, AsyncUserRegistry, parse_login, write_user_logins
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+XMR_WALLET = '4' + 'A' * 94
+TARI_WALLET = '12' + 'B' * 89
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def new_registry(server, new_users=None):
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    return UserRegistry(client, on_new_users=None if new_users is None else new_users.append)
+
+
+def test_parse_login():
+    assert parse_login(f'{XMR_WALLET}:{TARI_WALLET}') == (TARI_WALLET, XMR_WALLET, TARI_WALLET)
+    assert parse_login('worker:1') == ('worker:1', None, None)
+    assert parse_login('x' * 60) == ('x' * 60, None, None)
+
+
+def test_ids_are_sequential_and_shared_between_processes(server):
+    new_users = []
+    registry = new_registry(server, new_users)
+    assert registry.get_ids(['alice', 'bob', 'alice']) == [1, 2, 1]
+    assert registry.get_ids(['bob']) == [2]
+    assert new_users == [{1: 'alice', 2: 'bob'}]
+
+    other = new_registry(server, new_users)
+    assert other.get_ids(['bob', 'carol']) == [2, 3]
+    assert new_users[1:] == [{3: 'carol'}]
+    assert registry.get_logins([3, 1, 9]) == {3: 'carol', 1: 'alice'}
+    assert registry.get_logins([]) == {}
+
+
+def test_lookup_does_not_register(server):
+    registry = new_registry(server)
+    assert registry.lookup_id('alice') is None
+    assert registry.get_ids(['alice']) == [1]
+    assert new_registry(server).lookup_id('alice') == 1
+    assert fakeredis.FakeRedis(server=server, decode_responses=True).hlen(USER_IDS_KEY) == 1
+
+
+def test_cleared_registry_drops_cached_ids(server):
+    registry = new_registry(server)
+    assert registry.get_ids(['alice', 'bob']) == [1, 2]
+    fakeredis.FakeRedis(server=server).flushall()
+    # 清空后其他进程先注册的登录名拿到了旧ID
+    assert new_registry(server).get_ids(['carol']) == [1]
+    assert registry.get_ids(['dave']) == [2]
+    # 新ID不大于见过的最大ID，缓存中 alice 的旧映射被丢弃，重新注册
+    assert registry.get_ids(['alice']) == [3]
+    assert registry.get_logins([1, 2, 3]) == {1: 'carol', 2: 'dave', 3: 'alice'}
+
+
+def test_async_registry_shares_ids_with_sync_registry(server):
+    new_users = []
+    registry = AsyncUserRegistry(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True),
+                                 on_new_users=new_users.append)
+    assert new_registry(server).get_ids(['alice']) == [1]
+    assert asyncio.run(registry.get_ids(['alice', 'bob', 'bob'])) == [1, 2, 2]
+    assert new_users == [{2: 'bob'}]
+
+
+def test_write_user_logins_replaces_stale_mappings(api, db):
+    cur = db.cursor()
+    write_user_logins(cur, {1: 'alice', 2: f'{XMR_WALLET}:{TARI_WALLET}'})
+    # 注册表清空后同一ID分给了别的登录名，同一登录名也换了ID
+    write_user_logins(cur, {1: 'bob', 3: 'alice'})
+    cur.execute("SELECT user_id, login, username, xmr_wallet, tari_wallet FROM account_login ORDER BY user_id")
+    assert cur.fetchall() == [(1, 'bob', 'bob', None, None),
+                              (2, f'{XMR_WALLET}:{TARI_WALLET}', TARI_WALLET, XMR_WALLET, TARI_WALLET),
+                              (3, 'alice', 'alice', None, None)]
+
+
+def test_resolve_fills_logins_missing_from_database(api, db, monkeypatch):
+    failures = []
+    # 模拟提交时同步数据库失败
+    monkeypatch.setattr(api.user_registry, 'on_new_users', failures.append)
+    api.user_registry.get_ids(['alice', f'{XMR_WALLET}:{TARI_WALLET}'])
+    assert failures == [{1: 'alice', 2: f'{XMR_WALLET}:{TARI_WALLET}'}]
+    cur = db.cursor()
+    assert api.resolve_user_logins(cur, [1, 2, 7]) == {1: ('alice', None, None),
+                                                       2: (TARI_WALLET, XMR_WALLET, TARI_WALLET)}
+    cur.execute("SELECT user_id, username FROM account_login ORDER BY user_id")
+    assert cur.fetchall() == [(1, 'alice'), (2, TARI_WALLET)]
@@ -4,6 +4,10 @@ import json
 import logging
 from datetime import datetime
 
+# 用户ID -> 登录名，当前轮次有提交记录的用户ID
+from redis_keys import USER_NAMES_KEY
+from round_shares import get_active_user_ids
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -21,10 +25,6 @@ REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 0
 
-# Redis键前缀
-XMR_PREFIX = "xmr:submit:"
-TARI_PREFIX = "tari:submit:"
-
 # 加载配置文件
 def load_config():
     try:
@@ -88,21 +88,12 @@ def update_accounts():
         # 获取所有用户
         users = set()
         
-        # 从XMR提交记录中获取用户
-        for key in redis_client.keys(f"{XMR_PREFIX}*"):
-            data = key.replace(XMR_PREFIX, '')
-            try:
-                username = data.split(':')[1]
-                xmr_wallet = data.split(':')[0]
-                tari_wallet = data.split(':')[1]
-                users.add((username, xmr_wallet, tari_wallet))
-            except IndexError:
-                logger.warning(f"无法解析用户名格式: {data}")
+        # 从当前轮次的提交记录中获取用户
+        user_ids = get_active_user_ids(redis_client)
+        logins = redis_client.hmget(USER_NAMES_KEY, user_ids) if user_ids else []
+        for data in logins:
+            if data is None:
                 continue
-        
-        # 从TARI提交记录中获取用户
-        for key in redis_client.keys(f"{TARI_PREFIX}*"):
-            data = key.replace(TARI_PREFIX, '')
             try:
                 username = data.split(':')[1]
                 xmr_wallet = data.split(':')[0]
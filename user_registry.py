@@ -0,0 +1,203 @@
+"""矿工登录名 -> 整数ID 注册表
+
+stratum 登录名通常是 "<95位XMR地址>:<91位Tari地址>"，作为Redis字段名每个用户每条计数要占约200字节。
+注册表为每个登录名分配一个递增的整数ID，提交计数、轮次起点和区块快照都以ID为字段名。
+
+Redis键名:
+    user:ids       登录名 -> ID
+    user:names     ID -> 登录名
+    user:next_id   最后分配的ID
+
+分配ID在Lua脚本中原子完成，多个进程 (api_server.py / ingest_server.py) 同时注册同一登录名只会得到同一个ID。
+进程内用LRU缓存已知的映射，热路径上的已知矿工不需要额外的Redis往返。
+ID只增不减，新分配的ID不大于进程内见过的ID时说明Redis中的注册表被清空过，此时丢弃缓存重新解析；
+其他进程先重新注册的登录名无法这样发现，手动清空注册表后应重启 api_server.py 和 ingest_server.py。
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from redis_keys import USER_IDS_KEY, USER_NAMES_KEY, USER_NEXT_ID_KEY
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]=user:ids KEYS[2]=user:names KEYS[3]=user:next_id ARGV=登录名列表
+# 返回与ARGV一一对应的ID，新分配的ID以负数返回，调用方据此同步到数据库
+REGISTER_SCRIPT = """
+local ids = {}
+for i = 1, #ARGV do
+    local id = redis.call('HGET', KEYS[1], ARGV[i])
+    if id then
+        ids[i] = tonumber(id)
+    else
+        id = redis.call('INCR', KEYS[3])
+        redis.call('HSET', KEYS[1], ARGV[i], id)
+        redis.call('HSET', KEYS[2], id, ARGV[i])
+        ids[i] = -id
+    end
+end
+return ids
+"""
+
+REGISTRY_KEYS = [USER_IDS_KEY, USER_NAMES_KEY, USER_NEXT_ID_KEY]
+
+
+def parse_login(login: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """解析登录名，返回 (用户名, XMR钱包, Tari钱包)
+
+    长度超过50且包含冒号的登录名为 "<XMR地址>:<Tari地址>"，以Tari地址作为用户名；
+    其他情况直接使用整个字符串作为用户名，钱包为空
+    """
+    if len(login) > 50 and ':' in login:
+        parts = login.split(':')
+        if len(parts) >= 2:
+            return parts[1], parts[0] or None, parts[1] or None
+    return login, None, None
+
+
+def write_user_logins(cur, new_users: Dict[int, str]):
+    """在调用方的事务中把新分配的用户ID及解析后的用户名、钱包写入 account_login 表"""
+    rows = [(user_id, login) + parse_login(login) for user_id, login in new_users.items()]
+    # Redis注册表被清空后ID会重新分配，先删除与之冲突的旧映射
+    cur.execute("""
+        DELETE FROM account_login WHERE user_id = ANY(%s) OR login = ANY(%s)
+    """, (list(new_users), list(new_users.values())))
+    execute_values(cur, """
+        INSERT INTO account_login (user_id, login, username, xmr_wallet, tari_wallet)
+        VALUES %s
+    """, rows)
+
+
+class LRUCache:
+    """线程安全的定长LRU缓存"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            if len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+
+
+class RegistryCache:
+    """同步和asyncio版本共用的进程内缓存及注册结果处理"""
+
+    def __init__(self, cache_size: int, on_new_users: Optional[Callable[[Dict[int, str]], None]]):
+        self.cache = LRUCache(cache_size)
+        self.on_new_users = on_new_users
+        self.max_id = 0  # 进程内见过的最大ID
+
+    def lookup_cached(self, logins: List[str]) -> Tuple[List[Optional[int]], List[str]]:
+        """返回缓存中的ID (未缓存为 None) 和去重后需要注册的登录名"""
+        ids = [self.cache.get(login) for login in logins]
+        missing = list(dict.fromkeys(login for login, user_id in zip(logins, ids) if user_id is None))
+        return ids, missing
+
+    def store(self, missing: List[str], results: List[int]) -> Optional[Dict[str, int]]:
+        """处理注册脚本的结果并写入缓存
+
+        新分配的ID不大于见过的ID说明注册表被清空过，缓存中的映射已失效:
+        清空缓存并返回 None，调用方需要重新解析所有登录名
+        """
+        new_users = {}
+        resolved = {}
+        for login, user_id in zip(missing, results):
+            if user_id < 0:
+                user_id = -user_id
+                new_users[user_id] = login
+            resolved[login] = user_id
+        if new_users and self.on_new_users is not None:
+            self.on_new_users(new_users)
+        if new_users and min(new_users) <= self.max_id:
+            logger.warning(f"新分配的用户ID {min(new_users)} 不大于已知的最大ID {self.max_id}，"
+                           f"Redis中的注册表已被清空，丢弃缓存的映射")
+            self.clear_cache()
+            return None
+        for login, user_id in resolved.items():
+            self.cache.put(login, user_id)
+        self.max_id = max(self.max_id, max(resolved.values()))
+        return resolved
+
+    def clear_cache(self):
+        """Redis中的注册表被清空后调用，丢弃进程内缓存的旧映射"""
+        self.cache = LRUCache(self.cache.capacity)
+        self.max_id = 0
+
+
+class UserRegistry(RegistryCache):
+    """同步版本，供 api_server.py 等使用 redis-py 的脚本调用
+
+    on_new_users 在分配新ID后以 {ID: 登录名} 调用，用于同步到数据库
+    """
+
+    def __init__(self, redis_client, on_new_users: Optional[Callable[[Dict[int, str]], None]] = None,
+                 cache_size: int = 100000):
+        super().__init__(cache_size, on_new_users)
+        self.redis = redis_client
+        self.register_script = redis_client.register_script(REGISTER_SCRIPT)
+
+    def get_ids(self, logins: Iterable[str]) -> List[int]:
+        """返回登录名对应的ID，未注册的登录名会分配新ID"""
+        logins = list(logins)
+        ids, missing = self.lookup_cached(logins)
+        if missing:
+            resolved = self.store(missing, self.register_script(keys=REGISTRY_KEYS, args=missing))
+            if resolved is None:
+                return self.get_ids(logins)
+            ids = [resolved[login] if user_id is None else user_id for login, user_id in zip(logins, ids)]
+        return ids
+
+    def lookup_id(self, login: str) -> Optional[int]:
+        """只查询不注册，未知登录名返回 None"""
+        user_id = self.cache.get(login)
+        if user_id is None:
+            user_id = self.redis.hget(USER_IDS_KEY, login)
+            if user_id is None:
+                return None
+            user_id = int(user_id)
+            self.cache.put(login, user_id)
+        return user_id
+
+    def get_logins(self, ids: Iterable) -> Dict[int, str]:
+        """用一次HMGET把ID还原为登录名，未知ID不出现在结果中"""
+        ids = [int(user_id) for user_id in ids]
+        if not ids:
+            return {}
+        return {user_id: login for user_id, login in zip(ids, self.redis.hmget(USER_NAMES_KEY, ids)) if login is not None}
+
+
+class AsyncUserRegistry(RegistryCache):
+    """asyncio版本，供 ingest_server.py 使用 redis.asyncio 调用
+
+    on_new_users 与同步版本相同，在事件循环中调用，不能阻塞 (数据库写入应交给线程池)
+    """
+
+    def __init__(self, redis_client, cache_size: int = 100000,
+                 on_new_users: Optional[Callable[[Dict[int, str]], None]] = None):
+        super().__init__(cache_size, on_new_users)
+        self.register_script = redis_client.register_script(REGISTER_SCRIPT)
+
+    async def get_ids(self, logins: Iterable[str]) -> List[int]:
+        logins = list(logins)
+        ids, missing = self.lookup_cached(logins)
+        if missing:
+            resolved = self.store(missing, await self.register_script(keys=REGISTRY_KEYS, args=missing))
+            if resolved is None:
+                return await self.get_ids(logins)
+            ids = [resolved[login] if user_id is None else user_id for login, user_id in zip(logins, ids)]
+        return ids
@@ -31,7 +31,7 @@ def create_account(username, xmr_wallet, tari_wallet):
         logger.error(f"创建账户失败: {str(e)}")
         return None
 
-def add_block(block_height, rewards, time, total_shares):
+def add_block(block_height, block_type, rewards, time, total_shares):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
@@ -40,15 +40,15 @@ def add_block(block_height, rewards, time, total_shares):
         value = rewards / total_shares if total_shares > 0 else 0
         
         cur.execute("""
-            INSERT INTO blocks (block_height, rewards, time, total_shares, value)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (block_height) DO UPDATE
+            INSERT INTO blocks (block_height, type, rewards, time, total_shares, value)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (type, block_height) DO UPDATE
             SET rewards = EXCLUDED.rewards,
                 time = EXCLUDED.time,
                 total_shares = EXCLUDED.total_shares,
                 value = EXCLUDED.value
             RETURNING block_height
-        """, (block_height, rewards, time, total_shares, value))
+        """, (block_height, block_type, rewards, time, total_shares, value))
         
         result = cur.fetchone()
         conn.commit()
@@ -70,8 +70,8 @@ def add_reward(block_height, username, shares, reward_type):
             SELECT b.value, a.fee
             FROM blocks b
             CROSS JOIN account a
-            WHERE b.block_height = %s AND a.username = %s
-        """, (block_height, username))
+            WHERE b.type = %s AND b.block_height = %s AND a.username = %s
+        """, (reward_type, block_height, username))
         
         result = cur.fetchone()
         if not result:
@@ -79,8 +79,8 @@ def add_reward(block_height, username, shares, reward_type):
             
         value, fee = result
         
-        # 计算实际奖励金额：shares * value * (1 - fee)
-        actual_reward = shares * value * (1 - fee)
+        # 计算实际奖励金额：shares * value * (1 - fee)，value 为每个share的最小单位数
+        actual_reward = int(shares * value * (1 - fee))
         
         cur.execute("""
             INSERT INTO rewards (block_height, username, shares, type, reward)
@@ -4,15 +4,15 @@ ALTER TABLE account ADD COLUMN fee DECIMAL(5,4) DEFAULT 0.08;
 -- 更新现有account记录的fee值
 UPDATE account SET fee = 0.08 WHERE fee IS NULL;
 
--- 为blocks表添加value字段
-ALTER TABLE blocks ADD COLUMN value DECIMAL(20,8);
+-- 为blocks表添加value字段: 每个share的奖励，单位为最小单位 (piconero / microTari)，不是整数
+ALTER TABLE blocks ADD COLUMN value NUMERIC(30,12);
 
--- 更新现有blocks记录的value值
+-- 更新现有blocks记录的value值 (rewards 已是最小单位)
 UPDATE blocks b
 SET value = (
-    SELECT COALESCE(b.rewards / NULLIF(SUM(r.shares), 0), 0)
+    SELECT COALESCE(b.rewards::NUMERIC / NULLIF(SUM(r.shares), 0), 0)
     FROM rewards r
-    WHERE r.block_height = b.block_height
+    WHERE r.type = b.type AND r.block_height = b.block_height
     GROUP BY r.block_height
 );
 
@@ -9,12 +9,19 @@ from psycopg2.extras import DictCursor
 from datetime import datetime
 import json
 import os
+import sys
 import logging
 import threading
 import time
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from money import coins
+# 登录名 -> 用户ID，各链当前轮次提交数由 round_shares 按代求和
+from redis_keys import USER_IDS_KEY
+from round_shares import get_users_round_shares
+
 # 配置日志
 logging.basicConfig(
     level=logging.WARNING,
@@ -135,10 +142,10 @@ def calculate_pool_stats() -> Dict[str, float]:
         conn.close()
         
         return {
-            'total_rewards_xmr': float(stats['total_rewards_xmr'] or 0),
-            'total_rewards_tari': float(stats['total_rewards_tari'] or 0),
-            'total_paid_xmr': float(stats['total_paid_xmr'] or 0),
-            'total_paid_tari': float(stats['total_paid_tari'] or 0)
+            'total_rewards_xmr': coins(stats['total_rewards_xmr'], 'xmr'),
+            'total_rewards_tari': coins(stats['total_rewards_tari'], 'tari'),
+            'total_paid_xmr': coins(stats['total_paid_xmr'], 'xmr'),
+            'total_paid_tari': coins(stats['total_paid_tari'], 'tari')
         }
     except Exception as e:
         logger.error(f"计算矿池统计数据失败: {str(e)}")
@@ -181,16 +188,16 @@ def get_cached_online_miners() -> List[Miner]:
             except:
                 continue
         
-        pipe = redis_client.pipeline()
-        for username in miner_hashrates:
-            pipe.get(get_chain_key(username, 'xmr'))
-            pipe.get(get_chain_key(username, 'tari'))
-        redis_results = pipe.execute()
+        # 当前轮次提交数 = 链起点之后的封存代 + 当前代，每代一次HMGET
+        usernames = list(miner_hashrates)
+        # 先把登录名换成用户ID，未注册的登录名没有提交记录
+        user_ids = [user_id or 0 for user_id in redis_client.hmget(USER_IDS_KEY, usernames)] if usernames else []
+        round_shares = get_users_round_shares(redis_client, user_ids)
         
         online_miners = []
         for i, (username, hashrate) in enumerate(miner_hashrates.items()):
-            xmr_count = int(redis_results[i*2] or 0)
-            tari_count = int(redis_results[i*2+1] or 0)
+            xmr_count = round_shares['xmr'][i]
+            tari_count = round_shares['tari'][i]
             online_miners.append(Miner(
                 username=format_username(username),
                 hashrate=hashrate,
@@ -258,9 +265,10 @@ async def user_info(username: str):
         cur = conn.cursor(cursor_factory=DictCursor)
         
         cur.execute("""
-            SELECT username, xmr_balance, tari_balance, created_at, xmr_wallet, tari_wallet, fee
-            FROM account 
-            WHERE username = %s
+            SELECT a.username, b.xmr_balance, b.tari_balance, a.created_at, a.xmr_wallet, a.tari_wallet, a.fee
+            FROM account a
+            JOIN account_balance b ON b.username = a.username
+            WHERE a.username = %s
         """, (username,))
         account = cur.fetchone()
         
@@ -276,7 +284,7 @@ async def user_info(username: str):
             AND created_at >= NOW() - INTERVAL '18 hours'
         """, (username,))
         frozen_result = cur.fetchone()
-        frozen_tari = float(frozen_result['frozen_tari']) if frozen_result else 0
+        frozen_tari = int(frozen_result['frozen_tari']) if frozen_result else 0
 
         # 计算已支付的TARI
         cur.execute("""
@@ -287,7 +295,7 @@ async def user_info(username: str):
             AND status = 'completed'
         """, (username,))   
         tari_payed_result = cur.fetchone()
-        tari_payed = float(tari_payed_result['tari_payed']) if tari_payed_result else 0
+        tari_payed = coins(tari_payed_result['tari_payed'], 'tari') if tari_payed_result else 0
 
         # 计算已支付的XMR
         cur.execute("""
@@ -297,7 +305,7 @@ async def user_info(username: str):
             AND type = 'xmr'
         """, (username,))
         xmr_payed_result = cur.fetchone()
-        xmr_payed = float(xmr_payed_result['xmr_payed']) if xmr_payed_result else 0
+        xmr_payed = coins(xmr_payed_result['xmr_payed'], 'xmr') if xmr_payed_result else 0
 
         # 获取用户奖励历史
         cur.execute("""
@@ -309,7 +317,7 @@ async def user_info(username: str):
                 b.time as timestamp,
                 b.total_shares
             FROM rewards r
-            JOIN blocks b ON r.block_height = b.block_height
+            JOIN blocks b ON b.type = r.type AND b.block_height = r.block_height
             WHERE r.username = %s 
             ORDER BY b.time DESC 
             LIMIT 50
@@ -317,7 +325,7 @@ async def user_info(username: str):
         rewards = []
         for row in cur.fetchall():
             reward = dict(row)
-            reward['amount'] = float(reward['amount'])
+            reward['amount'] = coins(reward['amount'], reward['type'])
             reward['shares'] = float(reward['shares'])
             reward['total_shares'] = float(reward['total_shares'])
             rewards.append(reward)
@@ -337,7 +345,7 @@ async def user_info(username: str):
         payments = []
         for row in cur.fetchall():
             payment = dict(row)
-            payment['amount'] = float(payment['amount'])
+            payment['amount'] = coins(payment['amount'], payment['type'])
             payments.append(payment)
         
         # 获取用户当前算力
@@ -348,8 +356,8 @@ async def user_info(username: str):
         
         return UserInfo(
             username=username,
-            xmr_balance=float(account['xmr_balance']),
-            tari_balance=float(account['tari_balance'])-frozen_tari,
+            xmr_balance=coins(account['xmr_balance'], 'xmr'),
+            tari_balance=coins(account['tari_balance'] - frozen_tari, 'tari'),
             xmr_payed=xmr_payed,
             tari_payed=tari_payed,
             created_at=account['created_at'].isoformat(),
@@ -357,7 +365,7 @@ async def user_info(username: str):
             xmr_wallet=account['xmr_wallet'],
             tari_wallet=account['tari_wallet'],
             fee=float(account['fee']),
-            frozen_tari=frozen_tari,
+            frozen_tari=coins(frozen_tari, 'tari'),
             rewards=rewards,
             payments=payments
         )
@@ -389,9 +397,9 @@ async def get_blocks():
                 timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
             
             if block_type == 'xmr':
-                reward = f"{float(reward):.6f} XMR"
+                reward = f"{coins(reward, 'xmr'):.6f} XMR"
             else:  # TARI
-                reward = f"{float(reward):.2f} XTM"
+                reward = f"{coins(reward, 'tari'):.2f} XTM"
             
             formatted_blocks.append(Block(
                 timestamp=timestamp,
@@ -5,10 +5,17 @@ from psycopg2.extras import DictCursor
 from datetime import datetime
 import json
 import os
+import sys
 import logging
 import threading
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from money import coins
+# 登录名 -> 用户ID，各链当前轮次提交数由 round_shares 按代求和
+from redis_keys import USER_IDS_KEY
+from round_shares import get_users_round_shares
+
 # 配置日志
 logging.basicConfig(
     level=logging.WARNING,
@@ -73,10 +80,10 @@ def calculate_pool_stats():
         conn.close()
         
         return {
-            'total_rewards_xmr': float(stats['total_rewards_xmr'] or 0),
-            'total_rewards_tari': float(stats['total_rewards_tari'] or 0),
-            'total_paid_xmr': float(stats['total_paid_xmr'] or 0),
-            'total_paid_tari': float(stats['total_paid_tari'] or 0)
+            'total_rewards_xmr': coins(stats['total_rewards_xmr'], 'xmr'),
+            'total_rewards_tari': coins(stats['total_rewards_tari'], 'tari'),
+            'total_paid_xmr': coins(stats['total_paid_xmr'], 'xmr'),
+            'total_paid_tari': coins(stats['total_paid_tari'], 'tari')
         }
     except Exception as e:
         logger.error(f"计算矿池统计数据失败: {str(e)}")
@@ -120,18 +127,17 @@ def get_cached_online_miners():
             except:
                 continue
         
-        # 批量获取Redis数据
-        pipe = redis_client.pipeline()
-        for username in miner_hashrates:
-            pipe.get(get_chain_key(username, 'xmr'))
-            pipe.get(get_chain_key(username, 'tari'))
-        redis_results = pipe.execute()
+        # 当前轮次提交数 = 链起点之后的封存代 + 当前代，每代一次HMGET
+        usernames = list(miner_hashrates)
+        # 先把登录名换成用户ID，未注册的登录名没有提交记录
+        user_ids = [user_id or 0 for user_id in redis_client.hmget(USER_IDS_KEY, usernames)] if usernames else []
+        round_shares = get_users_round_shares(redis_client, user_ids)
         
         # 处理结果
         online_miners = []
         for i, (username, hashrate) in enumerate(miner_hashrates.items()):
-            xmr_count = int(redis_results[i*2] or 0)
-            tari_count = int(redis_results[i*2+1] or 0)
+            xmr_count = round_shares['xmr'][i]
+            tari_count = round_shares['tari'][i]
             online_miners.append({
                 'username': format_username(username),
                 'hashrate': hashrate,
@@ -184,15 +190,6 @@ def read_stratum_data():
         logger.error(f"读取stratum数据失败: {str(e)}")
         return None
     
-def get_chain_key(username: str, chain: str) -> str:
-    """获取Redis键名"""
-    xmr_prefix = "xmr:submit:"
-    tari_prefix = "tari:submit:"
-    if chain.lower() == 'xmr':
-        return f"{xmr_prefix}{username}"
-    else:
-        return f"{tari_prefix}{username}"
-
 def get_user_hashrate(username):
     stratum_data = read_stratum_data()
     total_hashrate = 0
@@ -306,9 +303,10 @@ def user_info(username):
         
         # 获取用户账户信息
         cur.execute("""
-            SELECT username, xmr_balance, tari_balance, created_at, xmr_wallet, tari_wallet, fee
-            FROM account 
-            WHERE username = %s
+            SELECT a.username, b.xmr_balance, b.tari_balance, a.created_at, a.xmr_wallet, a.tari_wallet, a.fee
+            FROM account a
+            JOIN account_balance b ON b.username = a.username
+            WHERE a.username = %s
         """, (username,))
         account = cur.fetchone()
         
@@ -325,7 +323,7 @@ def user_info(username):
             AND created_at >= NOW() - INTERVAL '18 hours'
         """, (username,))
         frozen_result = cur.fetchone()
-        frozen_tari = float(frozen_result['frozen_tari']) if frozen_result else 0
+        frozen_tari = int(frozen_result['frozen_tari']) if frozen_result else 0
         # 计算已支付的TARI
         cur.execute("""
             SELECT COALESCE(SUM(amount), 0) as tari_payed
@@ -335,7 +333,7 @@ def user_info(username):
             AND status = 'completed'
         """, (username,))   
         tari_payed_result = cur.fetchone()
-        tari_payed = float(tari_payed_result['tari_payed']) if tari_payed_result else 0
+        tari_payed = coins(tari_payed_result['tari_payed'], 'tari') if tari_payed_result else 0
         #计算已支付的XMR
         cur.execute("""
             SELECT COALESCE(SUM(amount), 0) as xmr_payed
@@ -344,7 +342,7 @@ def user_info(username):
             AND type = 'xmr'
         """, (username,))
         xmr_payed_result = cur.fetchone()
-        xmr_payed = float(xmr_payed_result['xmr_payed']) if xmr_payed_result else 0
+        xmr_payed = coins(xmr_payed_result['xmr_payed'], 'xmr') if xmr_payed_result else 0
 
         # 获取用户奖励历史
         cur.execute("""
@@ -356,7 +354,7 @@ def user_info(username):
                 b.time as timestamp,
                 b.total_shares
             FROM rewards r
-            JOIN blocks b ON r.block_height = b.block_height
+            JOIN blocks b ON b.type = r.type AND b.block_height = r.block_height
             WHERE r.username = %s 
             ORDER BY b.time DESC 
             LIMIT 50
@@ -364,7 +362,7 @@ def user_info(username):
         rewards = []
         for row in cur.fetchall():
             reward = dict(row)
-            reward['amount'] = float(reward['amount'])
+            reward['amount'] = coins(reward['amount'], reward['type'])
             reward['shares'] = float(reward['shares'])
             reward['total_shares'] = float(reward['total_shares'])
             rewards.append(reward)
@@ -384,7 +382,7 @@ def user_info(username):
         payments = []
         for row in cur.fetchall():
             payment = dict(row)
-            payment['amount'] = float(payment['amount'])
+            payment['amount'] = coins(payment['amount'], payment['type'])
             payments.append(payment)
         
         # 获取用户当前算力
@@ -395,8 +393,8 @@ def user_info(username):
         
         return jsonify({
             'username': username,
-            'xmr_balance': float(account['xmr_balance']),
-            'tari_balance': float(account['tari_balance'])-frozen_tari,
+            'xmr_balance': coins(account['xmr_balance'], 'xmr'),
+            'tari_balance': coins(account['tari_balance'] - frozen_tari, 'tari'),
             'xmr_payed': xmr_payed,
             'tari_payed': tari_payed,
             'created_at': account['created_at'].isoformat(),
@@ -404,7 +402,7 @@ def user_info(username):
             'xmr_wallet': account['xmr_wallet'],
             'tari_wallet': account['tari_wallet'],
             'fee': float(account['fee']),
-            'frozen_tari': frozen_tari,  # 添
+            'frozen_tari': coins(frozen_tari, 'tari'),  # 添
             'rewards': rewards,
             'payments': payments
         })
@@ -439,9 +437,9 @@ def get_blocks():
             
             # 格式化奖励
             if block_type == 'xmr':
-                reward = f"{float(reward):.6f} XMR"
+                reward = f"{coins(reward, 'xmr'):.6f} XMR"
             else:  # TARI
-                reward = f"{float(reward):.2f} XTM"
+                reward = f"{coins(reward, 'tari'):.2f} XTM"
             
             formatted_blocks.append({
                 'timestamp': timestamp,
@@ -470,7 +468,7 @@ def init_db():
             height INTEGER,
             timestamp TIMESTAMP,
             type VARCHAR(10),
-            reward DECIMAL(20, 8),
+            reward BIGINT,
             is_valid BOOLEAN DEFAULT TRUE,
             check_status BOOLEAN DEFAULT FALSE
         )
@@ -5,9 +5,11 @@ import logging
 import requests
 import time
 import argparse
-from decimal import Decimal
 from datetime import datetime
 
+from balance_ledger import append_entry, REASON_PAYMENT
+from money import XMR_ATOMIC_UNITS, to_atomic, format_amount
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -19,6 +21,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 支付金额精确到 0.001 XMR
+PAYOUT_STEP = XMR_ATOMIC_UNITS // 1000
+
 # 加载配置
 def load_config():
     try:
@@ -74,7 +79,7 @@ def confirm_action(message, interactive):
 class XMRPayment:
     def __init__(self, interactive=True):
         self.config = load_config()
-        self.min_payout = Decimal(str(self.config.get('xmr_min_payout', 0.01)))
+        self.min_payout = to_atomic(self.config.get('xmr_min_payout', 0.01), XMR_ATOMIC_UNITS)
         self.wallet_rpc_url = self.config.get('monero_wallet_rpc', 'http://127.0.0.1:18082/json_rpc')
         self.wallet_rpc_user = self.config.get('monero_wallet_rpc_user', '')
         self.wallet_rpc_password = self.config.get('monero_wallet_rpc_password', '')
@@ -88,7 +93,7 @@ class XMRPayment:
             # 获取待支付用户，限制数量为20个
             cur.execute("""
                 SELECT username, xmr_balance, xmr_wallet 
-                FROM account 
+                FROM account_balance 
                 WHERE xmr_balance >= %s 
                 AND xmr_wallet IS NOT NULL
                 ORDER BY xmr_balance DESC
@@ -96,12 +101,12 @@ class XMRPayment:
             """, (self.min_payout,))
             
             pending_payments = []
-            total_amount = Decimal('0')
+            total_amount = 0
             
             for username, balance, wallet in cur.fetchall():
                 # 将支付金额精确到小数点后3位
-                payment_amount = Decimal(str(int(balance * 1000) / 1000))
-                remaining_balance = balance - payment_amount
+                remaining_balance = balance % PAYOUT_STEP
+                payment_amount = balance - remaining_balance
                 # 验证钱包地址
                 if not is_valid_monero_address(wallet):
                     logger.warning(f"用户 {username} 的钱包地址无效: {wallet}")
@@ -120,14 +125,14 @@ class XMRPayment:
                 })
                 total_amount += payment_amount
             
-            logger.info(f"找到 {len(pending_payments)} 个待支付用户，总金额: {total_amount:.3f} XMR")
+            logger.info(f"找到 {len(pending_payments)} 个待支付用户，总金额: {format_amount(total_amount, 'xmr')} XMR")
             
             if self.interactive:
                 print("\n待支付用户列表:")
                 for payment in pending_payments:
-                    print(f"用户: {payment['username']} 总余额: {payment['total_balance']:.12f} XMR 本次支付: {payment['payment_amount']:.3f} XMR 剩余余额: {payment['remaining_balance']:.12f} XMR 钱包地址: {payment['wallet']}")
+                    print(f"用户: {payment['username']} 总余额: {format_amount(payment['total_balance'], 'xmr')} XMR 本次支付: {format_amount(payment['payment_amount'], 'xmr')} XMR 剩余余额: {format_amount(payment['remaining_balance'], 'xmr')} XMR 钱包地址: {payment['wallet']}")
                     print("-" * 50)
-                print(f"\n总支付金额: {total_amount:.3f} XMR")
+                print(f"\n总支付金额: {format_amount(total_amount, 'xmr')} XMR")
                 if len(pending_payments) == 0:
                     logger.info("没有待支付的用户")
                     exit()
@@ -172,14 +177,14 @@ class XMRPayment:
         try:
             result = self.make_rpc_request("get_balance")
             if "result" in result:
-                balance = Decimal(str(result["result"]["balance"])) / Decimal('1e12')
-                unlocked_balance = Decimal(str(result["result"]["unlocked_balance"])) / Decimal('1e12')
+                balance = int(result["result"]["balance"])
+                unlocked_balance = int(result["result"]["unlocked_balance"])
                 
                 print(f"\n钱包余额信息:")
-                print(f"总余额: {balance:.12f} XMR 可用余额: {unlocked_balance:.12f} XMR 需支付金额: {total_amount:.12f} XMR")
+                print(f"总余额: {format_amount(balance, 'xmr')} XMR 可用余额: {format_amount(unlocked_balance, 'xmr')} XMR 需支付金额: {format_amount(total_amount, 'xmr')} XMR")
                 
                 if unlocked_balance < total_amount:
-                    logger.error(f"钱包可用余额不足: {unlocked_balance:.12f} XMR, 需要: {total_amount:.12f} XMR")
+                    logger.error(f"钱包可用余额不足: {format_amount(unlocked_balance, 'xmr')} XMR, 需要: {format_amount(total_amount, 'xmr')} XMR")
                     return False
                 
                     
@@ -193,24 +198,21 @@ class XMRPayment:
         try:
             # 准备合并支付
             destinations = []
-            total_amount = Decimal('0')
+            total_amount = 0
             
             for payment in payment_info:
                 username = payment['username']
                 amount = payment['payment_amount']
                 address = payment['wallet']
-                
-                # 转换为atomic units
-                atomic_amount = int(amount * Decimal('1e12'))
                 total_amount += amount
                 
                 destinations.append({
-                    "amount": atomic_amount,
+                    "amount": amount,
                     "address": address
                 })
             
             print(f"\n准备合并支付:")
-            print(f"总金额: {total_amount:.3f} XMR")
+            print(f"总金额: {format_amount(total_amount, 'xmr')} XMR")
             print(f"支付用户数: {len(destinations)}")
             
             if not confirm_action("确认进行合并支付？", self.interactive):
@@ -228,12 +230,12 @@ class XMRPayment:
             
             if "result" in result:
                 tx_hash = result["result"]["tx_hash"]
-                fee = Decimal(str(result["result"]["fee"])) / Decimal('1e12')
+                fee = int(result["result"]["fee"])
                 
                 if self.interactive:
                     print(f"\n合并支付成功:")
                     print(f"交易哈希: {tx_hash}")
-                    print(f"手续费: {fee:.12f} XMR")
+                    print(f"手续费: {format_amount(fee, 'xmr')} XMR")
                     
                 # 记录所有用户的支付
                 for payment in payment_info:
@@ -241,10 +243,10 @@ class XMRPayment:
                         payment['username'],
                         payment['payment_amount'],
                         tx_hash,
-                        fee / len(payment_info)  # 平均分配手续费
+                        fee // len(payment_info)  # 平均分配手续费
                     )
                 
-                logger.info(f"合并支付成功 - 总金额: {total_amount:.3f} XMR, 用户数: {len(destinations)}, 交易哈希: {tx_hash}")
+                logger.info(f"合并支付成功 - 总金额: {format_amount(total_amount, 'xmr')} XMR, 用户数: {len(destinations)}, 交易哈希: {tx_hash}")
                 return True
             else:
                 logger.error(f"合并支付失败 - 错误: {result.get('error', 'Unknown error')}")
@@ -265,14 +267,10 @@ class XMRPayment:
             cur.execute("""
                 INSERT INTO payment (username, type, amount, txid, time, status, note)
                 VALUES (%s, 'xmr', %s, %s, %s, 'completed', %s)
-            """, (username, amount, txid, datetime.now(), f"Fee: {fee:.12f} XMR"))
+            """, (username, amount, txid, datetime.now(), f"Fee: {format_amount(fee, 'xmr')} XMR"))
             
-            # 更新用户余额（只减去实际支付的金额和手续费）
-            cur.execute("""
-                UPDATE account 
-                SET xmr_balance = xmr_balance - %s 
-                WHERE username = %s
-            """, (amount + fee, username))
+            # 追加扣款流水（只减去实际支付的金额和手续费）
+            append_entry(cur, username, 'xmr', -(amount + fee), REASON_PAYMENT, txid)
             
             conn.commit()
             